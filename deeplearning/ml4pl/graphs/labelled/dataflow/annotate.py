@@ -23,16 +23,20 @@ and text format protocol buffers:
         --n=5 \
         < /tmp/program_graph.pbtxt
 """
+import atexit
 import signal
-import subprocess
 import sys
+import threading
 from typing import Callable
 from typing import Dict
 from typing import List
+from typing import Optional
 from typing import Union
 
 from deeplearning.ml4pl.graphs import programl
 from deeplearning.ml4pl.graphs import programl_pb2
+from deeplearning.ml4pl.graphs.labelled.dataflow import annotator_pool
+from deeplearning.ml4pl.graphs.labelled.dataflow import control_flow_csr
 from deeplearning.ml4pl.graphs.labelled.dataflow import data_flow_graphs
 from deeplearning.ml4pl.graphs.labelled.dataflow.alias_set import alias_set
 from deeplearning.ml4pl.graphs.labelled.dataflow.datadep import data_dependence
@@ -47,7 +51,6 @@ from deeplearning.ml4pl.graphs.labelled.dataflow.subexpressions import (
 )
 from deeplearning.ml4pl.testing import test_annotators
 from labm8.py import app
-from labm8.py import bazelutil
 
 app.DEFINE_boolean(
   "list", False, "If true, list the available analyses and exit."
@@ -61,6 +64,12 @@ app.DEFINE_integer(
   "changing the root statement. If --n=0, enumerate all possible labelled "
   "graphs.",
 )
+app.DEFINE_integer(
+  "annotator_workers",
+  0,
+  "The number of persistent worker processes which annotate graphs for "
+  "callers outside of the main thread. If 0, one worker per CPU is used.",
+)
 
 FLAGS = app.FLAGS
 
@@ -69,9 +78,13 @@ FLAGS = app.FLAGS
 # a new entry in this table.
 ANALYSES = {
   "reachability": reachability.ReachabilityAnnotator,
+  "reachability_csr": reachability.CsrReachabilityAnnotator,
   "domtree": dominator_tree.DominatorTreeAnnotator,
+  "domtree_csr": dominator_tree.CsrDominatorTreeAnnotator,
   "liveness": liveness.LivenessAnnotator,
+  "liveness_csr": liveness.CsrLivenessAnnotator,
   "datadep": data_dependence.DataDependencyAnnotator,
+  "datadep_csr": data_dependence.CsrDataDependencyAnnotator,
   "subexpressions": subexpressions.CommonSubexpressionAnnotator,
   # Annotators which are used for testing this script. These should, for obvious
   # reasons, not be used in prod. However, they must remain here so that we can
@@ -89,13 +102,6 @@ AVAILABLE_ANALYSES = sorted(
   analysis for analysis in ANALYSES if not analysis.startswith("test_")
 )
 
-# The path of this script. Because a target cannot depend on itself, all calling
-# code must add this script to its `data` dependencies.
-SELF = bazelutil.DataPath(
-  "phd/deeplearning/ml4pl/graphs/labelled/dataflow/annotate"
-)
-
-
 # Return codes for error conditions.
 #
 # Error reading stdin.
@@ -106,21 +112,38 @@ E_ANALYSIS_FAILED = 12
 E_INVALID_STDOUT = 13
 
 
+# The pool of annotator worker processes, created on first use.
+_annotator_pool: Optional[annotator_pool.AnnotatorPool] = None
+_annotator_pool_lock = threading.Lock()
+
+
+def GetAnnotatorPool() -> annotator_pool.AnnotatorPool:
+  """Return the shared pool of annotator worker processes.
+
+  The pool is created on first use with --annotator_workers workers, and is
+  closed when the program exits.
+  """
+  global _annotator_pool
+  with _annotator_pool_lock:
+    if _annotator_pool is None:
+      _annotator_pool = annotator_pool.AnnotatorPool(
+        ANALYSES, worker_count=FLAGS.annotator_workers
+      )
+      atexit.register(_annotator_pool.Close)
+  return _annotator_pool
+
+
 def _AnnotateInSubprocess(
   analysis: str,
   graph: Union[programl_pb2.ProgramGraph, bytes],
   n: int = 0,
   timeout: int = 120,
-  binary_graph: bool = False,
 ) -> programl_pb2.ProgramGraphs:
-  """Run this script in a subprocess.
-
-  This is the most robust method for enforcing the timeout, but has a huge
-  overhead in starting up a new python interpreter for every invocation.
+  """Run an analysis in a worker process.
 
-  DISCLAIMER: Because a target cannot depend on itself, all calling code must
-  add //deeplearning/ml4pl/graphs/labelled/dataflow:annotate to its list of
-  data dependencies.
+  This is the most robust method for enforcing the timeout. The analysis runs
+  on a persistent worker of GetAnnotatorPool(), which is killed and replaced if
+  it exceeds the timeout.
 
   Args:
     analysis: The name of the analysis to run.
@@ -128,84 +151,49 @@ def _AnnotateInSubprocess(
       as a proto instance or as binary-encoded byte array.
     n: The maximum number of labelled graphs to produce.
     timeout: The maximum number of seconds to run the analysis for.
-    binary_graph: If true, treat the graph argument as a binary byte array.
 
   Returns:
     A ProgramGraphs protocol buffer.
 
   Raises:
-    IOError: If serializing the input or output protos fails.
     ValueError: If an invalid analysis is requested.
     data_flow_graphs.AnalysisFailed: If the analysis raised an error.
     data_flow_graphs.AnalysisTimeout: If the analysis did not complete within
       the requested timeout.
   """
-  process = subprocess.Popen(
-    [
-      "timeout",
-      "-s9",
-      str(timeout),
-      str(SELF),
-      "--analysis",
-      analysis,
-      "--n",
-      str(n),
-      "--stdin_fmt",
-      "pb",
-      "--stdout_fmt",
-      "pb",
-    ],
-    stdin=subprocess.PIPE,
-    stdout=subprocess.PIPE,
-    stderr=subprocess.PIPE,
+  annotated_graphs = GetAnnotatorPool().Annotate(
+    analysis, graph, n=n, timeout=timeout
   )
+  return programl_pb2.ProgramGraphs(graph=annotated_graphs.protos)
 
-  # Encode the input if required.
-  if binary_graph:
-    stdin = graph
-  else:
-    stdin = programl.ToBytes(graph, fmt=programl.InputOutputFormat.PB)
-
-  # Run this analysis script.
-  stdout, stderr = process.communicate(stdin)
 
-  if process.returncode == 9 or process.returncode == -9:
-    # Process was killed. We assume this is because of timeout, though it could
-    # be the user.
-    raise data_flow_graphs.AnalysisTimeout(timeout)
-  elif process.returncode == E_INVALID_INPUT:
-    raise IOError("Failed to serialize input graph")
-  elif process.returncode == E_INVALID_STDOUT:
-    raise IOError("Analysis failed to write stdout")
-  elif process.returncode:
-    raise data_flow_graphs.AnalysisFailed(
-      f"Analysis failed with returncode {process.returncode}: "
-      f"{stderr.decode('utf-8')}"
-    )
-
-  # Construct the protocol buffer from stdout.
-  output = programl.FromBytes(
-    stdout,
-    programl.InputOutputFormat.PB,
-    proto=programl_pb2.ProgramGraphs(),
-    empty_okay=True,
+def SupportsProgramGraphArrays(analysis: str) -> bool:
+  """Return whether an analysis can annotate ProgramGraphArrays."""
+  return issubclass(
+    ANALYSES[analysis], control_flow_csr.CsrDataFlowGraphAnnotator
   )
 
-  return output
-
 
 def Annotate(
   analysis: str,
-  graph: Union[programl_pb2.ProgramGraph, bytes],
+  graph: Union[
+    programl_pb2.ProgramGraph, bytes, control_flow_csr.ProgramGraphArrays
+  ],
   n: int = 0,
   timeout: int = 120,
 ) -> data_flow_graphs.DataFlowGraphs:
   """Run an analysis
 
+  The timeout is enforced using SIGALRM, which only works from the main thread.
+  When called from another thread, the analysis runs on a worker process of
+  GetAnnotatorPool() instead.
+
   Args:
     analysis: The name of the analysis to run.
     graph: The unlabelled ProgramGraph protocol buffer to to annotate, either
-      as a proto instance or as binary-encoded byte array.
+      as a proto instance or as binary-encoded byte array. Analyses for which
+      SupportsProgramGraphArrays() is true also accept the arrays of a program
+      graph, such as those produced by a program_graph_cache.ProgramGraphCache.
     n: The maximum number of labelled graphs to produce.
     timeout: The maximum number of seconds to run the analysis for.
     binary_graph: If true, treat the graph argument as a binary byte array.
@@ -232,9 +220,21 @@ def Annotate(
     del frame
     raise data_flow_graphs.AnalysisTimeout(timeout)
 
+  if isinstance(graph, control_flow_csr.ProgramGraphArrays):
+    if not SupportsProgramGraphArrays(analysis):
+      raise ValueError(
+        f"Analysis does not support program graph arrays: {analysis}"
+      )
+    annotator_args = {"arrays": graph}
+  else:
+    annotator_args = {"unlabelled_graph": graph}
+
+  if threading.current_thread() is not threading.main_thread():
+    return GetAnnotatorPool().Annotate(analysis, graph, n=n, timeout=timeout)
+
   signal.signal(signal.SIGALRM, TimeoutHandler)
   signal.alarm(timeout)
-  annotator = ANALYSES[analysis](graph)
+  annotator = ANALYSES[analysis](**annotator_args)
 
   try:
     annotated_graphs = annotator.MakeAnnotated(n)
@@ -1,7 +1,12 @@
 """Test the annotate binary."""
+import pickle
+import threading
+
 from deeplearning.ml4pl.graphs import programl
 from deeplearning.ml4pl.graphs import programl_pb2
+from deeplearning.ml4pl.graphs.labelled import graph_tuple
 from deeplearning.ml4pl.graphs.labelled.dataflow import annotate
+from deeplearning.ml4pl.graphs.labelled.dataflow import control_flow_csr
 from deeplearning.ml4pl.graphs.labelled.dataflow import data_flow_graphs
 from deeplearning.ml4pl.testing import random_programl_generator
 from labm8.py import test
@@ -70,6 +75,61 @@ def test_timeout(one_proto: programl_pb2.ProgramGraph):
     annotate.Annotate("test_timeout", one_proto, timeout=1)
 
 
+def test_timeout_from_thread(one_proto: programl_pb2.ProgramGraph):
+  """Test that the timeout is enforced outside of the main thread."""
+  errors = []
+
+  def Worker():
+    try:
+      annotate.Annotate("test_timeout", one_proto, timeout=1)
+    except Exception as e:
+      errors.append(e)
+
+  thread = threading.Thread(target=Worker)
+  thread.start()
+  thread.join()
+
+  assert len(errors) == 1
+  assert isinstance(errors[0], data_flow_graphs.AnalysisTimeout)
+  assert annotate.GetAnnotatorPool().stats.timeout_count >= 1
+
+
+def test_annotate_from_thread(one_proto: programl_pb2.ProgramGraph):
+  """Test that annotating outside of the main thread uses a worker process."""
+  results = []
+  thread = threading.Thread(
+    target=lambda: results.append(
+      annotate.Annotate("reachability", one_proto, n=0, timeout=30)
+    )
+  )
+  request_count = annotate.GetAnnotatorPool().stats.request_count
+  thread.start()
+  thread.join()
+
+  expected = annotate.Annotate("reachability", one_proto, n=0, timeout=30)
+  assert len(results) == 1
+  assert len(results[0].graph_tuples) == len(expected.graph_tuples)
+  for a, b in zip(results[0].graph_tuples, expected.graph_tuples):
+    assert pickle.dumps(a) == pickle.dumps(b)
+  assert annotate.GetAnnotatorPool().stats.request_count == request_count + 1
+
+
+def test_AnnotateInSubprocess(one_proto: programl_pb2.ProgramGraph):
+  """Test that annotating in a worker process produces ProgramGraph protos."""
+  annotated = annotate._AnnotateInSubprocess(
+    "test_pass_thru", one_proto, n=3, timeout=30
+  )
+  assert len(annotated.graph) == 3
+  for graph in annotated.graph:
+    assert len(graph.node) == len(one_proto.node)
+
+
+def test_AnnotateInSubprocess_timeout(one_proto: programl_pb2.ProgramGraph):
+  """Test that error is raised if the analysis times out in a worker."""
+  with test.Raises(data_flow_graphs.AnalysisTimeout):
+    annotate._AnnotateInSubprocess("test_timeout", one_proto, timeout=1)
+
+
 def test_annotate(analysis: str, real_proto: programl_pb2.ProgramGraph, n: int):
   """Test all annotators over all real protos."""
   try:
@@ -88,5 +148,46 @@ def test_annotate(analysis: str, real_proto: programl_pb2.ProgramGraph, n: int):
     pass
 
 
+def test_annotate_graph_tuples(
+  analysis: str, real_proto: programl_pb2.ProgramGraph, n: int
+):
+  """Test that annotated graph tuples are identical to converted networkx
+  graphs."""
+  try:
+    annotated = annotate.Annotate(analysis, real_proto, n, timeout=30)
+  except data_flow_graphs.AnalysisTimeout:
+    # A timeout error is acceptable.
+    return
+
+  assert len(annotated.graph_tuples) == len(annotated.graphs)
+  for actual, g in zip(annotated.graph_tuples, annotated.graphs):
+    expected = graph_tuple.GraphTuple.CreateFromNetworkX(g)
+    assert pickle.dumps(actual.graph_tuple) == pickle.dumps(expected)
+    assert actual.data_flow_root_node == g.graph["data_flow_root_node"]
+    assert actual.data_flow_steps == g.graph["data_flow_steps"]
+    assert (
+      actual.data_flow_positive_node_count
+      == g.graph["data_flow_positive_node_count"]
+    )
+
+
+def test_annotate_program_graph_arrays(
+  analysis: str, one_proto: programl_pb2.ProgramGraph
+):
+  """Test that annotating program graph arrays is identical to annotating the
+  proto."""
+  arrays = control_flow_csr.ProgramGraphArrays.FromProgramGraph(one_proto)
+  if not annotate.SupportsProgramGraphArrays(analysis):
+    with test.Raises(ValueError):
+      annotate.Annotate(analysis, arrays)
+    return
+
+  actual = annotate.Annotate(analysis, arrays, n=0)
+  expected = annotate.Annotate(analysis, one_proto, n=0)
+  assert len(actual.graph_tuples) == len(expected.graph_tuples)
+  for a, b in zip(actual.graph_tuples, expected.graph_tuples):
+    assert pickle.dumps(a) == pickle.dumps(b)
+
+
 if __name__ == "__main__":
   test.Main()
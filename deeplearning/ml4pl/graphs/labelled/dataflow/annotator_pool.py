@@ -0,0 +1,327 @@
+"""A pool of persistent worker processes for running data flow analyses.
+
+Enforcing a timeout using SIGALRM only works from the main thread, and starting
+a new python interpreter for every graph is slow. An AnnotatorPool instead
+forks a fixed number of worker processes which keep the analyses imported, and
+sends each graph to an idle worker. If a worker exceeds its timeout, only that
+worker is killed and replaced.
+
+Example usage:
+
+    with annotator_pool.AnnotatorPool(annotate.ANALYSES) as pool:
+      annotated = pool.Annotate("reachability", proto, n=10, timeout=60)
+      print(pool.stats)
+
+The Annotate() method is thread safe, so a pool can be shared by multiple
+threads, each annotating one graph at a time. annotate.Annotate() uses a shared
+pool when it is called from a thread other than the main thread.
+"""
+import multiprocessing
+import multiprocessing.connection
+import queue
+import signal
+import threading
+import time
+from typing import Callable
+from typing import Dict
+from typing import NamedTuple
+from typing import Optional
+from typing import Union
+
+from deeplearning.ml4pl.graphs import programl
+from deeplearning.ml4pl.graphs import programl_pb2
+from deeplearning.ml4pl.graphs.labelled.dataflow import control_flow_csr
+from deeplearning.ml4pl.graphs.labelled.dataflow import data_flow_graphs
+from labm8.py import app
+
+FLAGS = app.FLAGS
+
+# A map from analysis name to a callback which instantiates a
+# DataFlowGraphAnnotator, such as annotate.ANALYSES.
+AnalysesType = Dict[
+  str, Callable[..., data_flow_graphs.DataFlowGraphAnnotator]
+]
+
+
+class AnnotatorPoolStats(NamedTuple):
+  """Counters for the requests processed by an AnnotatorPool."""
+
+  # The number of graphs that were sent to workers.
+  request_count: int
+  # The number of requests which produced annotated graphs.
+  success_count: int
+  # The number of requests which raised an error, including timeouts.
+  failure_count: int
+  # The number of requests which exceeded their timeout.
+  timeout_count: int
+  # The number of worker processes that were started to replace a worker.
+  respawn_count: int
+  # The number of seconds since the pool was created.
+  elapsed_seconds: float
+
+  @property
+  def throughput(self) -> float:
+    """The number of requests completed per second."""
+    return self.request_count / max(self.elapsed_seconds, 1e-6)
+
+  def __repr__(self) -> str:
+    return (
+      f"{self.request_count} requests ({self.throughput:.1f} /s), "
+      f"{self.failure_count} failures, {self.timeout_count} timeouts, "
+      f"{self.respawn_count} respawns"
+    )
+
+
+def _WorkerLoop(
+  connection: multiprocessing.connection.Connection, analyses: AnalysesType
+) -> None:
+  """The main loop of a worker process.
+
+  Receives <analysis, graph, n> requests, where graph is either a serialized
+  ProgramGraph or a ProgramGraphArrays, and responds with
+  <success, annotated_graphs_or_error_message> tuples. A request of None
+  terminates the loop.
+  """
+  # Interrupts are handled by the parent process.
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+  while True:
+    try:
+      request = connection.recv()
+    except EOFError:
+      return
+    if request is None:
+      return
+
+    analysis, graph, n = request
+    try:
+      if isinstance(graph, control_flow_csr.ProgramGraphArrays):
+        annotator = analyses[analysis](arrays=graph)
+      else:
+        annotator = analyses[analysis](
+          programl.FromBytes(graph, programl.InputOutputFormat.PB)
+        )
+      response = (True, annotator.MakeAnnotated(n))
+    except Exception as e:
+      response = (False, f"{type(e).__name__}: {e}")
+
+    try:
+      connection.send(response)
+    except Exception as e:
+      # The annotated graphs could not be pickled.
+      connection.send((False, f"{type(e).__name__}: {e}"))
+
+
+class _Worker(object):
+  """A handle on a worker process."""
+
+  def __init__(self, context, name: str, analyses: AnalysesType):
+    self.connection, child_connection = context.Pipe()
+    self.process = context.Process(
+      target=_WorkerLoop,
+      args=(child_connection, analyses),
+      name=name,
+      daemon=True,
+    )
+    self.process.start()
+    # Close the parent's copy of the child end of the pipe, so that reads from
+    # self.connection raise EOFError if the process dies.
+    child_connection.close()
+    self.task_count = 0
+
+  def Kill(self) -> None:
+    """Terminate the worker process immediately."""
+    self.process.kill()
+    self.process.join()
+    self.connection.close()
+
+  def Stop(self, timeout: float = 5) -> None:
+    """Ask the worker process to exit, killing it if it does not."""
+    try:
+      self.connection.send(None)
+    except (OSError, ValueError):
+      pass
+    self.process.join(timeout)
+    if self.process.is_alive():
+      self.process.kill()
+      self.process.join()
+    self.connection.close()
+
+
+class AnnotatorPool(object):
+  """A pool of worker processes for annotating program graphs."""
+
+  def __init__(
+    self,
+    analyses: AnalysesType,
+    worker_count: Optional[int] = None,
+    max_tasks_per_worker: int = 0,
+    start_method: str = "fork",
+  ):
+    """Constructor.
+
+    Args:
+      analyses: A map from analysis name to annotator, such as
+        annotate.ANALYSES.
+      worker_count: The number of worker processes. If not provided, the number
+        of CPUs is used.
+      max_tasks_per_worker: If set, workers are restarted after this many
+        requests, to bound the memory that a worker may accumulate.
+      start_method: The multiprocessing start method for workers. With the
+        default "fork" method, workers inherit the analyses and parsed flags of
+        the calling process.
+    """
+    self.analyses = analyses
+    self.worker_count = worker_count or multiprocessing.cpu_count()
+    self.max_tasks_per_worker = max_tasks_per_worker
+    self.context = multiprocessing.get_context(start_method)
+
+    self._lock = threading.Lock()
+    self._start_time = time.time()
+    self._worker_number = 0
+    self._request_count = 0
+    self._success_count = 0
+    self._failure_count = 0
+    self._timeout_count = 0
+    self._respawn_count = 0
+
+    self._closed = False
+    self._workers = set()
+    self._idle_workers = queue.Queue()
+    for _ in range(self.worker_count):
+      self._idle_workers.put(self._StartWorker())
+
+  @property
+  def stats(self) -> AnnotatorPoolStats:
+    """Return the counters of the pool."""
+    with self._lock:
+      return AnnotatorPoolStats(
+        request_count=self._request_count,
+        success_count=self._success_count,
+        failure_count=self._failure_count,
+        timeout_count=self._timeout_count,
+        respawn_count=self._respawn_count,
+        elapsed_seconds=time.time() - self._start_time,
+      )
+
+  def Annotate(
+    self,
+    analysis: str,
+    graph: Union[
+      programl_pb2.ProgramGraph, bytes, control_flow_csr.ProgramGraphArrays
+    ],
+    n: int = 0,
+    timeout: int = 120,
+  ) -> data_flow_graphs.DataFlowGraphs:
+    """Run an analysis on a worker process.
+
+    This blocks until a worker is idle. The graph tuples of the annotated
+    graphs are constructed on first use, in the calling process.
+
+    Args:
+      analysis: The name of the analysis to run.
+      graph: The unlabelled ProgramGraph protocol buffer to to annotate, either
+        as a proto instance or as binary-encoded byte array, or the arrays of a
+        program graph for analyses which support them.
+      n: The maximum number of labelled graphs to produce.
+      timeout: The maximum number of seconds to run the analysis for.
+
+    Returns:
+      The annotated graphs.
+
+    Raises:
+      ValueError: If an invalid analysis is requested, or the pool is closed.
+      data_flow_graphs.AnalysisFailed: If the analysis raised an error, or the
+        worker process died.
+      data_flow_graphs.AnalysisTimeout: If the analysis did not complete within
+        the requested timeout.
+    """
+    if analysis not in self.analyses:
+      raise ValueError(
+        f"Unknown analysis: {analysis}. "
+        f"Available analyses: {sorted(self.analyses)}",
+      )
+    if self._closed:
+      raise ValueError("AnnotatorPool is closed")
+
+    if isinstance(graph, programl_pb2.ProgramGraph):
+      graph = programl.ToBytes(graph, programl.InputOutputFormat.PB)
+
+    worker = self._idle_workers.get()
+    with self._lock:
+      self._request_count += 1
+    try:
+      worker.task_count += 1
+      try:
+        worker.connection.send((analysis, graph, n))
+        if not worker.connection.poll(timeout):
+          worker = self._ReplaceWorker(worker)
+          with self._lock:
+            self._timeout_count += 1
+            self._failure_count += 1
+          raise data_flow_graphs.AnalysisTimeout(timeout)
+        success, value = worker.connection.recv()
+      except (EOFError, OSError):
+        exitcode = worker.process.exitcode
+        worker = self._ReplaceWorker(worker)
+        with self._lock:
+          self._failure_count += 1
+        raise data_flow_graphs.AnalysisFailed(
+          f"Annotator worker died with exit code {exitcode}"
+        )
+
+      if not success:
+        with self._lock:
+          self._failure_count += 1
+        raise data_flow_graphs.AnalysisFailed(value)
+
+      with self._lock:
+        self._success_count += 1
+      return value
+    finally:
+      if self.max_tasks_per_worker and (
+        worker.task_count >= self.max_tasks_per_worker
+      ):
+        worker = self._ReplaceWorker(worker, kill=False)
+      self._idle_workers.put(worker)
+
+  def Close(self) -> None:
+    """Stop all of the worker processes.
+
+    This must not be called while another thread is calling Annotate().
+    """
+    if self._closed:
+      return
+    self._closed = True
+    with self._lock:
+      workers = list(self._workers)
+      self._workers.clear()
+    for worker in workers:
+      worker.Stop()
+
+  def __enter__(self) -> "AnnotatorPool":
+    return self
+
+  def __exit__(self, *args) -> None:
+    self.Close()
+
+  def _StartWorker(self) -> _Worker:
+    """Start a new worker process."""
+    with self._lock:
+      self._worker_number += 1
+      name = f"annotator-{self._worker_number}"
+    worker = _Worker(self.context, name, self.analyses)
+    with self._lock:
+      self._workers.add(worker)
+    return worker
+
+  def _ReplaceWorker(self, worker: _Worker, kill: bool = True) -> _Worker:
+    """Terminate a worker process and start a new one in its place."""
+    with self._lock:
+      self._workers.discard(worker)
+      self._respawn_count += 1
+    if kill:
+      worker.Kill()
+    else:
+      worker.Stop()
+    return self._StartWorker()
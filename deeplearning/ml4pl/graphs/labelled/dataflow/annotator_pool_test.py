@@ -0,0 +1,199 @@
+"""Unit tests for //deeplearning/ml4pl/graphs/labelled/dataflow:annotator_pool."""
+import pickle
+import threading
+
+from deeplearning.ml4pl.graphs import programl
+from deeplearning.ml4pl.graphs import programl_pb2
+from deeplearning.ml4pl.graphs.labelled.dataflow import annotate
+from deeplearning.ml4pl.graphs.labelled.dataflow import annotator_pool
+from deeplearning.ml4pl.graphs.labelled.dataflow import control_flow_csr
+from deeplearning.ml4pl.graphs.labelled.dataflow import data_flow_graphs
+from deeplearning.ml4pl.testing import random_programl_generator
+from labm8.py import test
+
+FLAGS = test.FLAGS
+
+
+###############################################################################
+# Fixtures.
+###############################################################################
+
+
+@test.Fixture(scope="session")
+def one_proto() -> programl_pb2.ProgramGraph:
+  """A test fixture which enumerates a single real proto."""
+  return next(random_programl_generator.EnumerateTestSet())
+
+
+@test.Fixture(scope="function")
+def pool() -> annotator_pool.AnnotatorPool:
+  """A test fixture which yields a pool of two workers."""
+  with annotator_pool.AnnotatorPool(annotate.ANALYSES, worker_count=2) as pool:
+    yield pool
+
+
+###############################################################################
+# Tests.
+###############################################################################
+
+
+def test_Annotate_invalid_analysis(
+  pool: annotator_pool.AnnotatorPool, one_proto: programl_pb2.ProgramGraph
+):
+  """Test that error is raised if the analysis is unknown."""
+  with test.Raises(ValueError) as e_ctx:
+    pool.Annotate("invalid_analysis", one_proto)
+  assert str(e_ctx.value).startswith("Unknown analysis: invalid_analysis. ")
+  assert pool.stats.request_count == 0
+
+
+@test.Parametrize("binary_graph", (False, True))
+def test_Annotate_matches_annotate(
+  pool: annotator_pool.AnnotatorPool,
+  one_proto: programl_pb2.ProgramGraph,
+  binary_graph: bool,
+):
+  """Test that the output of a worker is identical to annotate.Annotate()."""
+  graph = (
+    programl.ToBytes(one_proto, programl.InputOutputFormat.PB)
+    if binary_graph
+    else one_proto
+  )
+  actual = pool.Annotate("reachability", graph, n=0)
+  expected = annotate.Annotate("reachability", one_proto, n=0)
+
+  assert len(actual.graph_tuples) == len(expected.graph_tuples)
+  for a, b in zip(actual.graph_tuples, expected.graph_tuples):
+    assert pickle.dumps(a) == pickle.dumps(b)
+  assert pool.stats.success_count == 1
+
+
+def test_Annotate_error(
+  pool: annotator_pool.AnnotatorPool, one_proto: programl_pb2.ProgramGraph
+):
+  """Test that an analysis error is raised, and the worker is re-used."""
+  with test.Raises(data_flow_graphs.AnalysisFailed) as e_ctx:
+    pool.Annotate("test_error", one_proto)
+  assert "something went wrong!" in str(e_ctx.value)
+
+  stats = pool.stats
+  assert stats.failure_count == 1
+  assert stats.timeout_count == 0
+  assert stats.respawn_count == 0
+
+
+def test_Annotate_timeout(
+  pool: annotator_pool.AnnotatorPool, one_proto: programl_pb2.ProgramGraph
+):
+  """Test that a worker which times out is replaced."""
+  with test.Raises(data_flow_graphs.AnalysisTimeout):
+    pool.Annotate("test_timeout", one_proto, timeout=1)
+
+  stats = pool.stats
+  assert stats.timeout_count == 1
+  assert stats.failure_count == 1
+  assert stats.respawn_count == 1
+
+  # The pool can still be used.
+  assert pool.Annotate("test_pass_thru", one_proto, n=2).graphs
+  assert pool.stats.success_count == 1
+
+
+def test_Annotate_timeout_does_not_affect_other_workers(
+  pool: annotator_pool.AnnotatorPool, one_proto: programl_pb2.ProgramGraph
+):
+  """Test that a hanging task is killed while tasks on other workers finish."""
+  errors = []
+  annotated_counts = []
+
+  def HangingWorker():
+    try:
+      pool.Annotate("test_timeout", one_proto, timeout=10)
+    except Exception as e:
+      errors.append(e)
+
+  def Worker():
+    for _ in range(5):
+      annotated_counts.append(
+        len(pool.Annotate("test_pass_thru", one_proto, n=1, timeout=30).protos)
+      )
+
+  hanging_thread = threading.Thread(target=HangingWorker)
+  hanging_thread.start()
+  thread = threading.Thread(target=Worker)
+  thread.start()
+  thread.join()
+  # The other tasks finish on the remaining worker before the hanging task is
+  # killed.
+  assert hanging_thread.is_alive()
+  hanging_thread.join()
+
+  assert len(errors) == 1
+  assert isinstance(errors[0], data_flow_graphs.AnalysisTimeout)
+  assert annotated_counts == [1, 1, 1, 1, 1]
+
+  stats = pool.stats
+  assert stats.request_count == 6
+  assert stats.success_count == 5
+  assert stats.timeout_count == 1
+  assert stats.respawn_count == 1
+  assert stats.throughput > 0
+
+
+def test_Annotate_program_graph_arrays(
+  pool: annotator_pool.AnnotatorPool, one_proto: programl_pb2.ProgramGraph
+):
+  """Test that a worker can annotate the arrays of a program graph."""
+  arrays = control_flow_csr.ProgramGraphArrays.FromProgramGraph(one_proto)
+  actual = pool.Annotate("reachability_csr", arrays, n=0)
+  expected = annotate.Annotate("reachability_csr", one_proto, n=0)
+
+  assert len(actual.graph_tuples) == len(expected.graph_tuples)
+  for a, b in zip(actual.graph_tuples, expected.graph_tuples):
+    assert pickle.dumps(a) == pickle.dumps(b)
+
+
+def test_Annotate_max_tasks_per_worker(one_proto: programl_pb2.ProgramGraph):
+  """Test that workers are restarted after a number of tasks."""
+  with annotator_pool.AnnotatorPool(
+    annotate.ANALYSES, worker_count=1, max_tasks_per_worker=2
+  ) as pool:
+    for _ in range(5):
+      pool.Annotate("test_empty", one_proto)
+    assert pool.stats.respawn_count == 2
+
+
+def test_Annotate_from_threads(
+  pool: annotator_pool.AnnotatorPool, one_proto: programl_pb2.ProgramGraph
+):
+  """Test that a pool can be shared by multiple threads."""
+  errors = []
+
+  def Worker():
+    try:
+      for _ in range(5):
+        pool.Annotate("test_pass_thru", one_proto, n=1, timeout=30)
+    except Exception as e:
+      errors.append(e)
+
+  threads = [threading.Thread(target=Worker) for _ in range(4)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+
+  assert not errors
+  assert pool.stats.request_count == 20
+  assert pool.stats.success_count == 20
+
+
+def test_Close(one_proto: programl_pb2.ProgramGraph):
+  """Test that a closed pool cannot be used."""
+  pool = annotator_pool.AnnotatorPool(annotate.ANALYSES, worker_count=1)
+  pool.Close()
+  with test.Raises(ValueError):
+    pool.Annotate("test_empty", one_proto)
+
+
+if __name__ == "__main__":
+  test.Main()
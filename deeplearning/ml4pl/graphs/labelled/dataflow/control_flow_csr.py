@@ -0,0 +1,637 @@
+"""This module defines a compact array representation of control flow.
+
+The control edges of a program graph are stored in compressed sparse row (CSR)
+format, which allows data flow analyses to traverse the graph using array
+operations rather than by iterating over networkx edge views.
+
+ProgramGraphArrays stores every edge flow of a program graph in this format,
+along with the node features that are needed to produce graph tuples, so that
+a program graph which has been preprocessed once can be annotated without
+parsing the protocol buffer again.
+"""
+import pathlib
+import random
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+
+from deeplearning.ml4pl.graphs import programl_pb2
+from deeplearning.ml4pl.graphs.labelled import graph_tuple as graph_tuple_lib
+from deeplearning.ml4pl.graphs.labelled.dataflow import data_flow_graphs
+from labm8.py import app
+
+FLAGS = app.FLAGS
+
+# The value of ControlFlowCsr.node_function for nodes which are not in a
+# function.
+NO_FUNCTION = -1
+
+
+def _CreateCsr(
+  node_count: int, sources: np.array, targets: np.array
+) -> Tuple[np.array, np.array]:
+  """Create CSR index pointer and index arrays for a list of edges.
+
+  The order of edges with the same source node is preserved.
+
+  Args:
+    node_count: The number of nodes.
+    sources: An array of edge source nodes.
+    targets: An array of edge target nodes.
+
+  Returns:
+    A tuple of <indptr, indices> arrays, where the neighbours of node `n` are
+    indices[indptr[n]:indptr[n + 1]].
+  """
+  order = np.argsort(sources, kind="stable")
+  indices = targets[order].astype(np.int32)
+  indptr = np.zeros(node_count + 1, dtype=np.int64)
+  np.cumsum(np.bincount(sources, minlength=node_count), out=indptr[1:])
+  return indptr, indices
+
+
+# The number of edge flows: {control, data, call}.
+EDGE_FLOW_COUNT = 3
+
+
+class ProgramGraphArrays(object):
+  """The edges and node features of a program graph, as arrays.
+
+  The edges of each flow are stored twice: once in CSR format indexed by source
+  node, and once indexed by destination node. Both orders match the order in
+  which networkx iterates over the out_edges() and in_edges() of the graph
+  produced by programl.ProgramGraphToNetworkX(), so that analyses which visit
+  neighbours in turn produce the same results as their networkx counterparts.
+  """
+
+  def __init__(
+    self,
+    node_type: np.array,
+    node_function: np.array,
+    node_x: np.array,
+    graph_x: Optional[np.array],
+    graph_y: Optional[np.array],
+    successor_indptrs: List[np.array],
+    successor_indices: List[np.array],
+    successor_positions: List[np.array],
+    predecessor_indptrs: List[np.array],
+    predecessor_indices: List[np.array],
+  ):
+    """Constructor.
+
+    Args:
+      node_type: An array of shape (node_count) of programl_pb2.Node.Type
+        values.
+      node_function: An array of shape (node_count) of function IDs, or
+        NO_FUNCTION.
+      node_x: An array of shape (node_count, node_x_dimensionality).
+      graph_x: The graph features, if any.
+      graph_y: The graph labels, if any.
+      successor_indptrs: A CSR index pointer array for each edge flow, indexed
+        by source node.
+      successor_indices: A CSR index array of destination nodes for each edge
+        flow.
+      successor_positions: The position of every edge in successor_indices.
+      predecessor_indptrs: A CSR index pointer array for each edge flow,
+        indexed by destination node.
+      predecessor_indices: A CSR index array of source nodes for each edge
+        flow.
+    """
+    self.node_type = node_type
+    self.node_function = node_function
+    self.node_x = node_x
+    self.graph_x = graph_x
+    self.graph_y = graph_y
+    self.successor_indptrs = successor_indptrs
+    self.successor_indices = successor_indices
+    self.successor_positions = successor_positions
+    self.predecessor_indptrs = predecessor_indptrs
+    self.predecessor_indices = predecessor_indices
+
+  @property
+  def node_count(self) -> int:
+    return len(self.node_type)
+
+  @property
+  def is_statement(self) -> np.array:
+    """A boolean array of shape (node_count)."""
+    return self.node_type == programl_pb2.Node.STATEMENT
+
+  @classmethod
+  def FromProgramGraph(
+    cls, proto: programl_pb2.ProgramGraph
+  ) -> "ProgramGraphArrays":
+    """Construct the arrays of a program graph.
+
+    Functions are identified by name, so that two function messages with the
+    same name are considered the same function.
+    """
+    node_count = len(proto.node)
+    edge_count = len(proto.edge)
+    edges = np.array(
+      [
+        (edge.flow, edge.source_node, edge.destination_node, edge.position)
+        for edge in proto.edge
+      ],
+      dtype=np.int64,
+    ).reshape(edge_count, 4)
+    flows, sources, targets, positions = edges.T
+
+    # networkx groups the out-edges of a node by the first occurrence of each
+    # <source, target> pair, and the in-edges of a node by the first occurrence
+    # of each <target, source> pair. Edges between the same pair of nodes are
+    # in insertion order.
+    _, first_occurrences, pair_indices = np.unique(
+      sources * max(node_count, 1) + targets,
+      return_index=True,
+      return_inverse=True,
+    )
+    pair_order = first_occurrences[pair_indices]
+    insertion_order = np.arange(edge_count)
+    successor_order = np.lexsort((insertion_order, pair_order, sources))
+    predecessor_order = np.lexsort((insertion_order, pair_order, targets))
+
+    successor_indptrs, successor_indices, successor_positions = [], [], []
+    predecessor_indptrs, predecessor_indices = [], []
+    for flow in range(EDGE_FLOW_COUNT):
+      # _CreateCsr() preserves the order of edges with the same source node.
+      order = successor_order[flows[successor_order] == flow]
+      indptr, indices = _CreateCsr(node_count, sources[order], targets[order])
+      successor_indptrs.append(indptr)
+      successor_indices.append(indices)
+      successor_positions.append(positions[order].astype(np.int32))
+
+      order = predecessor_order[flows[predecessor_order] == flow]
+      indptr, indices = _CreateCsr(node_count, targets[order], sources[order])
+      predecessor_indptrs.append(indptr)
+      predecessor_indices.append(indices)
+
+    function_ids = {}
+    function_names = [function.name for function in proto.function]
+    node_type = np.zeros(node_count, dtype=np.int32)
+    node_function = np.full(node_count, NO_FUNCTION, dtype=np.int32)
+    for i, node in enumerate(proto.node):
+      node_type[i] = node.type
+      if node.HasField("function"):
+        name = function_names[node.function]
+        node_function[i] = function_ids.setdefault(name, len(function_ids))
+
+    return cls(
+      node_type=node_type,
+      node_function=node_function,
+      node_x=np.vstack(
+        [np.array(node.x, dtype=np.int64) for node in proto.node]
+      ),
+      graph_x=np.array(proto.x, dtype=np.int64) if proto.x else None,
+      graph_y=np.array(proto.y, dtype=np.int64) if proto.y else None,
+      successor_indptrs=successor_indptrs,
+      successor_indices=successor_indices,
+      successor_positions=successor_positions,
+      predecessor_indptrs=predecessor_indptrs,
+      predecessor_indices=predecessor_indices,
+    )
+
+  def SuccessorLists(self, flow: int) -> List[List[int]]:
+    """Return the successors of every node for an edge flow as python lists."""
+    return _CsrToLists(
+      self.node_count,
+      self.successor_indptrs[flow],
+      self.successor_indices[flow],
+    )
+
+  def PredecessorLists(self, flow: int) -> List[List[int]]:
+    """Return the predecessors of every node for an edge flow as python lists.
+    """
+    return _CsrToLists(
+      self.node_count,
+      self.predecessor_indptrs[flow],
+      self.predecessor_indices[flow],
+    )
+
+  def ToGraphTuple(self) -> graph_tuple_lib.GraphTuple:
+    """Construct the unlabelled graph tuple.
+
+    The result is identical to GraphTuple.CreateFromProgramGraph(), except that
+    node labels are not stored.
+    """
+    adjacencies = []
+    for flow in range(EDGE_FLOW_COUNT):
+      indptr = self.successor_indptrs[flow]
+      sources = np.repeat(
+        np.arange(self.node_count, dtype=np.int32), np.diff(indptr)
+      )
+      adjacencies.append(
+        np.column_stack((sources, self.successor_indices[flow])).astype(
+          np.int32
+        )
+      )
+    return graph_tuple_lib.GraphTuple(
+      adjacencies=np.array(adjacencies),
+      edge_positions=np.array(self.successor_positions),
+      node_x=self.node_x,
+      node_y=None,
+      graph_x=self.graph_x,
+      graph_y=self.graph_y,
+    )
+
+  def Save(self, path: pathlib.Path) -> None:
+    """Write the arrays to an uncompressed numpy archive."""
+    arrays = {
+      "node_type": self.node_type,
+      "node_function": self.node_function,
+      "node_x": self.node_x,
+      # Empty arrays are used for missing graph features and labels.
+      "graph_x": np.zeros(0, dtype=np.int64)
+      if self.graph_x is None
+      else self.graph_x,
+      "graph_y": np.zeros(0, dtype=np.int64)
+      if self.graph_y is None
+      else self.graph_y,
+    }
+    for flow in range(EDGE_FLOW_COUNT):
+      arrays[f"successor_indptr_{flow}"] = self.successor_indptrs[flow]
+      arrays[f"successor_indices_{flow}"] = self.successor_indices[flow]
+      arrays[f"successor_positions_{flow}"] = self.successor_positions[flow]
+      arrays[f"predecessor_indptr_{flow}"] = self.predecessor_indptrs[flow]
+      arrays[f"predecessor_indices_{flow}"] = self.predecessor_indices[flow]
+    with open(path, "wb") as f:
+      np.savez(f, **arrays)
+
+  @classmethod
+  def Load(cls, path: pathlib.Path) -> "ProgramGraphArrays":
+    """Read arrays which were written by Save()."""
+    with np.load(path, allow_pickle=False) as arrays:
+      return cls(
+        node_type=arrays["node_type"],
+        node_function=arrays["node_function"],
+        node_x=arrays["node_x"],
+        graph_x=arrays["graph_x"] if arrays["graph_x"].size else None,
+        graph_y=arrays["graph_y"] if arrays["graph_y"].size else None,
+        successor_indptrs=[
+          arrays[f"successor_indptr_{flow}"] for flow in range(EDGE_FLOW_COUNT)
+        ],
+        successor_indices=[
+          arrays[f"successor_indices_{flow}"]
+          for flow in range(EDGE_FLOW_COUNT)
+        ],
+        successor_positions=[
+          arrays[f"successor_positions_{flow}"]
+          for flow in range(EDGE_FLOW_COUNT)
+        ],
+        predecessor_indptrs=[
+          arrays[f"predecessor_indptr_{flow}"]
+          for flow in range(EDGE_FLOW_COUNT)
+        ],
+        predecessor_indices=[
+          arrays[f"predecessor_indices_{flow}"]
+          for flow in range(EDGE_FLOW_COUNT)
+        ],
+      )
+
+
+def _CsrToLists(
+  node_count: int, indptr: np.array, indices: np.array
+) -> List[List[int]]:
+  """Convert CSR arrays to a list of python lists of neighbours."""
+  indptr = indptr.tolist()
+  indices = indices.tolist()
+  return [
+    indices[indptr[node] : indptr[node + 1]] for node in range(node_count)
+  ]
+
+
+class ControlFlowCsr(object):
+  """The control edges of a program graph in compressed sparse row format."""
+
+  def __init__(
+    self,
+    node_count: int,
+    sources: np.array,
+    targets: np.array,
+    node_function: np.array,
+    is_statement: np.array,
+  ):
+    """Constructor.
+
+    Args:
+      node_count: The number of nodes in the graph.
+      sources: An array of control edge source nodes.
+      targets: An array of control edge target nodes.
+      node_function: An array of shape (node_count) of function IDs, or
+        NO_FUNCTION.
+      is_statement: A boolean array of shape (node_count).
+    """
+    self.node_count = node_count
+    self.node_function = node_function
+    self.is_statement = is_statement
+    self.successor_indptr, self.successor_indices = _CreateCsr(
+      node_count, sources, targets
+    )
+    self.predecessor_indptr, self.predecessor_indices = _CreateCsr(
+      node_count, targets, sources
+    )
+    self._successor_lists = None
+
+  @classmethod
+  def FromProgramGraph(
+    cls, proto: programl_pb2.ProgramGraph
+  ) -> "ControlFlowCsr":
+    """Construct the control flow arrays of a program graph.
+
+    Functions are identified by name, so that two function messages with the
+    same name are considered the same function.
+    """
+    return cls.FromProgramGraphArrays(
+      ProgramGraphArrays.FromProgramGraph(proto)
+    )
+
+  @classmethod
+  def FromProgramGraphArrays(
+    cls, arrays: ProgramGraphArrays
+  ) -> "ControlFlowCsr":
+    """Construct the control flow arrays from the arrays of a program graph."""
+    indptr = arrays.successor_indptrs[programl_pb2.Edge.CONTROL]
+    return cls(
+      node_count=arrays.node_count,
+      sources=np.repeat(np.arange(arrays.node_count), np.diff(indptr)),
+      targets=arrays.successor_indices[programl_pb2.Edge.CONTROL],
+      node_function=arrays.node_function,
+      is_statement=arrays.is_statement,
+    )
+
+  def Successors(self, node: int) -> np.array:
+    """Return the control successors of a node."""
+    return self.successor_indices[
+      self.successor_indptr[node] : self.successor_indptr[node + 1]
+    ]
+
+  def Predecessors(self, node: int) -> np.array:
+    """Return the control predecessors of a node."""
+    return self.predecessor_indices[
+      self.predecessor_indptr[node] : self.predecessor_indptr[node + 1]
+    ]
+
+  def SuccessorLists(self) -> List[List[int]]:
+    """Return the control successors of every node as python lists.
+
+    Traversals which visit one node at a time are faster over python lists
+    than over numpy array slices, so the lists are constructed once and cached.
+    """
+    if self._successor_lists is None:
+      self._successor_lists = _CsrToLists(
+        self.node_count, self.successor_indptr, self.successor_indices
+      )
+    return self._successor_lists
+
+  def Reachable(self, root_node: int) -> Tuple[List[int], int]:
+    """Compute the set of nodes reachable from a root node.
+
+    This is a level-synchronous breadth first traversal, where each node is
+    visited once.
+
+    Args:
+      root_node: The node to begin traversal from.
+
+    Returns:
+      A tuple of the list of nodes which are reachable from the root (including
+      the root), in the order that they are visited, and the number of levels
+      of the traversal.
+    """
+    successors = self.SuccessorLists()
+    visited = [False] * self.node_count
+    visited[root_node] = True
+    reachable = [root_node]
+    frontier = reachable
+    level_count = 1
+    while True:
+      next_frontier = []
+      for node in frontier:
+        for successor in successors[node]:
+          if not visited[successor]:
+            visited[successor] = True
+            next_frontier.append(successor)
+      if not next_frontier:
+        break
+      reachable.extend(next_frontier)
+      frontier = next_frontier
+      level_count += 1
+    return reachable, level_count
+
+  def FunctionNodes(self, function: int) -> np.array:
+    """Return the statement nodes in a function, in ascending order."""
+    return np.nonzero(
+      (self.node_function == function) & self.is_statement
+    )[0].astype(np.int32)
+
+  def DominatorTree(
+    self, nodes: np.array, entry_nodes: List[int]
+  ) -> Tuple[np.array, int]:
+    """Compute the immediate dominators of a subgraph.
+
+    This uses the iterative algorithm of Cooper, Harvey, and Kennedy ("A Simple,
+    Fast Dominance Algorithm", 2001) over a reverse postorder of the subgraph.
+    A virtual entry node is inserted as the predecessor of every entry node, so
+    that graphs with multiple entry points have a single dominator tree.
+
+    Args:
+      nodes: A sorted array of the nodes in the subgraph. Only control edges
+        between these nodes are considered.
+      entry_nodes: The entry nodes of the subgraph.
+
+    Returns:
+      A tuple of an array of shape (len(nodes) + 1) of immediate dominators,
+      and the number of iterations to reach a fixed point. Values in the array
+      are indices into `nodes`, where the value len(nodes) refers to the virtual
+      entry node, and -1 means that the node is unreachable from the entry.
+    """
+    node_count = len(nodes)
+    virtual_entry = node_count
+
+    # Map from graph node to index into `nodes`, or -1 for nodes outside of the
+    # subgraph.
+    local = np.full(self.node_count, -1, dtype=np.int32)
+    local[nodes] = np.arange(node_count, dtype=np.int32)
+
+    # The inner loops of this algorithm operate on scalars, so use python lists
+    # rather than numpy arrays.
+    successors = [[] for _ in range(node_count + 1)]
+    predecessors = [[] for _ in range(node_count + 1)]
+    graph_successors = self.SuccessorLists()
+    local_list = local.tolist()
+    for i, node in enumerate(nodes.tolist()):
+      for successor in graph_successors[node]:
+        successor = local_list[successor]
+        if successor >= 0:
+          successors[i].append(successor)
+          predecessors[successor].append(i)
+    for entry in local[np.array(entry_nodes, dtype=np.int64)].tolist():
+      successors[virtual_entry].append(entry)
+      predecessors[entry].append(virtual_entry)
+
+    # Number the nodes in postorder using an iterative depth first search.
+    postorder_number = [-1] * (node_count + 1)
+    postorder = []
+    visited = [False] * (node_count + 1)
+    visited[virtual_entry] = True
+    stack = [(virtual_entry, iter(successors[virtual_entry]))]
+    while stack:
+      node, children = stack[-1]
+      for child in children:
+        if not visited[child]:
+          visited[child] = True
+          stack.append((child, iter(successors[child])))
+          break
+      else:
+        stack.pop()
+        postorder_number[node] = len(postorder)
+        postorder.append(node)
+
+    idom = [-1] * (node_count + 1)
+    idom[virtual_entry] = virtual_entry
+
+    def Intersect(a: int, b: int) -> int:
+      """Find the nearest common dominator of two nodes."""
+      while a != b:
+        while postorder_number[a] < postorder_number[b]:
+          a = idom[a]
+        while postorder_number[b] < postorder_number[a]:
+          b = idom[b]
+      return a
+
+    reverse_postorder = postorder[-2::-1]
+    iteration_count = 0
+    changed = True
+    while changed:
+      changed = False
+      iteration_count += 1
+      for node in reverse_postorder:
+        new_idom = -1
+        for predecessor in predecessors[node]:
+          if idom[predecessor] < 0:
+            continue
+          if new_idom < 0:
+            new_idom = predecessor
+          else:
+            new_idom = Intersect(predecessor, new_idom)
+        if idom[node] != new_idom:
+          idom[node] = new_idom
+          changed = True
+
+    return np.array(idom, dtype=np.int32), iteration_count
+
+
+def DominatorTreeIntervals(idom: np.array) -> Tuple[np.array, np.array]:
+  """Number the nodes of a dominator tree so that subtrees are intervals.
+
+  Args:
+    idom: An array of immediate dominators, as returned by
+      ControlFlowCsr.DominatorTree(). The last element is the root.
+
+  Returns:
+    A tuple of <enter, exit> arrays, where node `a` dominates node `b` iff
+    enter[a] <= enter[b] and exit[b] <= exit[a]. Nodes which are not in the
+    tree have the values -1.
+  """
+  root = len(idom) - 1
+  children = [[] for _ in range(len(idom))]
+  for node, parent in enumerate(idom[:-1].tolist()):
+    if parent >= 0:
+      children[parent].append(node)
+
+  enter = [-1] * len(idom)
+  exit = [-1] * len(idom)
+  counter = 0
+  stack = [(root, False)]
+  while stack:
+    node, done = stack.pop()
+    if done:
+      exit[node] = counter
+      counter += 1
+      continue
+    enter[node] = counter
+    counter += 1
+    stack.append((node, True))
+    stack.extend((child, False) for child in reversed(children[node]))
+  return np.array(enter, dtype=np.int32), np.array(exit, dtype=np.int32)
+
+
+class CsrDataFlowGraphAnnotator(data_flow_graphs.DataFlowGraphAnnotator):
+  """A data flow annotator which operates on the control flow arrays of a
+  program graph.
+
+  Unlike NetworkXDataFlowGraphAnnotator, this never constructs a networkx
+  graph. Subclasses implement GetRootNodes() and AnnotateRoot().
+  """
+
+  def __init__(
+    self,
+    unlabelled_graph: Optional[programl_pb2.ProgramGraph] = None,
+    arrays: Optional[ProgramGraphArrays] = None,
+  ):
+    """Constructor.
+
+    Args:
+      unlabelled_graph: The unlabelled program graph used to produce annotated
+        graphs.
+      arrays: The arrays of the unlabelled program graph. If provided, the
+        unlabelled graph is not required. The networkx graphs and protos of
+        the annotated graphs are available only if an unlabelled graph is
+        provided.
+    """
+    super(CsrDataFlowGraphAnnotator, self).__init__(unlabelled_graph)
+    if arrays is None:
+      arrays = ProgramGraphArrays.FromProgramGraph(unlabelled_graph)
+    self.arrays = arrays
+    self.cfg = ControlFlowCsr.FromProgramGraphArrays(arrays)
+    self.root_nodes = self.GetRootNodes().tolist()
+
+  def GetRootNodes(self) -> np.array:
+    """Return the array of nodes which can be used as a root node."""
+    raise NotImplementedError("abstract class")
+
+  def AnnotateRoot(
+    self, root_node: int
+  ) -> data_flow_graphs.RootNodeAnnotation:
+    """Compute the annotation for a single root node."""
+    raise NotImplementedError("abstract class")
+
+  def MakeAnnotated(
+    self, n: int = 0
+  ) -> data_flow_graphs.GraphTupleDataFlowGraphs:
+    """Produce up to "n" annotated graphs.
+
+    Args:
+      n: The maximum number of annotated graphs to produce. Multiple graphs are
+        produced by selecting different root nodes for creating annotations.
+        If `n` is provided, the number of annotated graphs generated will be in
+        the range 1 <= x <= min(root_node_count, n). Else, the number of graphs
+        will be equal to root_node_count (i.e. one graph for each root node in
+        the input graph).
+
+    Returns:
+      A GraphTupleDataFlowGraphs instance.
+
+    Raises:
+      AnalysisFailed: If the analysis fails.
+      AnalysisTimeout: If the analysis times out.
+    """
+    if n and n < len(self.root_nodes):
+      random.shuffle(self.root_nodes)
+      root_nodes = self.root_nodes[:n]
+    else:
+      root_nodes = self.root_nodes
+
+    annotations = []
+    for root_node in root_nodes:
+      annotation = self.AnnotateRoot(root_node)
+      # Ignore graphs that require no data flow steps.
+      if annotation.data_flow_steps:
+        annotations.append(annotation)
+
+    return data_flow_graphs.GraphTupleDataFlowGraphs(
+      self.unlabelled_graph,
+      annotations,
+      unlabelled_graph_tuple=self.arrays.ToGraphTuple(),
+    )
@@ -0,0 +1,222 @@
+"""Unit tests for //deeplearning/ml4pl/graphs/labelled/dataflow:control_flow_csr."""
+import pathlib
+
+import numpy as np
+
+from deeplearning.ml4pl.graphs import programl
+from deeplearning.ml4pl.graphs import programl_pb2
+from deeplearning.ml4pl.graphs.labelled import graph_tuple
+from deeplearning.ml4pl.graphs.labelled.dataflow import control_flow_csr
+from labm8.py import test
+
+FLAGS = test.FLAGS
+
+###############################################################################
+# Fixtures.
+###############################################################################
+
+
+@test.Fixture(scope="function")
+def graph() -> programl_pb2.ProgramGraph:
+  """A graph with a loop, a data edge, and a statement outside of a function."""
+  #   a --> b --> c --> d
+  #         ^     |
+  #         +-----+
+  builder = programl.GraphBuilder()
+  fn = builder.AddFunction()
+  a = builder.AddNode(function=fn)
+  b = builder.AddNode(function=fn)
+  c = builder.AddNode(function=fn)
+  d = builder.AddNode(function=fn)
+  v = builder.AddNode(type=programl_pb2.Node.IDENTIFIER, function=fn)
+  builder.AddNode()
+  builder.AddEdge(a, b)
+  builder.AddEdge(b, c)
+  builder.AddEdge(c, b)
+  builder.AddEdge(c, d)
+  builder.AddEdge(v, c, flow=programl_pb2.Edge.DATA)
+  return builder.proto
+
+
+@test.Fixture(scope="function")
+def multigraph() -> programl_pb2.ProgramGraph:
+  """A graph with parallel edges and edges of every flow."""
+
+  def Edge(flow, source_node, destination_node, position=0):
+    return programl_pb2.Edge(
+      flow=flow,
+      source_node=source_node,
+      destination_node=destination_node,
+      position=position,
+    )
+
+  return programl_pb2.ProgramGraph(
+    node=[programl_pb2.Node(x=[i]) for i in range(4)],
+    edge=[
+      Edge(programl_pb2.Edge.DATA, 2, 1),
+      Edge(programl_pb2.Edge.CONTROL, 0, 1),
+      Edge(programl_pb2.Edge.DATA, 0, 3),
+      Edge(programl_pb2.Edge.DATA, 3, 1, position=1),
+      Edge(programl_pb2.Edge.DATA, 0, 1, position=2),
+      Edge(programl_pb2.Edge.CALL, 1, 2),
+      Edge(programl_pb2.Edge.DATA, 2, 1, position=3),
+    ],
+    x=[5],
+  )
+
+
+###############################################################################
+# Tests.
+###############################################################################
+
+
+def test_FromProgramGraph_successors(graph: programl_pb2.ProgramGraph):
+  """Test that only control edges are included."""
+  cfg = control_flow_csr.ControlFlowCsr.FromProgramGraph(graph)
+  assert cfg.node_count == 6
+  assert cfg.Successors(0).tolist() == [1]
+  assert cfg.Successors(2).tolist() == [1, 3]
+  assert cfg.Successors(4).tolist() == []
+  assert cfg.Predecessors(1).tolist() == [0, 2]
+  assert cfg.Predecessors(2).tolist() == [1]
+
+
+def test_FromProgramGraph_node_function(graph: programl_pb2.ProgramGraph):
+  """Test function and statement arrays."""
+  cfg = control_flow_csr.ControlFlowCsr.FromProgramGraph(graph)
+  assert cfg.node_function.tolist() == [0, 0, 0, 0, 0, -1]
+  assert cfg.is_statement.tolist() == [True, True, True, True, False, True]
+  assert cfg.FunctionNodes(0).tolist() == [0, 1, 2, 3]
+
+
+def test_FromProgramGraph_empty_graph():
+  """Test that a graph with no edges has no successors."""
+  cfg = control_flow_csr.ControlFlowCsr.FromProgramGraph(
+    programl_pb2.ProgramGraph(node=[programl_pb2.Node()])
+  )
+  assert cfg.Successors(0).tolist() == []
+  assert cfg.Reachable(0) == ([0], 1)
+
+
+def test_Reachable(graph: programl_pb2.ProgramGraph):
+  """Test reachable nodes and the number of traversal levels."""
+  cfg = control_flow_csr.ControlFlowCsr.FromProgramGraph(graph)
+  assert cfg.Reachable(0) == ([0, 1, 2, 3], 4)
+  assert sorted(cfg.Reachable(2)[0]) == [1, 2, 3]
+  assert cfg.Reachable(2)[1] == 2
+  assert cfg.Reachable(3) == ([3], 1)
+
+
+def test_DominatorTree(graph: programl_pb2.ProgramGraph):
+  """Test immediate dominators of a graph with a loop."""
+  cfg = control_flow_csr.ControlFlowCsr.FromProgramGraph(graph)
+  nodes = cfg.FunctionNodes(0)
+  idom, iteration_count = cfg.DominatorTree(nodes, [0])
+  # The last element is the virtual entry node.
+  assert idom.tolist() == [4, 0, 1, 2, 4]
+  assert iteration_count >= 1
+
+
+def test_DominatorTree_multiple_entries(graph: programl_pb2.ProgramGraph):
+  """Test that a node reachable from two entries is dominated by neither."""
+  cfg = control_flow_csr.ControlFlowCsr.FromProgramGraph(graph)
+  nodes = cfg.FunctionNodes(0)
+  idom, _ = cfg.DominatorTree(nodes, [0, 2])
+  assert idom.tolist() == [4, 4, 4, 2, 4]
+
+
+def test_DominatorTree_unreachable_node(graph: programl_pb2.ProgramGraph):
+  """Test that nodes which are unreachable from the entries have no idom."""
+  cfg = control_flow_csr.ControlFlowCsr.FromProgramGraph(graph)
+  nodes = cfg.FunctionNodes(0)
+  idom, _ = cfg.DominatorTree(nodes, [2])
+  assert idom.tolist() == [-1, 2, 4, 2, 4]
+
+
+def test_DominatorTreeIntervals():
+  """Test that subtrees are nested intervals."""
+  # A tree rooted at 5, where 5 -> {0, 2, 4} and 0 -> 1, and 3 is unreachable.
+  idom = np.array([5, 0, 5, -1, 5, 5], dtype=np.int32)
+  enter, exit = control_flow_csr.DominatorTreeIntervals(idom)
+
+  def Dominates(a: int, b: int) -> bool:
+    return enter[a] <= enter[b] and exit[b] <= exit[a]
+
+  assert Dominates(0, 1)
+  assert not Dominates(1, 0)
+  assert not Dominates(2, 1)
+  assert Dominates(5, 2)
+  assert enter[3] == -1
+  assert exit[3] == -1
+
+
+def test_ProgramGraphArrays_successor_order(
+  multigraph: programl_pb2.ProgramGraph,
+):
+  """Test that successors are in the order of networkx out-edges."""
+  arrays = control_flow_csr.ProgramGraphArrays.FromProgramGraph(multigraph)
+  g = programl.ProgramGraphToNetworkX(multigraph)
+  for flow in range(control_flow_csr.EDGE_FLOW_COUNT):
+    successors = arrays.SuccessorLists(flow)
+    for node in g.nodes:
+      assert successors[node] == [
+        dst for _, dst, f in g.out_edges(node, data="flow") if f == flow
+      ]
+
+
+def test_ProgramGraphArrays_predecessor_order(
+  multigraph: programl_pb2.ProgramGraph,
+):
+  """Test that predecessors are in the order of networkx in-edges."""
+  arrays = control_flow_csr.ProgramGraphArrays.FromProgramGraph(multigraph)
+  g = programl.ProgramGraphToNetworkX(multigraph)
+  assert arrays.PredecessorLists(programl_pb2.Edge.DATA)[1] == [2, 2, 0, 3]
+  for flow in range(control_flow_csr.EDGE_FLOW_COUNT):
+    predecessors = arrays.PredecessorLists(flow)
+    for node in g.nodes:
+      assert predecessors[node] == [
+        src for src, _, f in g.in_edges(node, data="flow") if f == flow
+      ]
+
+
+def test_ProgramGraphArrays_ToGraphTuple(
+  multigraph: programl_pb2.ProgramGraph,
+):
+  """Test that the graph tuple is identical to a converted proto."""
+  arrays = control_flow_csr.ProgramGraphArrays.FromProgramGraph(multigraph)
+  actual = arrays.ToGraphTuple()
+  expected = graph_tuple.GraphTuple.CreateFromProgramGraph(multigraph)
+  for flow in range(control_flow_csr.EDGE_FLOW_COUNT):
+    assert (
+      actual.adjacencies[flow].tolist() == expected.adjacencies[flow].tolist()
+    )
+    assert (
+      actual.edge_positions[flow].tolist()
+      == expected.edge_positions[flow].tolist()
+    )
+  assert actual.node_x.tolist() == expected.node_x.tolist()
+  assert actual.graph_x.tolist() == [5]
+  assert actual.graph_y is None
+
+
+def test_ProgramGraphArrays_Save_Load(
+  graph: programl_pb2.ProgramGraph, tmp_path: pathlib.Path
+):
+  """Test that arrays are unchanged by a save and load."""
+  arrays = control_flow_csr.ProgramGraphArrays.FromProgramGraph(graph)
+  arrays.Save(tmp_path / "arrays.npz")
+  loaded = control_flow_csr.ProgramGraphArrays.Load(tmp_path / "arrays.npz")
+  assert loaded.node_type.tolist() == arrays.node_type.tolist()
+  assert loaded.node_function.tolist() == arrays.node_function.tolist()
+  assert loaded.graph_x is None
+  for flow in range(control_flow_csr.EDGE_FLOW_COUNT):
+    assert loaded.SuccessorLists(flow) == arrays.SuccessorLists(flow)
+    assert loaded.PredecessorLists(flow) == arrays.PredecessorLists(flow)
+    assert (
+      loaded.successor_positions[flow].tolist()
+      == arrays.successor_positions[flow].tolist()
+    )
+
+
+if __name__ == "__main__":
+  test.Main()
@@ -3,13 +3,17 @@ networkx graphs.
 """
 import copy
 import random
+from typing import Iterable
 from typing import List
+from typing import NamedTuple
 from typing import Optional
 
 import networkx as nx
+import numpy as np
 
 from deeplearning.ml4pl.graphs import programl
 from deeplearning.ml4pl.graphs import programl_pb2
+from deeplearning.ml4pl.graphs.labelled import graph_tuple as graph_tuple_lib
 from labm8.py import app
 
 FLAGS = app.FLAGS
@@ -19,9 +23,18 @@ FLAGS = app.FLAGS
 ###############################################################################
 
 
+class DataFlowGraphTuple(NamedTuple):
+  """A data-flow annotated graph tuple and its annotation metadata."""
+
+  graph_tuple: graph_tuple_lib.GraphTuple
+  data_flow_root_node: Optional[int]
+  data_flow_steps: Optional[int]
+  data_flow_positive_node_count: Optional[int]
+
+
 class DataFlowGraphs(object):
   """A set of data-flow annotated graphs that abstract the the difference
-  between proto and networkx representations.
+  between proto, networkx, and graph tuple representations.
   """
 
   @property
@@ -34,6 +47,11 @@ class DataFlowGraphs(object):
     """Access the data flow graphs as protos."""
     raise NotImplementedError("abstract class")
 
+  @property
+  def graph_tuples(self) -> List[DataFlowGraphTuple]:
+    """Access the data flow graphs as graph tuples."""
+    raise NotImplementedError("abstract class")
+
 
 class NetworkxDataFlowGraphs(DataFlowGraphs):
   """A set of data-flow annotated graphs."""
@@ -51,6 +69,171 @@ class NetworkxDataFlowGraphs(DataFlowGraphs):
     """Convert the networkx graphs to program graph protos."""
     return [programl.NetworkXToProgramGraph(g) for g in self.graphs]
 
+  @property
+  def graph_tuples(self) -> List[DataFlowGraphTuple]:
+    """Convert the networkx graphs to graph tuples."""
+    return [
+      DataFlowGraphTuple(
+        graph_tuple=graph_tuple_lib.GraphTuple.CreateFromNetworkX(g),
+        data_flow_root_node=g.graph.get("data_flow_root_node"),
+        data_flow_steps=g.graph.get("data_flow_steps"),
+        data_flow_positive_node_count=g.graph.get(
+          "data_flow_positive_node_count"
+        ),
+      )
+      for g in self.graphs
+    ]
+
+
+class RootNodeAnnotation(NamedTuple):
+  """The result of running a data flow analysis from a single root node."""
+
+  root_node: int
+  data_flow_steps: int
+  data_flow_positive_node_count: int
+  # The node labels. Shape (node_count, node_y_dimensionality), dtype int64.
+  # None if the analysis produces no labels for this root node.
+  node_y: Optional[np.array]
+
+
+def BinaryNodeLabels(
+  node_count: int,
+  positive_nodes: Iterable[int],
+  negative_label: List[int],
+  positive_label: List[int],
+) -> np.array:
+  """Construct an array of binary node labels.
+
+  Args:
+    node_count: The number of nodes.
+    positive_nodes: The nodes to assign the positive label to.
+    negative_label: The label vector of all other nodes.
+    positive_label: The label vector of positive nodes.
+
+  Returns:
+    An array of shape (node_count, len(negative_label)), dtype int64.
+  """
+  node_y = np.tile(np.array(negative_label, dtype=np.int64), (node_count, 1))
+  node_y[list(positive_nodes)] = positive_label
+  return node_y
+
+
+def ApplyRootNodeAnnotation(
+  g: nx.MultiDiGraph, annotation: RootNodeAnnotation
+) -> None:
+  """Set the root node features, node labels, and data flow metadata of a
+  networkx graph in-place.
+  """
+  if annotation.node_y is not None:
+    for node, data in g.nodes(data=True):
+      data["x"].append(ROOT_NODE_NO)
+      data["y"] = annotation.node_y[node].tolist()
+    g.nodes[annotation.root_node]["x"][-1] = ROOT_NODE_YES
+
+  g.graph["data_flow_root_node"] = annotation.root_node
+  g.graph["data_flow_steps"] = annotation.data_flow_steps
+  g.graph["data_flow_positive_node_count"] = (
+    annotation.data_flow_positive_node_count
+  )
+
+
+class GraphTupleDataFlowGraphs(DataFlowGraphs):
+  """A set of data-flow annotated graphs which share a single graph structure.
+
+  Rather than storing a copy of the graph for every root node, this stores the
+  unlabelled graph once, and the root node features and node labels of each
+  annotation as arrays. The graph tuples of each annotation share their
+  adjacency and edge position arrays.
+  """
+
+  def __init__(
+    self,
+    unlabelled_graph: Optional[programl_pb2.ProgramGraph],
+    annotations: List[RootNodeAnnotation],
+    unlabelled_graph_tuple: Optional[graph_tuple_lib.GraphTuple] = None,
+  ):
+    """Constructor.
+
+    Args:
+      unlabelled_graph: The unlabelled graph. This is not modified. If not
+        provided, only the graph tuples of the annotations are available.
+      annotations: The per-root node annotations.
+      unlabelled_graph_tuple: The graph tuple of the unlabelled graph. If not
+        provided, it is created from the unlabelled graph.
+    """
+    if unlabelled_graph is None and unlabelled_graph_tuple is None:
+      raise TypeError("Either an unlabelled graph or graph tuple is required")
+    self.unlabelled_graph = unlabelled_graph
+    self.annotations = annotations
+    self._unlabelled_graph_tuple = unlabelled_graph_tuple
+    self._graph_tuples = None
+
+  @property
+  def graphs(self) -> List[nx.MultiDiGraph]:
+    """Construct a networkx graph for each annotation.
+
+    This constructs a new copy of the unlabelled graph for every annotation.
+    Use graph_tuples where possible.
+
+    Raises:
+      ValueError: If there is no unlabelled graph.
+    """
+    if self.unlabelled_graph is None:
+      raise ValueError("Annotated graphs have no unlabelled graph")
+    graphs = []
+    for annotation in self.annotations:
+      g = programl.ProgramGraphToNetworkX(self.unlabelled_graph)
+      ApplyRootNodeAnnotation(g, annotation)
+      graphs.append(g)
+    return graphs
+
+  @property
+  def protos(self) -> List[programl_pb2.ProgramGraph]:
+    """Convert the annotations to program graph protos."""
+    return [programl.NetworkXToProgramGraph(g) for g in self.graphs]
+
+  @property
+  def graph_tuples(self) -> List[DataFlowGraphTuple]:
+    """Construct a graph tuple for each annotation.
+
+    The graph tuples are identical to those produced by converting the
+    annotated networkx graphs.
+    """
+    if self._graph_tuples is None:
+      self._graph_tuples = self._CreateGraphTuples()
+    return self._graph_tuples
+
+  def _CreateGraphTuples(self) -> List[DataFlowGraphTuple]:
+    if not self.annotations:
+      return []
+
+    # The structure and features shared by all annotations.
+    unlabelled = self._unlabelled_graph_tuple
+    if unlabelled is None:
+      unlabelled = graph_tuple_lib.GraphTuple.CreateFromProgramGraph(
+        self.unlabelled_graph
+      )
+    node_count = unlabelled.node_count
+
+    graph_tuples = []
+    for annotation in self.annotations:
+      root_node_x = np.zeros((node_count, 1), dtype=np.int64)
+      root_node_x[annotation.root_node] = ROOT_NODE_YES
+      graph_tuples.append(
+        DataFlowGraphTuple(
+          graph_tuple=unlabelled._replace(
+            node_x=np.hstack((unlabelled.node_x, root_node_x)),
+            node_y=annotation.node_y,
+          ),
+          data_flow_root_node=annotation.root_node,
+          data_flow_steps=annotation.data_flow_steps,
+          data_flow_positive_node_count=(
+            annotation.data_flow_positive_node_count
+          ),
+        )
+      )
+    return graph_tuples
+
 
 ###############################################################################
 # Analysis errors.
@@ -82,6 +265,12 @@ class AnalysisTimeout(AnalysisFailed):
 class DataFlowGraphAnnotator(object):
   """Abstract base class for implement data flow analysis graph annotators."""
 
+  # The version of the annotations produced by this annotator. A dataset
+  # records the analysis and version that produced it, so that annotations from
+  # different versions are not mixed. Increment this when a change to an
+  # annotator changes the node labels or data flow values that it produces.
+  DATASET_VERSION: int = 1
+
   def __init__(self, unlabelled_graph: programl_pb2.ProgramGraph):
     """Constructor.
 
@@ -170,6 +359,63 @@ class NetworkXDataFlowGraphAnnotator(DataFlowGraphAnnotator):
     return NetworkxDataFlowGraphs(annotated_graphs)
 
 
+class RootNodeDataFlowGraphAnnotator(NetworkXDataFlowGraphAnnotator):
+  """A data flow annotator which labels each root node without modifying the
+  graph.
+
+  Subclasses implement AnnotateRoot(), which computes the labels for a single
+  root node against the shared unlabelled graph. This avoids copying the graph
+  for every root node, and produces GraphTupleDataFlowGraphs.
+  """
+
+  def AnnotateRoot(self, root_node: int) -> RootNodeAnnotation:
+    """Compute the annotation for a single root node.
+
+    This must not modify self.g.
+    """
+    raise NotImplementedError("abstract class")
+
+  def Annotate(self, g: nx.MultiDiGraph, root_node: int) -> None:
+    """Annotate a networkx graph in-place.
+
+    The graph must have the same structure as self.g.
+    """
+    ApplyRootNodeAnnotation(g, self.AnnotateRoot(root_node))
+
+  def MakeAnnotated(self, n: int = 0) -> GraphTupleDataFlowGraphs:
+    """Produce up to "n" annotated graphs.
+
+    Args:
+      n: The maximum number of annotated graphs to produce. Multiple graphs are
+        produced by selecting different root nodes for creating annotations.
+        If `n` is provided, the number of annotated graphs generated will be in
+        the range 1 <= x <= min(root_node_count, n). Else, the number of graphs
+        will be equal to root_node_count (i.e. one graph for each root node in
+        the input graph).
+
+    Returns:
+      A GraphTupleDataFlowGraphs instance.
+
+    Raises:
+      AnalysisFailed: If the analysis fails.
+      AnalysisTimeout: If the analysis times out.
+    """
+    if n and n < len(self.root_nodes):
+      random.shuffle(self.root_nodes)
+      root_nodes = self.root_nodes[:n]
+    else:
+      root_nodes = self.root_nodes
+
+    annotations = []
+    for root_node in root_nodes:
+      annotation = self.AnnotateRoot(root_node)
+      # Ignore graphs that require no data flow steps.
+      if annotation.data_flow_steps:
+        annotations.append(annotation)
+
+    return GraphTupleDataFlowGraphs(self.unlabelled_graph, annotations)
+
+
 # The x value for specifying the root node for iterative data flow analyses
 # that have a defined "starting point".
 ROOT_NODE_NO = 0
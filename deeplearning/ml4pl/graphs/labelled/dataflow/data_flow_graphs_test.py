@@ -3,9 +3,11 @@ from typing import List
 from typing import Optional
 
 import networkx as nx
+import numpy as np
 
 from deeplearning.ml4pl.graphs import programl
 from deeplearning.ml4pl.graphs import programl_pb2
+from deeplearning.ml4pl.graphs.labelled import graph_tuple
 from deeplearning.ml4pl.graphs.labelled.dataflow import data_flow_graphs
 from labm8.py import test
 
@@ -44,6 +46,39 @@ class MockNetworkXDataFlowGraphAnnotator(
     g.graph["data_flow_steps"] = 1
 
 
+class MockRootNodeDataFlowGraphAnnotator(
+  data_flow_graphs.RootNodeDataFlowGraphAnnotator
+):
+  """A mock root node annotator for testing."""
+
+  def IsValidRootNode(self, node: int, data) -> bool:
+    """The root node type."""
+    return data["type"] == programl_pb2.Node.STATEMENT
+
+  def AnnotateRoot(
+    self, root_node: int
+  ) -> data_flow_graphs.RootNodeAnnotation:
+    """Label the root node and its control successors as positive."""
+    positive_nodes = [root_node] + list(self.g.successors(root_node))
+    return data_flow_graphs.RootNodeAnnotation(
+      root_node=root_node,
+      data_flow_steps=len(positive_nodes),
+      data_flow_positive_node_count=len(positive_nodes),
+      node_y=data_flow_graphs.BinaryNodeLabels(
+        self.g.number_of_nodes(), positive_nodes, [1, 0], [0, 1]
+      ),
+    )
+
+
+def MakeLinearGraph(node_count: int) -> programl_pb2.ProgramGraph:
+  """Build a graph of statement nodes with linear control flow."""
+  builder = programl.GraphBuilder()
+  nodes = [builder.AddNode(x=[i]) for i in range(node_count)]
+  for src, dst in zip(nodes, nodes[1:]):
+    builder.AddEdge(src, dst)
+  return builder.proto
+
+
 def test_IsValidRootNode():
   """Test that root nodes are correctly selected."""
   builder = programl.GraphBuilder()
@@ -146,5 +181,71 @@ def test_MakeAnnotated_graph_subset_of_root_nodes():
   assert len(annotated.protos) == 25
 
 
+def test_BinaryNodeLabels():
+  """Test the values of binary node labels."""
+  node_y = data_flow_graphs.BinaryNodeLabels(4, [1, 3], [1, 0], [0, 1])
+  assert node_y.dtype == np.int64
+  assert node_y.tolist() == [[1, 0], [0, 1], [1, 0], [0, 1]]
+
+
+def test_RootNodeDataFlowGraphAnnotator_does_not_modify_graph():
+  """Test that producing annotations leaves the unlabelled graph untouched."""
+  annotator = MockRootNodeDataFlowGraphAnnotator(MakeLinearGraph(5))
+  annotated = annotator.MakeAnnotated()
+  assert len(annotated.graph_tuples) == 5
+  for node, data in annotator.g.nodes(data=True):
+    assert data["x"] == [node]
+
+
+def test_RootNodeDataFlowGraphAnnotator_Annotate():
+  """Test that a networkx graph is annotated in-place."""
+  annotator = MockRootNodeDataFlowGraphAnnotator(MakeLinearGraph(3))
+  g = annotator.g
+  annotator.Annotate(g, 1)
+  assert [data["x"] for _, data in g.nodes(data=True)] == [
+    [0, 0],
+    [1, 1],
+    [2, 0],
+  ]
+  assert [data["y"] for _, data in g.nodes(data=True)] == [
+    [1, 0],
+    [0, 1],
+    [0, 1],
+  ]
+  assert g.graph["data_flow_root_node"] == 1
+  assert g.graph["data_flow_steps"] == 2
+  assert g.graph["data_flow_positive_node_count"] == 2
+
+
+@test.Parametrize("n", (0, 3))
+def test_RootNodeDataFlowGraphAnnotator_graph_tuples_match_graphs(n: int):
+  """Test that graph tuples are identical to converted networkx graphs."""
+  annotator = MockRootNodeDataFlowGraphAnnotator(MakeLinearGraph(10))
+  annotated = annotator.MakeAnnotated(n)
+
+  assert len(annotated.graph_tuples) == len(annotated.graphs)
+  for actual, g in zip(annotated.graph_tuples, annotated.graphs):
+    expected = graph_tuple.GraphTuple.CreateFromNetworkX(g)
+    assert actual.data_flow_root_node == g.graph["data_flow_root_node"]
+    assert actual.data_flow_steps == g.graph["data_flow_steps"]
+    assert (
+      actual.data_flow_positive_node_count
+      == g.graph["data_flow_positive_node_count"]
+    )
+    assert np.array_equal(actual.graph_tuple.node_x, expected.node_x)
+    assert actual.graph_tuple.node_x.dtype == expected.node_x.dtype
+    assert np.array_equal(actual.graph_tuple.node_y, expected.node_y)
+    assert actual.graph_tuple.node_y.dtype == expected.node_y.dtype
+    for edge_flow in range(3):
+      assert np.array_equal(
+        actual.graph_tuple.adjacencies[edge_flow],
+        expected.adjacencies[edge_flow],
+      )
+      assert np.array_equal(
+        actual.graph_tuple.edge_positions[edge_flow],
+        expected.edge_positions[edge_flow],
+      )
+
+
 if __name__ == "__main__":
   test.Main()
@@ -1,9 +1,10 @@
 """Module for labelling program graphs with data depedencies."""
 import collections
 
-import networkx as nx
+import numpy as np
 
 from deeplearning.ml4pl.graphs import programl_pb2
+from deeplearning.ml4pl.graphs.labelled.dataflow import control_flow_csr
 from deeplearning.ml4pl.graphs.labelled.dataflow import data_flow_graphs
 from labm8.py import app
 
@@ -15,27 +16,36 @@ NOT_DEPENDENCY = [1, 0]
 DEPENDENCY = [0, 1]
 
 
-class DataDependencyAnnotator(data_flow_graphs.NetworkXDataFlowGraphAnnotator):
+class DataDependencyAnnotator(
+  data_flow_graphs.RootNodeDataFlowGraphAnnotator
+):
   """Annotate graphs with data dependencies.
 
   Statement node A depends on statement B iff B produces data nodes that are
   operands to A.
   """
 
+  def __init__(self, *args, **kwargs):
+    super(DataDependencyAnnotator, self).__init__(*args, **kwargs)
+    # The data predecessors of every node, shared by all root nodes.
+    self.predecessors = [
+      [
+        pred
+        for pred, _, flow in self.g.in_edges(node, data="flow")
+        if flow == programl_pb2.Edge.DATA
+      ]
+      for node in range(self.g.number_of_nodes())
+    ]
+
   def IsValidRootNode(self, node: int, data) -> bool:
     """Data dependency is a statement-based analysis."""
     return data["type"] == programl_pb2.Node.STATEMENT and data["function"]
 
-  def Annotate(self, g: nx.MultiDiGraph, root_node: int) -> None:
-    """Annotate all of the nodes that must be executed prior to the root node.
+  def AnnotateRoot(
+    self, root_node: int
+  ) -> data_flow_graphs.RootNodeAnnotation:
+    """Compute all of the nodes that must be executed prior to the root node.
     """
-    # Initialize all nodes as not dependent and not the root node, except the root
-    # node.
-    for node, data in g.nodes(data=True):
-      data["x"].append(data_flow_graphs.ROOT_NODE_NO)
-      data["y"] = NOT_DEPENDENCY
-    g.nodes[root_node]["x"][-1] = data_flow_graphs.ROOT_NODE_YES
-
     # Breadth-first traversal to mark node dependencies.
     data_flow_steps = 0
     dependency_node_count = 0
@@ -46,14 +56,65 @@ class DataDependencyAnnotator(data_flow_graphs.NetworkXDataFlowGraphAnnotator):
       dependency_node_count += 1
       visited.add(next)
 
-      # Mark the node as dependent.
-      g.nodes[next]["y"] = DEPENDENCY
+      # Visit all data predecessors.
+      for pred in self.predecessors[next]:
+        if pred not in visited:
+          q.append((pred, data_flow_steps + 1))
+
+    return data_flow_graphs.RootNodeAnnotation(
+      root_node=root_node,
+      data_flow_steps=data_flow_steps,
+      data_flow_positive_node_count=dependency_node_count,
+      node_y=data_flow_graphs.BinaryNodeLabels(
+        self.g.number_of_nodes(), visited, NOT_DEPENDENCY, DEPENDENCY
+      ),
+    )
+
+
+class CsrDataDependencyAnnotator(control_flow_csr.CsrDataFlowGraphAnnotator):
+  """Annotate graphs with data dependencies using the arrays of a program graph.
+
+  This visits nodes and their neighbours in the same order as
+  DataDependencyAnnotator, and produces identical annotations for graphs in
+  which every function has a name.
+  """
+
+  def __init__(self, *args, **kwargs):
+    super(CsrDataDependencyAnnotator, self).__init__(*args, **kwargs)
+    self.predecessors = self.arrays.PredecessorLists(programl_pb2.Edge.DATA)
+
+  def GetRootNodes(self) -> np.array:
+    """Data dependency is a statement-based analysis."""
+    return np.nonzero(
+      self.arrays.is_statement
+      & (self.arrays.node_function != control_flow_csr.NO_FUNCTION)
+    )[0]
+
+  def AnnotateRoot(
+    self, root_node: int
+  ) -> data_flow_graphs.RootNodeAnnotation:
+    """Compute all of the nodes that must be executed prior to the root node.
+    """
+    # Breadth-first traversal to mark node dependencies.
+    data_flow_steps = 0
+    dependency_node_count = 0
+    visited = set()
+    q = collections.deque([(root_node, 1)])
+    while q:
+      next, data_flow_steps = q.popleft()
+      dependency_node_count += 1
+      visited.add(next)
 
       # Visit all data predecessors.
-      for pred, _, flow in g.in_edges(next, data="flow"):
-        if flow == programl_pb2.Edge.DATA and pred not in visited:
+      for pred in self.predecessors[next]:
+        if pred not in visited:
           q.append((pred, data_flow_steps + 1))
 
-    g.graph["data_flow_root_node"] = root_node
-    g.graph["data_flow_steps"] = data_flow_steps
-    g.graph["data_flow_positive_node_count"] = dependency_node_count
+    return data_flow_graphs.RootNodeAnnotation(
+      root_node=root_node,
+      data_flow_steps=data_flow_steps,
+      data_flow_positive_node_count=dependency_node_count,
+      node_y=data_flow_graphs.BinaryNodeLabels(
+        self.arrays.node_count, visited, NOT_DEPENDENCY, DEPENDENCY
+      ),
+    )
@@ -75,5 +75,21 @@ def test_MakeAnnotated_real_protos(real_proto: programl_pb2.ProgramGraph,):
   assert len(annotated.graphs) <= 10
 
 
+def test_CsrDataDependencyAnnotator_matches_DataDependencyAnnotator(
+  real_proto: programl_pb2.ProgramGraph,
+):
+  """Test that annotations are identical to the reference annotator."""
+  expected = data_dependence.DataDependencyAnnotator(real_proto).MakeAnnotated()
+  actual = data_dependence.CsrDataDependencyAnnotator(
+    real_proto
+  ).MakeAnnotated()
+  assert len(actual.graph_tuples) == len(expected.graph_tuples)
+  for a, b in zip(actual.graph_tuples, expected.graph_tuples):
+    assert a.data_flow_root_node == b.data_flow_root_node
+    assert a.data_flow_steps == b.data_flow_steps
+    assert a.data_flow_positive_node_count == b.data_flow_positive_node_count
+    assert a.graph_tuple.node_y.tolist() == b.graph_tuple.node_y.tolist()
+
+
 if __name__ == "__main__":
   test.Main()
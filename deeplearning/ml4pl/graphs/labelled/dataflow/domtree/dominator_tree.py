@@ -3,8 +3,10 @@ from typing import Dict
 from typing import Set
 
 import networkx as nx
+import numpy as np
 
 from deeplearning.ml4pl.graphs import programl_pb2
+from deeplearning.ml4pl.graphs.labelled.dataflow import control_flow_csr
 from deeplearning.ml4pl.graphs.labelled.dataflow import data_flow_graphs
 from labm8.py import app
 
@@ -25,7 +27,7 @@ def Predecessors(g: nx.MultiDiGraph, node: int) -> Set[int]:
   )
 
 
-class DominatorTreeAnnotator(data_flow_graphs.NetworkXDataFlowGraphAnnotator):
+class DominatorTreeAnnotator(data_flow_graphs.RootNodeDataFlowGraphAnnotator):
   """Annotate graphs with dominator analysis.
 
   Statement node A dominates statement node B iff all control paths to B pass
@@ -41,27 +43,31 @@ class DominatorTreeAnnotator(data_flow_graphs.NetworkXDataFlowGraphAnnotator):
     """Dominator trees are a statement-based analysis."""
     return data["type"] == programl_pb2.Node.STATEMENT and data["function"]
 
-  def Annotate(self, g: nx.MultiDiGraph, root_node: int) -> None:
-    """Annotate nodes in the graph with dominator trees.
+  def AnnotateRoot(
+    self, root_node: int
+  ) -> data_flow_graphs.RootNodeAnnotation:
+    """Compute the dominator tree annotation for a root node.
 
     The 'root node' annotation is a [0,1] value appended to node x vectors.
     The node label is a 1-hot binary vector set to y node vectors.
 
     Args:
-      g: The graph to annotate.
       root_node: The root node for building the dominator tree.
 
     Returns:
-      A data flow annotated graph.
+      The dominator tree annotation.
     """
+    g = self.g
     function = g.nodes[root_node]["function"]
 
     if function is None:
       # Root node is outside of a function, so cannot dominate any other nodes.
-      g.graph["data_flow_root_node"] = root_node
-      g.graph["data_flow_steps"] = 0
-      g.graph["data_flow_positive_node_count"] = 0
-      return
+      return data_flow_graphs.RootNodeAnnotation(
+        root_node=root_node,
+        data_flow_steps=0,
+        data_flow_positive_node_count=0,
+        node_y=None,
+      )
 
     if function in self.dominator_sets_by_function:
       dominators = self.dominator_sets_by_function[function]
@@ -115,19 +121,105 @@ class DominatorTreeAnnotator(data_flow_graphs.NetworkXDataFlowGraphAnnotator):
       self.dominator_sets_by_function[function] = dominators
       self.data_flow_steps_by_function[function] = data_flow_steps
 
-    # Now that we have computed the dominator sets, assign labels and features
-    # to all nodes.
-    dominated_node_count = 0
-    for node, data in g.nodes(data=True):
-      data["x"].append(data_flow_graphs.ROOT_NODE_NO)
-      if node in dominators and root_node in dominators[node]:
-        dominated_node_count += 1
-        data["y"] = DOMINATED
-      else:
-        data["y"] = NOT_DOMINATED
-
-    g.nodes[root_node]["x"][-1] = data_flow_graphs.ROOT_NODE_YES
-
-    g.graph["data_flow_root_node"] = root_node
-    g.graph["data_flow_steps"] = self.data_flow_steps_by_function[function]
-    g.graph["data_flow_positive_node_count"] = dominated_node_count
+    # Now that we have computed the dominator sets, assign labels to all nodes.
+    dominated_nodes = [
+      node
+      for node, node_dominators in dominators.items()
+      if root_node in node_dominators
+    ]
+
+    return data_flow_graphs.RootNodeAnnotation(
+      root_node=root_node,
+      data_flow_steps=self.data_flow_steps_by_function[function],
+      data_flow_positive_node_count=len(dominated_nodes),
+      node_y=data_flow_graphs.BinaryNodeLabels(
+        g.number_of_nodes(), dominated_nodes, NOT_DOMINATED, DOMINATED
+      ),
+    )
+
+
+class CsrDominatorTreeAnnotator(control_flow_csr.CsrDataFlowGraphAnnotator):
+  """Annotate graphs with dominator analysis using control flow arrays.
+
+  This uses the Cooper-Harvey-Kennedy algorithm over array-based control flow
+  rather than iterative set intersection. As with DominatorTreeAnnotator, the
+  dominator tree of a function is computed once, from the first root node
+  annotated in that function and every statement with no control predecessors,
+  and is re-used for subsequent root nodes in the same function.
+
+  The data flow steps are the number of iterations of the Cooper-Harvey-Kennedy
+  algorithm. Statements which cannot be reached from an entry are dominated
+  only by themselves.
+
+  Node labels differ from DominatorTreeAnnotator for loops which are reachable
+  from the root node. DominatorTreeAnnotator initializes every dominator set
+  without the root node, so the root is lost when intersecting the dominators
+  of a loop back edge.
+  """
+
+  DATASET_VERSION: int = 2
+
+  def __init__(self, *args, **kwargs):
+    super(CsrDominatorTreeAnnotator, self).__init__(*args, **kwargs)
+    # A map from function to a tuple of <nodes, enter, exit, data_flow_steps>,
+    # where enter and exit are the dominator tree intervals of the nodes.
+    self.dominator_trees_by_function = {}
+
+  def GetRootNodes(self) -> np.array:
+    """Dominator trees are a statement-based analysis."""
+    return np.nonzero(
+      self.cfg.is_statement
+      & (self.cfg.node_function != control_flow_csr.NO_FUNCTION)
+    )[0]
+
+  def AnnotateRoot(
+    self, root_node: int
+  ) -> data_flow_graphs.RootNodeAnnotation:
+    """Compute the dominator tree annotation for a root node."""
+    function = self.cfg.node_function[root_node]
+
+    if function == control_flow_csr.NO_FUNCTION:
+      # Root node is outside of a function, so cannot dominate any other nodes.
+      return data_flow_graphs.RootNodeAnnotation(
+        root_node=root_node,
+        data_flow_steps=0,
+        data_flow_positive_node_count=0,
+        node_y=None,
+      )
+
+    if function not in self.dominator_trees_by_function:
+      nodes = self.cfg.FunctionNodes(function)
+      in_function = self.cfg.node_function == function
+      entry_nodes = [root_node] + [
+        node
+        for node in nodes
+        if node != root_node
+        and not in_function[self.cfg.Predecessors(node)].any()
+      ]
+      idom, data_flow_steps = self.cfg.DominatorTree(nodes, entry_nodes)
+      enter, exit = control_flow_csr.DominatorTreeIntervals(idom)
+      self.dominator_trees_by_function[function] = (
+        nodes,
+        enter[:-1],
+        exit[:-1],
+        data_flow_steps,
+      )
+    nodes, enter, exit, data_flow_steps = self.dominator_trees_by_function[
+      function
+    ]
+
+    # A node dominates itself, even if it is unreachable from the entries.
+    root = np.searchsorted(nodes, root_node)
+    if enter[root] < 0:
+      dominated_nodes = [root_node]
+    else:
+      dominated_nodes = nodes[(enter >= enter[root]) & (exit <= exit[root])]
+
+    return data_flow_graphs.RootNodeAnnotation(
+      root_node=root_node,
+      data_flow_steps=data_flow_steps,
+      data_flow_positive_node_count=len(dominated_nodes),
+      node_y=data_flow_graphs.BinaryNodeLabels(
+        self.cfg.node_count, dominated_nodes, NOT_DOMINATED, DOMINATED
+      ),
+    )
@@ -158,6 +158,79 @@ def test_root_node_is_not_in_a_function():
   assert g.graph["data_flow_steps"] == 0
 
 
+def test_CsrDominatorTreeAnnotator_g1(g1: programl_pb2.ProgramGraph):
+  """Test dominator tree for a small graph."""
+  annotator = dominator_tree.CsrDominatorTreeAnnotator(g1)
+  annotation = annotator.AnnotateRoot(0)
+
+  assert annotation.data_flow_positive_node_count == 4
+  assert annotation.node_y.tolist() == [
+    dominator_tree.DOMINATED,
+    dominator_tree.DOMINATED,
+    dominator_tree.DOMINATED,
+    dominator_tree.DOMINATED,
+    dominator_tree.NOT_DOMINATED,
+  ]
+
+
+def test_CsrDominatorTreeAnnotator_g2(g2: programl_pb2.ProgramGraph):
+  """Test dominator tree for a small graph with two entry statements."""
+  annotator = dominator_tree.CsrDominatorTreeAnnotator(g2)
+  annotation = annotator.AnnotateRoot(0)
+
+  assert annotation.data_flow_positive_node_count == 2
+  assert annotation.node_y.tolist() == [
+    dominator_tree.DOMINATED,
+    dominator_tree.NOT_DOMINATED,
+    dominator_tree.DOMINATED,
+    dominator_tree.NOT_DOMINATED,
+    dominator_tree.NOT_DOMINATED,
+    dominator_tree.NOT_DOMINATED,
+  ]
+
+
+def test_CsrDominatorTreeAnnotator_loop():
+  """Test that the root dominates the nodes of a loop that it precedes."""
+  #   a --> b --> c --> d
+  #         ^     |
+  #         +-----+
+  builder = programl.GraphBuilder()
+  fn = builder.AddFunction()
+  a = builder.AddNode(x=[-1], function=fn)
+  b = builder.AddNode(x=[-1], function=fn)
+  c = builder.AddNode(x=[-1], function=fn)
+  d = builder.AddNode(x=[-1], function=fn)
+  builder.AddEdge(a, b)
+  builder.AddEdge(b, c)
+  builder.AddEdge(c, b)
+  builder.AddEdge(c, d)
+
+  annotator = dominator_tree.CsrDominatorTreeAnnotator(builder.proto)
+  assert annotator.AnnotateRoot(a).data_flow_positive_node_count == 4
+  assert annotator.AnnotateRoot(b).data_flow_positive_node_count == 3
+  assert annotator.AnnotateRoot(c).data_flow_positive_node_count == 2
+  assert annotator.AnnotateRoot(d).data_flow_positive_node_count == 1
+
+
+def test_CsrDominatorTreeAnnotator_root_node_is_not_in_a_function():
+  """Test that if root node is not in a function, then nothing is dominated."""
+  builder = programl.GraphBuilder()
+  a = builder.AddNode(type=programl_pb2.Node.STATEMENT)
+
+  annotator = dominator_tree.CsrDominatorTreeAnnotator(builder.proto)
+  assert annotator.root_nodes == []
+  assert annotator.AnnotateRoot(a).data_flow_steps == 0
+
+
+def test_CsrDominatorTreeAnnotator_MakeAnnotated_real_protos(
+  real_proto: programl_pb2.ProgramGraph,
+):
+  """Opaque black-box test of dominator tree annotator."""
+  annotator = dominator_tree.CsrDominatorTreeAnnotator(real_proto)
+  annotated = annotator.MakeAnnotated(10)
+  assert len(annotated.graph_tuples) <= 10
+
+
 def test_MakeAnnotated_real_protos(real_proto: programl_pb2.ProgramGraph,):
   """Opaque black-box test of reachability annotator."""
   annotator = dominator_tree.DominatorTreeAnnotator(real_proto)
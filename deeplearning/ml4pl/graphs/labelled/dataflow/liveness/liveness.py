@@ -4,8 +4,10 @@ from typing import List
 from typing import Tuple
 
 import networkx as nx
+import numpy as np
 
 from deeplearning.ml4pl.graphs import programl_pb2
+from deeplearning.ml4pl.graphs.labelled.dataflow import control_flow_csr
 from deeplearning.ml4pl.graphs.labelled.dataflow import data_flow_graphs
 from labm8.py import app
 
@@ -60,7 +62,7 @@ def IsExitStatement(g: nx.MultiDiGraph, node: int):
     return True
 
 
-class LivenessAnnotator(data_flow_graphs.NetworkXDataFlowGraphAnnotator):
+class LivenessAnnotator(data_flow_graphs.RootNodeDataFlowGraphAnnotator):
   """Annotate graphs with liveness."""
 
   def __init__(self, *args, **kwargs):
@@ -120,26 +122,125 @@ class LivenessAnnotator(data_flow_graphs.NetworkXDataFlowGraphAnnotator):
     """Liveness is a statement-based analysis."""
     return data["type"] == programl_pb2.Node.STATEMENT
 
-  def Annotate(self, g: nx.MultiDiGraph, root_node: int) -> None:
-    """Annotate nodes in the graph with liveness."""
+  def AnnotateRoot(
+    self, root_node: int
+  ) -> data_flow_graphs.RootNodeAnnotation:
+    """Compute the liveness annotation for a root node."""
 
     # A graph may not have any exit blocks.
     if not self.exit_nodes:
-      g.graph["data_flow_root_node"] = root_node
-      g.graph["data_flow_steps"] = 0
-      g.graph["data_flow_positive_node_count"] = 0
-      return
+      return data_flow_graphs.RootNodeAnnotation(
+        root_node=root_node,
+        data_flow_steps=0,
+        data_flow_positive_node_count=0,
+        node_y=None,
+      )
 
     # We have already pre-computed the live-out sets, so just add the
     # annotations.
-    for _, data in g.nodes(data=True):
-      data["x"].append(data_flow_graphs.ROOT_NODE_NO)
-      data["y"] = NOT_LIVE_OUT
-    g.nodes[root_node]["x"][-1] = data_flow_graphs.ROOT_NODE_YES
+    return data_flow_graphs.RootNodeAnnotation(
+      root_node=root_node,
+      data_flow_steps=self.data_flow_steps,
+      data_flow_positive_node_count=len(self.out_sets[root_node]),
+      node_y=data_flow_graphs.BinaryNodeLabels(
+        self.g.number_of_nodes(),
+        self.out_sets[root_node],
+        NOT_LIVE_OUT,
+        LIVE_OUT,
+      ),
+    )
+
+
+class CsrLivenessAnnotator(control_flow_csr.CsrDataFlowGraphAnnotator):
+  """Annotate graphs with liveness using the arrays of a program graph.
+
+  This visits nodes and their neighbours in the same order as
+  LivenessAnnotator, and produces identical annotations.
+  """
+
+  def __init__(self, *args, **kwargs):
+    super(CsrLivenessAnnotator, self).__init__(*args, **kwargs)
+    node_count = self.arrays.node_count
+    control_successors = self.arrays.SuccessorLists(programl_pb2.Edge.CONTROL)
+    control_predecessors = self.arrays.PredecessorLists(
+      programl_pb2.Edge.CONTROL
+    )
+    defs = self.arrays.SuccessorLists(programl_pb2.Edge.DATA)
+    uses = self.arrays.PredecessorLists(programl_pb2.Edge.DATA)
+
+    # Liveness analysis begins at the exit block and works backwards.
+    self.exit_nodes = [
+      node
+      for node in np.nonzero(self.arrays.is_statement)[0].tolist()
+      if not control_successors[node]
+    ]
+
+    # Add a temporary exit block which is the successor of every exit node.
+    liveness_start_node = node_count
+    for exit_node in self.exit_nodes:
+      control_successors[exit_node] = [liveness_start_node]
+    control_successors.append([])
+    control_predecessors.append(self.exit_nodes)
+    defs.append([])
+    uses.append([])
+
+    # Ignore the liveness starting block when totalling up the data flow steps.
+    data_flow_steps = -1
+
+    in_sets = [set() for _ in range(node_count + 1)]
+    out_sets = [set() for _ in range(node_count + 1)]
 
-    for node in self.out_sets[root_node]:
-      g.nodes[node]["y"] = LIVE_OUT
+    work_list = collections.deque([liveness_start_node])
+    while work_list:
+      data_flow_steps += 1
+      node = work_list.popleft()
+
+      # LiveOut(n) = U {LiveIn(p) for p in succ(n)}
+      new_out_set = set().union(
+        *[in_sets[p] for p in control_successors[node]]
+      )
+
+      # LiveIn(n) = Gen(n) U {LiveOut(n) - Kill(n)}
+      new_in_set = set(uses[node]).union(new_out_set - set(defs[node]))
+
+      # No need to visit predecessors if the in-set is non-empty and has not
+      # changed.
+      if not new_in_set or new_in_set != in_sets[node]:
+        work_list.extend(
+          [p for p in control_predecessors[node] if p not in work_list]
+        )
+
+      in_sets[node] = new_in_set
+      out_sets[node] = new_out_set
+
+    self.out_sets = out_sets[:node_count]
+    self.data_flow_steps = data_flow_steps
+
+  def GetRootNodes(self) -> np.array:
+    """Liveness is a statement-based analysis."""
+    return np.nonzero(self.arrays.is_statement)[0]
+
+  def AnnotateRoot(
+    self, root_node: int
+  ) -> data_flow_graphs.RootNodeAnnotation:
+    """Compute the liveness annotation for a root node."""
+    # A graph may not have any exit blocks.
+    if not self.exit_nodes:
+      return data_flow_graphs.RootNodeAnnotation(
+        root_node=root_node,
+        data_flow_steps=0,
+        data_flow_positive_node_count=0,
+        node_y=None,
+      )
 
-    g.graph["data_flow_root_node"] = root_node
-    g.graph["data_flow_steps"] = self.data_flow_steps
-    g.graph["data_flow_positive_node_count"] = len(self.out_sets[root_node])
+    return data_flow_graphs.RootNodeAnnotation(
+      root_node=root_node,
+      data_flow_steps=self.data_flow_steps,
+      data_flow_positive_node_count=len(self.out_sets[root_node]),
+      node_y=data_flow_graphs.BinaryNodeLabels(
+        self.arrays.node_count,
+        self.out_sets[root_node],
+        NOT_LIVE_OUT,
+        LIVE_OUT,
+      ),
+    )
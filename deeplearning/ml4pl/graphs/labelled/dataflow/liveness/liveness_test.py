@@ -565,5 +565,27 @@ def test_MakeAnnotated_real_graphs(real_graph: programl_pb2.ProgramGraph,):
     assert graph.graph["data_flow_steps"] >= 1
 
 
+def test_CsrLivenessAnnotator_wiki(wiki: programl_pb2.ProgramGraph):
+  """Test the live-out set of a single root node."""
+  annotation = liveness.CsrLivenessAnnotator(wiki).AnnotateRoot(5)
+  expected = liveness.LivenessAnnotator(wiki).AnnotateRoot(5)
+  assert annotation == expected._replace(node_y=annotation.node_y)
+  assert annotation.node_y.tolist() == expected.node_y.tolist()
+
+
+def test_CsrLivenessAnnotator_matches_LivenessAnnotator(
+  real_graph: programl_pb2.ProgramGraph,
+):
+  """Test that annotations are identical to the reference annotator."""
+  expected = liveness.LivenessAnnotator(real_graph).MakeAnnotated()
+  actual = liveness.CsrLivenessAnnotator(real_graph).MakeAnnotated()
+  assert len(actual.graph_tuples) == len(expected.graph_tuples)
+  for a, b in zip(actual.graph_tuples, expected.graph_tuples):
+    assert a.data_flow_root_node == b.data_flow_root_node
+    assert a.data_flow_steps == b.data_flow_steps
+    assert a.data_flow_positive_node_count == b.data_flow_positive_node_count
+    assert a.graph_tuple.node_y.tolist() == b.graph_tuple.node_y.tolist()
+
+
 if __name__ == "__main__":
   test.Main()
@@ -1,13 +1,40 @@
-"""This module prepares datasets for data flow analyses."""
+"""This module prepares datasets for data flow analyses.
+
+Annotation is a streaming pipeline: a reader thread reads batches of unlabelled
+protos, a pool of worker processes annotates them, and the workers write their
+results to spill files in fixed-size chunks, which the parent process copies to
+the output database one chunk at a time. The number of batches in flight is
+bounded, so memory usage is independent of the size of the dataset and of --n.
+
+After all of the graph tuples of an IR have been written, the IR is recorded
+in the IrIdCheckpoint table of the output database. An interrupted run can be
+resumed using any --order_by, and graph tuples for IRs which were not
+checkpointed are deleted and regenerated. To resume a database which was
+created before checkpoints were introduced, run once with
+--checkpoint_existing_graph_tuples to checkpoint the IRs that it already has
+graph tuples for.
+
+When running multiple analyses over the same unlabelled graph database, set
+--program_graph_cache to a local directory to store the preprocessed arrays of
+each program graph, so that each proto is parsed once rather than once per
+analysis. This requires an analysis which supports program graph arrays, such
+as reachability_csr, domtree_csr, liveness_csr, or datadep_csr.
+"""
 import multiprocessing
+import os
 import pathlib
+import pickle
 import resource
 import sys
+import tempfile
+import threading
 import time
 import traceback
+from typing import Dict
 from typing import Iterable
 from typing import List
 from typing import NamedTuple
+from typing import Set
 from typing import Tuple
 
 import psutil
@@ -16,6 +43,7 @@ import sqlalchemy as sql
 from deeplearning.ml4pl.graphs import programl
 from deeplearning.ml4pl.graphs.labelled import graph_tuple_database
 from deeplearning.ml4pl.graphs.labelled.dataflow import annotate
+from deeplearning.ml4pl.graphs.labelled.dataflow import program_graph_cache
 from deeplearning.ml4pl.graphs.unlabelled import unlabelled_graph_database
 from labm8.py import app
 from labm8.py import humanize
@@ -73,6 +101,46 @@ app.DEFINE_integer(
   32,
   "Tuning parameter. The number of protos to assign to each worker.",
 )
+app.DEFINE_integer(
+  "max_pending_batches",
+  0,
+  "Tuning parameter. The maximum number of proto batches which have been read "
+  "but whose results have not been written. If not set, twice --nproc is used.",
+)
+app.DEFINE_integer(
+  "spill_chunk_mb",
+  16,
+  "Tuning parameter. The number of megabytes of graph tuples that a worker "
+  "accumulates before writing them to its spill file.",
+)
+app.DEFINE_string(
+  "spill_dir",
+  None,
+  "The directory to write worker spill files to. If not set, the system "
+  "temporary directory is used.",
+)
+app.DEFINE_boolean(
+  "checkpoint_existing_graph_tuples",
+  False,
+  "If set, checkpoint every IR which has graph tuples in --graph_db before "
+  "resuming. This is a one-off migration for databases which were created "
+  "before checkpoints were introduced. Do not use it to resume an interrupted "
+  "run, as the graph tuples of partially written IRs would be kept.",
+)
+app.DEFINE_string(
+  "program_graph_cache",
+  None,
+  "A local directory to cache preprocessed program graphs in. The cache is "
+  "keyed by the sha1 of unlabelled graphs, and may be shared by runs of "
+  "different analyses. Only used for analyses which support program graph "
+  "arrays.",
+)
+app.DEFINE_integer(
+  "program_graph_cache_mb",
+  16 * 1024,
+  "The maximum size of the --program_graph_cache, in megabytes. The least "
+  "recently used entries are evicted once it is full.",
+)
 app.DEFINE_integer(
   "write_buffer_mb",
   32,
@@ -104,6 +172,7 @@ class ProgramGraphProto(NamedTuple):
   """A serialized program graph protocol buffer."""
 
   ir_id: int
+  sha1: str
   serialized_proto: bytes
 
 
@@ -155,29 +224,76 @@ def BatchedProtoReader(
           raise app.UsageError(f"Unknown order: {order_by}")
 
         graphs = graphs.all()
+
+      # A range of IDs may include graphs which have already been processed by
+      # a previous run.
+      batch_ids = {x[0] for x in ids_and_sizes_to_do[i:end_i]}
       yield [
         ProgramGraphProto(
-          ir_id=graph.ir_id, serialized_proto=graph.data.serialized_proto
+          ir_id=graph.ir_id,
+          sha1=graph.data.sha1,
+          serialized_proto=graph.data.serialized_proto,
         )
         for graph in graphs
+        if graph.ir_id in batch_ids
       ]
 
     i = end_i
 
 
 class AnnotationResult(NamedTuple):
-  """The result of running ProcessProgramGraphs() on a list of protos."""
+  """The result of running ProcessWorker() on a list of protos."""
 
   runtime: float
   proto_count: int
-  graph_tuples: List[graph_tuple_database.GraphTuple]
+  # A map from the IDs of the protos which were processed to the number of
+  # graph tuples written for each.
+  ir_graph_counts: Dict[int, int]
+  # The number of graph tuples written to the spill file.
+  graph_count: int
+  # The path of a file containing a sequence of pickled lists of graph tuples.
+  spill_path: pathlib.Path
+
+
+def WriteSpillChunk(
+  spill_file, graph_tuples: List[graph_tuple_database.GraphTuple]
+) -> None:
+  """Append a chunk of graph tuples to a spill file."""
+  pickle.dump(graph_tuples, spill_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def ReadSpillChunks(
+  spill_path: pathlib.Path,
+) -> Iterable[List[graph_tuple_database.GraphTuple]]:
+  """Read the chunks of graph tuples from a spill file, one chunk at a time."""
+  with open(spill_path, "rb") as f:
+    while True:
+      try:
+        yield pickle.load(f)
+      except EOFError:
+        break
+
+
+# The program graph cache of a worker process. This is created on first use, so
+# that it is not inherited by forked workers.
+_program_graph_cache = None
+
+
+def GetProgramGraphCache() -> program_graph_cache.ProgramGraphCache:
+  """Return the program graph cache of the current process."""
+  global _program_graph_cache
+  if _program_graph_cache is None:
+    _program_graph_cache = program_graph_cache.ProgramGraphCache(
+      FLAGS.program_graph_cache, FLAGS.program_graph_cache_mb * 1024 * 1024
+    )
+  return _program_graph_cache
 
 
 def ProcessWorker(packed_args) -> AnnotationResult:
   """The process pool worker function.
 
-  Accepts a batch of unlabelled graphs as inputs, labels them, and returns
-  a list of graph tuples.
+  Accepts a batch of unlabelled graphs as inputs, labels them, and writes the
+  graph tuples to a spill file in chunks of --spill_chunk_mb.
   """
   start_time = time.time()
 
@@ -188,7 +304,8 @@ def ProcessWorker(packed_args) -> AnnotationResult:
   max_mem_size: int = packed_args[1]
   analysis: str = packed_args[2]
   program_graphs: List[ProgramGraphProto] = packed_args[3]
-  ctx: progress.ProgressBarContext = packed_args[4]
+  spill_path: pathlib.Path = packed_args[4]
+  ctx: progress.ProgressBarContext = packed_args[5]
 
   # Set the hard limit on the memory size. Exceeding this limit will raise
   # a MemoryError.
@@ -196,7 +313,18 @@ def ProcessWorker(packed_args) -> AnnotationResult:
     resource.setrlimit(resource.RLIMIT_DATA, (max_mem_size, max_mem_size))
     resource.setrlimit(resource.RLIMIT_AS, (max_mem_size, max_mem_size))
 
+  # The chunk of graph tuples that have not yet been spilled, and its size.
   graph_tuples = []
+  graph_tuples_size = 0
+  # The total number of graph tuples produced, and the number for each proto.
+  graph_count = 0
+  ir_graph_counts = {}
+  spill_chunk_size = FLAGS.spill_chunk_mb * 1024 * 1024
+  spill_file = open(spill_path, "wb")
+
+  use_cache = FLAGS.program_graph_cache and (
+    annotate.SupportsProgramGraphArrays(analysis)
+  )
 
   ctx.Log(
     2,
@@ -209,28 +337,42 @@ def ProcessWorker(packed_args) -> AnnotationResult:
     2,
     lambda t: (
       f"[worker {worker_id}] processed {len(program_graphs)} protos "
-      f"({len(graph_tuples)} graphs, {humanize.Duration(t / len(program_graphs))} /proto)"
+      f"({graph_count} graphs, {humanize.Duration(t / len(program_graphs))} /proto)"
     ),
-  ):
+  ), spill_file:
     for i, program_graph in enumerate(program_graphs):
+      chunk_start = len(graph_tuples)
       try:
+        if use_cache:
+          graph = GetProgramGraphCache().Get(
+            program_graph.sha1, program_graph.serialized_proto
+          )
+        else:
+          graph = programl.FromBytes(
+            program_graph.serialized_proto, programl.InputOutputFormat.PB
+          )
         annotated_graphs = annotate.Annotate(
           analysis,
-          programl.FromBytes(
-            program_graph.serialized_proto, programl.InputOutputFormat.PB
-          ),
+          graph,
           n=FLAGS.n,
           timeout=FLAGS.annotator_timeout,
         )
 
-        if annotated_graphs.graphs:
+        annotated_graph_tuples = annotated_graphs.graph_tuples
+        if annotated_graph_tuples:
           # Record the annotated analysis results.
-          for annotated_graph in annotated_graphs.graphs:
-            graph_tuples.append(
-              graph_tuple_database.GraphTuple.CreateFromNetworkX(
-                annotated_graph, ir_id=program_graph.ir_id
-              )
+          for annotated_graph_tuple in annotated_graph_tuples:
+            mapped = graph_tuple_database.GraphTuple.CreateFromGraphTuple(
+              annotated_graph_tuple.graph_tuple, ir_id=program_graph.ir_id
+            )
+            mapped.data_flow_steps = annotated_graph_tuple.data_flow_steps
+            mapped.data_flow_root_node = (
+              annotated_graph_tuple.data_flow_root_node
+            )
+            mapped.data_flow_positive_node_count = (
+              annotated_graph_tuple.data_flow_positive_node_count
             )
+            graph_tuples.append(mapped)
         else:
           # Analysis produced no outputs, so just record an empty graph.
           graph_tuples.append(
@@ -258,10 +400,202 @@ def ProcessWorker(packed_args) -> AnnotationResult:
           graph_tuple_database.GraphTuple.CreateEmpty(ir_id=program_graph.ir_id)
         )
 
+      # Spill the graph tuples once the chunk is full. The graph tuples of a
+      # single proto may be split across chunks.
+      ir_graph_counts[program_graph.ir_id] = len(graph_tuples) - chunk_start
+      graph_count += len(graph_tuples) - chunk_start
+      graph_tuples_size += sum(
+        t.pickled_graph_tuple_size for t in graph_tuples[chunk_start:]
+      )
+      if graph_tuples_size >= spill_chunk_size:
+        WriteSpillChunk(spill_file, graph_tuples)
+        graph_tuples = []
+        graph_tuples_size = 0
+
+    if graph_tuples:
+      WriteSpillChunk(spill_file, graph_tuples)
+
   return AnnotationResult(
     runtime=time.time() - start_time,
     proto_count=len(program_graphs),
-    graph_tuples=graph_tuples,
+    ir_graph_counts=ir_graph_counts,
+    graph_count=graph_count,
+    spill_path=spill_path,
+  )
+
+
+def CheckDatasetVersion(
+  output_db: graph_tuple_database.Database, analysis: str
+) -> None:
+  """Record the analysis which produces a dataset, or check that it matches.
+
+  Annotators which produce different labels or data flow values for the same
+  graphs have different analysis names or DATASET_VERSIONs, so resuming a
+  dataset with a different analysis or version would mix their annotations.
+  Databases which were created before versions were recorded are assumed to
+  be version 1.
+
+  Args:
+    output_db: The database of annotated graph tuples.
+    analysis: The name of the analysis.
+
+  Raises:
+    UsageError: If the dataset was produced by a different analysis or version.
+  """
+  version = annotate.ANALYSES[analysis].DATASET_VERSION
+  with output_db.Session(commit=True) as session:
+    meta = (
+      session.query(graph_tuple_database.Meta)
+      .filter(graph_tuple_database.Meta.key == "Analysis")
+      .order_by(graph_tuple_database.Meta.id)
+      .first()
+    )
+    if meta:
+      if meta.value != (analysis, version):
+        raise app.UsageError(
+          f"Cannot add {analysis} version {version} annotations to a dataset "
+          f"of {meta.value[0]} version {meta.value[1]} annotations"
+        )
+    elif (
+      version != 1
+      and session.query(graph_tuple_database.GraphTuple.id).first()
+    ):
+      raise app.UsageError(
+        f"Cannot add {analysis} version {version} annotations to a dataset "
+        "of version 1 annotations"
+      )
+    else:
+      session.add(
+        graph_tuple_database.Meta.Create(
+          key="Analysis", value=(analysis, version)
+        )
+      )
+
+
+def CheckpointExistingGraphTuples(
+  output_db: graph_tuple_database.Database,
+) -> int:
+  """Checkpoint every IR which has graph tuples but no checkpoint.
+
+  This is a one-off migration for databases which were created before
+  checkpoints were introduced. Every IR with a graph tuple is assumed to be
+  complete, so this must not be used on the output of an interrupted run.
+
+  Args:
+    output_db: The database of annotated graph tuples.
+
+  Returns:
+    The number of checkpoints added.
+  """
+  with output_db.Session(commit=True) as session:
+    ir_ids = [
+      row.ir_id
+      for row in session.query(graph_tuple_database.GraphTuple.ir_id)
+      .filter(
+        ~graph_tuple_database.GraphTuple.ir_id.in_(
+          session.query(graph_tuple_database.IrIdCheckpoint.ir_id)
+        )
+      )
+      .distinct()
+    ]
+    if ir_ids:
+      app.Log(
+        1,
+        "Adding checkpoints for %s annotated IRs",
+        humanize.Commas(len(ir_ids)),
+      )
+      session.execute(
+        graph_tuple_database.IrIdCheckpoint.__table__.insert(),
+        [{"ir_id": ir_id} for ir_id in ir_ids],
+      )
+  return len(ir_ids)
+
+
+def GetCompletedIrIds(output_db: graph_tuple_database.Database) -> Set[int]:
+  """Get the IDs of the IRs which have been completely annotated.
+
+  Graph tuples for IRs which have no checkpoint were written by an interrupted
+  run, and are deleted so that they can be regenerated.
+
+  Args:
+    output_db: The database of annotated graph tuples.
+
+  Returns:
+    A set of IR IDs.
+  """
+  with output_db.Session(commit=True) as session:
+    completed_ir_ids = {
+      row.ir_id
+      for row in session.query(graph_tuple_database.IrIdCheckpoint.ir_id)
+    }
+
+    # Delete the graph tuples of incomplete IRs.
+    incomplete_graph_tuples = session.query(
+      graph_tuple_database.GraphTuple
+    ).filter(
+      ~graph_tuple_database.GraphTuple.ir_id.in_(
+        session.query(graph_tuple_database.IrIdCheckpoint.ir_id)
+      )
+    )
+    session.query(graph_tuple_database.GraphTupleData).filter(
+      graph_tuple_database.GraphTupleData.id.in_(
+        incomplete_graph_tuples.with_entities(
+          graph_tuple_database.GraphTuple.id
+        ).subquery()
+      )
+    ).delete(synchronize_session=False)
+    deleted_count = incomplete_graph_tuples.delete(synchronize_session=False)
+    if deleted_count:
+      app.Log(
+        1,
+        "Deleted %s from incomplete IRs",
+        humanize.Plural(deleted_count, "graph tuple"),
+      )
+
+  return completed_ir_ids
+
+
+def CheckpointIrs(
+  session: sqlutil.Database.SessionType,
+  ir_graph_counts: Dict[int, int],
+  ctx: progress.ProgressContext = progress.NullContext,
+) -> None:
+  """Checkpoint the IRs whose graph tuples have all been committed.
+
+  BufferedDatabaseWriter drops graph tuples which fail to commit, so the
+  committed graph tuples are counted, and IRs with missing graph tuples are not
+  checkpointed. Their graph tuples are deleted and regenerated by the next run.
+
+  Args:
+    session: A database session.
+    ir_graph_counts: A map from IR ID to the number of graph tuples which were
+      written for it.
+    ctx: A progress context.
+  """
+  committed_counts = dict(
+    session.query(
+      graph_tuple_database.GraphTuple.ir_id,
+      sql.func.count(graph_tuple_database.GraphTuple.id),
+    )
+    .filter(graph_tuple_database.GraphTuple.ir_id.in_(list(ir_graph_counts)))
+    .group_by(graph_tuple_database.GraphTuple.ir_id)
+  )
+  incomplete_ir_ids = {
+    ir_id
+    for ir_id, count in ir_graph_counts.items()
+    if committed_counts.get(ir_id, 0) != count
+  }
+  if incomplete_ir_ids:
+    ctx.Error(
+      "Not checkpointing %s with missing graph tuples",
+      humanize.Plural(len(incomplete_ir_ids), "IR"),
+    )
+  session.add_all(
+    [
+      graph_tuple_database.IrIdCheckpoint(ir_id=ir_id)
+      for ir_id in ir_graph_counts
+      if ir_id not in incomplete_ir_ids
+    ]
   )
 
 
@@ -285,17 +619,13 @@ class DatasetGenerator(progress.Progress):
         f"Unknown analysis: {analysis}. "
         f"Available analyses: {annotate.AVAILABLE_ANALYSES}",
       )
+    CheckDatasetVersion(output_db, analysis)
 
-    with input_db.Session() as in_session, output_db.Session() as out_session:
-      # Get the graphs that have already been processed.
-      already_done_max, already_done_count = out_session.query(
-        sql.func.max(graph_tuple_database.GraphTuple.ir_id),
-        sql.func.count(
-          sql.func.distinct(graph_tuple_database.GraphTuple.ir_id)
-        ),
-      ).one()
-      already_done_max = already_done_max or -1
+    # Get the graphs that have already been processed.
+    already_done_ids = GetCompletedIrIds(output_db)
+    already_done_count = len(already_done_ids)
 
+    with input_db.Session() as in_session:
       # Get the total number of graphs, including those that have already been
       # processed.
       total_graph_count = in_session.query(
@@ -309,32 +639,27 @@ class DatasetGenerator(progress.Progress):
         unlabelled_graph_database.ProgramGraph.serialized_proto_size,
       )
       if order_by == "in_order":
-        ids_and_sizes_to_do = ids_and_sizes_to_do.filter(
-          unlabelled_graph_database.ProgramGraph.ir_id > already_done_max
-        ).order_by(unlabelled_graph_database.ProgramGraph.ir_id)
+        ids_and_sizes_to_do = ids_and_sizes_to_do.order_by(
+          unlabelled_graph_database.ProgramGraph.ir_id
+        )
       elif order_by == "random":
-        # Filter out the graphs that have already been processed.
-        if already_done_count:
-          already_done_ids = {
-            row.ir_id
-            for row in out_session.query(graph_tuple_database.GraphTuple.ir_id)
-          }
-          assert already_done_ids != already_done_count
-          ids_and_sizes_to_do = ids_and_sizes_to_do.filter(
-            ~unlabelled_graph_database.ProgramGraph.ir_id.in_(already_done_ids)
-          )
         # Order the graphs to do randomly.
         ids_and_sizes_to_do = ids_and_sizes_to_do.order_by(input_db.Random())
       else:
         raise app.UsageError(f"Unknown order: {order_by}")
 
-      # Optionally limit the number of IDs to process.
-      if max_instances:
-        ids_and_sizes_to_do = ids_and_sizes_to_do.limit(max_instances)
+      # Filter out the graphs that have already been processed. This is done
+      # here rather than in the query as the set of IDs may be large.
       ids_and_sizes_to_do = [
-        (row.ir_id, row.serialized_proto_size) for row in ids_and_sizes_to_do
+        (row.ir_id, row.serialized_proto_size)
+        for row in ids_and_sizes_to_do
+        if row.ir_id not in already_done_ids
       ]
 
+    # Optionally limit the number of IDs to process.
+    if max_instances:
+      ids_and_sizes_to_do = ids_and_sizes_to_do[:max_instances]
+
     # Sanity check.
     if not max_instances:
       if len(ids_and_sizes_to_do) + already_done_count != total_graph_count:
@@ -393,15 +718,27 @@ class DatasetGenerator(progress.Progress):
     pool = multiprocessing.Pool(
       processes=FLAGS.nproc, maxtasksperchild=FLAGS.max_tasks_per_worker
     )
+    spill_dir = tempfile.TemporaryDirectory(
+      prefix="phd_ml4pl_make_data_flow_analysis_dataset_", dir=FLAGS.spill_dir
+    )
+
+    # The pool consumes its input iterator as fast as it can, so bound the
+    # number of batches which are in flight. A slot is released after the
+    # results of a batch have been written.
+    pending_batches = threading.Semaphore(
+      FLAGS.max_pending_batches or 2 * num_workers
+    )
 
     def ProcessWorkerArgsGenerator(graph_reader):
       """Generate packed arguments for a multiprocessing worker."""
       for i, graph_batch in enumerate(graph_reader):
+        pending_batches.acquire()
         yield (
           i,
           per_worker_memory,
           self.analysis,
           graph_batch,
+          pathlib.Path(spill_dir.name) / f"{i:06d}.pkl",
           self.ctx.ToProgressContext(),
         )
 
@@ -410,7 +747,7 @@ class DatasetGenerator(progress.Progress):
     worker_args = ProcessWorkerArgsGenerator(self.graph_reader)
     workers = pool.imap_unordered(ProcessWorker, worker_args)
     # Buffer the generated results to minimize blocking on database writes.
-    with sqlutil.BufferedDatabaseWriter(
+    with spill_dir, sqlutil.BufferedDatabaseWriter(
       self.output_db,
       max_buffer_size=FLAGS.write_buffer_mb * 1024 * 1024,
       max_buffer_length=FLAGS.write_buffer_length,
@@ -419,11 +756,21 @@ class DatasetGenerator(progress.Progress):
       log_level=1,
       ctx=self.ctx.ToProgressContext(),
     ) as writer:
-      for elapsed_time, proto_count, graph_tuples in workers:
-        self.ctx.i += proto_count
-        # Record the generated annotated graphs.
-        tuple_sizes = [t.pickled_graph_tuple_size for t in graph_tuples]
-        writer.AddMany(graph_tuples, sizes=tuple_sizes)
+      for result in workers:
+        # Record the generated annotated graphs, one chunk at a time.
+        for graph_tuples in ReadSpillChunks(result.spill_path):
+          tuple_sizes = [t.pickled_graph_tuple_size for t in graph_tuples]
+          writer.AddMany(graph_tuples, sizes=tuple_sizes)
+        os.unlink(result.spill_path)
+        # Checkpoint the IRs after all of their graph tuples have been
+        # committed.
+        writer.AddLambdaOp(
+          lambda session, counts=result.ir_graph_counts: CheckpointIrs(
+            session, counts, self.ctx.ToProgressContext()
+          )
+        )
+        self.ctx.i += result.proto_count
+        pending_batches.release()
 
     # End of buffered writing, this will block until the last results have been
     # committed.
@@ -455,6 +802,9 @@ def main():
   input_db = FLAGS.proto_db()
   output_db = FLAGS.graph_db()
 
+  if FLAGS.checkpoint_existing_graph_tuples:
+    CheckpointExistingGraphTuples(output_db)
+
   generator = DatasetGenerator(
     input_db,
     FLAGS.analysis,
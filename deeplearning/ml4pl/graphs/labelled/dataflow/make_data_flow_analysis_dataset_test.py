@@ -0,0 +1,191 @@
+"""Unit tests for //deeplearning/ml4pl/graphs/labelled/dataflow:make_data_flow_analysis_dataset."""
+import pathlib
+
+from deeplearning.ml4pl.graphs.labelled import graph_tuple_database
+from deeplearning.ml4pl.graphs.labelled.dataflow import (
+  make_data_flow_analysis_dataset,
+)
+from deeplearning.ml4pl.testing import testing_databases
+from labm8.py import app
+from labm8.py import test
+
+FLAGS = test.FLAGS
+
+###############################################################################
+# Fixtures.
+###############################################################################
+
+
+@test.Fixture(
+  scope="function",
+  params=testing_databases.GetDatabaseUrls(),
+  namer=testing_databases.DatabaseUrlNamer("graph_db"),
+)
+def graph_db(request) -> graph_tuple_database.Database:
+  """A test fixture which yields an empty graph tuple database."""
+  with testing_databases.DatabaseContext(
+    graph_tuple_database.Database, request.param
+  ) as db:
+    yield db
+
+
+###############################################################################
+# Tests.
+###############################################################################
+
+
+def test_ReadSpillChunks_round_trip(tmp_path: pathlib.Path):
+  """Test that chunks are read back in the order that they were written."""
+  path = tmp_path / "spill.pkl"
+  with open(path, "wb") as f:
+    make_data_flow_analysis_dataset.WriteSpillChunk(
+      f,
+      [
+        graph_tuple_database.GraphTuple.CreateEmpty(ir_id=1),
+        graph_tuple_database.GraphTuple.CreateEmpty(ir_id=1),
+      ],
+    )
+    make_data_flow_analysis_dataset.WriteSpillChunk(
+      f, [graph_tuple_database.GraphTuple.CreateEmpty(ir_id=2)]
+    )
+
+  chunks = list(make_data_flow_analysis_dataset.ReadSpillChunks(path))
+  assert [[t.ir_id for t in chunk] for chunk in chunks] == [[1, 1], [2]]
+
+
+def test_GetCompletedIrIds_empty_db(graph_db: graph_tuple_database.Database):
+  """Test that an empty database has no completed IRs."""
+  assert make_data_flow_analysis_dataset.GetCompletedIrIds(graph_db) == set()
+
+
+def test_GetCompletedIrIds_deletes_incomplete_irs(
+  graph_db: graph_tuple_database.Database,
+):
+  """Test that graph tuples of IRs without a checkpoint are deleted."""
+  with graph_db.Session(commit=True) as session:
+    session.add_all(
+      [
+        graph_tuple_database.GraphTuple.CreateEmpty(ir_id=1),
+        graph_tuple_database.GraphTuple.CreateEmpty(ir_id=2),
+        graph_tuple_database.IrIdCheckpoint(ir_id=1),
+      ]
+    )
+
+  assert make_data_flow_analysis_dataset.GetCompletedIrIds(graph_db) == {1}
+
+  with graph_db.Session() as session:
+    ir_ids = [
+      row.ir_id for row in session.query(graph_tuple_database.GraphTuple)
+    ]
+  assert ir_ids == [1]
+
+
+def test_GetCompletedIrIds_interrupted_run_without_checkpoints(
+  graph_db: graph_tuple_database.Database,
+):
+  """Test that a run interrupted before its first checkpoint is regenerated."""
+  with graph_db.Session(commit=True) as session:
+    session.add_all(
+      [
+        graph_tuple_database.GraphTuple.CreateEmpty(ir_id=1),
+        graph_tuple_database.GraphTuple.CreateEmpty(ir_id=2),
+      ]
+    )
+
+  assert make_data_flow_analysis_dataset.GetCompletedIrIds(graph_db) == set()
+
+  with graph_db.Session() as session:
+    assert session.query(graph_tuple_database.IrIdCheckpoint).count() == 0
+    assert session.query(graph_tuple_database.GraphTuple).count() == 0
+
+
+def test_CheckpointExistingGraphTuples(
+  graph_db: graph_tuple_database.Database,
+):
+  """Test that every IR with graph tuples is checkpointed."""
+  with graph_db.Session(commit=True) as session:
+    session.add_all(
+      [
+        graph_tuple_database.GraphTuple.CreateEmpty(ir_id=1),
+        graph_tuple_database.GraphTuple.CreateEmpty(ir_id=1),
+        graph_tuple_database.GraphTuple.CreateEmpty(ir_id=3),
+        graph_tuple_database.IrIdCheckpoint(ir_id=3),
+      ]
+    )
+
+  assert (
+    make_data_flow_analysis_dataset.CheckpointExistingGraphTuples(graph_db)
+    == 1
+  )
+  assert make_data_flow_analysis_dataset.GetCompletedIrIds(graph_db) == {1, 3}
+
+  with graph_db.Session() as session:
+    assert session.query(graph_tuple_database.IrIdCheckpoint).count() == 2
+    assert session.query(graph_tuple_database.GraphTuple).count() == 3
+
+
+def test_CheckpointIrs_skips_irs_with_missing_graph_tuples(
+  graph_db: graph_tuple_database.Database,
+):
+  """Test that an IR whose graph tuples were not all committed is not
+  checkpointed."""
+  with graph_db.Session(commit=True) as session:
+    session.add_all(
+      [
+        graph_tuple_database.GraphTuple.CreateEmpty(ir_id=1),
+        graph_tuple_database.GraphTuple.CreateEmpty(ir_id=1),
+        graph_tuple_database.GraphTuple.CreateEmpty(ir_id=2),
+      ]
+    )
+
+  with graph_db.Session(commit=True) as session:
+    make_data_flow_analysis_dataset.CheckpointIrs(session, {1: 2, 2: 2, 3: 1})
+
+  with graph_db.Session() as session:
+    ir_ids = [
+      row.ir_id
+      for row in session.query(graph_tuple_database.IrIdCheckpoint.ir_id)
+    ]
+  assert ir_ids == [1]
+
+
+def test_CheckDatasetVersion_resume_same_analysis(
+  graph_db: graph_tuple_database.Database,
+):
+  """Test that a dataset can be resumed with the analysis that created it."""
+  make_data_flow_analysis_dataset.CheckDatasetVersion(graph_db, "domtree_csr")
+  make_data_flow_analysis_dataset.CheckDatasetVersion(graph_db, "domtree_csr")
+
+
+@test.Parametrize(
+  "analysis,other_analysis",
+  (("domtree", "domtree_csr"), ("reachability_csr", "reachability")),
+)
+def test_CheckDatasetVersion_different_analysis(
+  graph_db: graph_tuple_database.Database, analysis: str, other_analysis: str
+):
+  """Test that annotations of different analyses cannot be mixed."""
+  make_data_flow_analysis_dataset.CheckDatasetVersion(graph_db, analysis)
+
+  with test.Raises(app.UsageError):
+    make_data_flow_analysis_dataset.CheckDatasetVersion(
+      graph_db, other_analysis
+    )
+
+
+def test_CheckDatasetVersion_unversioned_dataset(
+  graph_db: graph_tuple_database.Database,
+):
+  """Test that a dataset which predates versions is assumed to be version 1."""
+  with graph_db.Session(commit=True) as session:
+    session.add(graph_tuple_database.GraphTuple.CreateEmpty(ir_id=1))
+
+  with test.Raises(app.UsageError) as e_ctx:
+    make_data_flow_analysis_dataset.CheckDatasetVersion(graph_db, "domtree_csr")
+  assert "version 1" in str(e_ctx.value)
+
+  make_data_flow_analysis_dataset.CheckDatasetVersion(graph_db, "domtree")
+
+
+if __name__ == "__main__":
+  test.Main()
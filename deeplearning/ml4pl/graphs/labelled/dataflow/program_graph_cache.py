@@ -0,0 +1,178 @@
+"""A local disk cache of preprocessed program graphs.
+
+Annotating a program graph requires parsing its protocol buffer and building
+the adjacency lists of its edges. When multiple analyses are run over the same
+unlabelled graph database, each analysis would repeat this work. This module
+stores the control_flow_csr.ProgramGraphArrays of each program graph on local
+disk, keyed by the sha1 of the serialized proto and the cache format version,
+so that the work is done once per graph. Entries written with a different
+format version are never read, and are evicted like any other entry.
+
+The cache is bounded in size. When it grows beyond its maximum size, the least
+recently used entries are evicted. A cache directory may be shared by multiple
+processes.
+
+Example usage:
+
+    cache = program_graph_cache.ProgramGraphCache("/tmp/cache", 1024 << 20)
+    arrays = cache.Get(program_graph.sha1, program_graph.data.serialized_proto)
+    annotated = annotate.Annotate("reachability_csr", arrays)
+"""
+import os
+import pathlib
+import tempfile
+import zipfile
+from typing import Iterable
+from typing import Union
+
+from deeplearning.ml4pl.graphs import programl
+from deeplearning.ml4pl.graphs import programl_pb2
+from deeplearning.ml4pl.graphs.labelled.dataflow import control_flow_csr
+from labm8.py import app
+from labm8.py import humanize
+
+FLAGS = app.FLAGS
+
+# The version of the cache entry format. Increment this whenever the arrays
+# written by control_flow_csr.ProgramGraphArrays.Save() change, so that stale
+# entries are cache misses rather than being loaded as the new format.
+FORMAT_VERSION = 1
+
+
+class ProgramGraphCache(object):
+  """A least-recently-used disk cache of program graph arrays."""
+
+  def __init__(
+    self,
+    cache_dir: Union[str, pathlib.Path],
+    max_size_in_bytes: int,
+    evict_to_ratio: float = 0.9,
+  ):
+    """Constructor.
+
+    Args:
+      cache_dir: The directory to store cache entries in. It is created if it
+        does not exist.
+      max_size_in_bytes: The maximum total size of cache entries.
+      evict_to_ratio: When the cache exceeds its maximum size, entries are
+        evicted until the cache is this fraction of its maximum size, so that
+        the cache directory is not scanned after every insertion.
+    """
+    self.path = pathlib.Path(cache_dir)
+    self.path.mkdir(parents=True, exist_ok=True)
+    self.max_size_in_bytes = max_size_in_bytes
+    self.evict_to_ratio = evict_to_ratio
+
+    self.hit_count = 0
+    self.miss_count = 0
+    self.eviction_count = 0
+    # An estimate of the size of the cache. Other processes may add or evict
+    # entries, so this is recomputed whenever entries are evicted.
+    self.size_in_bytes = sum(path.stat().st_size for path in self._Entries())
+
+  def EntryPath(self, sha1: str) -> pathlib.Path:
+    """Return the path of the cache entry for a sha1."""
+    return self.path / sha1[:2] / f"{sha1}.v{FORMAT_VERSION}.npz"
+
+  def __contains__(self, sha1: str) -> bool:
+    return self.EntryPath(sha1).is_file()
+
+  def Get(
+    self, sha1: str, graph: Union[programl_pb2.ProgramGraph, bytes]
+  ) -> control_flow_csr.ProgramGraphArrays:
+    """Get the arrays of a program graph.
+
+    Args:
+      sha1: The sha1 of the serialized program graph, as stored in
+        unlabelled_graph_database.ProgramGraph.sha1.
+      graph: The program graph, either as a proto instance or as a
+        binary-encoded byte array. This is only parsed if the graph is not in
+        the cache.
+
+    Returns:
+      The program graph arrays.
+    """
+    path = self.EntryPath(sha1)
+    try:
+      arrays = control_flow_csr.ProgramGraphArrays.Load(path)
+      # Mark the entry as recently used.
+      os.utime(path)
+      self.hit_count += 1
+      return arrays
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+      # The entry does not exist, was evicted by another process while it was
+      # being read, or is corrupt.
+      pass
+
+    self.miss_count += 1
+    if isinstance(graph, bytes):
+      graph = programl.FromBytes(graph, programl.InputOutputFormat.PB)
+    arrays = control_flow_csr.ProgramGraphArrays.FromProgramGraph(graph)
+    self.Put(sha1, arrays)
+    return arrays
+
+  def Put(self, sha1: str, arrays: control_flow_csr.ProgramGraphArrays) -> None:
+    """Add the arrays of a program graph to the cache."""
+    path = self.EntryPath(sha1)
+    path.parent.mkdir(exist_ok=True)
+    # Write to a temporary file and rename it, so that other processes never
+    # read a partially written entry.
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    os.close(fd)
+    try:
+      arrays.Save(pathlib.Path(tmp_path))
+      os.replace(tmp_path, path)
+    except Exception:
+      os.unlink(tmp_path)
+      raise
+
+    self.size_in_bytes += path.stat().st_size
+    if self.size_in_bytes > self.max_size_in_bytes:
+      self.Evict()
+
+  def Evict(self) -> None:
+    """Evict the least recently used entries until the cache is below its
+    target size.
+    """
+    entries = []
+    for path in self._Entries():
+      try:
+        stat = path.stat()
+      except FileNotFoundError:
+        # Evicted by another process.
+        continue
+      entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort()
+
+    self.size_in_bytes = sum(size for _, size, _ in entries)
+    target_size = int(self.max_size_in_bytes * self.evict_to_ratio)
+    evicted_count = 0
+    for _, size, path in entries:
+      if self.size_in_bytes <= target_size:
+        break
+      try:
+        path.unlink()
+        evicted_count += 1
+      except FileNotFoundError:
+        pass
+      self.size_in_bytes -= size
+
+    self.eviction_count += evicted_count
+    app.Log(
+      2,
+      "Evicted %s from program graph cache, %s remaining",
+      humanize.Plural(evicted_count, "entry", "entries"),
+      humanize.BinaryPrefix(self.size_in_bytes, "B"),
+    )
+
+  def _Entries(self) -> Iterable[pathlib.Path]:
+    """Return the paths of the cache entries."""
+    return self.path.glob("*/*.npz")
+
+  def __repr__(self) -> str:
+    return (
+      f"ProgramGraphCache({self.path}, "
+      f"{humanize.BinaryPrefix(self.size_in_bytes, 'B')} of "
+      f"{humanize.BinaryPrefix(self.max_size_in_bytes, 'B')}, "
+      f"{self.hit_count} hits, {self.miss_count} misses)"
+    )
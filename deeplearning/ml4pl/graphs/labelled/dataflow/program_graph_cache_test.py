@@ -0,0 +1,137 @@
+"""Unit tests for //deeplearning/ml4pl/graphs/labelled/dataflow:program_graph_cache."""
+import os
+import pathlib
+
+from deeplearning.ml4pl.graphs import programl
+from deeplearning.ml4pl.graphs import programl_pb2
+from deeplearning.ml4pl.graphs.labelled.dataflow import control_flow_csr
+from deeplearning.ml4pl.graphs.labelled.dataflow import program_graph_cache
+from labm8.py import test
+
+FLAGS = test.FLAGS
+
+###############################################################################
+# Fixtures.
+###############################################################################
+
+
+@test.Fixture(scope="function")
+def graph() -> programl_pb2.ProgramGraph:
+  """A small program graph."""
+  builder = programl.GraphBuilder()
+  a = builder.AddNode()
+  b = builder.AddNode()
+  builder.AddEdge(a, b)
+  return builder.proto
+
+
+@test.Fixture(scope="function")
+def cache(tmp_path: pathlib.Path) -> program_graph_cache.ProgramGraphCache:
+  """An empty cache with no size limit."""
+  return program_graph_cache.ProgramGraphCache(tmp_path / "cache", 1 << 30)
+
+
+###############################################################################
+# Tests.
+###############################################################################
+
+
+def test_Get_miss_then_hit(
+  cache: program_graph_cache.ProgramGraphCache,
+  graph: programl_pb2.ProgramGraph,
+):
+  """Test that a graph is preprocessed once."""
+  a = cache.Get("a" * 40, graph)
+  assert "a" * 40 in cache
+  assert (cache.hit_count, cache.miss_count) == (0, 1)
+
+  # The graph is not used on a cache hit.
+  b = cache.Get("a" * 40, b"not a graph")
+  assert (cache.hit_count, cache.miss_count) == (1, 1)
+  assert b.SuccessorLists(programl_pb2.Edge.CONTROL) == [[1], []]
+  assert b.node_x.tolist() == a.node_x.tolist()
+
+
+def test_Get_serialized_proto(
+  cache: program_graph_cache.ProgramGraphCache,
+  graph: programl_pb2.ProgramGraph,
+):
+  """Test that a binary-encoded graph is parsed on a miss."""
+  arrays = cache.Get(
+    "a" * 40, programl.ToBytes(graph, programl.InputOutputFormat.PB)
+  )
+  assert arrays.node_count == 2
+
+
+def test_Get_corrupt_entry(
+  cache: program_graph_cache.ProgramGraphCache,
+  graph: programl_pb2.ProgramGraph,
+):
+  """Test that a corrupt entry is replaced."""
+  path = cache.EntryPath("a" * 40)
+  path.parent.mkdir()
+  path.write_bytes(b"corrupt")
+  arrays = cache.Get("a" * 40, graph)
+  assert arrays.node_count == 2
+  assert cache.miss_count == 1
+  assert control_flow_csr.ProgramGraphArrays.Load(path).node_count == 2
+
+
+def test_Get_format_version_mismatch(
+  cache: program_graph_cache.ProgramGraphCache,
+  graph: programl_pb2.ProgramGraph,
+):
+  """Test that an entry written with another format version is a miss."""
+  cache.Get("a" * 40, graph)
+  format_version = program_graph_cache.FORMAT_VERSION
+  program_graph_cache.FORMAT_VERSION += 1
+  try:
+    assert "a" * 40 not in cache
+    arrays = cache.Get("a" * 40, graph)
+    assert arrays.node_count == 2
+    assert (cache.hit_count, cache.miss_count) == (0, 2)
+    assert "a" * 40 in cache
+  finally:
+    program_graph_cache.FORMAT_VERSION = format_version
+  # The entry of the original version is still readable.
+  cache.Get("a" * 40, b"not a graph")
+  assert cache.hit_count == 1
+
+
+def test_Evict_least_recently_used(
+  tmp_path: pathlib.Path, graph: programl_pb2.ProgramGraph
+):
+  """Test that the least recently used entries are evicted."""
+  arrays = control_flow_csr.ProgramGraphArrays.FromProgramGraph(graph)
+  arrays.Save(tmp_path / "entry.npz")
+  entry_size = (tmp_path / "entry.npz").stat().st_size
+
+  cache = program_graph_cache.ProgramGraphCache(
+    tmp_path / "cache", max_size_in_bytes=int(entry_size * 2.5)
+  )
+  cache.Put("a" * 40, arrays)
+  cache.Put("b" * 40, arrays)
+  # Make "a" the least recently used entry.
+  os.utime(cache.EntryPath("a" * 40), (0, 0))
+  cache.Put("c" * 40, arrays)
+
+  assert "a" * 40 not in cache
+  assert "b" * 40 in cache
+  assert "c" * 40 in cache
+  assert cache.eviction_count == 1
+  assert cache.size_in_bytes == 2 * entry_size
+
+
+def test_size_in_bytes_existing_cache(
+  tmp_path: pathlib.Path, graph: programl_pb2.ProgramGraph
+):
+  """Test that a cache opened on an existing directory counts its entries."""
+  a = program_graph_cache.ProgramGraphCache(tmp_path, 1 << 30)
+  a.Get("a" * 40, graph)
+  b = program_graph_cache.ProgramGraphCache(tmp_path, 1 << 30)
+  assert b.size_in_bytes == a.size_in_bytes
+  assert b.size_in_bytes > 0
+
+
+if __name__ == "__main__":
+  test.Main()
@@ -1,9 +1,10 @@
 """Library for labelling program graphs with reachability information."""
 import collections
 
-import networkx as nx
+import numpy as np
 
 from deeplearning.ml4pl.graphs import programl_pb2
+from deeplearning.ml4pl.graphs.labelled.dataflow import control_flow_csr
 from deeplearning.ml4pl.graphs.labelled.dataflow import data_flow_graphs
 from labm8.py import app
 
@@ -15,37 +16,43 @@ REACHABLE_NO = [1, 0]
 REACHABLE_YES = [0, 1]
 
 
-class ReachabilityAnnotator(data_flow_graphs.NetworkXDataFlowGraphAnnotator):
+class ReachabilityAnnotator(data_flow_graphs.RootNodeDataFlowGraphAnnotator):
   """Annotate graphs with reachability analysis.
 
   Statement node A is reachable from statement node B iff there exists some
   control flow path from B >> A. Non-statement nodes are never reachable.
   """
 
+  def __init__(self, *args, **kwargs):
+    super(ReachabilityAnnotator, self).__init__(*args, **kwargs)
+    # The control successors of every node, shared by all root nodes.
+    self.successors = [
+      [
+        next
+        for _, next, flow in self.g.out_edges(node, data="flow")
+        if flow == programl_pb2.Edge.CONTROL
+      ]
+      for node in range(self.g.number_of_nodes())
+    ]
+
   def IsValidRootNode(self, node: int, data) -> bool:
     """Reachability is a statement-based analysis."""
     return data["type"] == programl_pb2.Node.STATEMENT
 
-  def Annotate(self, g: nx.MultiDiGraph, root_node: int) -> None:
-    """Annotate nodes in the graph with their reachability.
+  def AnnotateRoot(
+    self, root_node: int
+  ) -> data_flow_graphs.RootNodeAnnotation:
+    """Compute the reachability of nodes from a root node.
 
     The 'root node' annotation is a [0,1] value appended to node x vectors.
     The reachability label is a 1-hot binary vector set to y node vectors.
 
     Args:
-      g: The graph to annotate.
       root_node: The source node for determining reachability.
 
     Returns:
-      The program graph with reachability annotations.
+      The reachability annotation.
     """
-    # Initialize all nodes as unreachable and not root node, except the root
-    # node.
-    for node, data in g.nodes(data=True):
-      data["x"].append(data_flow_graphs.ROOT_NODE_NO)
-      data["y"] = REACHABLE_NO
-    g.nodes[root_node]["x"][-1] = data_flow_graphs.ROOT_NODE_YES
-
     # Perform a breadth-first traversal to mark reachable nodes.
     data_flow_steps = 0
     reachable_node_count = 0
@@ -53,19 +60,59 @@ class ReachabilityAnnotator(data_flow_graphs.NetworkXDataFlowGraphAnnotator):
     q = collections.deque()
 
     # Only begin reachable BFS if the root is a statement.
-    if g.nodes[root_node]["type"] == programl_pb2.Node.STATEMENT:
+    if self.g.nodes[root_node]["type"] == programl_pb2.Node.STATEMENT:
       q.append((root_node, 1))
 
     while q:
       node, data_flow_steps = q.popleft()
       reachable_node_count += 1
-      g.nodes[node]["y"] = REACHABLE_YES
       visited.add(node)
 
-      for _, next, flow in g.out_edges(node, data="flow"):
-        if flow == programl_pb2.Edge.CONTROL and next not in visited:
+      for next in self.successors[node]:
+        if next not in visited:
           q.append((next, data_flow_steps + 1))
 
-    g.graph["data_flow_root_node"] = root_node
-    g.graph["data_flow_steps"] = data_flow_steps
-    g.graph["data_flow_positive_node_count"] = reachable_node_count
+    return data_flow_graphs.RootNodeAnnotation(
+      root_node=root_node,
+      data_flow_steps=data_flow_steps,
+      data_flow_positive_node_count=reachable_node_count,
+      node_y=data_flow_graphs.BinaryNodeLabels(
+        self.g.number_of_nodes(), visited, REACHABLE_NO, REACHABLE_YES
+      ),
+    )
+
+
+class CsrReachabilityAnnotator(control_flow_csr.CsrDataFlowGraphAnnotator):
+  """Annotate graphs with reachability analysis using control flow arrays.
+
+  This produces the same node labels as ReachabilityAnnotator, but traverses a
+  ControlFlowCsr one breadth-first level at a time. The data flow steps are the
+  number of levels of the traversal, and the positive node count is the number
+  of reachable nodes. ReachabilityAnnotator may count a node more than once if
+  it is enqueued by multiple predecessors, in which case these values differ.
+  """
+
+  DATASET_VERSION: int = 2
+
+  def GetRootNodes(self) -> np.array:
+    """Reachability is a statement-based analysis."""
+    return np.nonzero(self.cfg.is_statement)[0]
+
+  def AnnotateRoot(
+    self, root_node: int
+  ) -> data_flow_graphs.RootNodeAnnotation:
+    """Compute the reachability of nodes from a root node."""
+    # Only begin reachable BFS if the root is a statement.
+    if self.cfg.is_statement[root_node]:
+      reachable_nodes, data_flow_steps = self.cfg.Reachable(root_node)
+    else:
+      reachable_nodes, data_flow_steps = [], 0
+
+    return data_flow_graphs.RootNodeAnnotation(
+      root_node=root_node,
+      data_flow_steps=data_flow_steps,
+      data_flow_positive_node_count=len(reachable_nodes),
+      node_y=data_flow_graphs.BinaryNodeLabels(
+        self.cfg.node_count, reachable_nodes, REACHABLE_NO, REACHABLE_YES
+      ),
+    )
@@ -93,6 +93,28 @@ def test_MakeAnnotated_real_graphs(real_graph: programl_pb2.ProgramGraph,):
   assert len(annotated.graphs) <= 10
 
 
+def test_CsrReachabilityAnnotator_linear_graph(
+  graph: programl_pb2.ProgramGraph,
+):
+  annotator = reachability.CsrReachabilityAnnotator(graph)
+  annotation = annotator.AnnotateRoot(1)
+  assert annotation.data_flow_steps == 3
+  assert annotation.data_flow_positive_node_count == 3
+  assert annotation.node_y.tolist() == [[1, 0], [0, 1], [0, 1], [0, 1]]
+
+
+def test_CsrReachabilityAnnotator_matches_ReachabilityAnnotator(
+  real_graph: programl_pb2.ProgramGraph,
+):
+  """Test that node labels are identical to the reference annotator."""
+  expected = reachability.ReachabilityAnnotator(real_graph).MakeAnnotated()
+  actual = reachability.CsrReachabilityAnnotator(real_graph).MakeAnnotated()
+  assert len(actual.graph_tuples) == len(expected.graph_tuples)
+  for a, b in zip(actual.graph_tuples, expected.graph_tuples):
+    assert a.data_flow_root_node == b.data_flow_root_node
+    assert a.graph_tuple.node_y.tolist() == b.graph_tuple.node_y.tolist()
+
+
 @decorators.loop_for(seconds=30)
 def test_fuzz_MakeAnnotated():
   """Opaque black-box test of reachability annotator."""
@@ -9,10 +9,13 @@ This can be executed as a script to dump graph tuples to file, example:
           --graph_reader_limit=1000 \
           --vmodule='*'=3
 """
+import bisect
+import itertools
 import pathlib
 from typing import Iterable
 from typing import List
 from typing import Optional
+from typing import Tuple
 
 from deeplearning.ml4pl.graphs.labelled import graph_database_reader
 from deeplearning.ml4pl.graphs.labelled import graph_tuple
@@ -46,6 +49,16 @@ app.DEFINE_string(
   "the batch anyway). This flag has no effect when --graph_batch_node_count "
   "is not set.",
 )
+app.DEFINE_integer(
+  "graph_batch_bin_packing_window",
+  0,
+  "If set, batch graphs using bin packing over a sliding window of this many "
+  "pending graphs, rather than in the order they are read. Each batch is "
+  "filled as close to --graph_batch_node_count as possible by selecting the "
+  "largest pending graphs that fit first. A larger window produces fuller "
+  "batches but reorders graphs further from the order that they were read. "
+  "Requires --graph_batch_node_count.",
+)
 app.DEFINE_output_path(
   "graph_batch_outdir",
   None,
@@ -66,6 +79,7 @@ class GraphBatcher(object):
     exact_graph_count: int = 0,
     max_node_count: int = 0,
     max_node_count_limit_handler: str = "error",
+    bin_packing_window_size: int = 0,
     ctx: progress.ProgressContext = progress.NullContext,
   ):
     """Constructor.
@@ -84,19 +98,52 @@ class GraphBatcher(object):
         (skip the graph but print a warning), error (raise an error), or
         include (include the graph in the batch anyway). Has no effect when
         max_node_count is not set.
+      bin_packing_window_size: If non-zero, batch graphs using first-fit
+        decreasing bin packing over a sliding window of this many pending
+        graphs, rather than in the order that they are read. Requires
+        max_node_count, and cannot be used with exact_graph_count.
       ctx: A progress context.
+
+    Raises:
+      ValueError: If bin_packing_window_size is set without max_node_count, or
+        with exact_graph_count.
     """
     self.graphs = graphs
     self.max_graph_count = max_graph_count
     self.exact_graph_count = exact_graph_count
     self.max_node_count = max_node_count
     self.max_node_count_limit_handler = max_node_count_limit_handler
+    self.bin_packing_window_size = bin_packing_window_size
     self.ctx = ctx
 
+    if self.bin_packing_window_size and not self.max_node_count:
+      raise ValueError("Bin packing requires a max_node_count")
+    if self.bin_packing_window_size and self.exact_graph_count:
+      raise ValueError("Bin packing cannot be used with exact_graph_count")
+
     # Hold onto the last read graph so that if we don't decide to include it in
     # a batch we may still include it in subsequent batches.
     self.last_graph: Optional[graph_tuple.GraphTuple] = None
 
+    # The sliding window of graphs pending bin packing, as a list of
+    # <node_count, sequence_number, graph> tuples sorted by node count. The
+    # sequence number breaks ties between graphs of the same size so that the
+    # graphs themselves are never compared.
+    self.pending_graphs: List[Tuple[int, int, graph_tuple.GraphTuple]] = []
+    self.pending_graph_counter = itertools.count()
+    self.graphs_exhausted = False
+
+    # Batch fill ratio statistics, where the fill ratio of a batch is its node
+    # count divided by max_node_count.
+    self.batch_count = 0
+    self.fill_ratio_sum = 0.0
+    self.fill_ratio_min = 1.0
+
+  @property
+  def fill_ratio_avg(self) -> float:
+    """Return the average fill ratio of the batches produced so far."""
+    return self.fill_ratio_sum / max(self.batch_count, 1)
+
   def __iter__(self):
     return self
 
@@ -107,6 +154,9 @@ class GraphBatcher(object):
       A batch of graphs as a disjointed graph tuple. If there are no graphs to
       batch then None is returned.
     """
+    if self.bin_packing_window_size:
+      return self._NextBinPackedBatch()
+
     with self.ctx.Profile(
       2, lambda t: f"Constructed a batch of {len(graphs)} graphs"
     ):
@@ -151,21 +201,110 @@ class GraphBatcher(object):
         raise StopIteration
       if graphs:
         # We have graphs to batch.
+        self._RecordBatch(node_count)
         return graph_tuple.GraphTuple.FromGraphTuples(graphs)
       else:
         raise StopIteration
 
+  def _NextBinPackedBatch(self) -> graph_tuple.GraphTuple:
+    """Construct a graph batch using first-fit decreasing bin packing.
+
+    The window of pending graphs is topped up, then the batch is filled by
+    repeatedly selecting the largest pending graph that fits in the remaining
+    node budget.
+
+    Returns:
+      A batch of graphs as a disjointed graph tuple.
+
+    Raises:
+      StopIteration: If there are no graphs to batch.
+    """
+    with self.ctx.Profile(
+      2, lambda t: f"Constructed a bin-packed batch of {len(graphs)} graphs"
+    ):
+      # Top up the window of pending graphs.
+      while (
+        not self.graphs_exhausted
+        and len(self.pending_graphs) < self.bin_packing_window_size
+      ):
+        graph = self._ReadNextGraph()
+        if graph is None:
+          self.graphs_exhausted = True
+        else:
+          bisect.insort(
+            self.pending_graphs,
+            (graph.node_count, next(self.pending_graph_counter), graph),
+          )
+
+      if not self.pending_graphs:
+        raise StopIteration
+
+      graphs: List[graph_tuple.GraphTuple] = []
+      node_count = 0
+
+      # A graph which is larger than the node budget can only be pending if
+      # max_node_count_limit_handler is "include". Batch it on its own.
+      if self.pending_graphs[-1][0] > self.max_node_count:
+        node_count, _, graph = self.pending_graphs.pop()
+        graphs.append(graph)
+
+      while self.pending_graphs and node_count < self.max_node_count:
+        if self.max_graph_count and len(graphs) >= self.max_graph_count:
+          break
+        # Find the largest pending graph that fits in the remaining budget.
+        i = (
+          bisect.bisect_right(
+            self.pending_graphs,
+            (self.max_node_count - node_count, float("inf")),
+          )
+          - 1
+        )
+        if i < 0:
+          break
+        graph_node_count, _, graph = self.pending_graphs.pop(i)
+        graphs.append(graph)
+        node_count += graph_node_count
+
+      self._RecordBatch(node_count)
+      return graph_tuple.GraphTuple.FromGraphTuples(graphs)
+
+  def _RecordBatch(self, node_count: int) -> None:
+    """Update and log the batch fill ratio statistics."""
+    if not self.max_node_count:
+      return
+    fill_ratio = node_count / self.max_node_count
+    self.batch_count += 1
+    self.fill_ratio_sum += fill_ratio
+    self.fill_ratio_min = min(self.fill_ratio_min, fill_ratio)
+    self.ctx.Log(
+      3,
+      "Batch fill ratio %.1f%% (%d of %d nodes), average %.1f%%, min %.1f%% "
+      "over %d batches",
+      fill_ratio * 100,
+      node_count,
+      self.max_node_count,
+      self.fill_ratio_avg * 100,
+      self.fill_ratio_min * 100,
+      self.batch_count,
+    )
+
   def _ReadNextGraph(self,) -> Optional[graph_tuple.GraphTuple]:
     """Read the next graph from graph iterable, or None if no more graphs.
 
+    Graphs which are skipped by max_node_count_limit_handler are consumed, so
+    None is only returned once the graph iterable is exhausted.
+
     Returns:
       A graph, or None.
 
     Raises:
       ValueError: If the graph is larger than permitted by the batch size.
     """
-    try:
-      graph = next(self.graphs)
+    while True:
+      try:
+        graph = next(self.graphs)
+      except StopIteration:  # We have run out of graphs.
+        return None
       if self.max_node_count and graph.node_count > self.max_node_count:
         # Determine the behaviour when we find a graph that is larger than
         # the graph node limit.
@@ -175,7 +314,7 @@ class GraphBatcher(object):
         )
         if self.max_node_count_limit_handler == "skip":
           self.ctx.Warning("%s, skipping it", msg)
-          return None
+          continue
         if self.max_node_count_limit_handler == "error":
           raise ValueError(msg)
         elif self.max_node_count_limit_handler == "include":
@@ -186,8 +325,6 @@ class GraphBatcher(object):
             f"{self.max_node_count_limit_handler}"
           )
       return graph
-    except StopIteration:  # We have run out of graphs.
-      return None
 
   @classmethod
   def CreateFromFlags(
@@ -201,6 +338,7 @@ class GraphBatcher(object):
       exact_graph_count=FLAGS.graph_batch_exact_size,
       max_node_count=FLAGS.graph_batch_node_count,
       max_node_count_limit_handler=FLAGS.max_node_count_limit_handler,
+      bin_packing_window_size=FLAGS.graph_batch_bin_packing_window,
       ctx=ctx,
     )
 
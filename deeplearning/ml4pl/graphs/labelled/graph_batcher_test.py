@@ -140,6 +140,106 @@ def test_GraphBatcher_exact_graph_count():
   # graphs.
 
 
+def test_GraphBatcher_bin_packing_fills_batches():
+  """Test that bin packing fills batches with graphs out of order."""
+  batcher = graph_batcher.GraphBatcher(
+    MockIterator(
+      [
+        random_graph_tuple_generator.CreateRandomGraphTuple(node_count=n)
+        for n in (6, 6, 4, 4)
+      ]
+    ),
+    max_node_count=10,
+    bin_packing_window_size=4,
+  )
+
+  batches = list(batcher)
+  # Greedy in-order batching would produce three batches: [6], [6, 4], [4].
+  assert len(batches) == 2
+  assert batches[0].node_count == 10
+  assert batches[1].node_count == 10
+  assert batcher.batch_count == 2
+  assert batcher.fill_ratio_avg == 1.0
+
+
+def test_GraphBatcher_bin_packing_max_graph_count():
+  """Test that bin packing respects the maximum graph count."""
+  batcher = graph_batcher.GraphBatcher(
+    MockIterator(
+      [
+        random_graph_tuple_generator.CreateRandomGraphTuple(node_count=5)
+        for _ in range(7)
+      ]
+    ),
+    max_node_count=100,
+    max_graph_count=3,
+    bin_packing_window_size=10,
+  )
+
+  batches = list(batcher)
+  assert [b.disjoint_graph_count for b in batches] == [3, 3, 1]
+
+
+def test_GraphBatcher_bin_packing_include_large_graph():
+  """Test that a graph larger than the node budget is batched on its own."""
+  batcher = graph_batcher.GraphBatcher(
+    MockIterator(
+      [
+        random_graph_tuple_generator.CreateRandomGraphTuple(node_count=5),
+        random_graph_tuple_generator.CreateRandomGraphTuple(node_count=20),
+      ]
+    ),
+    max_node_count=10,
+    max_node_count_limit_handler="include",
+    bin_packing_window_size=10,
+  )
+
+  batches = list(batcher)
+  assert [b.node_count for b in batches] == [20, 5]
+
+
+def test_GraphBatcher_max_node_count_limit_handler_skip_continues():
+  """Test that skipping a large graph does not end the stream of graphs."""
+  batcher = graph_batcher.GraphBatcher(
+    MockIterator(
+      [
+        random_graph_tuple_generator.CreateRandomGraphTuple(node_count=n)
+        for n in (5, 20, 5, 5)
+      ]
+    ),
+    max_node_count=10,
+    max_node_count_limit_handler="skip",
+  )
+
+  batches = list(batcher)
+  assert [b.node_count for b in batches] == [10, 5]
+
+
+def test_GraphBatcher_bin_packing_skip_large_graph():
+  """Test that bin packing batches every graph after a skipped graph."""
+  batcher = graph_batcher.GraphBatcher(
+    MockIterator(
+      [
+        random_graph_tuple_generator.CreateRandomGraphTuple(node_count=n)
+        for n in (5, 20, 4, 6, 5, 3)
+      ]
+    ),
+    max_node_count=10,
+    max_node_count_limit_handler="skip",
+    bin_packing_window_size=2,
+  )
+
+  batches = list(batcher)
+  assert sum(b.disjoint_graph_count for b in batches) == 5
+  assert sum(b.node_count for b in batches) == 23
+
+
+def test_GraphBatcher_bin_packing_requires_max_node_count():
+  """Test that bin packing without a node budget is an error."""
+  with test.Raises(ValueError):
+    graph_batcher.GraphBatcher(MockIterator([]), bin_packing_window_size=10)
+
+
 @decorators.loop_for(seconds=5)
 @test.Parametrize("graph_count", (1, 10, 100))
 @test.Parametrize("max_node_count", (50, 100))
@@ -163,5 +263,32 @@ def test_fuzz_GraphBatcher(
   assert sum(b.disjoint_graph_count for b in batches) == graph_count
 
 
+@decorators.loop_for(seconds=5)
+@test.Parametrize("graph_count", (1, 10, 100))
+@test.Parametrize("max_node_count", (50, 100))
+@test.Parametrize("bin_packing_window_size", (1, 10, 1000))
+def test_fuzz_GraphBatcher_bin_packing(
+  graph_count: int, max_node_count: int, bin_packing_window_size: int
+):
+  """Fuzz the bin packing graph batcher."""
+  graphs = [
+    random_graph_tuple_generator.CreateRandomGraphTuple()
+    for _ in range(graph_count)
+  ]
+  batcher = graph_batcher.GraphBatcher(
+    MockIterator(graphs),
+    max_node_count=max_node_count,
+    max_node_count_limit_handler="include",
+    bin_packing_window_size=bin_packing_window_size,
+  )
+  batches = list(batcher)
+  assert sum(b.disjoint_graph_count for b in batches) == graph_count
+  assert sum(b.node_count for b in batches) == sum(
+    g.node_count for g in graphs
+  )
+  for batch in batches:
+    assert batch.node_count <= max_node_count or batch.disjoint_graph_count == 1
+
+
 if __name__ == "__main__":
   test.Main()
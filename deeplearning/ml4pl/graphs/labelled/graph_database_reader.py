@@ -1,7 +1,9 @@
 """A module for reaching graphs from graph databases."""
 import enum
 import pathlib
+import queue
 import random
+import threading
 from typing import Callable
 from typing import List
 from typing import Optional
@@ -9,6 +11,7 @@ from typing import Optional
 import sqlalchemy as sql
 
 from deeplearning.ml4pl.graphs.labelled import graph_tuple_database
+from deeplearning.ml4pl.graphs.labelled import graph_tuple_shard
 from labm8.py import app
 from labm8.py import humanize
 from labm8.py import progress
@@ -29,6 +32,15 @@ app.DEFINE_integer(
   "megabytes. A larger buffer means fewer costly SQL queries, but requires "
   "more memory to store the results.",
 )
+app.DEFINE_integer(
+  "graph_reader_prefetch_buffer_count",
+  0,
+  "Tuning parameter. The number of graph buffers to read ahead in a background "
+  "thread while the current buffer is being consumed. Prefetched buffers have "
+  "their graph tuples un-pickled ahead of time. This hides the latency of "
+  "reading a buffer from the database, at the cost of holding up to this many "
+  "additional buffers in memory. If zero, buffers are read synchronously.",
+)
 app.DEFINE_integer(
   "graph_reader_limit",
   None,
@@ -40,6 +52,14 @@ app.DEFINE_output_path(
   "When //deeplearning/ml4pl/graphs/labelled:graph_database_reader is executed "
   "as a script, this determines the directory to write pickled graph tuples to.",
 )
+app.DEFINE_boolean(
+  "graph_reader_write_shard",
+  False,
+  "When //deeplearning/ml4pl/graphs/labelled:graph_database_reader is executed "
+  "as a script, write the graphs to a single memory-mapped graph tuple shard "
+  "in --graph_reader_outdir, rather than one pickled file per graph. See "
+  "//deeplearning/ml4pl/graphs/labelled:graph_tuple_shard.",
+)
 
 
 class BufferedGraphReaderOrder(enum.Enum):
@@ -78,6 +98,7 @@ class BufferedGraphReader(object):
     order: BufferedGraphReaderOrder = BufferedGraphReaderOrder.IN_ORDER,
     eager_graph_loading: bool = True,
     limit: Optional[int] = None,
+    prefetch_buffer_count: int = 0,
     ctx: progress.ProgressContext = progress.NullContext,
   ):
     """Constructor.
@@ -93,6 +114,11 @@ class BufferedGraphReader(object):
         larger number reduces the number of queries, but increases the memory
         requirement.
       limit: Limit the total number of rows returned to this value.
+      prefetch_buffer_count: The number of buffers to read ahead in a background
+        thread. If zero, buffers are read synchronously when the previous buffer
+        has been consumed. When eager_graph_loading is set, the graph tuples of
+        prefetched buffers are un-pickled by the background thread. Use Close()
+        to stop the background thread if the reader is not fully consumed.
 
     Raises:
       ValueError: If the query with the given filters returns no results.
@@ -179,6 +205,17 @@ class BufferedGraphReader(object):
       self.buffer: List[graph_tuple_database.GraphTuple] = []
       self.buffer_i = 0
 
+    # Start the background thread which reads ahead buffers.
+    self.prefetch_buffer_count = prefetch_buffer_count
+    self._prefetch_thread: Optional[threading.Thread] = None
+    if self.prefetch_buffer_count > 0:
+      self._prefetch_queue = queue.Queue(maxsize=self.prefetch_buffer_count)
+      self._prefetch_stop = threading.Event()
+      self._prefetch_thread = threading.Thread(
+        target=self._PrefetchWorker, daemon=True
+      )
+      self._prefetch_thread.start()
+
   def __iter__(self):
     return self
 
@@ -189,10 +226,86 @@ class BufferedGraphReader(object):
       self.buffer_i += 1
       return graph
     else:
-      self.buffer = self.GetNextBuffer()
+      if self._prefetch_thread:
+        self.buffer = self._GetNextPrefetchedBuffer()
+      else:
+        self.buffer = self.GetNextBuffer()
       self.buffer_i = 1
       return self.buffer[0]
 
+  def __enter__(self) -> "BufferedGraphReader":
+    return self
+
+  def __exit__(self, *args):
+    self.Close()
+
+  def Close(self) -> None:
+    """Stop the background prefetching thread, if any.
+
+    This is only required if the reader is not consumed to the end. It is safe
+    to call this multiple times.
+    """
+    if not self._prefetch_thread:
+      return
+    self._prefetch_stop.set()
+    # Drain the queue to unblock the worker if it is waiting to put a buffer.
+    while self._prefetch_thread.is_alive():
+      try:
+        self._prefetch_queue.get(timeout=0.1)
+      except queue.Empty:
+        pass
+    self._prefetch_thread.join()
+
+  def _PrefetchWorker(self) -> None:
+    """The background thread which reads buffers and puts them in a queue.
+
+    The queue receives lists of graphs, followed by a StopIteration instance
+    to mark the end of the graphs. Errors raised when reading a buffer are put
+    in the queue so that they can be raised in the consumer thread. The final
+    item is always put in the queue, even if the thread is killed by a
+    BaseException, so that the consumer never blocks waiting for it.
+    """
+    end: BaseException = StopIteration()
+    try:
+      while not self._prefetch_stop.is_set():
+        buffer = self.GetNextBuffer()
+        # Un-pickle the graph tuples now so that the consumer does not have to.
+        # The results are cached by the GraphTuple.tuple property.
+        if self.eager_graph_loading:
+          for graph in buffer:
+            graph.tuple
+        self._PutPrefetchedBuffer(buffer)
+    except BaseException as e:
+      end = e
+    finally:
+      self._PutPrefetchedBuffer(end)
+
+  def _PutPrefetchedBuffer(self, item) -> None:
+    """Put an item in the prefetch queue, or give up if stopped."""
+    while not self._prefetch_stop.is_set():
+      try:
+        self._prefetch_queue.put(item, timeout=0.1)
+        return
+      except queue.Full:
+        pass
+
+  def _GetNextPrefetchedBuffer(self) -> List[graph_tuple_database.GraphTuple]:
+    """Get the next buffer from the prefetch queue.
+
+    Raises:
+      StopIteration: When all buffers have been consumed.
+      Exception: Any error raised by the background thread.
+    """
+    if self._prefetch_stop.is_set():
+      raise StopIteration
+    item = self._prefetch_queue.get()
+    if isinstance(item, BaseException):
+      # Both the end-of-iteration marker and errors stop the worker thread.
+      self._prefetch_stop.set()
+      self._prefetch_thread.join()
+      raise item
+    return item
+
   def GetNextBuffer(self) -> List[graph_tuple_database.GraphTuple]:
     """Fetch the next buffer of graphs from the database."""
     if self.i >= self.n:
@@ -280,6 +393,8 @@ class BufferedGraphReader(object):
         --graph_db: The database.
         --graph_reader_order: The order of graphs read.
         --graph_reader_buffer_size_mb: The size of the buffer.
+        --graph_reader_prefetch_buffer_count: The number of buffers to read
+          ahead.
 
     Ars:
       graph_db: A graph database instance. If not given, one is created from
@@ -313,6 +428,7 @@ class BufferedGraphReader(object):
       eager_graph_loading=eager_graph_loading,
       buffer_size_mb=FLAGS.graph_reader_buffer_size_mb,
       limit=limit or FLAGS.graph_reader_limit,
+      prefetch_buffer_count=FLAGS.graph_reader_prefetch_buffer_count,
       ctx=ctx,
     )
 
@@ -337,11 +453,36 @@ class WriteGraphsToFile(progress.Progress):
       graph_tuple.ToFile(path)
 
 
+class WriteGraphsToShard(progress.Progress):
+  """Write graphs in a graph database to a memory-mapped graph tuple shard.
+
+  Unlike the pickled graph tuples in the database, graphs read from a shard
+  need no de-serialization. See graph_tuple_shard.GraphTupleShard.
+  """
+
+  def __init__(self, outdir: pathlib.Path):
+    self.reader = BufferedGraphReader.CreateFromFlags()
+    self.outdir = outdir
+    super(WriteGraphsToShard, self).__init__("read_db", 0, self.reader.n)
+    self.reader.ctx = self.ctx
+
+  def Run(self):
+    """Read and write the graphs."""
+    with graph_tuple_shard.GraphTupleShardWriter(self.outdir) as writer:
+      for self.ctx.i, graph_tuple in enumerate(self.reader):
+        writer.Write(
+          graph_tuple.tuple, id=graph_tuple.id, ir_id=graph_tuple.ir_id
+        )
+
+
 def Main():
   """Main entry point."""
   if not FLAGS.graph_reader_outdir:
     raise app.UsageError("--graph_reader_outdir must be set")
-  progress.Run(WriteGraphsToFile(FLAGS.graph_reader_outdir))
+  if FLAGS.graph_reader_write_shard:
+    progress.Run(WriteGraphsToShard(FLAGS.graph_reader_outdir))
+  else:
+    progress.Run(WriteGraphsToFile(FLAGS.graph_reader_outdir))
 
 
 if __name__ == "__main__":
@@ -196,5 +196,72 @@ def test_BufferedGraphReader_data_flow_steps_order(
   assert i + 1 == 10000
 
 
+@test.Parametrize("buffer_size_mb", READER_BUFFER_SIZES)
+@test.Parametrize("prefetch_buffer_count", [1, 2])
+def test_BufferedGraphReader_prefetch_values_in_order(
+  db_10000: graph_tuple_database.Database,
+  buffer_size_mb: int,
+  prefetch_buffer_count: int,
+):
+  """Test that prefetching returns the same graphs in the same order."""
+  graphs = list(
+    reader.BufferedGraphReader(
+      db_10000,
+      buffer_size_mb=buffer_size_mb,
+      prefetch_buffer_count=prefetch_buffer_count,
+    )
+  )
+  assert len(graphs) == 10000
+  assert all([g.ir_id == i for i, g in enumerate(graphs)])
+
+
+def test_BufferedGraphReader_prefetch_close(
+  db_10000: graph_tuple_database.Database,
+):
+  """Test that a partially consumed prefetching reader can be closed."""
+  with reader.BufferedGraphReader(
+    db_10000, buffer_size_mb=1, prefetch_buffer_count=2
+  ) as db_reader:
+    next(db_reader)
+  assert not db_reader._prefetch_thread.is_alive()
+
+
+def test_BufferedGraphReader_prefetch_error(
+  db_10000: graph_tuple_database.Database,
+):
+  """Test that errors in the prefetch thread are raised in the consumer."""
+
+  class TestError(Exception):
+    pass
+
+  class FailingReader(reader.BufferedGraphReader):
+    def GetNextBuffer(self):
+      raise TestError("foo")
+
+  db_reader = FailingReader(db_10000, prefetch_buffer_count=1)
+  with test.Raises(TestError):
+    next(db_reader)
+  assert not db_reader._prefetch_thread.is_alive()
+
+
+def test_BufferedGraphReader_prefetch_base_exception(
+  db_10000: graph_tuple_database.Database,
+):
+  """Test that a BaseException in the prefetch thread is raised in the
+  consumer, rather than leaving it blocked on an empty queue."""
+
+  class TestBaseException(BaseException):
+    pass
+
+  class FailingReader(reader.BufferedGraphReader):
+    def GetNextBuffer(self):
+      raise TestBaseException("foo")
+
+  db_reader = FailingReader(db_10000, prefetch_buffer_count=1)
+  with test.Raises(TestBaseException):
+    next(db_reader)
+  assert not db_reader._prefetch_thread.is_alive()
+
+
 if __name__ == "__main__":
   test.Main()
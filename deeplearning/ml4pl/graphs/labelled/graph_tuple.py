@@ -10,7 +10,6 @@ from typing import Tuple
 import networkx as nx
 import numpy as np
 
-from deeplearning.ml4pl.graphs import programl
 from deeplearning.ml4pl.graphs import programl_pb2
 from labm8.py import app
 
@@ -320,11 +319,91 @@ class GraphTuple(NamedTuple):
     )
 
   @classmethod
-  def CreateFromProgramGraph(cls, program_graph: programl_pb2.ProgramGraph):
-    # TODO(github.com/ChrisCummins/ProGraML/issues/31): Perform the conversion
-    # directly.
-    return cls.CreateFromNetworkX(
-      programl.ProgramGraphToNetworkX(program_graph)
+  def CreateFromProgramGraph(
+    cls, program_graph: programl_pb2.ProgramGraph
+  ) -> "GraphTuple":
+    """Construct a graph tuple from a program graph.
+
+    This converts the protocol buffer directly, without constructing an
+    intermediate networkx graph. The result is identical to
+    CreateFromNetworkX(programl.ProgramGraphToNetworkX(program_graph)).
+
+    Args:
+      program_graph: The program graph to convert.
+
+    Returns:
+      A GraphTuple instance.
+    """
+    node_count = len(program_graph.node)
+    edge_count = len(program_graph.edge)
+    edges = np.array(
+      [
+        (edge.flow, edge.source_node, edge.destination_node, edge.position)
+        for edge in program_graph.edge
+      ],
+      dtype=np.int64,
+    ).reshape(edge_count, 4)
+    flows, sources, targets, positions = edges.T
+
+    # Order the edges as networkx iterates over them: grouped by source node,
+    # then by the first occurrence of each <source, target> pair, then by
+    # insertion order.
+    _, first_occurrences, pair_indices = np.unique(
+      sources * max(node_count, 1) + targets,
+      return_index=True,
+      return_inverse=True,
+    )
+    order = np.lexsort(
+      (np.arange(edge_count), first_occurrences[pair_indices], sources)
+    )
+
+    # Build the adjacency and positions lists for each edge type.
+    # {control, data, call} types.
+    adjacencies = []
+    edge_positions = []
+    for flow in range(3):
+      flow_order = order[flows[order] == flow]
+      if flow_order.size:
+        adjacencies.append(
+          np.column_stack((sources[flow_order], targets[flow_order])).astype(
+            np.int32
+          )
+        )
+      else:
+        adjacencies.append(np.zeros((0, 2), dtype=np.int32))
+      edge_positions.append(positions[flow_order].astype(np.int32))
+
+    # Shape (edge_flow_count, edge_count):
+    edge_positions = np.array(edge_positions)
+
+    # Shape (node_count, node_x_dimensionality):
+    node_x = np.vstack(
+      [np.array(node.x, dtype=np.int64) for node in program_graph.node]
+    )
+
+    # Node labels are optional. If any node has no labels, there are none.
+    node_y = None
+    if all(len(node.y) for node in program_graph.node):
+      # Shape (node_count, node_y_dimensionality):
+      node_y = np.vstack([list(node.y) for node in program_graph.node]).astype(
+        np.int64
+      )
+
+    # Get the optional graph-level features and labels.
+    graph_x = (
+      np.array(program_graph.x, dtype=np.int64) if program_graph.x else None
+    )
+    graph_y = (
+      np.array(program_graph.y, dtype=np.int64) if program_graph.y else None
+    )
+
+    return GraphTuple(
+      adjacencies=np.array(adjacencies),
+      edge_positions=edge_positions,
+      node_x=node_x,
+      node_y=node_y,
+      graph_x=graph_x,
+      graph_y=graph_y,
     )
 
   @classmethod
@@ -340,77 +419,80 @@ class GraphTuple(NamedTuple):
     Returns:
       A GraphTuple instance.
     """
-    adjacencies: List[List[Tuple[int, int]]] = [[], [], []]
-    edge_positions: List[List[int]] = [[], [], []]
-    disjoint_nodes_list: List[List[int]] = []
-
-    node_x: List[List[int]] = []
-    node_y: List[List[int]] = []
-    graph_x: List[List[int]] = []
-    graph_y: List[List[int]] = []
-
-    disjoint_graph_count = 0
-    node_count = 0
-
-    # Iterate over each graph, merging them.
-    for graph in graph_tuples:
-      disjoint_nodes_list.append(
-        np.full(
-          shape=[graph.node_count],
-          fill_value=disjoint_graph_count,
-          dtype=np.int32,
-        )
-      )
+    graph_tuples = list(graph_tuples)
+    disjoint_graph_count = len(graph_tuples)
 
-      for edge_flow, (adjacency_list, position_list) in enumerate(
-        zip(graph.adjacencies, graph.edge_positions)
-      ):
-        if adjacency_list.size:
-          # Offset the adjacency list node indices.
-          offset = np.array((node_count, node_count), dtype=np.int32)
-          adjacencies[edge_flow].append(adjacency_list + offset)
-          edge_positions[edge_flow].append(position_list)
-
-      # Add features and labels.
-
-      # Shape (graph.node_count, node_x_dimensionality):
-      node_x.extend(graph.node_x)
+    # Compute the node offset of each graph in the disjoint graph.
+    # Shape (disjoint_graph_count):
+    node_counts = np.array(
+      [graph.node_count for graph in graph_tuples], dtype=np.int32
+    )
+    node_offsets = np.zeros(disjoint_graph_count, dtype=np.int32)
+    np.cumsum(node_counts[:-1], out=node_offsets[1:])
 
-      if graph.has_node_y:
-        # Shape (graph.node_count, node_y_dimensionality):
-        node_y.extend(graph.node_y)
+    # Shape (node_count), dtype int32:
+    disjoint_nodes_list = np.repeat(
+      np.arange(disjoint_graph_count, dtype=np.int32), node_counts
+    )
 
-      if graph.has_graph_x:
-        graph_x.append(graph.graph_x)
+    adjacencies: List[np.array] = []
+    edge_positions: List[np.array] = []
+    for edge_flow in range(3):
+      # Select the graphs with edges of this type.
+      graph_indices = [
+        i
+        for i, graph in enumerate(graph_tuples)
+        if graph.adjacencies[edge_flow].size
+      ]
+      if not graph_indices:
+        adjacencies.append(np.zeros((0, 2), dtype=np.int32))
+        edge_positions.append(np.array([], dtype=np.int32))
+        continue
 
-      if graph.has_graph_y:
-        graph_y.append(graph.graph_y)
+      adjacency_lists = [
+        graph_tuples[i].adjacencies[edge_flow] for i in graph_indices
+      ]
+      edge_counts = [len(adjacency_list) for adjacency_list in adjacency_lists]
+
+      # Copy every graph's adjacency list into a single buffer, then offset
+      # the node indices of each edge by the node offset of its graph.
+      # Shape (edge_count, 2):
+      adjacency_list = np.empty((sum(edge_counts), 2), dtype=np.int32)
+      np.concatenate(adjacency_lists, out=adjacency_list)
+      adjacency_list += np.repeat(node_offsets[graph_indices], edge_counts)[
+        :, np.newaxis
+      ]
+      adjacencies.append(adjacency_list)
 
-      # Update the counters.
-      disjoint_graph_count += 1
-      node_count += graph.node_count
+      # Shape (edge_count):
+      edge_positions.append(
+        np.concatenate(
+          [graph_tuples[i].edge_positions[edge_flow] for i in graph_indices]
+        )
+      )
 
-    # Concatenate and convert lists to numpy arrays.
-    for i in range(len(adjacencies)):
-      if len(adjacencies[i]):
-        adjacencies[i] = np.concatenate(adjacencies[i])
-      else:
-        adjacencies[i] = np.zeros((0, 2), dtype=np.int32)
+    # Shape (node_count, node_x_dimensionality):
+    node_x = np.concatenate([graph.node_x for graph in graph_tuples]).astype(
+      np.int64, copy=False
+    )
 
-      if len(edge_positions[i]):
-        edge_positions[i] = np.concatenate(edge_positions[i])
-      else:
-        edge_positions[i] = np.array([], dtype=np.int32)
+    # Node labels, graph features, and graph labels are optional. Only graphs
+    # which have them contribute values.
+    node_y = [graph.node_y for graph in graph_tuples if graph.has_node_y]
+    graph_x = [graph.graph_x for graph in graph_tuples if graph.has_graph_x]
+    graph_y = [graph.graph_y for graph in graph_tuples if graph.has_graph_y]
 
     return cls(
       adjacencies=np.array(adjacencies),
       edge_positions=np.array(edge_positions),
-      node_x=np.array(node_x, dtype=np.int64),
-      node_y=np.array(node_y, dtype=np.int64) if node_y else None,
+      node_x=node_x,
+      node_y=np.concatenate(node_y).astype(np.int64, copy=False)
+      if node_y
+      else None,
       graph_x=np.array(graph_x, dtype=np.int64) if graph_x else None,
       graph_y=np.array(graph_y, dtype=np.int64) if graph_y else None,
       disjoint_graph_count=disjoint_graph_count,
-      disjoint_nodes_list=np.concatenate(disjoint_nodes_list),
+      disjoint_nodes_list=disjoint_nodes_list,
     )
 
   ##############################################################################
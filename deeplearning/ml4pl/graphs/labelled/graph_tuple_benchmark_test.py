@@ -0,0 +1,153 @@
+"""Benchmarks for //deeplearning/ml4pl/graphs/labelled:graph_tuple."""
+from typing import List
+
+import numpy as np
+
+from deeplearning.ml4pl.graphs.labelled import graph_tuple
+from deeplearning.ml4pl.testing import random_graph_tuple_generator
+from labm8.py import test
+
+FLAGS = test.FLAGS
+
+MODULE_UNDER_TEST = None
+
+PYTEST_ARGS = ["--benchmark-warmup-iterations=2"]
+
+# The number of graphs in a batch.
+BATCH_SIZES = [10, 1000]
+
+
+def FromGraphTuplesReference(
+  graph_tuples: List[graph_tuple.GraphTuple],
+) -> graph_tuple.GraphTuple:
+  """The reference per-graph loop implementation of FromGraphTuples().
+
+  This is the implementation that GraphTuple.FromGraphTuples() replaced. It is
+  kept to compare performance and to check that outputs are unchanged.
+  """
+  adjacencies = [[], [], []]
+  edge_positions = [[], [], []]
+  disjoint_nodes_list = []
+
+  node_x = []
+  node_y = []
+  graph_x = []
+  graph_y = []
+
+  disjoint_graph_count = 0
+  node_count = 0
+
+  for graph in graph_tuples:
+    disjoint_nodes_list.append(
+      np.full(
+        shape=[graph.node_count],
+        fill_value=disjoint_graph_count,
+        dtype=np.int32,
+      )
+    )
+
+    for edge_flow, (adjacency_list, position_list) in enumerate(
+      zip(graph.adjacencies, graph.edge_positions)
+    ):
+      if adjacency_list.size:
+        offset = np.array((node_count, node_count), dtype=np.int32)
+        adjacencies[edge_flow].append(adjacency_list + offset)
+        edge_positions[edge_flow].append(position_list)
+
+    node_x.extend(graph.node_x)
+    if graph.has_node_y:
+      node_y.extend(graph.node_y)
+    if graph.has_graph_x:
+      graph_x.append(graph.graph_x)
+    if graph.has_graph_y:
+      graph_y.append(graph.graph_y)
+
+    disjoint_graph_count += 1
+    node_count += graph.node_count
+
+  for i in range(len(adjacencies)):
+    if len(adjacencies[i]):
+      adjacencies[i] = np.concatenate(adjacencies[i])
+    else:
+      adjacencies[i] = np.zeros((0, 2), dtype=np.int32)
+
+    if len(edge_positions[i]):
+      edge_positions[i] = np.concatenate(edge_positions[i])
+    else:
+      edge_positions[i] = np.array([], dtype=np.int32)
+
+  return graph_tuple.GraphTuple(
+    adjacencies=np.array(adjacencies),
+    edge_positions=np.array(edge_positions),
+    node_x=np.array(node_x, dtype=np.int64),
+    node_y=np.array(node_y, dtype=np.int64) if node_y else None,
+    graph_x=np.array(graph_x, dtype=np.int64) if graph_x else None,
+    graph_y=np.array(graph_y, dtype=np.int64) if graph_y else None,
+    disjoint_graph_count=disjoint_graph_count,
+    disjoint_nodes_list=np.concatenate(disjoint_nodes_list),
+  )
+
+
+def CreateGraphTuples(
+  batch_size: int, with_labels: bool = False
+) -> List[graph_tuple.GraphTuple]:
+  """Generate a list of random graph tuples."""
+  return [
+    random_graph_tuple_generator.CreateRandomGraphTuple(
+      node_y_dimensionality=2 if with_labels else 0,
+      graph_x_dimensionality=2 if with_labels else 0,
+      graph_y_dimensionality=2 if with_labels else 0,
+    )
+    for _ in range(batch_size)
+  ]
+
+
+@test.Parametrize("with_labels", (False, True))
+def test_FromGraphTuples_matches_reference(with_labels: bool):
+  """Test that the output is identical to the reference implementation."""
+  graph_tuples = CreateGraphTuples(100, with_labels=with_labels)
+
+  expected = FromGraphTuplesReference(graph_tuples)
+  actual = graph_tuple.GraphTuple.FromGraphTuples(graph_tuples)
+
+  assert actual.disjoint_graph_count == expected.disjoint_graph_count
+  assert np.array_equal(
+    actual.disjoint_nodes_list, expected.disjoint_nodes_list
+  )
+  assert actual.disjoint_nodes_list.dtype == expected.disjoint_nodes_list.dtype
+  for edge_flow in range(3):
+    assert np.array_equal(
+      actual.adjacencies[edge_flow], expected.adjacencies[edge_flow]
+    )
+    assert (
+      actual.adjacencies[edge_flow].dtype
+      == expected.adjacencies[edge_flow].dtype
+    )
+    assert np.array_equal(
+      actual.edge_positions[edge_flow], expected.edge_positions[edge_flow]
+    )
+  assert np.array_equal(actual.node_x, expected.node_x)
+  assert actual.node_x.dtype == expected.node_x.dtype
+  for name in ("node_y", "graph_x", "graph_y"):
+    if getattr(expected, name) is None:
+      assert getattr(actual, name) is None
+    else:
+      assert np.array_equal(getattr(actual, name), getattr(expected, name))
+
+
+@test.Parametrize("batch_size", BATCH_SIZES)
+def test_benchmark_FromGraphTuples(benchmark, batch_size: int):
+  """Benchmark the vectorized disjoint graph construction."""
+  graph_tuples = CreateGraphTuples(batch_size)
+  benchmark(graph_tuple.GraphTuple.FromGraphTuples, graph_tuples)
+
+
+@test.Parametrize("batch_size", BATCH_SIZES)
+def test_benchmark_FromGraphTuplesReference(benchmark, batch_size: int):
+  """Benchmark the reference per-graph loop implementation."""
+  graph_tuples = CreateGraphTuples(batch_size)
+  benchmark(FromGraphTuplesReference, graph_tuples)
+
+
+if __name__ == "__main__":
+  test.Main()
@@ -319,6 +319,24 @@ class GraphTupleData(Base, sqlutil.PluralTablenameFromCamelCapsClassNameMixin):
   )
 
 
+class IrIdCheckpoint(
+  Base, sqlutil.PluralTablenameFromCamelCapsClassNameMixin
+):
+  """A table of IR IDs for which all graph tuples have been written.
+
+  Dataset generators add a checkpoint for an IR only after all of its graph
+  tuples have been added, so that an interrupted run can be resumed exactly.
+  Graph tuples for an IR which has no checkpoint may be incomplete.
+  """
+
+  # A reference to the 'id' column of a
+  # deeplearning.ml4pl.ir.ir_database.IntermediateRepresentationFile database
+  # row.
+  ir_id: int = sql.Column(sql.Integer, primary_key=True, autoincrement=False)
+
+  timestamp: datetime.datetime = sqlutil.ColumnFactory.MillisecondDatetime()
+
+
 # A registry of database statics, where each entry is a <name, property> tuple.
 database_statistics_registry: List[Tuple[str, Callable[["Database"], Any]]] = []
 
@@ -0,0 +1,346 @@
+"""This module defines a columnar, memory-mapped file format for graph tuples.
+
+A shard is a directory containing a contiguous binary array for each of the
+graph tuple fields, concatenated across all of the graphs in the shard, and an
+index of offsets into those arrays. Reading a graph from a shard returns a
+GraphTuple whose arrays are views into the memory-mapped files, so no data is
+copied or de-serialized, and repeated reads of a shard across epochs are served
+by the OS page cache.
+
+A shard directory has the following layout:
+
+    <shard>/meta.json          Format version, dimensionalities and counts.
+    <shard>/offsets.bin        int64, (graph_count + 1, 4) cumulative node and
+                               {control,data,call} edge offsets.
+    <shard>/ids.bin            int64, (graph_count, 2) <id, ir_id> pairs.
+    <shard>/adjacencies_{flow}.bin      int32, (edge_count, 2).
+    <shard>/edge_positions_{flow}.bin   int32, (edge_count).
+    <shard>/node_x.bin         int64, (node_count, node_x_dimensionality).
+    <shard>/node_y.bin         int64, (node_count, node_y_dimensionality).
+    <shard>/graph_x.bin        int64, (graph_count, graph_x_dimensionality).
+    <shard>/graph_y.bin        int64, (graph_count, graph_y_dimensionality).
+
+The node_y, graph_x, and graph_y files are present only if the graphs have
+those fields. All graphs in a shard must have the same dimensionalities.
+"""
+import json
+import pathlib
+from typing import Dict
+from typing import Iterable
+from typing import Optional
+
+import numpy as np
+
+from deeplearning.ml4pl.graphs.labelled import graph_tuple as graph_tuple_lib
+from labm8.py import app
+
+FLAGS = app.FLAGS
+
+# The number of edge flow types, {control, data, call}.
+EDGE_FLOW_COUNT = 3
+
+# The dtypes of shard arrays. These match the dtypes of the arrays produced by
+# GraphTuple.CreateFromNetworkX().
+ADJACENCY_DTYPE = np.int32
+EDGE_POSITION_DTYPE = np.int32
+FEATURE_DTYPE = np.int64
+OFFSET_DTYPE = np.int64
+
+# The version of the shard format, recorded in the meta file.
+SHARD_FORMAT_VERSION = 1
+
+
+class GraphTupleShardWriter(object):
+  """A writer for graph tuple shards.
+
+  Graphs are appended to the end of the column files as they are written, so
+  the memory required to write a shard is independent of its size. The shard
+  is not readable until the writer has been closed. Use it as a context
+  manager:
+
+    with GraphTupleShardWriter(path) as writer:
+      for graph in graphs:
+        writer.Write(graph)
+
+  If the context exits with an exception, the shard is aborted rather than
+  closed, so that a partially written shard is never readable.
+  """
+
+  def __init__(self, path: pathlib.Path):
+    """Constructor.
+
+    Args:
+      path: The directory to write the shard to. It is created if it does not
+        exist.
+
+    Raises:
+      FileExistsError: If a shard already exists at the path.
+    """
+    self.path = pathlib.Path(path)
+    self.path.mkdir(parents=True, exist_ok=True)
+    if (self.path / "meta.json").is_file():
+      raise FileExistsError(f"Shard already exists: `{self.path}`")
+
+    self.graph_count = 0
+    # The cumulative node and per-flow edge counts of the graphs written so
+    # far. The offsets for graph i are in row i of the offsets file.
+    self.offsets = np.zeros(1 + EDGE_FLOW_COUNT, dtype=OFFSET_DTYPE)
+
+    # The dimensionalities of the graphs in this shard. These are set by the
+    # first graph written, and every subsequent graph must match.
+    self.dimensionalities: Optional[Dict[str, int]] = None
+
+    self._files = {}
+    self._OpenFile("offsets")
+    self._OpenFile("ids")
+    for flow in range(EDGE_FLOW_COUNT):
+      self._OpenFile(f"adjacencies_{flow}")
+      self._OpenFile(f"edge_positions_{flow}")
+    self._OpenFile("node_x")
+
+    # Write the leading offsets row.
+    self.offsets.tofile(self._files["offsets"])
+
+  def _OpenFile(self, name: str):
+    self._files[name] = open(self.path / f"{name}.bin", "wb")
+
+  def _CheckDimensionalities(
+    self, graph_tuple: graph_tuple_lib.GraphTuple
+  ) -> None:
+    """Set or check the dimensionalities of the shard."""
+    dimensionalities = {
+      "node_x": graph_tuple.node_x_dimensionality,
+      "node_y": graph_tuple.node_y_dimensionality,
+      "graph_x": graph_tuple.graph_x_dimensionality,
+      "graph_y": graph_tuple.graph_y_dimensionality,
+    }
+    if self.dimensionalities is None:
+      self.dimensionalities = dimensionalities
+      for name in ("node_y", "graph_x", "graph_y"):
+        if dimensionalities[name]:
+          self._OpenFile(name)
+    elif dimensionalities != self.dimensionalities:
+      raise ValueError(
+        f"Graph dimensionalities {dimensionalities} do not match shard "
+        f"dimensionalities {self.dimensionalities}"
+      )
+
+  def Write(
+    self,
+    graph_tuple: graph_tuple_lib.GraphTuple,
+    id: int = 0,
+    ir_id: int = 0,
+  ) -> None:
+    """Append a graph tuple to the shard.
+
+    Args:
+      graph_tuple: The graph tuple to write. This must not be a disjoint graph.
+      id: The graph tuple database ID of the graph.
+      ir_id: The IR ID of the graph.
+
+    Raises:
+      ValueError: If the graph tuple is disjoint, or does not have the same
+        dimensionalities as the rest of the graphs in the shard.
+    """
+    if graph_tuple.is_disjoint_graph:
+      raise ValueError("Cannot write disjoint graph tuple to shard")
+    self._CheckDimensionalities(graph_tuple)
+
+    for flow in range(EDGE_FLOW_COUNT):
+      adjacency_list = graph_tuple.adjacencies[flow]
+      position_list = graph_tuple.edge_positions[flow]
+      np.ascontiguousarray(adjacency_list, dtype=ADJACENCY_DTYPE).tofile(
+        self._files[f"adjacencies_{flow}"]
+      )
+      np.ascontiguousarray(position_list, dtype=EDGE_POSITION_DTYPE).tofile(
+        self._files[f"edge_positions_{flow}"]
+      )
+      self.offsets[1 + flow] += len(adjacency_list)
+
+    np.ascontiguousarray(graph_tuple.node_x, dtype=FEATURE_DTYPE).tofile(
+      self._files["node_x"]
+    )
+    if graph_tuple.has_node_y:
+      np.ascontiguousarray(graph_tuple.node_y, dtype=FEATURE_DTYPE).tofile(
+        self._files["node_y"]
+      )
+    if graph_tuple.has_graph_x:
+      np.ascontiguousarray(graph_tuple.graph_x, dtype=FEATURE_DTYPE).tofile(
+        self._files["graph_x"]
+      )
+    if graph_tuple.has_graph_y:
+      np.ascontiguousarray(graph_tuple.graph_y, dtype=FEATURE_DTYPE).tofile(
+        self._files["graph_y"]
+      )
+    self.offsets[0] += graph_tuple.node_count
+
+    self.offsets.tofile(self._files["offsets"])
+    np.array([id, ir_id], dtype=OFFSET_DTYPE).tofile(self._files["ids"])
+    self.graph_count += 1
+
+  def Close(self) -> None:
+    """Finalize the shard by writing the meta file."""
+    for f in self._files.values():
+      f.close()
+
+    meta = {
+      "version": SHARD_FORMAT_VERSION,
+      "graph_count": self.graph_count,
+      "node_count": int(self.offsets[0]),
+      "edge_counts": [int(x) for x in self.offsets[1:]],
+      "dimensionalities": self.dimensionalities
+      or {"node_x": 0, "node_y": 0, "graph_x": 0, "graph_y": 0},
+    }
+    with open(self.path / "meta.json", "w") as f:
+      json.dump(meta, f)
+
+  def Abort(self) -> None:
+    """Discard the shard by removing the files that have been written."""
+    for name, f in self._files.items():
+      f.close()
+      (self.path / f"{name}.bin").unlink()
+    self._files = {}
+    # Remove the shard directory, unless it contains other files.
+    try:
+      self.path.rmdir()
+    except OSError:
+      pass
+
+  def __enter__(self) -> "GraphTupleShardWriter":
+    return self
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    del exc_val
+    del exc_tb
+    if exc_type:
+      self.Abort()
+    else:
+      self.Close()
+
+
+class GraphTupleShard(object):
+  """A read-only, memory-mapped shard of graph tuples.
+
+  Indexing a shard returns a GraphTuple whose arrays are read-only views into
+  the memory-mapped shard files.
+  """
+
+  def __init__(self, path: pathlib.Path):
+    """Constructor.
+
+    Args:
+      path: The directory of a shard produced by GraphTupleShardWriter.
+
+    Raises:
+      FileNotFoundError: If the shard does not exist or was not closed.
+      ValueError: If the shard format is not supported.
+    """
+    self.path = pathlib.Path(path)
+    meta_path = self.path / "meta.json"
+    if not meta_path.is_file():
+      raise FileNotFoundError(f"Shard not found: `{self.path}`")
+    with open(meta_path) as f:
+      self.meta = json.load(f)
+    if self.meta["version"] != SHARD_FORMAT_VERSION:
+      raise ValueError(
+        f"Unsupported shard format version {self.meta['version']}"
+      )
+
+    self.graph_count: int = self.meta["graph_count"]
+    self.node_count: int = self.meta["node_count"]
+    dimensionalities = self.meta["dimensionalities"]
+
+    # Shape (graph_count + 1, 1 + edge_flow_count).
+    self.offsets = self._Map(
+      "offsets", OFFSET_DTYPE, (self.graph_count + 1, 1 + EDGE_FLOW_COUNT)
+    )
+    # Shape (graph_count, 2).
+    ids = self._Map("ids", OFFSET_DTYPE, (self.graph_count, 2))
+    self.ids = ids[:, 0]
+    self.ir_ids = ids[:, 1]
+
+    self.adjacencies = [
+      self._Map(
+        f"adjacencies_{flow}",
+        ADJACENCY_DTYPE,
+        (self.meta["edge_counts"][flow], 2),
+      )
+      for flow in range(EDGE_FLOW_COUNT)
+    ]
+    self.edge_positions = [
+      self._Map(
+        f"edge_positions_{flow}",
+        EDGE_POSITION_DTYPE,
+        (self.meta["edge_counts"][flow],),
+      )
+      for flow in range(EDGE_FLOW_COUNT)
+    ]
+
+    self.node_x = self._Map(
+      "node_x", FEATURE_DTYPE, (self.node_count, dimensionalities["node_x"])
+    )
+    self.node_y = self._MapOptional(
+      "node_y", (self.node_count, dimensionalities["node_y"])
+    )
+    self.graph_x = self._MapOptional(
+      "graph_x", (self.graph_count, dimensionalities["graph_x"])
+    )
+    self.graph_y = self._MapOptional(
+      "graph_y", (self.graph_count, dimensionalities["graph_y"])
+    )
+
+  def _Map(self, name: str, dtype, shape) -> np.array:
+    """Memory-map a shard column file."""
+    # np.memmap cannot map zero-length files.
+    if not np.prod(shape):
+      return np.zeros(shape, dtype=dtype)
+    return np.memmap(
+      self.path / f"{name}.bin", dtype=dtype, mode="r", shape=shape
+    )
+
+  def _MapOptional(self, name: str, shape) -> Optional[np.array]:
+    """Memory-map an optional shard column file."""
+    if not shape[1]:
+      return None
+    return self._Map(name, FEATURE_DTYPE, shape)
+
+  def __len__(self) -> int:
+    return self.graph_count
+
+  def __getitem__(self, i: int) -> graph_tuple_lib.GraphTuple:
+    """Return the i-th graph in the shard.
+
+    Raises:
+      IndexError: If the index is out of range.
+    """
+    if i < 0:
+      i += self.graph_count
+    if not 0 <= i < self.graph_count:
+      raise IndexError(
+        f"Graph index {i} out of range for shard of {self.graph_count} graphs"
+      )
+
+    start, end = self.offsets[i], self.offsets[i + 1]
+
+    # Build the per-flow arrays as object arrays of views. We can't use
+    # np.array() on the list of views because it would copy the data into a
+    # single array when all flows have the same number of edges.
+    adjacencies = np.empty(EDGE_FLOW_COUNT, dtype=object)
+    edge_positions = np.empty(EDGE_FLOW_COUNT, dtype=object)
+    for flow in range(EDGE_FLOW_COUNT):
+      edges = slice(start[1 + flow], end[1 + flow])
+      adjacencies[flow] = self.adjacencies[flow][edges]
+      edge_positions[flow] = self.edge_positions[flow][edges]
+
+    return graph_tuple_lib.GraphTuple(
+      adjacencies=adjacencies,
+      edge_positions=edge_positions,
+      node_x=self.node_x[start[0] : end[0]],
+      node_y=None if self.node_y is None else self.node_y[start[0] : end[0]],
+      graph_x=None if self.graph_x is None else self.graph_x[i],
+      graph_y=None if self.graph_y is None else self.graph_y[i],
+    )
+
+  def __iter__(self) -> Iterable[graph_tuple_lib.GraphTuple]:
+    for i in range(self.graph_count):
+      yield self[i]
@@ -0,0 +1,153 @@
+"""Unit tests for //deeplearning/ml4pl/graphs/labelled:graph_tuple_shard."""
+import pathlib
+
+import numpy as np
+
+from deeplearning.ml4pl.graphs.labelled import graph_tuple
+from deeplearning.ml4pl.graphs.labelled import graph_tuple_shard
+from deeplearning.ml4pl.testing import random_graph_tuple_generator
+from labm8.py import test
+
+FLAGS = test.FLAGS
+
+
+def AssertGraphTuplesAreEqual(
+  a: graph_tuple.GraphTuple, b: graph_tuple.GraphTuple
+):
+  """Assert that two graph tuples have the same values."""
+  for flow in range(graph_tuple_shard.EDGE_FLOW_COUNT):
+    assert np.array_equal(
+      np.reshape(a.adjacencies[flow], (-1, 2)), b.adjacencies[flow]
+    )
+    assert np.array_equal(a.edge_positions[flow], b.edge_positions[flow])
+  assert np.array_equal(a.node_x, b.node_x)
+  assert a.has_node_y == b.has_node_y
+  assert a.has_graph_x == b.has_graph_x
+  assert a.has_graph_y == b.has_graph_y
+  if a.has_node_y:
+    assert np.array_equal(a.node_y, b.node_y)
+  if a.has_graph_x:
+    assert np.array_equal(a.graph_x, b.graph_x)
+  if a.has_graph_y:
+    assert np.array_equal(a.graph_y, b.graph_y)
+
+
+@test.Parametrize("node_y_dimensionality", (0, 3))
+@test.Parametrize("graph_x_dimensionality", (0, 2))
+@test.Parametrize("graph_y_dimensionality", (0, 4))
+def test_GraphTupleShard_round_trip(
+  tmp_path: pathlib.Path,
+  node_y_dimensionality: int,
+  graph_x_dimensionality: int,
+  graph_y_dimensionality: int,
+):
+  """Test that graphs read from a shard equal the graphs written."""
+  graphs = [
+    random_graph_tuple_generator.CreateRandomGraphTuple(
+      node_y_dimensionality=node_y_dimensionality,
+      graph_x_dimensionality=graph_x_dimensionality,
+      graph_y_dimensionality=graph_y_dimensionality,
+    )
+    for _ in range(20)
+  ]
+
+  with graph_tuple_shard.GraphTupleShardWriter(tmp_path / "shard") as writer:
+    for i, graph in enumerate(graphs):
+      writer.Write(graph, id=i, ir_id=i * 10)
+
+  shard = graph_tuple_shard.GraphTupleShard(tmp_path / "shard")
+  assert len(shard) == 20
+  assert shard.ids.tolist() == list(range(20))
+  assert shard.ir_ids.tolist() == [i * 10 for i in range(20)]
+  for graph_in, graph_out in zip(graphs, shard):
+    AssertGraphTuplesAreEqual(graph_in, graph_out)
+
+
+def test_GraphTupleShard_zero_copy(tmp_path: pathlib.Path):
+  """Test that graph arrays are views into the memory-mapped shard."""
+  with graph_tuple_shard.GraphTupleShardWriter(tmp_path / "shard") as writer:
+    writer.Write(random_graph_tuple_generator.CreateRandomGraphTuple())
+
+  shard = graph_tuple_shard.GraphTupleShard(tmp_path / "shard")
+  graph = shard[0]
+  assert isinstance(graph.node_x, np.memmap)
+  assert not graph.node_x.flags.writeable
+
+
+def test_GraphTupleShard_negative_index(tmp_path: pathlib.Path):
+  """Test indexing from the end of a shard."""
+  graphs = [
+    random_graph_tuple_generator.CreateRandomGraphTuple() for _ in range(3)
+  ]
+  with graph_tuple_shard.GraphTupleShardWriter(tmp_path / "shard") as writer:
+    for graph in graphs:
+      writer.Write(graph)
+
+  shard = graph_tuple_shard.GraphTupleShard(tmp_path / "shard")
+  AssertGraphTuplesAreEqual(graphs[-1], shard[-1])
+  with test.Raises(IndexError):
+    shard[3]
+
+
+def test_GraphTupleShardWriter_mismatched_dimensionalities(
+  tmp_path: pathlib.Path,
+):
+  """Test that graphs with different dimensionalities are rejected."""
+  with graph_tuple_shard.GraphTupleShardWriter(tmp_path / "shard") as writer:
+    writer.Write(
+      random_graph_tuple_generator.CreateRandomGraphTuple(
+        node_y_dimensionality=2
+      )
+    )
+    with test.Raises(ValueError):
+      writer.Write(
+        random_graph_tuple_generator.CreateRandomGraphTuple(
+          node_y_dimensionality=3
+        )
+      )
+
+
+def test_GraphTupleShardWriter_disjoint_graph(tmp_path: pathlib.Path):
+  """Test that disjoint graphs are rejected."""
+  with graph_tuple_shard.GraphTupleShardWriter(tmp_path / "shard") as writer:
+    with test.Raises(ValueError):
+      writer.Write(
+        random_graph_tuple_generator.CreateRandomGraphTuple(
+          disjoint_graph_count=2
+        )
+      )
+
+
+def test_GraphTupleShardWriter_exception_aborts_shard(tmp_path: pathlib.Path):
+  """Test that a shard is discarded if an error is raised while writing."""
+  with test.Raises(ValueError):
+    with graph_tuple_shard.GraphTupleShardWriter(tmp_path / "shard") as writer:
+      writer.Write(random_graph_tuple_generator.CreateRandomGraphTuple())
+      raise ValueError("Write failed")
+
+  assert not (tmp_path / "shard").exists()
+  with test.Raises(FileNotFoundError):
+    graph_tuple_shard.GraphTupleShard(tmp_path / "shard")
+
+  # The shard can be written again.
+  with graph_tuple_shard.GraphTupleShardWriter(tmp_path / "shard") as writer:
+    writer.Write(random_graph_tuple_generator.CreateRandomGraphTuple())
+  assert len(graph_tuple_shard.GraphTupleShard(tmp_path / "shard")) == 1
+
+
+def test_GraphTupleShardWriter_existing_shard(tmp_path: pathlib.Path):
+  """Test that an existing shard is not overwritten."""
+  with graph_tuple_shard.GraphTupleShardWriter(tmp_path / "shard"):
+    pass
+  with test.Raises(FileExistsError):
+    graph_tuple_shard.GraphTupleShardWriter(tmp_path / "shard")
+
+
+def test_GraphTupleShard_not_found(tmp_path: pathlib.Path):
+  """Test that opening a missing shard raises an error."""
+  with test.Raises(FileNotFoundError):
+    graph_tuple_shard.GraphTupleShard(tmp_path / "shard")
+
+
+if __name__ == "__main__":
+  test.Main()
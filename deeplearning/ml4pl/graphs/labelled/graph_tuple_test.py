@@ -6,10 +6,12 @@ from typing import Tuple
 import networkx as nx
 import numpy as np
 
+from deeplearning.ml4pl.graphs import programl
 from deeplearning.ml4pl.graphs import programl_pb2
 from deeplearning.ml4pl.graphs.labelled import graph_tuple
 from deeplearning.ml4pl.testing import random_graph_tuple_generator
 from deeplearning.ml4pl.testing import random_networkx_generator
+from deeplearning.ml4pl.testing import random_programl_generator
 from labm8.py import app
 from labm8.py import decorators
 from labm8.py import fs
@@ -311,6 +313,54 @@ def test_on_real_graph(real_nx_graph: nx.MultiDiGraph):
     raise
 
 
+# programl_pb2.ProgramGraph -> GraphTuple.
+
+
+def test_CreateFromProgramGraph_multigraph_edge_order():
+  """Test that parallel edges are ordered as networkx orders them."""
+  proto = programl_pb2.ProgramGraph(
+    node=[
+      programl_pb2.Node(x=[0]),
+      programl_pb2.Node(x=[1]),
+      programl_pb2.Node(x=[2]),
+    ],
+    edge=[
+      programl_pb2.Edge(source_node=0, destination_node=2, position=0),
+      programl_pb2.Edge(source_node=0, destination_node=1, position=1),
+      programl_pb2.Edge(source_node=0, destination_node=2, position=2),
+      programl_pb2.Edge(source_node=1, destination_node=0, position=3),
+    ],
+  )
+
+  t = graph_tuple.GraphTuple.CreateFromProgramGraph(proto)
+
+  assert t.adjacencies[programl_pb2.Edge.CONTROL].tolist() == [
+    [0, 2],
+    [0, 2],
+    [0, 1],
+    [1, 0],
+  ]
+  assert t.edge_positions[programl_pb2.Edge.CONTROL].tolist() == [0, 2, 1, 3]
+
+
+@decorators.loop_for(seconds=10)
+def test_fuzz_CreateFromProgramGraph_matches_networkx():
+  """Test that direct conversion is identical to conversion via networkx."""
+  proto = random_programl_generator.CreateRandomProto(
+    node_x_dimensionality=random.randint(1, 3),
+    node_y_dimensionality=random.randint(0, 3),
+    graph_x_dimensionality=random.randint(0, 3),
+    graph_y_dimensionality=random.randint(0, 3),
+  )
+
+  actual = graph_tuple.GraphTuple.CreateFromProgramGraph(proto)
+  expected = graph_tuple.GraphTuple.CreateFromNetworkX(
+    programl.ProgramGraphToNetworkX(proto)
+  )
+
+  assert pickle.dumps(actual) == pickle.dumps(expected)
+
+
 # Disjoint graph tests:
 
 
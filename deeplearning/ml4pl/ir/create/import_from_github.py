@@ -290,7 +290,7 @@ def PopulateBytecodeTable(
     )
 
     row_batches = sqlutil.OffsetLimitBatchedQuery(
-      q, batch_size=FLAGS.batch_size
+      q, batch_size=FLAGS.batch_size, key_column=contentfiles.ContentFile.id
     )
 
     for i, batch in zip(range(resume_from, n + 1), row_batches):
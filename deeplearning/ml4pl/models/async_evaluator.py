@@ -0,0 +1,212 @@
+"""Run validation and test epochs on a separate process.
+
+An AsyncEvaluator forks a worker process which holds a copy of the model. The
+calling process sends snapshots of the model data, as returned by
+GetModelData(), and the worker loads each snapshot and runs validation or test
+epochs on it, writing batch and epoch logs to the log database. This allows the
+next training epoch to start while the previous epoch is being evaluated.
+
+Example usage:
+
+    with async_evaluator.AsyncEvaluator(model, splits) as evaluator:
+      evaluator.Evaluate(
+        model.epoch_num, [epoch.Type.VAL], model.GetModelData()
+      )
+      ...
+      result = evaluator.Get()
+
+The worker is forked after the model has been created, so the model must be
+usable from a forked process. This is not the case for models which have
+already initialized a CUDA device.
+"""
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import signal
+import traceback
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+
+from deeplearning.ml4pl.models import batch_iterator as batch_iterator_lib
+from deeplearning.ml4pl.models import classifier_base
+from deeplearning.ml4pl.models import epoch
+from deeplearning.ml4pl.models import log_database
+from deeplearning.ml4pl.models import logger as logger_lib
+from labm8.py import app
+
+FLAGS = app.FLAGS
+
+
+class EvaluationResult(NamedTuple):
+  """The result of evaluating a snapshot of a model."""
+
+  # The training epoch which produced the model snapshot.
+  epoch_num: int
+  epoch_type: epoch.Type
+  # The results of the epoch, or None if evaluation failed.
+  results: Optional[epoch.Results]
+  # The error message if evaluation failed.
+  error: Optional[str] = None
+
+
+def _EvaluatorMain(
+  model: classifier_base.ClassifierBase,
+  splits: Dict[epoch.Type, List[int]],
+  requests: multiprocessing.Queue,
+  connection: multiprocessing.connection.Connection,
+  parent_pid: int,
+) -> None:
+  """The main loop of the evaluator process.
+
+  Receives <epoch_num, epoch_types, model_data> requests and responds with an
+  EvaluationResult for each epoch type. A request of None, or the death of the
+  parent process, terminates the loop.
+  """
+  # Interrupts are handled by the calling process.
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+  # Database connections must not be shared with the parent process. The
+  # inherited databases are kept referenced so that they are not garbage
+  # collected, which would close the parent's connections.
+  inherited_databases = (model.graph_db, model.logger)
+  model.graph_db = type(model.graph_db)(model.graph_db.url)
+  log_db = log_database.Database(model.logger.db.url)
+
+  with logger_lib.Logger(
+    log_db,
+    max_buffer_size=FLAGS.logger_buffer_size_mb * 1024 * 1024,
+    max_buffer_length=FLAGS.logger_buffer_length,
+    max_seconds_since_flush=FLAGS.logger_flush_seconds,
+  ) as logger:
+    model.logger = logger
+    while True:
+      try:
+        request = requests.get(timeout=5)
+      except queue.Empty:
+        if os.getppid() != parent_pid:
+          break
+        continue
+      if request is None:
+        break
+
+      epoch_num, epoch_types, model_data = request
+      model.LoadModelData(model_data)
+      model.epoch_num = epoch_num
+      for epoch_type in epoch_types:
+        try:
+          batch_iterator = batch_iterator_lib.MakeBatchIterator(
+            model=model,
+            graph_db=model.graph_db,
+            splits=splits,
+            epoch_type=epoch_type,
+          )
+          results = model(epoch_type, batch_iterator, logger)
+          response = EvaluationResult(epoch_num, epoch_type, results)
+        except Exception as e:
+          app.Error("Evaluation failed: %s", traceback.format_exc())
+          response = EvaluationResult(
+            epoch_num, epoch_type, None, f"{type(e).__name__}: {e}"
+          )
+        connection.send(response)
+
+  del inherited_databases
+
+
+class AsyncEvaluator(object):
+  """Evaluate model snapshots on a worker process.
+
+  Requests are evaluated in the order that they are made, so results are
+  returned in the same order.
+  """
+
+  def __init__(
+    self,
+    model: classifier_base.ClassifierBase,
+    splits: Dict[epoch.Type, List[int]],
+  ):
+    """Constructor.
+
+    Args:
+      model: The model to evaluate. The worker process is forked from the
+        calling process, so it receives a copy of the model in its current
+        state.
+      splits: A mapping from epoch type to a list of split numbers.
+    """
+    context = multiprocessing.get_context("fork")
+    # Requests are sent through a queue, which is written by a background
+    # thread so that sending a large snapshot never blocks the caller. Results
+    # are returned through a pipe.
+    self.requests = context.Queue()
+    self.connection, child_connection = context.Pipe(duplex=False)
+    # The worker is not a daemon so that it may start its own worker processes
+    # to construct batches.
+    self.process = context.Process(
+      target=_EvaluatorMain,
+      args=(model, splits, self.requests, child_connection, os.getpid()),
+      name="async-evaluator",
+    )
+    self.process.start()
+    # Close the parent's copy of the child end of the pipe, so that reads from
+    # self.connection raise EOFError if the process dies.
+    child_connection.close()
+    # The number of results which have been requested but not yet returned.
+    self.pending_count = 0
+
+  def Evaluate(
+    self, epoch_num: int, epoch_types: List[epoch.Type], model_data: Any
+  ) -> None:
+    """Request the evaluation of a model snapshot.
+
+    Args:
+      epoch_num: The training epoch which produced the snapshot.
+      epoch_types: The types of epochs to run on the snapshot.
+      model_data: The model data, as returned by GetModelData().
+    """
+    self.requests.put((epoch_num, epoch_types, model_data))
+    self.pending_count += len(epoch_types)
+
+  def Poll(self) -> bool:
+    """Return whether a result is ready."""
+    return bool(self.pending_count) and self.connection.poll()
+
+  def Get(self) -> EvaluationResult:
+    """Return the next evaluation result, blocking until it is ready.
+
+    Raises:
+      ValueError: If there are no pending requests.
+      OSError: If the worker process died.
+    """
+    if not self.pending_count:
+      raise ValueError("No pending evaluations")
+    try:
+      result = self.connection.recv()
+    except EOFError:
+      self.process.join(5)
+      raise OSError(
+        f"Evaluator process died with exit code {self.process.exitcode}"
+      )
+    self.pending_count -= 1
+    return result
+
+  def Close(self) -> None:
+    """Stop the worker process, discarding any pending requests."""
+    if self.pending_count:
+      self.process.terminate()
+    else:
+      self.requests.put(None)
+    self.process.join(60)
+    if self.process.is_alive():
+      self.process.terminate()
+      self.process.join()
+    self.requests.close()
+    self.connection.close()
+
+  def __enter__(self) -> "AsyncEvaluator":
+    return self
+
+  def __exit__(self, *args) -> None:
+    self.Close()
@@ -0,0 +1,352 @@
+"""A columnar file store for detailed batch results.
+
+log_database.BatchDetails stores the graph IDs, targets, and predictions of
+every batch as pickled blobs in the log database. This module provides an
+alternative, where the detailed results of each epoch are appended to chunked
+columnar files on disk, and the log database stores only the path of the chunk
+which contains a batch.
+
+Each chunk is a numpy .npz archive containing the concatenated arrays of a
+sequence of batches:
+
+    batch_nums       int32, shape (batch_count)
+    graph_offsets    int64, shape (batch_count + 1)
+    target_offsets   int64, shape (batch_count + 1)
+    graph_ids        int32, shape (graph_count)
+    true_y           int32, shape (target_count)
+    predictions      float16, shape (target_count, y_dimensionality)
+
+The results of batch i are the slices [offsets[i], offsets[i + 1]) of the
+graph_ids, true_y, and predictions arrays. Uncompressed chunks are memory
+mapped when read, so reading the results of a batch does not copy them.
+
+Chunks are stored in the directory layout:
+
+    <root>/<run_id>/<epoch_type>_<epoch_num>/chunk_<chunk_num>.npz
+"""
+import functools
+import os
+import pathlib
+import struct
+import tempfile
+import zipfile
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+
+from deeplearning.ml4pl import run_id as run_id_lib
+from deeplearning.ml4pl.models import batch as batches
+from deeplearning.ml4pl.models import epoch
+from labm8.py import app
+
+FLAGS = app.FLAGS
+
+app.DEFINE_string(
+  "batch_details_dir",
+  None,
+  "If set, detailed batch logs are written to columnar files in this "
+  "directory, and the log database stores only the path of the file "
+  "containing each batch. Else, detailed batch logs are stored in the log "
+  "database.",
+)
+app.DEFINE_integer(
+  "batch_details_chunk_mb",
+  16,
+  "Tuning parameter. The size of detailed batch results to accumulate before "
+  "writing a chunk to --batch_details_dir, in megabytes.",
+)
+app.DEFINE_boolean(
+  "batch_details_compress",
+  False,
+  "If set, compress the chunks written to --batch_details_dir. Compressed "
+  "chunks are smaller, but must be decompressed to read them rather than "
+  "being memory mapped.",
+)
+
+# The sizes of the fixed-length fields of a zip file local header.
+_ZIP_LOCAL_HEADER_SIZE = 30
+_ZIP_LOCAL_HEADER_NAME_LENGTHS = struct.Struct("<HH")
+
+
+class BatchDetailsArrays(NamedTuple):
+  """The detailed results of a batch."""
+
+  graph_ids: np.array
+  true_y: np.array
+  predictions: np.array
+
+
+class _EpochWriter(object):
+  """Accumulates the detailed results of an epoch and writes them in chunks."""
+
+  def __init__(self, path: pathlib.Path, chunk_size: int, compress: bool):
+    self.path = path
+    self.chunk_size = chunk_size
+    self.compress = compress
+    self.chunk_num = 0
+    self._Reset()
+
+  @property
+  def chunk_path(self) -> pathlib.Path:
+    """The path of the chunk that is currently being accumulated."""
+    return self.path / f"chunk_{self.chunk_num:06d}.npz"
+
+  def Add(
+    self,
+    batch_num: int,
+    graph_ids: np.array,
+    true_y: np.array,
+    predictions: np.array,
+  ) -> pathlib.Path:
+    """Add the results of a batch, returning the path of its chunk."""
+    path = self.chunk_path
+    self.batch_nums.append(batch_num)
+    self.graph_ids.append(graph_ids)
+    self.true_y.append(true_y)
+    self.predictions.append(predictions)
+    self.size += graph_ids.nbytes + true_y.nbytes + predictions.nbytes
+    if self.size >= self.chunk_size:
+      self.Flush()
+    return path
+
+  def Flush(self) -> None:
+    """Write the accumulated results to a chunk."""
+    if not self.batch_nums:
+      return
+
+    arrays = {
+      "batch_nums": np.array(self.batch_nums, dtype=np.int32),
+      "graph_offsets": _Offsets(self.graph_ids),
+      "target_offsets": _Offsets(self.true_y),
+      "graph_ids": np.concatenate(self.graph_ids),
+      "true_y": np.concatenate(self.true_y),
+      "predictions": np.concatenate(self.predictions),
+    }
+
+    self.path.mkdir(parents=True, exist_ok=True)
+    path = self.chunk_path
+    # Write to a temporary file and rename it, so that readers never see a
+    # partially written chunk.
+    fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+    try:
+      with os.fdopen(fd, "wb") as f:
+        if self.compress:
+          np.savez_compressed(f, **arrays)
+        else:
+          np.savez(f, **arrays)
+      os.replace(tmp_path, path)
+    except Exception:
+      os.unlink(tmp_path)
+      raise
+
+    self.chunk_num += 1
+    self._Reset()
+
+  def _Reset(self) -> None:
+    self.batch_nums: List[int] = []
+    self.graph_ids: List[np.array] = []
+    self.true_y: List[np.array] = []
+    self.predictions: List[np.array] = []
+    self.size = 0
+
+
+def _Offsets(arrays: List[np.array]) -> np.array:
+  """Return the offsets of a list of arrays in their concatenation."""
+  offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+  np.cumsum([len(a) for a in arrays], out=offsets[1:])
+  return offsets
+
+
+class BatchDetailsStore(object):
+  """A writer of detailed batch results to columnar files."""
+
+  def __init__(
+    self, root: pathlib.Path, chunk_size: int = 16 << 20, compress: bool = False
+  ):
+    """Constructor.
+
+    Args:
+      root: The directory to write chunks to.
+      chunk_size: The number of bytes of results to accumulate before writing
+        a chunk.
+      compress: Whether to compress chunks.
+    """
+    self.root = pathlib.Path(root).absolute()
+    self.chunk_size = chunk_size
+    self.compress = compress
+    self._epochs: Dict[Tuple[str, epoch.Type, int], _EpochWriter] = {}
+
+  @classmethod
+  def FromFlags(cls) -> Optional["BatchDetailsStore"]:
+    """Construct a store from flags, or None if --batch_details_dir is unset."""
+    if not FLAGS.batch_details_dir:
+      return None
+    return cls(
+      pathlib.Path(FLAGS.batch_details_dir),
+      chunk_size=FLAGS.batch_details_chunk_mb * 1024 * 1024,
+      compress=FLAGS.batch_details_compress,
+    )
+
+  def EpochPath(
+    self, run_id: run_id_lib.RunId, epoch_type: epoch.Type, epoch_num: int
+  ) -> pathlib.Path:
+    """Return the directory which contains the chunks of an epoch."""
+    return (
+      self.root / str(run_id) / f"{epoch_type.name.lower()}_{epoch_num:04d}"
+    )
+
+  def Add(
+    self,
+    run_id: run_id_lib.RunId,
+    epoch_type: epoch.Type,
+    epoch_num: int,
+    batch_num: int,
+    data: batches.Data,
+    results: batches.Results,
+  ) -> str:
+    """Add the detailed results of a batch.
+
+    The results are not written until the chunk which contains them is full,
+    or FlushEpoch() is called.
+
+    Returns:
+      The path of the chunk which will contain the results.
+    """
+    key = (str(run_id), epoch_type, epoch_num)
+    writer = self._epochs.get(key)
+    if not writer:
+      writer = _EpochWriter(
+        self.EpochPath(run_id, epoch_type, epoch_num),
+        self.chunk_size,
+        self.compress,
+      )
+      self._epochs[key] = writer
+
+    path = writer.Add(
+      batch_num,
+      np.array(data.graph_ids, dtype=np.int32),
+      np.argmax(results.targets, axis=1).astype(np.int32),
+      results.predictions.astype(np.float16),
+    )
+    return str(path)
+
+  def FlushEpoch(
+    self, run_id: run_id_lib.RunId, epoch_type: epoch.Type, epoch_num: int
+  ) -> None:
+    """Write the remaining results of an epoch."""
+    writer = self._epochs.pop((str(run_id), epoch_type, epoch_num), None)
+    if writer:
+      writer.Flush()
+
+  def Close(self) -> None:
+    """Write the remaining results of all epochs."""
+    for writer in self._epochs.values():
+      writer.Flush()
+    self._epochs = {}
+
+
+def LoadChunk(path: str) -> Dict[str, np.array]:
+  """Load the arrays of a chunk.
+
+  The arrays of uncompressed chunks are memory mapped.
+
+  Args:
+    path: The path of the chunk.
+
+  Returns:
+    A mapping from array name to array.
+  """
+  arrays = {}
+  with zipfile.ZipFile(path) as archive, open(path, "rb") as f:
+    for info in archive.infolist():
+      name = info.filename[: -len(".npy")]
+      if info.compress_type != zipfile.ZIP_STORED:
+        with archive.open(info) as member:
+          arrays[name] = np.lib.format.read_array(member)
+        continue
+
+      # Find the start of the member data, after its local header.
+      f.seek(info.header_offset + _ZIP_LOCAL_HEADER_SIZE - 4)
+      name_length, extra_length = _ZIP_LOCAL_HEADER_NAME_LENGTHS.unpack(
+        f.read(4)
+      )
+      f.seek(
+        info.header_offset
+        + _ZIP_LOCAL_HEADER_SIZE
+        + name_length
+        + extra_length
+      )
+      version = np.lib.format.read_magic(f)
+      if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+      else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+
+      if not np.prod(shape):
+        # Empty arrays cannot be mapped.
+        arrays[name] = np.empty(shape, dtype=dtype)
+      else:
+        arrays[name] = np.memmap(
+          path,
+          dtype=dtype,
+          mode="r",
+          offset=f.tell(),
+          shape=shape,
+          order="F" if fortran_order else "C",
+        )
+  return arrays
+
+
+def _LoadChunkIndex(path: str) -> Tuple[Dict[int, int], Dict[str, np.array]]:
+  """Load a chunk and index its batches by batch number.
+
+  Loaded chunks are cached. A chunk file which has been replaced since it was
+  cached is loaded again.
+  """
+  stat = os.stat(path)
+  return _LoadChunkIndexOfVersion(path, stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=32)
+def _LoadChunkIndexOfVersion(
+  path: str, mtime_ns: int, size: int
+) -> Tuple[Dict[int, int], Dict[str, np.array]]:
+  """Load a chunk and index its batches by batch number.
+
+  The modification time and size of the chunk file are part of the cache key.
+  """
+  del mtime_ns  # Unused.
+  del size  # Unused.
+  arrays = LoadChunk(path)
+  index = {
+    batch_num: i for i, batch_num in enumerate(arrays["batch_nums"].tolist())
+  }
+  return index, arrays
+
+
+def ReadBatchDetails(path: str, batch_num: int) -> BatchDetailsArrays:
+  """Read the detailed results of a batch from a chunk.
+
+  Args:
+    path: The path of the chunk containing the batch.
+    batch_num: The number of the batch.
+
+  Returns:
+    The detailed results of the batch.
+
+  Raises:
+    KeyError: If the batch is not in the chunk.
+  """
+  index, arrays = _LoadChunkIndex(path)
+  i = index[batch_num]
+  graph_start, graph_end = arrays["graph_offsets"][i : i + 2]
+  target_start, target_end = arrays["target_offsets"][i : i + 2]
+  return BatchDetailsArrays(
+    graph_ids=arrays["graph_ids"][graph_start:graph_end],
+    true_y=arrays["true_y"][target_start:target_end],
+    predictions=arrays["predictions"][target_start:target_end],
+  )
@@ -0,0 +1,134 @@
+"""Unit tests for //deeplearning/ml4pl/models:batch_details_store."""
+import pathlib
+
+import numpy as np
+
+from deeplearning.ml4pl import run_id as run_id_lib
+from deeplearning.ml4pl.models import batch as batches
+from deeplearning.ml4pl.models import batch_details_store
+from deeplearning.ml4pl.models import epoch
+from labm8.py import test
+
+FLAGS = test.FLAGS
+
+###############################################################################
+# Fixtures.
+###############################################################################
+
+
+@test.Fixture(scope="function")
+def run_id() -> run_id_lib.RunId:
+  """A test fixture which returns a run ID."""
+  return run_id_lib.RunId.GenerateUnique("test")
+
+
+@test.Fixture(scope="function", params=(False, True))
+def compress(request) -> bool:
+  """A test fixture which enumerates chunk compression."""
+  return request.param
+
+
+def MakeBatch(graph_ids, target_count: int):
+  """Generate the data and results of a batch with 3 classes."""
+  targets = np.eye(3, dtype=np.float32)[np.arange(target_count) % 3]
+  predictions = np.random.rand(target_count, 3).astype(np.float32)
+  data = batches.Data(graph_ids=graph_ids, data=None)
+  results = batches.Results.Create(targets=targets, predictions=predictions)
+  return data, results
+
+
+###############################################################################
+# Tests.
+###############################################################################
+
+
+def test_BatchDetailsStore_round_trip(
+  tmp_path: pathlib.Path, run_id: run_id_lib.RunId, compress: bool
+):
+  """Test that the details of a batch are read back."""
+  store = batch_details_store.BatchDetailsStore(tmp_path, compress=compress)
+  data_1, results_1 = MakeBatch([1, 2], 5)
+  data_2, results_2 = MakeBatch([3], 2)
+  path_1 = store.Add(run_id, epoch.Type.VAL, 1, 1, data_1, results_1)
+  path_2 = store.Add(run_id, epoch.Type.VAL, 1, 2, data_2, results_2)
+  assert path_1 == path_2
+  store.FlushEpoch(run_id, epoch.Type.VAL, 1)
+
+  details = batch_details_store.ReadBatchDetails(path_2, 2)
+  assert details.graph_ids.tolist() == [3]
+  assert details.true_y.tolist() == [0, 1]
+  assert details.predictions.dtype == np.float16
+  np.testing.assert_allclose(
+    details.predictions, results_2.predictions, atol=1e-3
+  )
+
+  details = batch_details_store.ReadBatchDetails(path_1, 1)
+  assert details.graph_ids.tolist() == [1, 2]
+  assert details.true_y.tolist() == [0, 1, 2, 0, 1]
+
+
+def test_LoadChunk_uncompressed_is_memory_mapped(
+  tmp_path: pathlib.Path, run_id: run_id_lib.RunId
+):
+  """Test that the arrays of uncompressed chunks are not copied."""
+  store = batch_details_store.BatchDetailsStore(tmp_path)
+  path = store.Add(run_id, epoch.Type.TEST, 1, 1, *MakeBatch([1], 4))
+  store.Close()
+
+  arrays = batch_details_store.LoadChunk(path)
+  assert isinstance(arrays["predictions"], np.memmap)
+  # The chunks are also readable by numpy.
+  with np.load(path) as expected:
+    for name in expected.files:
+      assert arrays[name].tolist() == expected[name].tolist()
+
+
+def test_BatchDetailsStore_chunks(
+  tmp_path: pathlib.Path, run_id: run_id_lib.RunId
+):
+  """Test that an epoch is split into chunks."""
+  store = batch_details_store.BatchDetailsStore(tmp_path, chunk_size=1)
+  paths = [
+    store.Add(run_id, epoch.Type.TRAIN, 3, i, *MakeBatch([i], 1))
+    for i in range(1, 4)
+  ]
+  assert len(set(paths)) == 3
+  assert all(pathlib.Path(path).is_file() for path in paths)
+  assert pathlib.Path(paths[0]).parent == store.EpochPath(
+    run_id, epoch.Type.TRAIN, 3
+  )
+  for i, path in enumerate(paths, start=1):
+    assert batch_details_store.ReadBatchDetails(path, i).graph_ids == [i]
+
+
+def test_ReadBatchDetails_missing_batch(
+  tmp_path: pathlib.Path, run_id: run_id_lib.RunId
+):
+  """Test that an error is raised if a batch is not in a chunk."""
+  store = batch_details_store.BatchDetailsStore(tmp_path)
+  path = store.Add(run_id, epoch.Type.TRAIN, 1, 1, *MakeBatch([1], 1))
+  store.Close()
+  with test.Raises(KeyError):
+    batch_details_store.ReadBatchDetails(path, 2)
+
+
+def test_ReadBatchDetails_replaced_chunk(
+  tmp_path: pathlib.Path, run_id: run_id_lib.RunId
+):
+  """Test that a chunk which is rewritten after it was read is read again."""
+  store = batch_details_store.BatchDetailsStore(tmp_path)
+  path = store.Add(run_id, epoch.Type.TRAIN, 1, 1, *MakeBatch([1], 1))
+  store.Close()
+  assert batch_details_store.ReadBatchDetails(path, 1).graph_ids == [1]
+
+  # A new store for the same epoch rewrites the first chunk.
+  store = batch_details_store.BatchDetailsStore(tmp_path)
+  assert path == store.Add(run_id, epoch.Type.TRAIN, 1, 2, *MakeBatch([2], 1))
+  store.Close()
+  assert batch_details_store.ReadBatchDetails(path, 2).graph_ids == [2]
+  with test.Raises(KeyError):
+    batch_details_store.ReadBatchDetails(path, 1)
+
+
+if __name__ == "__main__":
+  test.Main()
@@ -5,6 +5,7 @@ from typing import List
 from deeplearning.ml4pl.graphs.labelled import graph_database_reader
 from deeplearning.ml4pl.graphs.labelled import graph_tuple_database
 from deeplearning.ml4pl.models import batch as batches
+from deeplearning.ml4pl.models import batch_producer
 from deeplearning.ml4pl.models import classifier_base
 from deeplearning.ml4pl.models import epoch
 from labm8.py import app
@@ -74,6 +75,12 @@ def MakeBatchIterator(
       splits_for_type
     )
 
+  # Start the batch producer workers before the graph reader starts its
+  # threads, so that they are not forked while another thread holds a lock.
+  producer = None
+  if FLAGS.batch_producer_workers:
+    producer = batch_producer.GetBatchProducer(model)
+
   graph_reader = model.GraphReader(
     epoch_type=epoch_type,
     graph_db=graph_db,
@@ -82,10 +89,14 @@ def MakeBatchIterator(
     ctx=ctx,
   )
 
+  if producer:
+    batch_iterator = producer(epoch_type, graph_reader)
+  else:
+    batch_iterator = model.BatchIterator(epoch_type, graph_reader, ctx=ctx)
+
   return batches.BatchIterator(
     batches=ppar.ThreadedIterator(
-      model.BatchIterator(epoch_type, graph_reader, ctx=ctx),
-      max_queue_size=FLAGS.batch_queue_size,
+      batch_iterator, max_queue_size=FLAGS.batch_queue_size,
     ),
     graph_count=graph_reader.n,
   )
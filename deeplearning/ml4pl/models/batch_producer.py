@@ -0,0 +1,375 @@
+"""A multi-process producer of model batches.
+
+ClassifierBase.BatchIterator() constructs batches on a single thread, so batch
+construction is limited to a single core by the GIL. A BatchProducer instead
+splits the stream of input graphs into chunks and constructs the batches of
+each chunk on a pool of worker processes.
+
+Large numpy arrays in the constructed batches are not pickled through the
+pool's result pipe. Workers write them to a file in a shared memory directory
+(/dev/shm by default), and the calling process maps the file and wraps the
+arrays around the mapped memory without copying them.
+
+Because each chunk of graphs is batched independently, the final batch of each
+chunk may contain fewer graphs than it would if the whole stream was batched
+serially.
+
+Example usage:
+
+    with batch_producer.BatchProducer(model, worker_count=8) as producer:
+      for batch in producer(epoch.Type.TRAIN, graph_reader):
+        model.RunBatch(epoch.Type.TRAIN, batch)
+
+The worker processes are started once and reused by every call to a producer.
+Workers are forked from the calling process, so they inherit the model. Model
+MakeBatch() implementations must not use state that does not survive a fork,
+such as GPU devices. Database engines inherited by a worker are disposed of,
+and new connections are opened on demand. To avoid forking while other threads
+hold locks, start a producer before starting graph readers.
+
+Workers exit without running atexit handlers, so sequences encoded by a worker
+are written to --encoded_sequence_store when the producer is closed.
+"""
+import atexit
+import gc
+import io
+import itertools
+import mmap
+import multiprocessing
+import multiprocessing.pool
+import multiprocessing.util
+import os
+import pickle
+import queue
+import shutil
+import signal
+import tempfile
+import threading
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+import sqlalchemy as sql
+
+from deeplearning.ml4pl.graphs.labelled import graph_tuple_database
+from deeplearning.ml4pl.models import batch as batches
+from deeplearning.ml4pl.models import classifier_base
+from deeplearning.ml4pl.models import epoch
+from deeplearning.ml4pl.seq import encoded_sequence_store
+from labm8.py import app
+
+FLAGS = app.FLAGS
+
+app.DEFINE_integer(
+  "batch_producer_workers",
+  0,
+  "The number of worker processes used to construct batches. If zero, "
+  "batches are constructed on a single background thread.",
+)
+app.DEFINE_boolean(
+  "batch_producer_ordered",
+  True,
+  "If set, batches constructed by worker processes are returned in the order "
+  "of the input graphs. Otherwise, batches are returned as soon as they are "
+  "constructed.",
+)
+app.DEFINE_integer(
+  "batch_producer_chunk_size",
+  512,
+  "The number of graphs sent to a batch producer worker process at a time. "
+  "Each chunk is batched independently, so this should be much larger than "
+  "the number of graphs in a batch.",
+)
+app.DEFINE_string(
+  "batch_producer_shm_dir",
+  "/dev/shm",
+  "The directory used to transfer batch arrays from worker processes. This "
+  "should be a memory-backed filesystem.",
+)
+
+# Arrays smaller than this are pickled along with the rest of the batch.
+_MIN_SHARED_ARRAY_SIZE = 4096
+
+# The model used by worker processes. Workers are forked, so the model is
+# inherited rather than pickled.
+_worker_model: Optional[classifier_base.ClassifierBase] = None
+
+
+class _ArrayWriter(pickle.Pickler):
+  """A pickler which writes large arrays to a file rather than pickling them.
+
+  Pickled arrays are replaced by an (offset, dtype, shape) reference into the
+  file.
+  """
+
+  def __init__(self, file, array_file):
+    super(_ArrayWriter, self).__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+    self.array_file = array_file
+    self.offset = 0
+
+  def persistent_id(self, obj: Any) -> Optional[Tuple[int, str, Tuple[int]]]:
+    if (
+      type(obj) is not np.ndarray
+      or obj.nbytes < _MIN_SHARED_ARRAY_SIZE
+      or obj.dtype.hasobject
+    ):
+      return None
+
+    # Align arrays so that views on the mapped file are aligned.
+    padding = -self.offset % 64
+    if padding:
+      self.array_file.write(b"\0" * padding)
+      self.offset += padding
+
+    offset = self.offset
+    data = np.ascontiguousarray(obj)
+    self.array_file.write(data.data)
+    self.offset += data.nbytes
+    return (offset, data.dtype.str, data.shape)
+
+
+class _ArrayReader(pickle.Unpickler):
+  """An unpickler which resolves array references into a mapped file."""
+
+  def __init__(self, file, buffer: Optional[mmap.mmap]):
+    super(_ArrayReader, self).__init__(file)
+    self.buffer = buffer
+
+  def persistent_load(self, pid: Tuple[int, str, Tuple[int]]) -> np.ndarray:
+    offset, dtype, shape = pid
+    dtype = np.dtype(dtype)
+    count = int(np.prod(shape))
+    # The array holds a reference to the mapped file, which is unmapped when
+    # the last array is freed.
+    return np.frombuffer(
+      self.buffer, dtype=dtype, count=count, offset=offset
+    ).reshape(shape)
+
+
+def _InitWorker(model: classifier_base.ClassifierBase) -> None:
+  """Initialize a worker process."""
+  global _worker_model
+  # Interrupts are handled by the calling process.
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+  # Pooled database connections inherited from the calling process share
+  # their sockets with it. Discard them so that the worker opens its own.
+  for obj in gc.get_objects():
+    if isinstance(obj, sql.engine.Engine):
+      obj.dispose()
+
+  # Workers exit through os._exit(), which skips atexit handlers, but runs
+  # multiprocessing finalizers when the pool is closed.
+  multiprocessing.util.Finalize(
+    None, encoded_sequence_store.FlushAll, exitpriority=0
+  )
+
+  _worker_model = model
+
+
+def _MakeBatches(
+  args: Tuple[epoch.Type, str, List[graph_tuple_database.GraphTuple]]
+) -> Tuple[Optional[str], bytes]:
+  """Construct the batches for a chunk of graphs on a worker process.
+
+  Returns:
+    A tuple of the path of the file containing the batch arrays, or None if
+    the batches have no large arrays, and the pickled list of batches.
+  """
+  epoch_type, shm_dir, graphs = args
+  batch_list = list(_worker_model.BatchIterator(epoch_type, iter(graphs)))
+
+  fd, path = tempfile.mkstemp(dir=shm_dir, suffix=".batch")
+  buf = io.BytesIO()
+  try:
+    with os.fdopen(fd, "wb") as array_file:
+      writer = _ArrayWriter(buf, array_file)
+      writer.dump(batch_list)
+  except Exception:
+    os.unlink(path)
+    raise
+
+  if not writer.offset:
+    os.unlink(path)
+    path = None
+  return path, buf.getvalue()
+
+
+def _LoadBatches(path: Optional[str], pickled: bytes) -> List[batches.Data]:
+  """Load the batches returned by _MakeBatches()."""
+  buffer = None
+  if path:
+    with open(path, "rb") as f:
+      # A copy-on-write mapping, so that batch arrays are writable.
+      buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    # The mapping remains valid after the file is removed.
+    os.unlink(path)
+  return _ArrayReader(io.BytesIO(pickled), buffer).load()
+
+
+def _Chunk(iterable: Iterable[Any], chunk_size: int) -> Iterable[List[Any]]:
+  """Split an iterable into lists of chunk_size elements."""
+  iterator = iter(iterable)
+  while True:
+    chunk = list(itertools.islice(iterator, chunk_size))
+    if not chunk:
+      return
+    yield chunk
+
+
+class BatchProducer(object):
+  """Construct model batches using a pool of worker processes."""
+
+  def __init__(
+    self,
+    model: classifier_base.ClassifierBase,
+    worker_count: int,
+    ordered: bool = True,
+    chunk_size: int = 512,
+    shm_dir: str = "/dev/shm",
+    max_pending_chunks: Optional[int] = None,
+  ):
+    """Constructor.
+
+    Args:
+      model: The model to construct batches for.
+      worker_count: The number of worker processes.
+      ordered: If true, batches are returned in the order of the input graphs.
+        Else, batches are returned in the order that they are constructed.
+      chunk_size: The number of graphs to send to a worker at a time.
+      shm_dir: The directory to transfer batch arrays through.
+      max_pending_chunks: The maximum number of chunks which have been read
+        but whose batches have not been returned. This bounds the memory used
+        for read-ahead. If not provided, twice the number of workers is used.
+    """
+    self.model = model
+    self.worker_count = worker_count
+    self.ordered = ordered
+    self.chunk_size = chunk_size
+    self.shm_dir = shm_dir
+    self.max_pending_chunks = max_pending_chunks or 2 * worker_count
+
+    self._pool: Optional[multiprocessing.pool.Pool] = None
+    self._lock = threading.Lock()
+
+  @classmethod
+  def CreateFromFlags(
+    cls, model: classifier_base.ClassifierBase
+  ) -> "BatchProducer":
+    """Construct a batch producer from flags."""
+    return cls(
+      model,
+      worker_count=FLAGS.batch_producer_workers,
+      ordered=FLAGS.batch_producer_ordered,
+      chunk_size=FLAGS.batch_producer_chunk_size,
+      shm_dir=FLAGS.batch_producer_shm_dir,
+    )
+
+  def Start(self) -> None:
+    """Start the worker processes, if they are not already running."""
+    with self._lock:
+      if self._pool is None:
+        self._pool = multiprocessing.get_context("fork").Pool(
+          self.worker_count, initializer=_InitWorker, initargs=(self.model,)
+        )
+
+  def Close(self) -> None:
+    """Stop the worker processes.
+
+    Workers finish their current chunk and write any sequences that they have
+    encoded before exiting. The producer may be started again by a later call.
+    """
+    with self._lock:
+      pool, self._pool = self._pool, None
+    if pool is not None:
+      pool.close()
+      pool.join()
+
+  def __enter__(self) -> "BatchProducer":
+    self.Start()
+    return self
+
+  def __exit__(self, *args):
+    self.Close()
+
+  def __call__(
+    self,
+    epoch_type: epoch.Type,
+    graphs: Iterable[graph_tuple_database.GraphTuple],
+  ) -> Iterable[batches.Data]:
+    """Generate model batches from an iterator of graphs.
+
+    Graphs are read on the calling thread, and at most max_pending_chunks
+    chunks are in flight at a time.
+
+    Args:
+      epoch_type: The type of epoch that batches are being constructed for.
+      graphs: The graphs to construct batches from.
+
+    Returns:
+      A batch iterator.
+    """
+    self.Start()
+    pool = self._pool
+
+    # Each call uses its own directory, which is removed once the iterator
+    # is exhausted or closed, along with any batches that were not returned.
+    # Chunks which are still in flight when the directory is removed fail to
+    # write their batches, and their results are discarded.
+    shm_dir = tempfile.mkdtemp(prefix="batch_producer_", dir=self.shm_dir)
+
+    # A map from chunk number to the result of the chunk, in input order, for
+    # chunks which have been submitted but not returned. If unordered, the
+    # number of each chunk is put on a queue when it completes.
+    pending: Dict[int, multiprocessing.pool.AsyncResult] = {}
+    completed = queue.Queue()
+
+    chunks = enumerate(_Chunk(graphs, self.chunk_size))
+    try:
+      while True:
+        for i, chunk in itertools.islice(
+          chunks, self.max_pending_chunks - len(pending)
+        ):
+          callback = None if self.ordered else lambda _, i=i: completed.put(i)
+          pending[i] = pool.apply_async(
+            _MakeBatches,
+            ((epoch_type, shm_dir, chunk),),
+            callback=callback,
+            error_callback=callback,
+          )
+        if not pending:
+          break
+
+        i = next(iter(pending)) if self.ordered else completed.get()
+        yield from _LoadBatches(*pending.pop(i).get())
+    finally:
+      shutil.rmtree(shm_dir, ignore_errors=True)
+
+
+# The batch producer shared by every batch iterator, created on first use.
+_batch_producer: Optional[BatchProducer] = None
+_batch_producer_lock = threading.Lock()
+
+
+def GetBatchProducer(model: classifier_base.ClassifierBase) -> BatchProducer:
+  """Return the batch producer for a model.
+
+  The producer is created on first use from flags, and is reused by later
+  calls for the same model, so that its worker processes are started once per
+  run. It is closed when the program exits, or when a producer is requested
+  for a different model.
+  """
+  global _batch_producer
+  with _batch_producer_lock:
+    if _batch_producer is not None and _batch_producer.model is not model:
+      _batch_producer.Close()
+      _batch_producer = None
+    if _batch_producer is None:
+      _batch_producer = BatchProducer.CreateFromFlags(model)
+      atexit.register(_batch_producer.Close)
+    _batch_producer.Start()
+    return _batch_producer
@@ -0,0 +1,165 @@
+"""Unit tests for //deeplearning/ml4pl/models:batch_producer."""
+import os
+import pathlib
+from typing import Iterable
+from typing import NamedTuple
+
+import numpy as np
+
+from deeplearning.ml4pl.models import batch as batches
+from deeplearning.ml4pl.models import batch_producer
+from deeplearning.ml4pl.models import epoch
+from labm8.py import test
+
+FLAGS = test.FLAGS
+
+###############################################################################
+# Fixtures and mocks.
+###############################################################################
+
+
+class MockGraph(NamedTuple):
+  """A mock graph tuple."""
+
+  id: int
+
+
+class MockModel(object):
+  """A mock model which batches up to 10 graphs at a time."""
+
+  def BatchIterator(
+    self, epoch_type: epoch.Type, graphs: Iterable[MockGraph]
+  ) -> Iterable[batches.Data]:
+    while True:
+      graph_ids = [graph.id for _, graph in zip(range(10), graphs)]
+      if not graph_ids:
+        break
+      yield batches.Data(
+        graph_ids=graph_ids,
+        data={
+          # A large array which is transferred through shared memory.
+          "node_x": np.repeat(np.array(graph_ids, dtype=np.int64), 1000),
+          # A small array which is pickled.
+          "graph_y": np.array(graph_ids, dtype=np.float32),
+          "epoch_type": epoch_type,
+          "pid": os.getpid(),
+        },
+      )
+
+
+@test.Fixture(scope="function", params=(False, True))
+def ordered(request) -> bool:
+  """A test fixture which enumerates batch orderings."""
+  return request.param
+
+
+###############################################################################
+# Tests.
+###############################################################################
+
+
+def test_BatchProducer_all_graphs_batched(
+  tmp_path: pathlib.Path, ordered: bool
+):
+  """Test that every graph is in exactly one batch."""
+  with batch_producer.BatchProducer(
+    MockModel(),
+    worker_count=3,
+    ordered=ordered,
+    chunk_size=25,
+    shm_dir=str(tmp_path),
+  ) as producer:
+    batch_list = list(
+      producer(epoch.Type.TRAIN, (MockGraph(id=i) for i in range(100)))
+    )
+
+  graph_ids = [graph_id for batch in batch_list for graph_id in batch.graph_ids]
+  if ordered:
+    assert graph_ids == list(range(100))
+    # Each chunk of 25 graphs is batched independently.
+    assert [batch.graph_count for batch in batch_list[:3]] == [10, 10, 5]
+  else:
+    assert sorted(graph_ids) == list(range(100))
+
+  for batch in batch_list:
+    assert batch.data["node_x"].tolist() == list(
+      np.repeat(batch.graph_ids, 1000)
+    )
+    assert batch.data["graph_y"].tolist() == batch.graph_ids
+    assert batch.data["epoch_type"] == epoch.Type.TRAIN
+
+  # Shared memory files are removed.
+  assert not list(tmp_path.iterdir())
+
+
+def test_BatchProducer_arrays_are_writable(tmp_path: pathlib.Path):
+  """Test that arrays returned through shared memory can be modified."""
+  with batch_producer.BatchProducer(
+    MockModel(), worker_count=1, shm_dir=str(tmp_path)
+  ) as producer:
+    batch = next(iter(producer(epoch.Type.VAL, [MockGraph(id=5)])))
+  batch.data["node_x"][0] = 10
+  assert batch.data["node_x"][:2].tolist() == [10, 5]
+
+
+def test_BatchProducer_no_graphs(tmp_path: pathlib.Path):
+  """Test that no batches are produced for an empty input."""
+  with batch_producer.BatchProducer(
+    MockModel(), worker_count=2, shm_dir=str(tmp_path)
+  ) as producer:
+    assert list(producer(epoch.Type.TEST, [])) == []
+
+
+def test_BatchProducer_early_close(tmp_path: pathlib.Path):
+  """Test that a partially consumed producer can be closed."""
+  with batch_producer.BatchProducer(
+    MockModel(),
+    worker_count=2,
+    chunk_size=10,
+    shm_dir=str(tmp_path),
+    max_pending_chunks=2,
+  ) as producer:
+    batch_iterator = producer(
+      epoch.Type.TRAIN, (MockGraph(id=i) for i in range(1000))
+    )
+    assert next(batch_iterator).graph_ids == list(range(10))
+    batch_iterator.close()
+    assert not list(tmp_path.iterdir())
+
+    # The producer can be used again after an iterator is closed.
+    batch_list = list(producer(epoch.Type.VAL, [MockGraph(id=5)]))
+    assert [batch.graph_ids for batch in batch_list] == [[5]]
+
+
+def test_BatchProducer_workers_are_reused(tmp_path: pathlib.Path):
+  """Test that every call to a producer uses the same worker processes."""
+  with batch_producer.BatchProducer(
+    MockModel(), worker_count=2, chunk_size=10, shm_dir=str(tmp_path)
+  ) as producer:
+    pids = set()
+    for epoch_type in (epoch.Type.TRAIN, epoch.Type.VAL, epoch.Type.TEST):
+      for batch in producer(epoch_type, (MockGraph(id=i) for i in range(50))):
+        pids.add(batch.data["pid"])
+
+  assert os.getpid() not in pids
+  assert 1 <= len(pids) <= 2
+
+
+def test_BatchProducer_worker_error(tmp_path: pathlib.Path):
+  """Test that an error raised by a worker is raised by the iterator."""
+
+  class ErrorModel(object):
+    def BatchIterator(self, epoch_type, graphs):
+      raise ValueError("Invalid graph")
+
+  with batch_producer.BatchProducer(
+    ErrorModel(), worker_count=2, shm_dir=str(tmp_path)
+  ) as producer:
+    with test.Raises(ValueError) as e_ctx:
+      list(producer(epoch.Type.TRAIN, [MockGraph(id=1)]))
+    assert str(e_ctx.value) == "Invalid graph"
+  assert not list(tmp_path.iterdir())
+
+
+if __name__ == "__main__":
+  test.Main()
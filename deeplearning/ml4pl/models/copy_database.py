@@ -19,10 +19,17 @@ app.DEFINE_database(
 app.DEFINE_string("run_id", None, "If set, specify the run ID to copy.")
 
 
-def CopyResults(query, dst_db):
-  """Copy the results of the query to a different database."""
+def CopyResults(query, dst_db, key_column):
+  """Copy the results of the query to a different database.
+
+  Args:
+    query: The query to copy the results of.
+    dst_db: The database to copy the results to.
+    key_column: The primary key column of the queried table, which the results
+      are paged on.
+  """
   with dst_db.Session(commit=True) as session:
-    for chunk in sqlutil.OffsetLimitBatchedQuery(query):
+    for chunk in sqlutil.OffsetLimitBatchedQuery(query, key_column=key_column):
       for row in chunk.rows:
         session.merge(row)
 
@@ -44,20 +51,22 @@ def main():
       batch_log_metas = batch_log_metas.filter(
         log_database.BatchLogMeta.id.in_(batch_logs_to_copy)
       )
-      CopyResults(batch_log_metas, output_db)
+      CopyResults(
+        batch_log_metas, output_db, key_column=log_database.BatchLogMeta.id
+      )
 
       batch_logs = in_session.query(log_database.BatchLog)
       batch_logs = batch_logs.filter(
         log_database.BatchLog.id.in_(batch_logs_to_copy)
       )
-      CopyResults(batch_logs, output_db)
+      CopyResults(batch_logs, output_db, key_column=log_database.BatchLog.id)
 
   with prof.Profile("Copied parameters"):
     with input_db.Session() as in_session:
       params = in_session.query(log_database.Parameter)
       if run_id:
         params = params.filter(log_database.Parameter.run_id == run_id)
-      CopyResults(params, output_db)
+      CopyResults(params, output_db, key_column=log_database.Parameter.id)
 
   with prof.Profile("Copied checkpoints"):
     with input_db.Session() as in_session:
@@ -73,13 +82,19 @@ def main():
       checkpoint_metas = checkpoint_metas.filter(
         log_database.ModelCheckpointMeta.id.in_(checkpoints_to_copy)
       )
-      CopyResults(checkpoint_metas, output_db)
+      CopyResults(
+        checkpoint_metas,
+        output_db,
+        key_column=log_database.ModelCheckpointMeta.id,
+      )
 
       checkpoints = in_session.query(log_database.ModelCheckpoint)
       checkpoints = checkpoints.filter(
         log_database.ModelCheckpoint.id.in_(checkpoints_to_copy)
       )
-      CopyResults(checkpoints, output_db)
+      CopyResults(
+        checkpoints, output_db, key_column=log_database.ModelCheckpoint.id
+      )
 
 
 if __name__ == "__main__":
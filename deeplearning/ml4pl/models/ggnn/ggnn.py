@@ -55,7 +55,13 @@ app.DEFINE_string(
   "The unroll strategy to use. One of: "
   "{none, constant, edge_count, data_flow_max_steps, label_convergence} "
   "constant: Unroll by a constant number of steps. The total number of steps is "
-  "(unroll_factor * message_passing_step_count).",
+  "(unroll_factor * message_passing_step_count). "
+  "data_flow_max_steps: Unroll enough times to cover the largest "
+  "data_flow_steps of the graphs in a batch. "
+  "label_convergence: Unroll until the node states converge, as determined by "
+  "--unroll_convergence_threshold, up to unroll_factor times. This requires "
+  "--unroll_factor >= 1. "
+  "Unrolling is only performed in validation and test epochs.",
 )
 app.DEFINE_float(
   "unroll_factor",
@@ -65,7 +71,16 @@ app.DEFINE_float(
   "sum(layer_timesteps) are performed. So one unroll adds sum(layer_timesteps) "
   "many steps to the network. If --unroll_strategy=edge_counts, "
   "max_edge_count * --unroll_factor timesteps are performed. (rounded up to "
-  "the next multiple of sum(layer_timesteps))",
+  "the next multiple of sum(layer_timesteps)). At least one unroll is always "
+  "performed.",
+)
+app.DEFINE_float(
+  "unroll_convergence_threshold",
+  0.0,
+  "If greater than zero, stop unrolling a batch in a validation or test epoch "
+  "once an unroll changes no element of the node states by more than this "
+  "amount. Required by --unroll_strategy=label_convergence, and optional for "
+  "the other unroll strategies.",
 )
 app.DEFINE_boolean(
   "limit_max_data_flow_steps_during_training",
@@ -93,6 +108,15 @@ app.DEFINE_boolean(
   True,
   "If true, normalize incoming messages by the number of incoming messages.",
 )
+app.DEFINE_enum(
+  "ggnn_message_passing_backend",
+  "edge_list",
+  ("edge_list", "sparse"),
+  "The implementation of message passing. 'edge_list' gathers and scatters "
+  "messages separately for each edge type. 'sparse' builds a single sparse "
+  "adjacency matrix per batch and computes all messages of a timestep with "
+  "one sparse-dense matrix multiplication.",
+)
 app.DEFINE_float(
   "graph_state_dropout", 0.0, "Graph state dropout rate.",
 )
@@ -316,6 +340,9 @@ class Ggnn(classifier_base.ClassifierBase):
   ) -> int:
     """Determine the unroll factor from the --unroll_strategy and --unroll_factor
   flags, and the batch log.
+
+  The unroll factor is the number of times that the layer timesteps are run,
+  so it is always at least one.
   """
     # Determine the unrolling strategy.
     if unroll_strategy == "none" or epoch_type == epoch.Type.TRAIN:
@@ -326,13 +353,17 @@ class Ggnn(classifier_base.ClassifierBase):
     elif unroll_strategy == "constant":
       # Unroll by a constant number of steps. The total number of steps is
       # (unroll_factor * message_passing_step_count).
-      return int(unroll_factor)
+      return max(int(unroll_factor), 1)
     elif unroll_strategy == "data_flow_max_steps":
-      max_data_flow_steps = max(
-        graph.data_flow_steps for graph in batch.data.disjoint_graphs
-      )
-      unroll_factor = math.ceil(
-        max_data_flow_steps / self.message_passing_step_count
+      data_flow_steps = [graph.data_flow_steps for graph in batch.data.graphs]
+      if None in data_flow_steps:
+        raise app.UsageError(
+          "--unroll_strategy=data_flow_max_steps requires graphs with data "
+          "flow annotations"
+        )
+      max_data_flow_steps = max(data_flow_steps)
+      unroll_factor = max(
+        math.ceil(max_data_flow_steps / self.message_passing_step_count), 1
       )
       app.Log(
         2,
@@ -343,18 +374,32 @@ class Ggnn(classifier_base.ClassifierBase):
       return unroll_factor
     elif unroll_strategy == "edge_count":
       max_edge_count = max(graph.edge_count for graph in batch.data.graphs)
-      unroll_factor = math.ceil(
-        (max_edge_count * unroll_factor) / self.message_passing_step_count
+      unroll_factor = max(
+        math.ceil(
+          (max_edge_count * unroll_factor) / self.message_passing_step_count
+        ),
+        1,
       )
       app.Log(
         2,
         "Determined unroll factor %d from max edge count %d",
         unroll_factor,
-        self.message_passing_step_count,
+        max_edge_count,
       )
       return unroll_factor
     elif unroll_strategy == "label_convergence":
-      return 0
+      # Unroll until the node states converge. The unroll factor is an upper
+      # bound on the number of unrolls.
+      if FLAGS.unroll_convergence_threshold <= 0:
+        raise app.UsageError(
+          "--unroll_strategy=label_convergence requires "
+          "--unroll_convergence_threshold"
+        )
+      if unroll_factor < 1:
+        raise app.UsageError(
+          "--unroll_strategy=label_convergence requires --unroll_factor >= 1"
+        )
+      return int(unroll_factor)
     else:
       raise app.UsageError(f"Unknown unroll strategy '{unroll_strategy}'")
 
@@ -401,7 +446,7 @@ class Ggnn(classifier_base.ClassifierBase):
     # maybe fetch more inputs.
     if disjoint_graph.has_graph_y:
       assert (
-        disjoint_graph.disjoint_graph_count > 1
+        disjoint_graph.disjoint_graph_count >= 1
       ), f"graph_count is {disjoint_graph.disjoint_graph_count}"
       num_graphs = torch.tensor(disjoint_graph.disjoint_graph_count).to(
         self.dev, torch.long
@@ -425,7 +470,20 @@ class Ggnn(classifier_base.ClassifierBase):
       self.model.eval()
       self.model.opt.zero_grad()
 
-    outputs = self.model(*model_inputs)
+    unroll_factor = self.GetUnrollFactor(
+      epoch_type, batch, FLAGS.unroll_strategy, FLAGS.unroll_factor
+    )
+    convergence_threshold = (
+      FLAGS.unroll_convergence_threshold
+      if epoch_type != epoch.Type.TRAIN
+      else 0.0
+    )
+
+    outputs = self.model(
+      *model_inputs,
+      unroll_factor=unroll_factor,
+      convergence_threshold=convergence_threshold,
+    )
 
     logits, accuracy, logits, correct, targets, graph_features = outputs
 
@@ -454,9 +512,10 @@ class Ggnn(classifier_base.ClassifierBase):
     # will change this value.
     learning_rate = self.model.config.lr
 
-    # TODO(github.com/ChrisCummins/ProGraML/issues/27): Set these.
-    model_converged = False
-    iteration_count = 1
+    # The number of message passing timesteps, and whether unrolling stopped
+    # early because the node states converged.
+    model_converged = self.model.ggnn.converged
+    iteration_count = self.model.ggnn.step_count
 
     loss_value = loss.item()
     assert not np.isnan(loss_value), loss
@@ -32,6 +32,7 @@ class GGNNConfig(object):
     self.use_edge_bias: bool = FLAGS.use_edge_bias
     self.msg_mean_aggregation: bool = FLAGS.msg_mean_aggregation
     self.backward_edges: bool = True
+    self.message_passing_backend: str = FLAGS.ggnn_message_passing_backend
     ###############
 
     self.num_classes: int = num_classes
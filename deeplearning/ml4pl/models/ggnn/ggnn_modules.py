@@ -9,6 +9,9 @@ from labm8.py import app
 
 FLAGS = app.FLAGS
 SMALL_NUMBER = 1e-8
+# The number of edges to gather messages for at a time in the 'sparse' message
+# passing backend when edge positions are used.
+SPARSE_GATHER_CHUNK_SIZE = 4096
 
 # optimizer Adam
 # FLAGS.learning_rate * self.placeholders["learning_rate_multiple"]
@@ -59,10 +62,12 @@ class GGNNModel(nn.Module):
       num_graphs=None,
       graph_nodes_list=None,
       aux_in=None,
+      unroll_factor=1,
+      convergence_threshold=0.0,
   ):
     raw_in = self.node_embeddings(vocab_ids, selector_ids)
     raw_out, raw_in = self.ggnn(
-      edge_lists, raw_in, pos_lists
+      edge_lists, raw_in, pos_lists, unroll_factor, convergence_threshold
     )  # OBS! self.ggnn might change raw_in inplace, so use the two outputs
     # instead!
     prediction = self.nodewise_readout(raw_in, raw_out)
@@ -217,6 +222,9 @@ class GGNNProper(nn.Module):
     super().__init__()
     self.backward_edges = config.backward_edges
     self.layer_timesteps = config.layer_timesteps
+    self.message_passing_backend = config.message_passing_backend
+    self.msg_mean_aggregation = config.msg_mean_aggregation
+    self.position_embeddings = config.position_embeddings
 
     self.message = nn.ModuleList()
     for i in range(len(self.layer_timesteps)):
@@ -226,7 +234,20 @@ class GGNNProper(nn.Module):
     for i in range(len(self.layer_timesteps)):
       self.update.append(GGNNLayer(config))
 
-  def forward(self, edge_lists, node_states, pos_lists):
+    # The number of timesteps run by the last call to forward(), and whether
+    # it stopped early because the node states converged.
+    self.step_count = 0
+    self.converged = False
+
+  def forward(self, edge_lists, node_states, pos_lists, unroll_factor=1,
+              convergence_threshold=0.0):
+    """Run message passing.
+
+    The layer_timesteps schedule is run unroll_factor times. If a convergence
+    threshold is set and the model is not training, message passing stops
+    early after any unroll in which no element of the node states changes by
+    more than the threshold. The first unroll is always run.
+    """
     # TODO(github.com/ChrisCummins/ProGraML/issues/27): This modifies the
     # arguments in-place.
 
@@ -237,13 +258,132 @@ class GGNNProper(nn.Module):
       back_edge_lists = [x.flip([1]) for x in edge_lists]
       edge_lists.extend(back_edge_lists)
 
-    for (layer_idx, num_timesteps) in enumerate(self.layer_timesteps):
-      for t in range(num_timesteps):
-        messages = self.message[layer_idx](edge_lists, node_states, pos_lists)
-        node_states = self.update[layer_idx](messages, node_states)
+    # The sparse adjacency does not change between timesteps, so build it once
+    # per batch.
+    sparse_adjacency = None
+    if self.message_passing_backend == 'sparse':
+      sparse_adjacency = SparseAdjacency.Create(
+        edge_lists,
+        pos_lists,
+        node_count=node_states.size()[0],
+        mean_aggregation=self.msg_mean_aggregation,
+        use_positions=self.position_embeddings,
+      )
+
+    check_convergence = (convergence_threshold > 0 and not self.training and
+                         node_states.numel())
+    self.step_count = 0
+    self.converged = False
+    for unroll in range(unroll_factor):
+      unroll_node_states = node_states
+      for (layer_idx, num_timesteps) in enumerate(self.layer_timesteps):
+        for t in range(num_timesteps):
+          messages = self.message[layer_idx](edge_lists, node_states,
+                                             pos_lists,
+                                             sparse_adjacency=sparse_adjacency)
+          node_states = self.update[layer_idx](messages, node_states)
+          self.step_count += 1
+      if check_convergence and unroll + 1 < unroll_factor:
+        change = (node_states - unroll_node_states).abs().max().item()
+        if change < convergence_threshold:
+          self.converged = True
+          break
     return node_states, old_node_states
 
 
+class SparseAdjacency(object):
+  """A single sparse adjacency matrix over all edge types of a batch.
+
+  This is the data for the 'sparse' message passing backend, which replaces the
+  per-edge-type gather and scatter of MessagingLayer with a single sparse-dense
+  matrix multiplication.
+
+  The matrix has shape <N, N * T>, where N is the number of nodes and T is the
+  number of edge types, including backward edges. An edge of type i from node s
+  to node t is the entry [t, s * T + i]. Multiplying it with the edge-type
+  transformed node states, viewed as <N * T, D>, produces the incoming messages
+  of every node. When mean aggregation is used, the entries of each row are
+  scaled by the inverse of the in-degree of the target node.
+
+  Position gating multiplies each message by a vector, which cannot be folded
+  into the scalar entries of the matrix. When positions are used the matrix is
+  therefore not built, and messages are computed by gathering and scattering
+  over the coordinates of the matrix in fixed size chunks of edges, rather than
+  one edge type at a time.
+  """
+  def __init__(self, rows, columns, positions, row_scale, node_count: int,
+               edge_type_count: int, use_positions: bool):
+    # Long tensors of shape <M> of the coordinates of the non-zero entries.
+    self.rows = rows
+    self.columns = columns
+    # Long tensor of shape <M> of edge positions.
+    self.positions = positions
+    # Tensor of shape <N> to scale the rows by, or None.
+    self.row_scale = row_scale
+    self.node_count = node_count
+    self.edge_type_count = edge_type_count
+
+    self.matrix = None
+    if not use_positions:
+      if row_scale is None:
+        values = torch.ones(rows.size()[0], device=rows.device)
+      else:
+        values = row_scale[rows]
+      self.matrix = torch.sparse_coo_tensor(
+        torch.stack((rows, columns)),
+        values,
+        (node_count, node_count * edge_type_count),
+        device=rows.device,
+      ).coalesce()
+
+  @classmethod
+  def Create(cls, edge_lists, pos_lists, node_count: int,
+             mean_aggregation: bool, use_positions: bool):
+    """Construct the sparse adjacency for a batch.
+
+    Args:
+      edge_lists: A list of <M_i, 2> long tensors, one per edge type, including
+        backward edges.
+      pos_lists: A list of <M_i> long tensors of edge positions, one per edge
+        type. As with MessagingLayer.forward(), edge types without a position
+        list are ignored.
+      node_count: The number of nodes in the batch.
+      mean_aggregation: If true, normalize incoming messages by the number of
+        incoming messages.
+      use_positions: If true, the messages will be gated by edge position.
+
+    Returns:
+      A SparseAdjacency instance.
+    """
+    edge_type_count = len(edge_lists)
+    edge_lists = edge_lists[:len(pos_lists)]
+    device = edge_lists[0].device
+
+    targets = torch.cat([edge_list[:, 1] for edge_list in edge_lists])
+    sources = torch.cat([edge_list[:, 0] for edge_list in edge_lists])
+    edge_types = torch.cat([
+      torch.full((edge_list.size()[0],), i, dtype=torch.long, device=device)
+      for i, edge_list in enumerate(edge_lists)
+    ])
+
+    row_scale = None
+    if mean_aggregation:
+      degrees = targets.bincount(minlength=node_count).to(
+        torch.get_default_dtype())
+      degrees[degrees == 0] = 1.0  # avoid div by zero for lonely nodes
+      row_scale = 1.0 / (degrees + SMALL_NUMBER)
+
+    return cls(
+      rows=targets,
+      columns=sources * edge_type_count + edge_types,
+      positions=torch.cat(list(pos_lists)),
+      row_scale=row_scale,
+      node_count=node_count,
+      edge_type_count=edge_type_count,
+      use_positions=use_positions,
+    )
+
+
 class MessagingLayer(nn.Module):
   """takes an edge_list (for a single edge type) and node_states <N, D+S> and
   returns incoming messages per node of shape <N, D+S>"""
@@ -274,12 +414,21 @@ class MessagingLayer(nn.Module):
         dropout=config.edge_weight_dropout,
       )
 
-  def forward(self, edge_lists, node_states, pos_lists):
-    """edge_lists: [<M_i, 2>, ...]"""
+  def forward(self, edge_lists, node_states, pos_lists,
+              sparse_adjacency=None):
+    """edge_lists: [<M_i, 2>, ...]
+
+    If sparse_adjacency is given, messages are computed using a single
+    sparse-dense matrix multiplication. See SparseAdjacency.
+    """
 
     if self.pos_transform:
       pos_gating = 2 * torch.sigmoid(self.pos_transform(self.position_embs))
-      
+
+    if sparse_adjacency is not None:
+      return self._SparseForward(sparse_adjacency, node_states,
+                                 pos_gating if self.pos_transform else None)
+
     # all edge types are handled in one matrix, but we
     # let propagated_states[i] be equal to the case with only edge_type i
     propagated_states = (self.transform(node_states).transpose(0, 1).view(
@@ -321,6 +470,31 @@ class MessagingLayer(nn.Module):
       messages_by_targets /= (divisor.unsqueeze_(1) + SMALL_NUMBER)
     return messages_by_targets
 
+  def _SparseForward(self, sparse_adjacency, node_states, pos_gating):
+    """Compute incoming messages using the sparse adjacency of the batch."""
+    # Row s * T + i is the state of node s transformed for edge type i.
+    # Shape <N * T, D>:
+    propagated_states = self.transform(node_states).view(-1, self.dim)
+
+    if sparse_adjacency.matrix is not None:
+      return torch.sparse.mm(sparse_adjacency.matrix, propagated_states)
+
+    # Gather, gate, and scatter the messages in chunks of edges so that the
+    # per-edge intermediate of shape <chunk, D> stays small.
+    messages_by_targets = torch.zeros_like(node_states)
+    for start in range(0, sparse_adjacency.rows.size()[0],
+                       SPARSE_GATHER_CHUNK_SIZE):
+      end = start + SPARSE_GATHER_CHUNK_SIZE
+      messages_by_edge = F.embedding(sparse_adjacency.columns[start:end],
+                                     propagated_states)
+      messages_by_edge.mul_(
+        F.embedding(sparse_adjacency.positions[start:end], pos_gating))
+      messages_by_targets.index_add_(0, sparse_adjacency.rows[start:end],
+                                     messages_by_edge)
+    if sparse_adjacency.row_scale is not None:
+      messages_by_targets.mul_(sparse_adjacency.row_scale.unsqueeze(1))
+    return messages_by_targets
+
 
 class GGNNLayer(nn.Module):
   def __init__(self, config):
@@ -0,0 +1,174 @@
+"""Unit tests for //deeplearning/ml4pl/models/ggnn:ggnn_modules."""
+import copy
+from typing import List
+from typing import Tuple
+
+import torch
+
+from deeplearning.ml4pl.models.ggnn import ggnn_modules
+from labm8.py import test
+
+FLAGS = test.FLAGS
+
+
+class MockGGNNConfig(object):
+  """A minimal stand-in for ggnn_config.GGNNConfig that does not use flags."""
+
+  def __init__(
+    self, msg_mean_aggregation: bool, position_embeddings: bool,
+    message_passing_backend: str = "edge_list"):
+    self.emb_size = 30
+    self.selector_size = 2
+    self.hidden_size = self.emb_size + self.selector_size
+    self.edge_type_count = 3
+    self.backward_edges = True
+    self.layer_timesteps = [2, 2]
+    self.use_edge_bias = True
+    self.edge_weight_dropout = 0.0
+    self.graph_state_dropout = 0.0
+    self.msg_mean_aggregation = msg_mean_aggregation
+    self.position_embeddings = position_embeddings
+    self.message_passing_backend = message_passing_backend
+
+
+def CreateRandomBatch(
+  node_count: int, edge_count: int
+) -> Tuple[List[torch.Tensor], List[torch.Tensor]]:
+  """Generate random edge lists and position lists for three edge types.
+
+  As in GGNNProper.forward(), the edge lists are extended with backward edges.
+  """
+  edge_lists = [
+    torch.randint(node_count, (edge_count, 2), dtype=torch.long)
+    for _ in range(3)
+  ]
+  edge_lists.extend([edge_list.flip([1]) for edge_list in edge_lists])
+  pos_lists = [
+    torch.randint(32, (edge_count,), dtype=torch.long) for _ in range(3)
+  ]
+  return edge_lists, pos_lists
+
+
+@test.Parametrize("msg_mean_aggregation", (False, True))
+@test.Parametrize("position_embeddings", (False, True))
+@test.Parametrize("chunk_size", (7, 4096))
+def test_MessagingLayer_sparse_backend_matches_edge_list(
+  monkeypatch, msg_mean_aggregation: bool, position_embeddings: bool,
+  chunk_size: int
+):
+  """Test that both message passing backends compute the same messages."""
+  monkeypatch.setattr(ggnn_modules, "SPARSE_GATHER_CHUNK_SIZE", chunk_size)
+  config = MockGGNNConfig(msg_mean_aggregation, position_embeddings)
+  layer = ggnn_modules.MessagingLayer(config)
+  node_states = torch.rand(50, config.hidden_size)
+  edge_lists, pos_lists = CreateRandomBatch(50, 100)
+
+  expected = layer(edge_lists, node_states, pos_lists)
+
+  sparse_adjacency = ggnn_modules.SparseAdjacency.Create(
+    edge_lists,
+    pos_lists,
+    node_count=50,
+    mean_aggregation=msg_mean_aggregation,
+    use_positions=position_embeddings,
+  )
+  actual = layer(
+    edge_lists, node_states, pos_lists, sparse_adjacency=sparse_adjacency
+  )
+
+  assert actual.shape == expected.shape
+  assert torch.allclose(actual, expected, atol=1e-5)
+
+
+def test_MessagingLayer_sparse_backend_lonely_nodes():
+  """Test that nodes without incoming edges receive zero messages."""
+  config = MockGGNNConfig(msg_mean_aggregation=True, position_embeddings=True)
+  layer = ggnn_modules.MessagingLayer(config)
+  node_states = torch.rand(10, config.hidden_size)
+  edge_lists = [torch.tensor([[0, 1], [2, 1]], dtype=torch.long)] + [
+    torch.zeros((0, 2), dtype=torch.long) for _ in range(2)
+  ]
+  edge_lists.extend([edge_list.flip([1]) for edge_list in edge_lists])
+  pos_lists = [torch.tensor([0, 1], dtype=torch.long)] + [
+    torch.zeros((0,), dtype=torch.long) for _ in range(2)
+  ]
+  sparse_adjacency = ggnn_modules.SparseAdjacency.Create(
+    edge_lists,
+    pos_lists,
+    node_count=10,
+    mean_aggregation=True,
+    use_positions=True,
+  )
+
+  messages = layer(
+    edge_lists, node_states, pos_lists, sparse_adjacency=sparse_adjacency
+  )
+
+  assert messages[1].abs().sum() > 0
+  assert not messages[0].any()
+  assert not messages[2:].any()
+
+
+def test_GGNNProper_sparse_backend_matches_edge_list():
+  """Test that the full message passing stack matches across backends."""
+  edge_list_config = MockGGNNConfig(True, True, "edge_list")
+  sparse_config = MockGGNNConfig(True, True, "sparse")
+  edge_list_model = ggnn_modules.GGNNProper(edge_list_config)
+  sparse_model = ggnn_modules.GGNNProper(sparse_config)
+  sparse_model.load_state_dict(edge_list_model.state_dict())
+  edge_list_model.eval()
+  sparse_model.eval()
+
+  node_states = torch.rand(50, edge_list_config.hidden_size)
+  edge_lists, pos_lists = CreateRandomBatch(50, 100)
+  edge_lists = edge_lists[:3]
+
+  expected, _ = edge_list_model(
+    copy.copy(edge_lists), node_states.clone(), pos_lists
+  )
+  actual, _ = sparse_model(copy.copy(edge_lists), node_states.clone(),
+                           pos_lists)
+
+  assert torch.allclose(actual, expected, atol=1e-4)
+
+
+def test_GGNNProper_unroll_convergence():
+  """Test that unrolling stops early once the node states converge."""
+  config = MockGGNNConfig(True, True)
+  model = ggnn_modules.GGNNProper(config)
+  model.eval()
+  node_states = torch.rand(50, config.hidden_size)
+  edge_lists, pos_lists = CreateRandomBatch(50, 100)
+  edge_lists = edge_lists[:3]
+
+  def Run(unroll_factor: int, convergence_threshold: float):
+    outputs, _ = model(
+      copy.copy(edge_lists), node_states.clone(), pos_lists,
+      unroll_factor=unroll_factor, convergence_threshold=convergence_threshold
+    )
+    return outputs
+
+  # Without a threshold, every unroll is run.
+  unrolled = Run(3, 0.0)
+  assert model.step_count == 12
+  assert not model.converged
+
+  # A threshold which is never reached has no effect.
+  assert torch.allclose(Run(3, 1e-12), unrolled)
+  assert model.step_count == 12
+  assert not model.converged
+
+  # A threshold which is always reached stops after the first unroll.
+  converged = Run(3, 1e9)
+  assert model.step_count == 4
+  assert model.converged
+  assert torch.allclose(converged, Run(1, 0.0))
+
+  # Convergence is not checked during training.
+  model.train()
+  Run(3, 1e9)
+  assert model.step_count == 12
+
+
+if __name__ == "__main__":
+  test.Main()
@@ -0,0 +1,493 @@
+"""A long-lived inference server for online classification with a GGNN.
+
+The server restores a trained model from a checkpoint, and then serves
+predictions for program graphs. Requests are program graph protos, with the
+same node features (and graph features, if the model uses them) as the graph
+database that the model was trained on. Every request is answered with a copy
+of the request graph which is labelled with the model's predictions: for node
+classification models, the y vector of every node is set to the one-hot
+encoding of the predicted class; for graph classification models, the y
+vector of the graph is set. Requests have no data flow annotations, so
+--unroll_strategy=data_flow_max_steps is not supported.
+
+Requests which arrive at the same time are dynamically batched. A batching
+thread waits for the first pending request, then collects further requests
+until either --ggnn_server_batch_node_count nodes have been collected, or
+--ggnn_server_batch_wait_ms milliseconds have passed. The graphs of a batch are
+combined into a single disjoint graph and run through the model in a single
+call to RunBatch(), and the predictions are split back into per-request
+responses.
+
+Requests and responses are read and written as a stream of serialized protos,
+each prefixed by its length in bytes, encoded as a little-endian uint64. A
+request which cannot be processed is answered with an empty graph. Requests
+are read from stdin and responses written to stdout, or, if
+--ggnn_server_socket is set, served to every client which connects to that
+unix domain socket. Responses on a stream are written in the order that the
+requests were read.
+
+Usage:
+
+    $ bazel run //deeplearning/ml4pl/models/ggnn:ggnn_server -- \
+        --graph_db='sqlite:////path/to/graphs.db' \
+        --log_db='sqlite:////path/to/logs.db' \
+        --restore_model=<run_id>[:<epoch_num>] \
+        --ggnn_server_socket=/tmp/ggnn.sock
+"""
+import collections
+import queue
+import socketserver
+import struct
+import sys
+import threading
+import time
+from concurrent import futures
+from typing import BinaryIO
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+
+import numpy as np
+import torch
+
+from deeplearning.ml4pl.graphs import programl_pb2
+from deeplearning.ml4pl.graphs.labelled import graph_tuple
+from deeplearning.ml4pl.models import batch as batches
+from deeplearning.ml4pl.models import classifier_base
+from deeplearning.ml4pl.models import epoch
+from deeplearning.ml4pl.models import logger as logger_lib
+from deeplearning.ml4pl.models import run
+from deeplearning.ml4pl.models.ggnn import ggnn
+from labm8.py import app
+
+FLAGS = app.FLAGS
+
+app.DEFINE_string(
+  "ggnn_server_socket",
+  None,
+  "If set, serve requests to clients of a unix domain socket at this path. "
+  "Else, requests are read from stdin and responses written to stdout.",
+)
+app.DEFINE_integer(
+  "ggnn_server_batch_node_count",
+  10000,
+  "The maximum number of nodes to combine into a batch of requests. A request "
+  "which exceeds this is run in a batch of its own.",
+)
+app.DEFINE_integer(
+  "ggnn_server_batch_wait_ms",
+  5,
+  "The maximum number of milliseconds to wait for more requests to batch "
+  "with the first pending request.",
+)
+app.DEFINE_integer(
+  "ggnn_server_stats_interval",
+  60,
+  "The number of seconds between logging the latency and throughput of the "
+  "server.",
+)
+
+# The length prefix of a proto on a stream.
+_LENGTH_PREFIX = struct.Struct("<Q")
+
+
+class ServerStats(NamedTuple):
+  """Latency and throughput counters of an inference server."""
+
+  # The number of requests answered, including failed requests.
+  request_count: int
+  # The number of requests which could not be processed.
+  error_count: int
+  # The number of calls to RunBatch().
+  batch_count: int
+  # The total number of nodes of the batched graphs.
+  node_count: int
+  # The number of seconds since the server started.
+  elapsed_seconds: float
+  # Percentiles of the time between submitting and answering a request, over
+  # the most recent requests.
+  p50_latency_ms: float
+  p99_latency_ms: float
+
+  @property
+  def requests_per_second(self) -> float:
+    return self.request_count / max(self.elapsed_seconds, 1e-6)
+
+  @property
+  def nodes_per_second(self) -> float:
+    return self.node_count / max(self.elapsed_seconds, 1e-6)
+
+  def __repr__(self) -> str:
+    return (
+      f"{self.request_count} requests ({self.error_count} errors) in "
+      f"{self.batch_count} batches, "
+      f"{self.requests_per_second:.1f} requests/sec, "
+      f"{self.nodes_per_second:.1f} nodes/sec, "
+      f"p50 latency {self.p50_latency_ms:.1f} ms, "
+      f"p99 latency {self.p99_latency_ms:.1f} ms"
+    )
+
+
+class _Request(NamedTuple):
+  """A pending request."""
+
+  program_graph: programl_pb2.ProgramGraph
+  graph: graph_tuple.GraphTuple
+  future: futures.Future
+  submit_time: float
+
+
+class InferenceServer(object):
+  """Dynamically batch requests to a model.
+
+  Requests may be submitted from any number of threads. The model is only
+  called from the batching thread of the server.
+  """
+
+  def __init__(
+    self,
+    model: classifier_base.ClassifierBase,
+    batch_node_count: int,
+    batch_wait_ms: int,
+    stats_interval_seconds: int = 60,
+    latency_window: int = 10000,
+  ):
+    """Constructor.
+
+    Args:
+      model: A restored model.
+      batch_node_count: The maximum number of nodes in a batch.
+      batch_wait_ms: The maximum number of milliseconds to wait for more
+        requests to add to a batch.
+      stats_interval_seconds: The number of seconds between logging the
+        latency and throughput counters.
+      latency_window: The number of most recent requests to compute latency
+        percentiles over.
+    """
+    self.model = model
+    self.batch_node_count = batch_node_count
+    self.batch_wait_ms = batch_wait_ms
+    self.stats_interval_seconds = stats_interval_seconds
+
+    self.node_y_dimensionality = model.graph_db.node_y_dimensionality
+    self.graph_y_dimensionality = model.graph_db.graph_y_dimensionality
+    self.graph_x_dimensionality = model.graph_db.graph_x_dimensionality
+    self.node_x_dimensionality = model.graph_db.node_x_dimensionality
+
+    self._queue = queue.Queue()
+    # A request which was dequeued but did not fit in the previous batch.
+    self._carry: Optional[_Request] = None
+
+    self._lock = threading.Lock()
+    self._start_time = time.time()
+    self._latencies = collections.deque(maxlen=latency_window)
+    self._request_count = 0
+    self._error_count = 0
+    self._batch_count = 0
+    self._node_count = 0
+
+    self._thread = threading.Thread(target=self._Run, daemon=True)
+    self._thread.start()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    del exc_type
+    del exc_val
+    del exc_tb
+    self.Close()
+
+  def Submit(self, program_graph: programl_pb2.ProgramGraph) -> futures.Future:
+    """Submit a request.
+
+    Args:
+      program_graph: The graph to classify.
+
+    Returns:
+      A future of the labelled graph. If the graph cannot be processed, the
+      future raises an error.
+    """
+    submit_time = time.time()
+    future = futures.Future()
+    try:
+      self._ValidateRequest(program_graph)
+      graph = self._CreateGraphTuple(program_graph)
+    except Exception as e:
+      self._Finish(future, submit_time, error=e)
+      return future
+    self._queue.put(_Request(program_graph, graph, future, submit_time))
+    return future
+
+  def Close(self) -> None:
+    """Wait for the pending requests to be answered, and stop the server."""
+    self._queue.put(None)
+    self._thread.join()
+
+  def Stats(self) -> ServerStats:
+    """Return the latency and throughput counters of the server."""
+    with self._lock:
+      if self._latencies:
+        p50, p99 = np.percentile(self._latencies, [50, 99]) * 1000
+      else:
+        p50, p99 = 0, 0
+      return ServerStats(
+        request_count=self._request_count,
+        error_count=self._error_count,
+        batch_count=self._batch_count,
+        node_count=self._node_count,
+        elapsed_seconds=time.time() - self._start_time,
+        p50_latency_ms=float(p50),
+        p99_latency_ms=float(p99),
+      )
+
+  def _ValidateRequest(
+    self, program_graph: programl_pb2.ProgramGraph
+  ) -> None:
+    """Check that a request has the features that the model was trained on.
+
+    Raises:
+      ValueError: If the request has no nodes, or has the wrong number of
+        node or graph features.
+    """
+    if not program_graph.node:
+      raise ValueError("Request has no nodes")
+    for i, node in enumerate(program_graph.node):
+      if len(node.x) != self.node_x_dimensionality:
+        raise ValueError(
+          f"Expected {self.node_x_dimensionality} features for node {i}, "
+          f"received {len(node.x)}"
+        )
+    if (
+      self.graph_x_dimensionality
+      and len(program_graph.x) != self.graph_x_dimensionality
+    ):
+      raise ValueError(
+        f"Expected {self.graph_x_dimensionality} graph features, received "
+        f"{len(program_graph.x)}"
+      )
+
+  def _CreateGraphTuple(
+    self, program_graph: programl_pb2.ProgramGraph
+  ) -> graph_tuple.GraphTuple:
+    """Convert a request to a graph tuple with placeholder labels.
+
+    RunBatch() requires labels to compute the loss, so any labels of the
+    request are replaced by zeros.
+    """
+    graph = graph_tuple.GraphTuple.CreateFromProgramGraph(program_graph)
+    if self.node_y_dimensionality:
+      return graph._replace(
+        node_y=np.zeros(
+          (graph.node_count, self.node_y_dimensionality), dtype=np.int64
+        ),
+        graph_y=None,
+      )
+    return graph._replace(
+      node_y=None,
+      graph_y=np.zeros(self.graph_y_dimensionality, dtype=np.int64),
+    )
+
+  def _NextBatch(self) -> Optional[List[_Request]]:
+    """Block until a batch of requests is available, or None on close."""
+    request = self._carry or self._queue.get()
+    self._carry = None
+    if request is None:
+      return None
+
+    batch = [request]
+    node_count = request.graph.node_count
+    deadline = time.time() + self.batch_wait_ms / 1000
+    while node_count < self.batch_node_count:
+      try:
+        request = self._queue.get(timeout=max(deadline - time.time(), 0))
+      except queue.Empty:
+        break
+      if (
+        request is None
+        or node_count + request.graph.node_count > self.batch_node_count
+      ):
+        self._carry = request
+        break
+      batch.append(request)
+      node_count += request.graph.node_count
+    return batch
+
+  def _Run(self) -> None:
+    """The batching thread."""
+    last_stats_time = time.time()
+    while True:
+      requests = self._NextBatch()
+      if requests is None:
+        break
+      self._RunBatch(requests)
+
+      if time.time() - last_stats_time >= self.stats_interval_seconds:
+        app.Log(1, "%s", self.Stats())
+        last_stats_time = time.time()
+
+  def _RunBatch(self, requests: List[_Request]) -> None:
+    """Run a batch of requests through the model and answer them."""
+    graphs = [request.graph for request in requests]
+    try:
+      disjoint_graph = graph_tuple.GraphTuple.FromGraphTuples(graphs)
+      batch = batches.Data(
+        graph_ids=list(range(len(requests))),
+        data=ggnn.GgnnBatchData(disjoint_graph=disjoint_graph, graphs=graphs),
+      )
+      with torch.no_grad():
+        results = self.model.RunBatch(epoch.Type.TEST, batch)
+    except Exception as e:
+      app.Error("Failed to run batch of %d requests: %s", len(requests), e)
+      for request in requests:
+        self._Finish(request.future, request.submit_time, error=e)
+      return
+
+    with self._lock:
+      self._batch_count += 1
+      self._node_count += disjoint_graph.node_count
+
+    predictions = np.argmax(results.predictions, axis=1)
+    if self.node_y_dimensionality:
+      # Split the node predictions of the disjoint graph into per-graph lists.
+      node_counts = [graph.node_count for graph in graphs]
+      predictions = np.split(predictions, np.cumsum(node_counts)[:-1])
+
+    for request, prediction in zip(requests, predictions):
+      labelled = programl_pb2.ProgramGraph()
+      labelled.CopyFrom(request.program_graph)
+      if self.node_y_dimensionality:
+        one_hot = np.eye(self.node_y_dimensionality, dtype=np.int64)
+        for node, y in zip(labelled.node, one_hot[prediction].tolist()):
+          node.y[:] = y
+      else:
+        one_hot = np.eye(self.graph_y_dimensionality, dtype=np.int64)
+        labelled.y[:] = one_hot[prediction].tolist()
+      self._Finish(request.future, request.submit_time, result=labelled)
+
+  def _Finish(
+    self,
+    future: futures.Future,
+    submit_time: float,
+    result: Optional[programl_pb2.ProgramGraph] = None,
+    error: Optional[Exception] = None,
+  ) -> None:
+    """Answer a request and record its latency."""
+    with self._lock:
+      self._request_count += 1
+      self._latencies.append(time.time() - submit_time)
+      if error:
+        self._error_count += 1
+    if error:
+      future.set_exception(error)
+    else:
+      future.set_result(result)
+
+
+def ServeStream(
+  server: InferenceServer, infile: BinaryIO, outfile: BinaryIO
+) -> int:
+  """Answer a stream of length-prefixed requests until the input is closed.
+
+  Requests are submitted as soon as they are read, so that the requests of a
+  stream are batched with each other and with the requests of other streams.
+
+  Args:
+    server: The server to submit requests to.
+    infile: The stream to read requests from.
+    outfile: The stream to write responses to.
+
+  Returns:
+    The number of requests answered.
+  """
+  pending = queue.Queue()
+
+  def WriteResponses():
+    """Write the response of every request in order."""
+    while True:
+      future = pending.get()
+      if future is None:
+        break
+      try:
+        serialized = future.result().SerializeToString()
+      except Exception as e:
+        app.Log(1, "Failed to process request: %s", e)
+        serialized = b""
+      outfile.write(_LENGTH_PREFIX.pack(len(serialized)) + serialized)
+      outfile.flush()
+
+  writer = threading.Thread(target=WriteResponses)
+  writer.start()
+
+  request_count = 0
+  try:
+    while True:
+      header = infile.read(_LENGTH_PREFIX.size)
+      if len(header) < _LENGTH_PREFIX.size:
+        break
+      (length,) = _LENGTH_PREFIX.unpack(header)
+      serialized = infile.read(length)
+      if len(serialized) < length:
+        break
+
+      program_graph = programl_pb2.ProgramGraph()
+      try:
+        program_graph.ParseFromString(serialized)
+      except Exception as e:
+        future = futures.Future()
+        future.set_exception(e)
+      else:
+        future = server.Submit(program_graph)
+      pending.put(future)
+      request_count += 1
+  finally:
+    pending.put(None)
+    writer.join()
+  return request_count
+
+
+class _StreamHandler(socketserver.StreamRequestHandler):
+  """Answer the requests of a socket client."""
+
+  def handle(self):
+    ServeStream(self.server.inference_server, self.rfile, self.wfile)
+
+
+def main():
+  """Main entry point."""
+  if not FLAGS.graph_db:
+    raise app.UsageError("--graph_db is required")
+  if not FLAGS.restore_model:
+    raise app.UsageError("--restore_model is required")
+  if FLAGS.unroll_strategy == "data_flow_max_steps":
+    raise app.UsageError(
+      "--unroll_strategy=data_flow_max_steps is not supported, as requests "
+      "have no data flow annotations"
+    )
+
+  with logger_lib.Logger.FromFlags() as logger:
+    model = run.CreateModel(ggnn.Ggnn, FLAGS.graph_db(), logger)
+
+    with InferenceServer(
+      model,
+      batch_node_count=FLAGS.ggnn_server_batch_node_count,
+      batch_wait_ms=FLAGS.ggnn_server_batch_wait_ms,
+      stats_interval_seconds=FLAGS.ggnn_server_stats_interval,
+    ) as server:
+      if FLAGS.ggnn_server_socket:
+        with socketserver.ThreadingUnixStreamServer(
+          FLAGS.ggnn_server_socket, _StreamHandler
+        ) as socket_server:
+          socket_server.inference_server = server
+          app.Log(1, "Serving requests on %s", FLAGS.ggnn_server_socket)
+          try:
+            socket_server.serve_forever()
+          except KeyboardInterrupt:
+            pass
+      else:
+        ServeStream(server, sys.stdin.buffer, sys.stdout.buffer)
+      app.Log(1, "%s", server.Stats())
+
+
+if __name__ == "__main__":
+  app.Run(main)
@@ -0,0 +1,189 @@
+"""Unit tests for //deeplearning/ml4pl/models/ggnn:ggnn_server."""
+import io
+import threading
+from typing import List
+
+import numpy as np
+
+from deeplearning.ml4pl.graphs import programl_pb2
+from deeplearning.ml4pl.models import batch as batches
+from deeplearning.ml4pl.models import epoch
+from deeplearning.ml4pl.models.ggnn import ggnn_server
+from deeplearning.ml4pl.testing import random_programl_generator
+from labm8.py import test
+
+FLAGS = test.FLAGS
+
+
+class MockGraphDatabase(object):
+  """A mock graph database which provides the label dimensionalities."""
+
+  def __init__(self, node_y_dimensionality: int, graph_y_dimensionality: int):
+    self.node_y_dimensionality = node_y_dimensionality
+    self.graph_y_dimensionality = graph_y_dimensionality
+    self.graph_x_dimensionality = 0
+    self.node_x_dimensionality = 2
+
+
+class MockModel(object):
+  """A mock model which predicts the class of the first node feature.
+
+  Graph classifications are the class of the first node feature of the first
+  node of each graph.
+  """
+
+  def __init__(self, node_y_dimensionality: int, graph_y_dimensionality: int):
+    self.graph_db = MockGraphDatabase(
+      node_y_dimensionality, graph_y_dimensionality
+    )
+    self.y_dimensionality = node_y_dimensionality or graph_y_dimensionality
+    self.batch_graph_counts: List[int] = []
+    # Set to block RunBatch() until released.
+    self.lock = threading.Lock()
+
+  def RunBatch(
+    self, epoch_type: epoch.Type, batch: batches.Data
+  ) -> batches.Results:
+    assert epoch_type == epoch.Type.TEST
+    with self.lock:
+      disjoint_graph = batch.data.disjoint_graph
+      self.batch_graph_counts.append(disjoint_graph.disjoint_graph_count)
+      classes = disjoint_graph.node_x[:, 0] % self.y_dimensionality
+      if disjoint_graph.has_graph_y:
+        first_nodes = np.searchsorted(
+          disjoint_graph.disjoint_nodes_list,
+          np.arange(disjoint_graph.disjoint_graph_count),
+        )
+        classes = classes[first_nodes]
+        targets = disjoint_graph.graph_y
+      else:
+        targets = disjoint_graph.node_y
+      predictions = np.eye(self.y_dimensionality, dtype=np.float32)[classes]
+      return batches.Results.Create(targets=targets, predictions=predictions)
+
+
+def CreateRequest(node_count: int) -> programl_pb2.ProgramGraph:
+  """Generate a random request."""
+  return random_programl_generator.CreateRandomProto(
+    node_x_dimensionality=2, node_count=node_count
+  )
+
+
+def NodeClasses(program_graph: programl_pb2.ProgramGraph) -> List[int]:
+  return [int(np.argmax(node.y)) for node in program_graph.node]
+
+
+@test.Parametrize("node_count", (5, 30))
+def test_InferenceServer_node_classification(node_count: int):
+  """Test that concurrent requests are batched and split."""
+  model = MockModel(node_y_dimensionality=3, graph_y_dimensionality=0)
+  requests = [CreateRequest(node_count) for _ in range(10)]
+
+  with ggnn_server.InferenceServer(
+    model, batch_node_count=100, batch_wait_ms=1000
+  ) as server:
+    # Block the model so that the requests are pending together.
+    with model.lock:
+      pending = [server.Submit(request) for request in requests]
+    responses = [future.result() for future in pending]
+
+  for request, response in zip(requests, responses):
+    assert len(response.node) == len(request.node)
+    assert NodeClasses(response) == [node.x[0] % 3 for node in request.node]
+    assert all(len(node.y) == 3 for node in response.node)
+
+  # Every batch is within the node budget, unless it is a single request.
+  assert sum(model.batch_graph_counts) == 10
+  for graph_count in model.batch_graph_counts:
+    assert graph_count == 1 or graph_count * node_count <= 100
+  assert len(model.batch_graph_counts) < 10
+
+  stats = server.Stats()
+  assert stats.request_count == 10
+  assert stats.error_count == 0
+  assert stats.batch_count == len(model.batch_graph_counts)
+  assert stats.node_count == 10 * node_count
+  assert 0 < stats.p50_latency_ms <= stats.p99_latency_ms
+
+
+def test_InferenceServer_graph_classification():
+  """Test that graph predictions are returned per request."""
+  model = MockModel(node_y_dimensionality=0, graph_y_dimensionality=2)
+  requests = [CreateRequest(10) for _ in range(5)]
+  with ggnn_server.InferenceServer(
+    model, batch_node_count=1000, batch_wait_ms=10
+  ) as server:
+    responses = [f.result() for f in [server.Submit(r) for r in requests]]
+
+  for request, response in zip(requests, responses):
+    expected = [0, 0]
+    expected[request.node[0].x[0] % 2] = 1
+    assert list(response.y) == expected
+    assert not any(node.y for node in response.node)
+
+
+def test_InferenceServer_invalid_request():
+  """Test that an invalid request fails without affecting other requests."""
+  model = MockModel(node_y_dimensionality=2, graph_y_dimensionality=0)
+  with ggnn_server.InferenceServer(
+    model, batch_node_count=1000, batch_wait_ms=10
+  ) as server:
+    invalid = server.Submit(programl_pb2.ProgramGraph())
+    valid = server.Submit(CreateRequest(5))
+    with test.Raises(ValueError) as e_ctx:
+      invalid.result()
+    assert str(e_ctx.value) == "Request has no nodes"
+    assert len(valid.result().node) == 5
+  assert server.Stats().error_count == 1
+
+
+def test_InferenceServer_wrong_node_feature_count():
+  """Test that a request with the wrong number of node features fails."""
+  model = MockModel(node_y_dimensionality=2, graph_y_dimensionality=0)
+  request = random_programl_generator.CreateRandomProto(
+    node_x_dimensionality=3, node_count=5
+  )
+  with ggnn_server.InferenceServer(
+    model, batch_node_count=1000, batch_wait_ms=10
+  ) as server:
+    with test.Raises(ValueError) as e_ctx:
+      server.Submit(request).result()
+  assert str(e_ctx.value) == "Expected 2 features for node 0, received 3"
+  assert model.batch_graph_counts == []
+
+
+def test_ServeStream():
+  """Test answering a stream of length-prefixed requests."""
+  model = MockModel(node_y_dimensionality=2, graph_y_dimensionality=0)
+  requests = [CreateRequest(5), programl_pb2.ProgramGraph(), CreateRequest(8)]
+  infile = io.BytesIO()
+  for request in requests:
+    serialized = request.SerializeToString()
+    infile.write(ggnn_server._LENGTH_PREFIX.pack(len(serialized)) + serialized)
+  infile.seek(0)
+  outfile = io.BytesIO()
+
+  with ggnn_server.InferenceServer(
+    model, batch_node_count=1000, batch_wait_ms=10
+  ) as server:
+    assert ggnn_server.ServeStream(server, infile, outfile) == 3
+
+  outfile.seek(0)
+  responses = []
+  while True:
+    header = outfile.read(ggnn_server._LENGTH_PREFIX.size)
+    if not header:
+      break
+    (length,) = ggnn_server._LENGTH_PREFIX.unpack(header)
+    response = programl_pb2.ProgramGraph()
+    response.ParseFromString(outfile.read(length))
+    responses.append(response)
+
+  assert [len(response.node) for response in responses] == [5, 0, 8]
+  assert NodeClasses(responses[2]) == [
+    node.x[0] % 2 for node in requests[2].node
+  ]
+
+
+if __name__ == "__main__":
+  test.Main()
@@ -0,0 +1,152 @@
+"""Unit tests for //deeplearning/ml4pl/models/ggnn."""
+import random
+
+from deeplearning.ml4pl import run_id as run_id_lib
+from deeplearning.ml4pl.graphs.labelled import graph_tuple_database
+from deeplearning.ml4pl.models import batch_iterator as batch_iterator_lib
+from deeplearning.ml4pl.models import epoch
+from deeplearning.ml4pl.models import log_database
+from deeplearning.ml4pl.models import logger as logging
+from deeplearning.ml4pl.models.ggnn import ggnn
+from deeplearning.ml4pl.testing import random_graph_tuple_database_generator
+from deeplearning.ml4pl.testing import testing_databases
+from labm8.py import app
+from labm8.py import test
+
+FLAGS = test.FLAGS
+
+# For testing models, always use --strict_graph_segmentation.
+FLAGS.strict_graph_segmentation = True
+
+
+###############################################################################
+# Fixtures.
+###############################################################################
+
+
+@test.Fixture(
+  scope="session",
+  params=testing_databases.GetDatabaseUrls(),
+  namer=testing_databases.DatabaseUrlNamer("log_db"),
+)
+def log_db(request) -> log_database.Database:
+  """A test fixture which yields an empty log database."""
+  yield from testing_databases.YieldDatabase(
+    log_database.Database, request.param
+  )
+
+
+@test.Fixture(scope="session")
+def logger(log_db: log_database.Database) -> logging.Logger:
+  """A test fixture which yields a logger."""
+  with logging.Logger(log_db, max_buffer_length=128) as logger:
+    yield logger
+
+
+@test.Fixture(
+  scope="session",
+  params=testing_databases.GetDatabaseUrls(),
+  namer=testing_databases.DatabaseUrlNamer("graph_db"),
+)
+def graph_db(request) -> graph_tuple_database.Database:
+  """A test fixture which yields a graph database with node labels and data
+  flow annotations."""
+  with testing_databases.DatabaseContext(
+    graph_tuple_database.Database, request.param
+  ) as db:
+    random_graph_tuple_database_generator.PopulateWithTestSet(
+      db,
+      100,
+      node_x_dimensionality=2,
+      node_y_dimensionality=2,
+      with_data_flow=True,
+      split_count=3,
+    )
+    yield db
+
+
+@test.Fixture(scope="function")
+def model(
+  logger: logging.Logger, graph_db: graph_tuple_database.Database
+) -> ggnn.Ggnn:
+  """A test fixture which yields an initialized model."""
+  run_id = run_id_lib.RunId.GenerateUnique(
+    f"mock{random.randint(0, int(1e6)):06}"
+  )
+  model = ggnn.Ggnn(logger, graph_db, run_id=run_id)
+  model.Initialize()
+  return model
+
+
+###############################################################################
+# Tests.
+###############################################################################
+
+
+@test.Parametrize(
+  "unroll_strategy", ("none", "constant", "edge_count", "data_flow_max_steps")
+)
+def test_val_epoch_unroll_strategy_default_unroll_factor(
+  model: ggnn.Ggnn,
+  graph_db: graph_tuple_database.Database,
+  logger: logging.Logger,
+  unroll_strategy: str,
+):
+  """Test that every unroll strategy performs at least one unroll when
+  --unroll_factor is left at its default value."""
+  FLAGS.unroll_strategy = unroll_strategy
+  try:
+    batch_iterator = batch_iterator_lib.MakeBatchIterator(
+      model=model,
+      graph_db=graph_db,
+      splits={epoch.Type.TRAIN: [0], epoch.Type.VAL: [1], epoch.Type.TEST: [2],},
+      epoch_type=epoch.Type.VAL,
+    )
+    results = model(
+      epoch_type=epoch.Type.VAL, batch_iterator=batch_iterator, logger=logger,
+    )
+  finally:
+    FLAGS.unroll_strategy = "none"
+
+  assert results.batch_count
+  assert results.iteration_count >= model.message_passing_step_count
+
+
+@test.Parametrize("unroll_factor", (0, 0.5, 1))
+def test_GetUnrollFactor_constant_at_least_one(
+  model: ggnn.Ggnn, unroll_factor: float
+):
+  """Test that a constant unroll factor less than one is clamped to one."""
+  assert (
+    model.GetUnrollFactor(epoch.Type.VAL, None, "constant", unroll_factor) == 1
+  )
+
+
+def test_GetUnrollFactor_label_convergence_default_unroll_factor(
+  model: ggnn.Ggnn,
+):
+  """Test that label convergence rejects the default --unroll_factor."""
+  FLAGS.unroll_convergence_threshold = 0.05
+  try:
+    with test.Raises(app.UsageError) as e_ctx:
+      model.GetUnrollFactor(
+        epoch.Type.VAL, None, "label_convergence", FLAGS.unroll_factor
+      )
+    assert "--unroll_factor >= 1" in str(e_ctx.value)
+  finally:
+    FLAGS.unroll_convergence_threshold = 0.0
+
+
+def test_GetUnrollFactor_label_convergence(model: ggnn.Ggnn):
+  """Test that label convergence uses --unroll_factor as an upper bound."""
+  FLAGS.unroll_convergence_threshold = 0.05
+  try:
+    assert (
+      model.GetUnrollFactor(epoch.Type.VAL, None, "label_convergence", 5) == 5
+    )
+  finally:
+    FLAGS.unroll_convergence_threshold = 0.0
+
+
+if __name__ == "__main__":
+  test.Main()
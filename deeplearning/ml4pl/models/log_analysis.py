@@ -392,7 +392,9 @@ class WriteGraphsToFile(progress.Progress):
       )
 
       for i, batches in enumerate(
-        sqlutil.OffsetLimitBatchedQuery(query, batch_size=512)
+        sqlutil.OffsetLimitBatchedQuery(
+          query, batch_size=512, key_column=log_database.Batch.id
+        )
       ):
         for batch in batches.rows:
           self.ctx.i += batch.graph_count
@@ -21,6 +21,7 @@ from sqlalchemy.ext import declarative
 
 from deeplearning.ml4pl import run_id as run_id_lib
 from deeplearning.ml4pl.models import batch as batches
+from deeplearning.ml4pl.models import batch_details_store
 from deeplearning.ml4pl.models import checkpoints
 from deeplearning.ml4pl.models import epoch
 from labm8.py import app
@@ -41,6 +42,13 @@ app.DEFINE_boolean(
   "When //deeplearning/ml4pl/models:log_database is executed as a script, "
   "using this flag will prune any runs that do not have a checkpoint.",
 )
+app.DEFINE_boolean(
+  "backfill_epoch_stats",
+  False,
+  "When //deeplearning/ml4pl/models:log_database is executed as a script, "
+  "using this flag will compute the per-epoch stats of any epochs that were "
+  "logged before the epoch_stats table existed.",
+)
 app.DEFINE_list(
   "rm",
   [],
@@ -94,6 +102,11 @@ class RunId(Base, sqlutil.PluralTablenameFromCamelCapsClassNameMixin):
     back_populates="run_id_relationship",
     cascade="all, delete-orphan",
   )
+  epoch_stats: "EpochStats" = sql.orm.relationship(
+    "EpochStats",
+    back_populates="run_id_relationship",
+    cascade="all, delete-orphan",
+  )
 
   def __repr__(self):
     return str(self.run_id)
@@ -354,19 +367,39 @@ class Batch(Base, sqlutil.PluralTablenameFromCamelCapsClassNameMixin):
 
   @property
   def graph_ids(self) -> List[int]:
+    if self.details.columnar_path:
+      return self.columnar_details.graph_ids.tolist()
     return pickle.loads(self.details.binary_graph_ids)
 
   @property
   def true_y(self) -> Any:
+    if self.details.columnar_path:
+      return self.columnar_details.true_y
     return pickle.loads(codecs.decode(self.details.binary_true_y, "zlib"))
 
   @property
   def predictions(self) -> Any:
+    if self.details.columnar_path:
+      return self.columnar_details.predictions
     return pickle.loads(self.details.binary_predictions)
 
+  @property
+  def columnar_details(self) -> batch_details_store.BatchDetailsArrays:
+    """Read the details of a batch which were written to a columnar file.
+
+    The arrays are views of a memory mapped file.
+    """
+    return batch_details_store.ReadBatchDetails(
+      self.details.columnar_path, self.batch_num
+    )
+
 
 class BatchDetails(Base, sqlutil.TablenameFromCamelCapsClassNameMixin):
-  """The per-instance results of a batch."""
+  """The per-instance results of a batch.
+
+  The results are either stored in the binary columns of this table, or, if
+  columnar_path is set, in a file written by batch_details_store.
+  """
 
   id: int = sql.Column(
     sql.Integer,
@@ -378,7 +411,7 @@ class BatchDetails(Base, sqlutil.TablenameFromCamelCapsClassNameMixin):
   # deeplearning.ml4pl.graphs.labelled.graph_tuple_database.GraphTuple.id
   # values.
   binary_graph_ids: bytes = sql.Column(
-    sqlutil.ColumnTypes.LargeBinary(), nullable=False
+    sqlutil.ColumnTypes.LargeBinary(), nullable=True
   )
 
   # A pickled array of labels, of shape (target_count), dtype int32. The number
@@ -387,16 +420,20 @@ class BatchDetails(Base, sqlutil.TablenameFromCamelCapsClassNameMixin):
   # For node-level classification, there are
   # sum(graph.node_count for graph in batch.data) targets.
   binary_true_y: bytes = sql.Column(
-    sqlutil.ColumnTypes.LargeBinary(), nullable=False
+    sqlutil.ColumnTypes.LargeBinary(), nullable=True
   )
 
   # A pickled array of 1-hot model predictions, of shape
   # (target_count, y_dimensionality), dtype float32. See binary_true_y for a
   # description of target_count.
   binary_predictions: bytes = sql.Column(
-    sqlutil.ColumnTypes.LargeBinary(), nullable=False
+    sqlutil.ColumnTypes.LargeBinary(), nullable=True
   )
 
+  # The path of the batch_details_store chunk which contains the results, if
+  # they are not stored in the binary columns.
+  columnar_path: str = sql.Column(sql.String(1024), nullable=True)
+
   @classmethod
   def Create(cls, data: batches.Data, results: batches.Results):
     return cls(
@@ -408,6 +445,71 @@ class BatchDetails(Base, sqlutil.TablenameFromCamelCapsClassNameMixin):
     )
 
 
+###############################################################################
+# Epoch stats.
+###############################################################################
+
+
+class EpochStats(Base, sqlutil.TablenameFromCamelCapsClassNameMixin):
+  """The materialized per-epoch aggregates of the batches table.
+
+  A row is computed by Database.MaterializeEpochStats() once all of the batches
+  of an epoch have been logged. The metrics are weighted by target count, as
+  computed by Database.GetWeightedEpochStats(), which reads from this table
+  rather than aggregating the batches of epochs that have a row.
+  """
+
+  id: int = sql.Column(sql.Integer, primary_key=True)
+
+  # A string to uniquely identify the given experiment run.
+  run_id: int = sql.Column(
+    run_id_lib.RunId.SqlStringColumnType(),
+    sql.ForeignKey("run_ids.run_id", onupdate="CASCADE", ondelete="CASCADE"),
+    default=None,
+    index=True,
+    nullable=False,
+  )
+  run_id_relationship: RunId = sql.orm.relationship(
+    "RunId", back_populates="epoch_stats", uselist=False,
+  )
+
+  # The epoch number, >= 1.
+  epoch_num: int = sql.Column(sql.Integer, nullable=False)
+
+  # The numeric value of the epoch type.
+  epoch_type_num: int = sql.Column(sql.Integer, nullable=False)
+
+  # The timestamp of the first batch of the epoch.
+  timestamp: datetime.datetime = sqlutil.ColumnFactory.MillisecondDatetime()
+
+  # Sums of batch counts.
+  batch_count: int = sql.Column(sql.Integer, nullable=False)
+  graph_count: int = sql.Column(sql.Integer, nullable=False)
+  target_count: int = sql.Column(sql.Integer, nullable=False)
+
+  # Weighted averages of batch metrics.
+  iteration_count: float = sql.Column(sql.Float, nullable=True)
+  model_converged: float = sql.Column(sql.Float, nullable=True)
+  learning_rate: float = sql.Column(sql.Float, nullable=True)
+  loss: float = sql.Column(sql.Float, nullable=True)
+  accuracy: float = sql.Column(sql.Float, nullable=True)
+  precision: float = sql.Column(sql.Float, nullable=True)
+  recall: float = sql.Column(sql.Float, nullable=True)
+  f1: float = sql.Column(sql.Float, nullable=True)
+
+  # The sum of batch elapsed times, and the sum of batch elapsed times
+  # multiplied by their weight.
+  runtime_ms: int = sql.Column(sql.BigInteger, nullable=False)
+  weighted_runtime_ms: int = sql.Column(sql.BigInteger, nullable=False)
+
+  # Unique epochs.
+  __table_args__ = (
+    sql.UniqueConstraint(
+      "run_id", "epoch_num", "epoch_type_num", name="unique_epoch_stats"
+    ),
+  )
+
+
 ###############################################################################
 # Checkpoints.
 ###############################################################################
@@ -520,6 +622,63 @@ def database_statistic(func):
   return property(func)
 
 
+# The columns of the Batch table which identify an epoch.
+_EPOCH_KEY_COLUMNS = {"run_id", "epoch_num", "epoch_type_num"}
+
+
+def _IsEpochFilter(clause) -> bool:
+  """Return whether a filter on the Batch table selects whole epochs."""
+  return all(
+    element.name in _EPOCH_KEY_COLUMNS
+    for element in sql.sql.visitors.iterate(clause, {})
+    if isinstance(element, sql.Column) and element.table is Batch.__table__
+  )
+
+
+def _EpochKeysSubquery(
+  batch_filters: List[Callable[[], bool]],
+  session: sqlutil.Database.SessionType,
+):
+  """Return a subquery of the distinct epochs in the Batch table."""
+  query = session.query(
+    Batch.run_id, Batch.epoch_num, Batch.epoch_type_num
+  ).group_by(Batch.run_id, Batch.epoch_num, Batch.epoch_type_num)
+  for filter in batch_filters:
+    query = query.filter(filter())
+  return query.subquery()
+
+
+def _EpochStatsJoinCondition(epoch_keys):
+  """Return the condition to join EpochStats to an epoch keys subquery."""
+  return sql.and_(
+    EpochStats.run_id == epoch_keys.c.run_id,
+    EpochStats.epoch_num == epoch_keys.c.epoch_num,
+    EpochStats.epoch_type_num == epoch_keys.c.epoch_type_num,
+  )
+
+
+def _MissingEpochStatsQuery(
+  batch_filters: List[Callable[[], bool]],
+  session: sqlutil.Database.SessionType,
+):
+  """Return a query of the epochs in the Batch table with no EpochStats row."""
+  epoch_keys = _EpochKeysSubquery(batch_filters, session)
+  return (
+    session.query(
+      epoch_keys.c.run_id,
+      epoch_keys.c.epoch_num,
+      epoch_keys.c.epoch_type_num,
+    )
+    .outerjoin(EpochStats, _EpochStatsJoinCondition(epoch_keys))
+    .filter(EpochStats.id == None)
+  )
+
+
+def _FloatOrNone(value: Any) -> Optional[float]:
+  """Convert a data frame value to a float, or None if it is null."""
+  return None if pd.isnull(value) else float(value)
+
+
 class Database(sqlutil.Database):
   """A database of model logs."""
 
@@ -706,6 +865,12 @@ class Database(sqlutil.Database):
     Use this method to aggregate over the batches table with a consistent
     weighting strategy, don't roll your own implementation.
 
+    Epochs which have a row in the EpochStats table are read from that table,
+    and only the batches of the remaining epochs are aggregated. The EpochStats
+    table is used only when weighting by target count, and when the filters
+    select whole epochs, i.e. they filter only on the run ID, epoch number, and
+    epoch type columns.
+
     Args:
       batch_filters: An optional list of callbacks which return filters on the
         Batch table.
@@ -717,80 +882,12 @@ class Database(sqlutil.Database):
     """
     batch_filters = batch_filters or []
     with self.Session(session=session) as session:
-      # Compute per-epoch weighted metrics.
-      left = session.query(
-        Batch.run_id,
-        Batch.epoch_num,
-        Batch.epoch_type_num.label("epoch_type"),
-        sql.func.min(Batch.timestamp).label("timestamp"),
-        sql.func.count(Batch.run_id).label("batch_count"),
-        sql.func.sum(Batch.graph_count).label("graph_count"),
-        sql.func.sum(Batch.target_count).label("target_count"),
-        sql.func.avg(Batch.iteration_count * weight).label(
-          "weighted_iteration_count"
-        ),
-        sql.func.avg(Batch.model_converged * weight).label(
-          "weighted_model_converged"
-        ),
-        sql.func.avg(Batch.learning_rate * weight).label(
-          "weighted_learning_rate"
-        ),
-        sql.func.avg(Batch.loss * weight).label("weighted_loss"),
-        sql.func.sum(Batch.accuracy * weight).label("weighted_accuracy"),
-        sql.func.sum(Batch.precision * weight).label("weighted_precision"),
-        sql.func.sum(Batch.recall * weight).label("weighted_recall"),
-        sql.func.sum(Batch.f1 * weight).label("weighted_f1"),
-        sql.func.sum(Batch.elapsed_time_ms).label("runtime"),
-        sql.func.sum(Batch.elapsed_time_ms * weight).label("weighted_runtime"),
-      ).group_by(Batch.run_id, Batch.epoch_num, Batch.epoch_type_num)
-      for filter in batch_filters:
-        left = left.filter(filter())
-      left = left.subquery()
-
-      # Compute per-epoch weight sums.
-      right = session.query(
-        Batch.run_id,
-        Batch.epoch_num,
-        Batch.epoch_type_num.label("epoch_type"),
-        sql.func.sum(weight).label("weight"),
-      ).group_by(Batch.run_id, Batch.epoch_num, Batch.epoch_type_num)
-      for filter in batch_filters:
-        right = right.filter(filter())
-      right = right.subquery()
-
-      # Normalize the metrics by their weight.
-      query = session.query(
-        left.c.run_id,
-        left.c.epoch_num,
-        left.c.epoch_type,
-        left.c.timestamp,
-        left.c.batch_count,
-        left.c.graph_count,
-        left.c.target_count,
-        (left.c.weighted_iteration_count / right.c.weight).label(
-          "iteration_count"
-        ),
-        (left.c.weighted_model_converged / right.c.weight).label(
-          "model_converged"
-        ),
-        (left.c.weighted_learning_rate / right.c.weight).label("learning_rate"),
-        (left.c.weighted_loss / right.c.weight).label("loss"),
-        (left.c.weighted_accuracy / right.c.weight).label("accuracy"),
-        (left.c.weighted_precision / right.c.weight).label("precision"),
-        (left.c.weighted_recall / right.c.weight).label("recall"),
-        (left.c.weighted_f1 / right.c.weight).label("f1"),
-        left.c.runtime,
-        left.c.weighted_runtime,
-      ).join(
-        right,
-        sql.and_(
-          left.c.run_id == right.c.run_id,
-          left.c.epoch_num == right.c.epoch_num,
-          left.c.epoch_type == right.c.epoch_type,
-        ),
-      )
-
-      df = pdutil.QueryToDataFrame(session, query)
+      if weight is Batch.target_count and all(
+        _IsEpochFilter(filter()) for filter in batch_filters
+      ):
+        df = self._QueryMaterializedEpochStats(batch_filters, session)
+      else:
+        df = self._QueryWeightedEpochStats(batch_filters, weight, session)
 
     # Rewrite the epoch_type column to use the native enum type.
     pdutil.RewriteColumn(df, "epoch_type", lambda x: epoch.Type(x))
@@ -806,6 +903,274 @@ class Database(sqlutil.Database):
 
     return df
 
+  def MaterializeEpochStats(
+    self,
+    batch_filters: List[Callable[[], bool]] = None,
+    session: Optional[sqlutil.Database.SessionType] = None,
+  ) -> int:
+    """Compute and store the EpochStats rows of epochs.
+
+    Any existing rows for the epochs are replaced. Only materialize epochs
+    whose batches have all been logged, since rows are not updated when new
+    batches are added.
+
+    Args:
+      batch_filters: An optional list of callbacks which return filters on the
+        Batch table. The filters must select whole epochs.
+      session: An optional database session to re-use.
+
+    Returns:
+      The number of epochs that were materialized.
+    """
+    batch_filters = batch_filters or []
+    with self.Session(session=session, commit=True) as session:
+      df = self._QueryWeightedEpochStats(
+        batch_filters, Batch.target_count, session
+      )
+      for row in df.itertuples():
+        session.query(EpochStats).filter(
+          EpochStats.run_id == row.run_id,
+          EpochStats.epoch_num == row.epoch_num,
+          EpochStats.epoch_type_num == row.epoch_type,
+        ).delete(synchronize_session=False)
+      session.bulk_insert_mappings(
+        EpochStats,
+        [
+          {
+            "run_id": row.run_id,
+            "epoch_num": int(row.epoch_num),
+            "epoch_type_num": int(row.epoch_type),
+            "timestamp": row.timestamp,
+            "batch_count": int(row.batch_count),
+            "graph_count": int(row.graph_count),
+            "target_count": int(row.target_count),
+            "iteration_count": _FloatOrNone(row.iteration_count),
+            "model_converged": _FloatOrNone(row.model_converged),
+            "learning_rate": _FloatOrNone(row.learning_rate),
+            "loss": _FloatOrNone(row.loss),
+            "accuracy": _FloatOrNone(row.accuracy),
+            "precision": _FloatOrNone(row.precision),
+            "recall": _FloatOrNone(row.recall),
+            "f1": _FloatOrNone(row.f1),
+            "runtime_ms": int(row.runtime),
+            "weighted_runtime_ms": int(row.weighted_runtime),
+          }
+          for row in df.itertuples()
+        ],
+      )
+    return len(df)
+
+  def BackfillEpochStats(
+    self,
+    run_ids: Optional[List[run_id_lib.RunId]] = None,
+    session: Optional[sqlutil.Database.SessionType] = None,
+  ) -> int:
+    """Materialize the EpochStats rows of epochs which do not have one.
+
+    Use this to populate the EpochStats table of databases which were written
+    before it existed. Epochs which are still running should not be
+    backfilled, although their rows are replaced once they end.
+
+    Args:
+      run_ids: An optional list of run IDs to backfill. If not provided, all
+        runs are backfilled.
+      session: An optional database session to re-use.
+
+    Returns:
+      The number of epochs that were materialized.
+    """
+    if run_ids is not None and not run_ids:
+      return 0
+    elif run_ids:
+      run_id_strings = [str(run_id) for run_id in run_ids]
+      batch_filters = [lambda: Batch.run_id.in_(run_id_strings)]
+    else:
+      batch_filters = []
+
+    with self.Session(session=session, commit=True) as session:
+      # A map from run ID to the epoch numbers which have missing rows.
+      missing_epochs: Dict[str, Set[int]] = {}
+      for row in _MissingEpochStatsQuery(batch_filters, session):
+        missing_epochs.setdefault(row.run_id, set()).add(row.epoch_num)
+
+      epoch_count = 0
+      for run_id, epoch_nums in sorted(missing_epochs.items()):
+        epoch_count += self.MaterializeEpochStats(
+          [
+            lambda run_id=run_id: Batch.run_id == run_id,
+            lambda epoch_nums=epoch_nums: Batch.epoch_num.in_(epoch_nums),
+          ],
+          session=session,
+        )
+        # Commit each run so that progress is not lost if interrupted.
+        session.commit()
+        app.Log(
+          1,
+          "Backfilled %s of run %s",
+          humanize.Plural(len(epoch_nums), "epoch"),
+          run_id,
+        )
+    return epoch_count
+
+  def _QueryWeightedEpochStats(
+    self,
+    batch_filters: List[Callable[[], bool]],
+    weight: sql.Column,
+    session: sqlutil.Database.SessionType,
+  ) -> pd.DataFrame:
+    """Aggregate the batches table to compute per-epoch stats."""
+    # Compute per-epoch weighted metrics.
+    left = session.query(
+      Batch.run_id,
+      Batch.epoch_num,
+      Batch.epoch_type_num.label("epoch_type"),
+      sql.func.min(Batch.timestamp).label("timestamp"),
+      sql.func.count(Batch.run_id).label("batch_count"),
+      sql.func.sum(Batch.graph_count).label("graph_count"),
+      sql.func.sum(Batch.target_count).label("target_count"),
+      sql.func.avg(Batch.iteration_count * weight).label(
+        "weighted_iteration_count"
+      ),
+      sql.func.avg(Batch.model_converged * weight).label(
+        "weighted_model_converged"
+      ),
+      sql.func.avg(Batch.learning_rate * weight).label(
+        "weighted_learning_rate"
+      ),
+      sql.func.avg(Batch.loss * weight).label("weighted_loss"),
+      sql.func.sum(Batch.accuracy * weight).label("weighted_accuracy"),
+      sql.func.sum(Batch.precision * weight).label("weighted_precision"),
+      sql.func.sum(Batch.recall * weight).label("weighted_recall"),
+      sql.func.sum(Batch.f1 * weight).label("weighted_f1"),
+      sql.func.sum(Batch.elapsed_time_ms).label("runtime"),
+      sql.func.sum(Batch.elapsed_time_ms * weight).label("weighted_runtime"),
+    ).group_by(Batch.run_id, Batch.epoch_num, Batch.epoch_type_num)
+    for filter in batch_filters:
+      left = left.filter(filter())
+    left = left.subquery()
+
+    # Compute per-epoch weight sums.
+    right = session.query(
+      Batch.run_id,
+      Batch.epoch_num,
+      Batch.epoch_type_num.label("epoch_type"),
+      sql.func.sum(weight).label("weight"),
+    ).group_by(Batch.run_id, Batch.epoch_num, Batch.epoch_type_num)
+    for filter in batch_filters:
+      right = right.filter(filter())
+    right = right.subquery()
+
+    # Normalize the metrics by their weight.
+    query = session.query(
+      left.c.run_id,
+      left.c.epoch_num,
+      left.c.epoch_type,
+      left.c.timestamp,
+      left.c.batch_count,
+      left.c.graph_count,
+      left.c.target_count,
+      (left.c.weighted_iteration_count / right.c.weight).label(
+        "iteration_count"
+      ),
+      (left.c.weighted_model_converged / right.c.weight).label(
+        "model_converged"
+      ),
+      (left.c.weighted_learning_rate / right.c.weight).label("learning_rate"),
+      (left.c.weighted_loss / right.c.weight).label("loss"),
+      (left.c.weighted_accuracy / right.c.weight).label("accuracy"),
+      (left.c.weighted_precision / right.c.weight).label("precision"),
+      (left.c.weighted_recall / right.c.weight).label("recall"),
+      (left.c.weighted_f1 / right.c.weight).label("f1"),
+      left.c.runtime,
+      left.c.weighted_runtime,
+    ).join(
+      right,
+      sql.and_(
+        left.c.run_id == right.c.run_id,
+        left.c.epoch_num == right.c.epoch_num,
+        left.c.epoch_type == right.c.epoch_type,
+      ),
+    )
+
+    return pdutil.QueryToDataFrame(session, query)
+
+  def _QueryMaterializedEpochStats(
+    self,
+    batch_filters: List[Callable[[], bool]],
+    session: sqlutil.Database.SessionType,
+  ) -> pd.DataFrame:
+    """Read per-epoch stats from the EpochStats table, aggregating the batches
+    table only for epochs which are not materialized.
+    """
+    epoch_keys = _EpochKeysSubquery(batch_filters, session)
+    query = session.query(
+      EpochStats.run_id,
+      EpochStats.epoch_num,
+      EpochStats.epoch_type_num.label("epoch_type"),
+      EpochStats.timestamp,
+      EpochStats.batch_count,
+      EpochStats.graph_count,
+      EpochStats.target_count,
+      EpochStats.iteration_count,
+      EpochStats.model_converged,
+      EpochStats.learning_rate,
+      EpochStats.loss,
+      EpochStats.accuracy,
+      EpochStats.precision,
+      EpochStats.recall,
+      EpochStats.f1,
+      EpochStats.runtime_ms.label("runtime"),
+      EpochStats.weighted_runtime_ms.label("weighted_runtime"),
+    ).join(epoch_keys, _EpochStatsJoinCondition(epoch_keys))
+    df = pdutil.QueryToDataFrame(session, query)
+
+    # A map from run ID to the first epoch number which is not materialized.
+    missing_epochs: Dict[str, int] = {}
+    for row in _MissingEpochStatsQuery(batch_filters, session):
+      missing_epochs[row.run_id] = min(
+        row.epoch_num, missing_epochs.get(row.run_id, row.epoch_num)
+      )
+    if not missing_epochs:
+      return df
+
+    # Aggregate the batches of the runs which have missing epochs. Runs which
+    # have materialized epochs are aggregated starting at their first missing
+    # epoch, so that once a database has been backfilled, only the batches of
+    # running epochs are scanned.
+    materialized_run_ids = set(df["run_id"])
+    unmaterialized_run_ids = [
+      run_id for run_id in missing_epochs if run_id not in materialized_run_ids
+    ]
+    missing_conditions = [
+      sql.and_(Batch.run_id == run_id, Batch.epoch_num >= epoch_num)
+      for run_id, epoch_num in missing_epochs.items()
+      if run_id in materialized_run_ids
+    ]
+    # Avoid an empty IN clause when every run has materialized epochs.
+    if unmaterialized_run_ids:
+      missing_conditions.append(Batch.run_id.in_(unmaterialized_run_ids))
+    missing_df = self._QueryWeightedEpochStats(
+      batch_filters + [lambda: sql.or_(*missing_conditions)],
+      Batch.target_count,
+      session,
+    )
+    if not len(df):
+      return missing_df
+
+    # Discard the epochs which were read from the EpochStats table.
+    materialized = set(zip(df["run_id"], df["epoch_num"], df["epoch_type"]))
+    missing_df = missing_df[
+      [
+        key not in materialized
+        for key in zip(
+          missing_df["run_id"],
+          missing_df["epoch_num"],
+          missing_df["epoch_type"],
+        )
+      ]
+    ]
+    return pd.concat([df, missing_df], ignore_index=True)
+
   ############################################################################
   # Properties.
   ############################################################################
@@ -922,12 +1287,15 @@ class Database(sqlutil.Database):
     """
 
     def Copy(
-      query, session: sqlutil.Database.SessionType, batch_size: int = 512
+      query,
+      key_column,
+      session: sqlutil.Database.SessionType,
+      batch_size: int = 512,
     ):
       """Copy the results of the query to the destination session."""
       row_count = 0
       for chunk in sqlutil.OffsetLimitBatchedQuery(
-        query, batch_size=batch_size
+        query, batch_size=batch_size, key_column=key_column
       ):
         for row in chunk.rows:
           row_count += 1
@@ -954,6 +1322,9 @@ class Database(sqlutil.Database):
         .filter(Checkpoint.run_id.in_(run_id_strings))
         .options(sql.orm.joinedload(Checkpoint.data))
       )
+      src_epoch_stats = src.query(EpochStats).filter(
+        EpochStats.run_id.in_(run_id_strings)
+      )
 
       # Check for any runs that do not exist.
       missing_runs = run_id_strings - set(row.run_id for row in src_run_ids)
@@ -973,10 +1344,11 @@ class Database(sqlutil.Database):
 
       # Copy the tables.
       row_count = 0
-      row_count += Copy(src_run_ids, dst)
-      row_count += Copy(src_params, dst)
-      row_count += Copy(src_batches, dst)
-      row_count += Copy(src_checkpoints, dst)
+      row_count += Copy(src_run_ids, RunId.run_id, dst)
+      row_count += Copy(src_params, Parameter.id, dst)
+      row_count += Copy(src_batches, Batch.id, dst)
+      row_count += Copy(src_checkpoints, Checkpoint.id, dst)
+      row_count += Copy(src_epoch_stats, EpochStats.id, dst)
 
     return row_count
 
@@ -1288,6 +1660,14 @@ def Main():
         synchronize_session=False
       )
 
+  # Materialize the stats of epochs which were logged without them.
+  if FLAGS.backfill_epoch_stats:
+    app.Log(
+      1,
+      "Backfilled %s",
+      humanize.Plural(log_db.BackfillEpochStats(), "epoch stats row"),
+    )
+
   print(jsonutil.format_json(log_db.stats_json, default=DatetimeHandler))
 
 
@@ -1,4 +1,5 @@
 """Unit tests for //deeplearning/ml4pl/models:log_database."""
+import pathlib
 import random
 from typing import List
 from typing import NamedTuple
@@ -10,11 +11,15 @@ import sqlalchemy as sql
 
 from deeplearning.ml4pl import run_id
 from deeplearning.ml4pl.graphs.labelled import graph_tuple_database
+from deeplearning.ml4pl.models import batch as batches
+from deeplearning.ml4pl.models import batch_details_store
+from deeplearning.ml4pl.models import epoch
 from deeplearning.ml4pl.models import log_database
 from deeplearning.ml4pl.testing import random_graph_tuple_database_generator
 from deeplearning.ml4pl.testing import random_log_database_generator
 from deeplearning.ml4pl.testing import testing_databases
 from labm8.py import app
+from labm8.py import prof
 from labm8.py import test
 
 FLAGS = app.FLAGS
@@ -210,6 +215,47 @@ def test_Batch_cascaded_delete(two_run_id_session: DatabaseSessionWithRunLogs):
   )
 
 
+def test_Batch_columnar_details(
+  empty_db_session: log_database.Database.SessionType, tmp_path: pathlib.Path
+):
+  """Test reading the details of a batch from a columnar file."""
+  run = run_id.RunId.GenerateUnique("test")
+  data = batches.Data(graph_ids=[5, 6], data=None)
+  results = batches.Results.Create(
+    targets=np.array([[0, 1], [1, 0], [0, 1]]),
+    predictions=np.array([[0.25, 0.75], [0.5, 0.5], [1, 0]]),
+  )
+  store = batch_details_store.BatchDetailsStore(tmp_path)
+  details = log_database.BatchDetails(
+    columnar_path=store.Add(run, epoch.Type.TEST, 1, 1, data, results)
+  )
+  store.Close()
+
+  empty_db_session.add_all(
+    [
+      log_database.RunId(run_id=str(run)),
+      log_database.Batch.Create(
+        run_id=run,
+        epoch_type=epoch.Type.TEST,
+        epoch_num=1,
+        batch_num=1,
+        timer=prof.ProfileTimer(),
+        data=data,
+        results=results,
+        details=details,
+      ),
+    ]
+  )
+  empty_db_session.commit()
+
+  batch = empty_db_session.query(log_database.Batch).one()
+  assert batch.has_details
+  assert batch.details.binary_predictions is None
+  assert batch.graph_ids == [5, 6]
+  assert batch.true_y.tolist() == [1, 0, 1]
+  assert batch.predictions.tolist() == [[0.25, 0.75], [0.5, 0.5], [1, 0]]
+
+
 def test_RunId_cascaded_delete(two_run_id_session: DatabaseSessionWithRunLogs):
   """Test the deleting the RunId deletes all other entries."""
   session = two_run_id_session.session
@@ -395,6 +441,89 @@ def test_GetWeightedEpochStats_filter_all_results(
   )
 
 
+def AssertEpochStatsEqual(actual: pd.DataFrame, expected: pd.DataFrame):
+  """Assert that two tables of per-epoch stats are equal, ignoring order."""
+  assert len(actual) == len(expected)
+
+  def Sorted(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy()
+    df["epoch_type"] = [epoch_type.value for epoch_type in df["epoch_type"]]
+    return df.sort_values(["run_id", "epoch_num", "epoch_type"])
+
+  actual, expected = Sorted(actual), Sorted(expected)
+  for column in ["run_id", "epoch_num", "epoch_type", "timestamp"]:
+    assert actual[column].tolist() == expected[column].tolist()
+  for column in expected.columns.drop(
+    ["run_id", "epoch_num", "epoch_type", "timestamp"]
+  ):
+    np.testing.assert_allclose(
+      actual[column].values.astype(np.float64),
+      expected[column].values.astype(np.float64),
+      rtol=1e-5,
+    )
+
+
+def test_BackfillEpochStats(disposable_populated_log_db: DatabaseAndRunIds):
+  """Test that materialized epoch stats match the aggregated batches."""
+  db = disposable_populated_log_db.db
+  expected = db.GetWeightedEpochStats()
+
+  # An empty list of run IDs backfills nothing.
+  assert db.BackfillEpochStats(run_ids=[]) == 0
+  assert db.BackfillEpochStats() == len(expected)
+  # There is nothing left to backfill.
+  assert db.BackfillEpochStats() == 0
+  with db.Session() as session:
+    assert session.query(log_database.EpochStats).count() == len(expected)
+
+  AssertEpochStatsEqual(db.GetWeightedEpochStats(), expected)
+  # Filters on columns other than the epoch keys aggregate the batches.
+  AssertEpochStatsEqual(
+    db.GetWeightedEpochStats(
+      batch_filters=[lambda: log_database.Batch.graph_count >= 0]
+    ),
+    expected,
+  )
+
+
+def test_GetWeightedEpochStats_partially_materialized(
+  disposable_populated_log_db: DatabaseAndRunIds,
+):
+  """Test per-epoch stats when only some epochs are materialized."""
+  db = disposable_populated_log_db.db
+  expected = db.GetWeightedEpochStats()
+  run_id = str(disposable_populated_log_db.run_ids[0])
+  epoch_num = expected[expected["run_id"] == run_id]["epoch_num"].min()
+
+  assert db.MaterializeEpochStats(
+    [
+      lambda: log_database.Batch.run_id == run_id,
+      lambda: log_database.Batch.epoch_num == int(epoch_num),
+    ]
+  )
+
+  AssertEpochStatsEqual(db.GetWeightedEpochStats(), expected)
+  AssertEpochStatsEqual(
+    db.GetWeightedEpochStats(
+      batch_filters=[lambda: log_database.Batch.run_id == run_id]
+    ),
+    expected[expected["run_id"] == run_id],
+  )
+
+  # Materialize the first epoch of every run, so that no run is entirely
+  # unmaterialized.
+  for run_id in disposable_populated_log_db.run_ids:
+    run_id = str(run_id)
+    epoch_num = expected[expected["run_id"] == run_id]["epoch_num"].min()
+    db.MaterializeEpochStats(
+      [
+        lambda: log_database.Batch.run_id == run_id,
+        lambda: log_database.Batch.epoch_num == int(epoch_num),
+      ]
+    )
+  AssertEpochStatsEqual(db.GetWeightedEpochStats(), expected)
+
+
 def test_run_ids_list(disposable_populated_log_db: DatabaseAndRunIds,):
   """Test that the correct run IDs are returned."""
   assert set(disposable_populated_log_db.db.run_ids) == set(
@@ -2,6 +2,9 @@
 
 TODO: Detailed explanation of the file.
 """
+import os
+from typing import Dict
+from typing import List
 from typing import Optional
 
 import pandas as pd
@@ -11,6 +14,7 @@ import build_info
 from deeplearning.ml4pl import run_id as run_id_lib
 from deeplearning.ml4pl.graphs.labelled import graph_tuple_database
 from deeplearning.ml4pl.models import batch
+from deeplearning.ml4pl.models import batch_details_store
 from deeplearning.ml4pl.models import checkpoints
 from deeplearning.ml4pl.models import epoch
 from deeplearning.ml4pl.models import log_database
@@ -94,6 +98,13 @@ class Logger(object):
       max_seconds_since_flush=max_seconds_since_flush,
       log_level=log_level,
     )
+    # If set, detailed batch results are written to columnar files rather than
+    # the log database.
+    self.batch_details_store = batch_details_store.BatchDetailsStore.FromFlags()
+    # Batch logs whose detailed results are in a chunk which has not been
+    # written yet, keyed by chunk path. They are written once their chunk is,
+    # so that the log database never references a missing chunk.
+    self._batches_awaiting_chunk: Dict[str, List[log_database.Batch]] = {}
 
     # Build a set of epoch types to keep detailed batches for.
     self.detailed_batch_epoch_types = set()
@@ -116,6 +127,9 @@ class Logger(object):
     del exc_type
     del exc_val
     del exc_tb
+    if self.batch_details_store:
+      self.batch_details_store.Close()
+      self._AddBatchesOfWrittenChunks()
     self._writer.Close()
     self.CheckForError()
 
@@ -145,10 +159,9 @@ class Logger(object):
     """
     # Record the run ID and experimental parameters.
     flags = {k.split(".")[-1]: v for k, v in app.FlagsToDict().items()}
-    self._writer.AddMany(
-      # Record run ID.
-      [log_database.RunId(run_id=str(run_id))]
-      +
+    # Record run ID.
+    self._writer.AddOne(log_database.RunId(run_id=str(run_id)))
+    parameters = (
       # Record flag values.
       log_database.Parameter.CreateManyFromDict(
         run_id, log_database.ParameterType.FLAG, flags
@@ -168,6 +181,10 @@ class Logger(object):
         pbutil.ToJson(build_info.GetBuildInfo()),
       )
     )
+    self._writer.AddRows(
+      log_database.Parameter,
+      [sqlutil.RowFromMapped(parameter) for parameter in parameters],
+    )
 
   def OnBatchEnd(
     self,
@@ -179,23 +196,40 @@ class Logger(object):
     data: batch.Data,
     results: batch.Results,
   ):
-    if epoch_type in self.detailed_batch_epoch_types:
-      details = log_database.BatchDetails.Create(data=data, results=results)
-    else:
+    if epoch_type not in self.detailed_batch_epoch_types:
       details = None
-
-    self._writer.AddOne(
-      log_database.Batch.Create(
-        run_id=run_id,
-        epoch_type=epoch_type,
-        epoch_num=epoch_num,
-        batch_num=batch_num,
-        timer=timer,
-        data=data,
-        results=results,
-        details=details,
+    elif self.batch_details_store:
+      details = log_database.BatchDetails(
+        columnar_path=self.batch_details_store.Add(
+          run_id, epoch_type, epoch_num, batch_num, data, results
+        )
       )
+    else:
+      details = log_database.BatchDetails.Create(data=data, results=results)
+
+    batch_log = log_database.Batch.Create(
+      run_id=run_id,
+      epoch_type=epoch_type,
+      epoch_num=epoch_num,
+      batch_num=batch_num,
+      timer=timer,
+      data=data,
+      results=results,
+      details=details,
     )
+    if details and details.columnar_path:
+      self._batches_awaiting_chunk.setdefault(details.columnar_path, []).append(
+        batch_log
+      )
+      self._AddBatchesOfWrittenChunks()
+    elif details:
+      # The details reference the generated ID of the batch, so must be added
+      # through the ORM.
+      self._writer.AddOne(batch_log)
+    else:
+      self._writer.AddRows(
+        log_database.Batch, [sqlutil.RowFromMapped(batch_log)]
+      )
 
   def OnEpochEnd(
     self,
@@ -204,9 +238,25 @@ class Logger(object):
     epoch_num: epoch.Type,
     results: epoch.Results,
   ):
-    del epoch_type
     del results
 
+    if self.batch_details_store:
+      self.batch_details_store.FlushEpoch(run_id, epoch_type, epoch_num)
+      self._AddBatchesOfWrittenChunks()
+
+    # Materialize the stats of the epoch once all of its batches are written.
+    # Lambda ops run after the buffered batches that precede them.
+    self._writer.AddLambdaOp(
+      lambda session: self.db.MaterializeEpochStats(
+        [
+          lambda: log_database.Batch.run_id == str(run_id),
+          lambda: log_database.Batch.epoch_num == epoch_num,
+          lambda: log_database.Batch.epoch_type_num == epoch_type.value,
+        ],
+        session=session,
+      )
+    )
+
     schedule = FLAGS.keep_detailed_batches()
 
     if schedule == schedules.KeepDetailedBatches.NONE:
@@ -220,14 +270,33 @@ class Logger(object):
         detailed_batches_to_delete = [
           row.id
           for row in session.query(log_database.Batch.id).filter(
-            log_database.Batch.run_id == run_id,
+            log_database.Batch.run_id == str(run_id),
             log_database.Batch.epoch_num != epoch_num,
           )
         ]
         if detailed_batches_to_delete:
+          columnar_paths = {
+            row.columnar_path
+            for row in session.query(
+              log_database.BatchDetails.columnar_path
+            ).filter(
+              log_database.BatchDetails.id.in_(detailed_batches_to_delete),
+              log_database.BatchDetails.columnar_path != None,
+            )
+          }
           session.query(log_database.BatchDetails).filter(
             log_database.BatchDetails.id.in_(detailed_batches_to_delete)
           ).delete(synchronize_session=False)
+          for path in columnar_paths:
+            if os.path.isfile(path):
+              os.unlink(path)
+            # Remove the epoch directory once it is empty. The directory may
+            # already have been removed along with an earlier chunk.
+            try:
+              if not os.listdir(os.path.dirname(path)):
+                os.rmdir(os.path.dirname(path))
+            except FileNotFoundError:
+              pass
           self.ctx.Log(
             2,
             "Deleted %s old batch log details",
@@ -237,6 +306,14 @@ class Logger(object):
       self._writer.AddLambdaOp(DeleteOldDetailedBatchLogs)
       self.CheckForError()
 
+  def _AddBatchesOfWrittenChunks(self) -> None:
+    """Write the batch logs whose detailed results chunk has been written."""
+    for path in list(self._batches_awaiting_chunk):
+      if os.path.isfile(path):
+        # The details reference the generated ID of the batch, so must be
+        # added through the ORM.
+        self._writer.AddMany(self._batches_awaiting_chunk.pop(path))
+
   #############################################################################
   # Save and restore checkpoints.
   #############################################################################
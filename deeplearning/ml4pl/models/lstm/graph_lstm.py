@@ -57,17 +57,12 @@ class GraphLstmBatch(NamedTuple):
 
   # Shape (batch_size, padded_sequence_length, 1), dtype np.int32
   encoded_sequences: np.array
-<<<<<<< HEAD
   # Shape (batch_size, graph_x_dimensionality), dtype np.int64
-=======
-  # Shape (batch_size, graph_x_dimensionality), dtype np.int32
->>>>>>> 33703e4de... Split the LSTM into multiple modules.
   graph_x: np.array
   # Shape (batch_size, graph_y_dimensionality), dtype np.float32
   graph_y: np.array
 
   @property
-<<<<<<< HEAD
   def targets(self) -> np.array:
     """Return the targets for predictions.
     Shape (batch_size, graph_y_dimensionality)."""
@@ -92,15 +87,6 @@ class GraphLstmBatch(NamedTuple):
     del ctx  # Unused.
     return model_output[0]
 
-=======
-  def x(self):
-    return [self.encoded_sequences, self.graph_x]
-
-  @property
-  def y(self):
-    return [self.graph_y, self.graph_y]
-
->>>>>>> 33703e4de... Split the LSTM into multiple modules.
 
 class GraphLstm(lstm_base.LstmBase):
   """LSTM Model.
@@ -127,15 +113,11 @@ class GraphLstm(lstm_base.LstmBase):
   def CreateKerasModel(self) -> tf.compat.v1.keras.Model:
     """Construct the tensorflow computation graph."""
     sequence_input = tf.compat.v1.keras.layers.Input(
-      shape=(self.padded_sequence_length,), dtype="int32", name="sequence_in",
+      shape=(self.sequence_input_length,), dtype="int32", name="sequence_in",
     )
     graph_x_input = tf.compat.v1.keras.layers.Input(
       shape=(self.graph_db.graph_x_dimensionality,),
-<<<<<<< HEAD
       dtype="float32",
-=======
-      dtype="flaot32",
->>>>>>> 33703e4de... Split the LSTM into multiple modules.
       name="graph_x",
     )
 
@@ -144,7 +126,7 @@ class GraphLstm(lstm_base.LstmBase):
     # (y_dimensionality, lang_model_hidden_size).
     lang_model = tf.compat.v1.keras.layers.Embedding(
       input_dim=self.padded_vocabulary_size,
-      input_length=self.padded_sequence_length,
+      input_length=self.sequence_input_length,
       output_dim=FLAGS.lang_model_hidden_size,
       name="embedding",
     )(sequence_input)
@@ -218,41 +200,26 @@ class GraphLstm(lstm_base.LstmBase):
 
     graphs = self.GetBatchOfGraphs(graph_iterator)
     if not graphs:
-<<<<<<< HEAD
-      return batches.EndOfBatches()
-=======
       return batches.Data(graph_ids=[], data=None)
->>>>>>> 33703e4de... Split the LSTM into multiple modules.
 
     # Encode the graphs in the batch.
     encoded_sequences: List[np.array] = self.encoder.Encode(graphs, ctx=ctx)
-    graph_x: List[np.array] = []
-    graph_y: List[np.array] = []
-    for graph in graphs:
-      graph_x.append(graph.tuple.graph_x)
-      graph_y.append(graph.tuple.graph_y)
-
-    # Pad and truncate encoded sequences.
-    encoded_sequences = tf.keras.preprocessing.sequence.pad_sequences(
-      encoded_sequences,
-      maxlen=self.padded_sequence_length,
-      dtype="int32",
-      padding="pre",
-      truncating="post",
+
+    # Pad and truncate encoded sequences. The sequences are concatenated into
+    # a single buffer which is scattered into the padded array.
+    lengths = [len(encoded) for encoded in encoded_sequences]
+    encoded_sequences = utils.PadSequences(
+      np.concatenate(encoded_sequences).astype(np.int32),
+      lengths,
+      maxlen=self.GetPaddedSequenceLength(lengths),
       value=self.padding_element,
     )
 
     return batches.Data(
       graph_ids=[graph.id for graph in graphs],
       data=GraphLstmBatch(
-        encoded_sequences=np.vstack(encoded_sequences),
-        graph_x=np.vstack(graph_x),
-        graph_y=np.vstack(graph_y),
+        encoded_sequences=encoded_sequences,
+        graph_x=np.vstack([graph.tuple.graph_x for graph in graphs]),
+        graph_y=np.vstack([graph.tuple.graph_y for graph in graphs]),
       ),
     )
-<<<<<<< HEAD
-=======
-
-  def ReshapeLoss(self, loss):
-    return loss[0]
->>>>>>> 33703e4de... Split the LSTM into multiple modules.
@@ -1,18 +1,24 @@
 """Unit tests for //deeplearning/ml4pl/models/lstm:graph_lstm."""
+import pathlib
 import random
 import string
 from typing import List
 
+import numpy as np
+
 from datasets.opencl.device_mapping import opencl_device_mapping_dataset
 from deeplearning.ml4pl import run_id as run_id_lib
+from deeplearning.ml4pl.graphs.labelled import graph_database_reader
 from deeplearning.ml4pl.graphs.labelled import graph_tuple_database
 from deeplearning.ml4pl.graphs.labelled.devmap import make_devmap_dataset
 from deeplearning.ml4pl.ir import ir_database
 from deeplearning.ml4pl.models import batch_iterator as batch_iterator_lib
+from deeplearning.ml4pl.models import batch_producer
 from deeplearning.ml4pl.models import epoch
 from deeplearning.ml4pl.models import log_database
 from deeplearning.ml4pl.models import logger as logging
 from deeplearning.ml4pl.models.lstm import graph_lstm
+from deeplearning.ml4pl.models.lstm import lstm_base
 from deeplearning.ml4pl.testing import random_graph_tuple_database_generator
 from deeplearning.ml4pl.testing import testing_databases
 from labm8.py import test
@@ -164,6 +170,101 @@ def test_load_restore_model_from_checkpoint_smoke_test(
   model.RestoreFrom(checkpoint_ref)
 
 
+@test.Parametrize(
+  "max_length,bucket_count,bucket_lengths",
+  ((100, 0, []), (100, 1, [100]), (100, 3, [25, 50, 100]), (2, 4, [1, 2])),
+)
+def test_GetBucketLengths(
+  max_length: int, bucket_count: int, bucket_lengths: List[int]
+):
+  """Test the lengths of sequence length buckets."""
+  assert lstm_base.GetBucketLengths(max_length, bucket_count) == bucket_lengths
+
+
+def test_MakeBatch(
+  logger: logging.Logger,
+  graph_db: graph_tuple_database.Database,
+  ir_db: ir_database.Database,
+  graph_y_dimensionality: int,
+):
+  """Test the shapes of a graph classifier batch."""
+  run_id = run_id_lib.RunId.GenerateUnique(
+    f"mock{random.randint(0, int(1e6)):06}"
+  )
+
+  model = graph_lstm.GraphLstm(
+    logger,
+    graph_db,
+    ir_db=ir_db,
+    batch_size=8,
+    padded_sequence_length=100,
+    run_id=run_id,
+  )
+  model.Initialize()
+
+  graphs = list(graph_database_reader.BufferedGraphReader(graph_db, limit=5))
+  batch = model.MakeBatch(epoch.Type.TEST, iter(graphs))
+  assert batch.graph_ids == [graph.id for graph in graphs]
+  assert batch.data.encoded_sequences.shape == (5, model.padded_sequence_length)
+  assert batch.data.graph_x.shape == (5, 2)
+  assert batch.data.graph_y.shape == (5, graph_y_dimensionality)
+
+  # There are no more graphs to batch.
+  assert not model.MakeBatch(epoch.Type.TEST, iter([])).graph_count
+
+
+def test_MakeBatch_sequence_length_buckets(
+  logger: logging.Logger,
+  graph_db: graph_tuple_database.Database,
+  ir_db: ir_database.Database,
+):
+  """Test that bucketed batches are padded to the shortest bucket which fits
+  their longest sequence."""
+  run_id = run_id_lib.RunId.GenerateUnique(
+    f"mock{random.randint(0, int(1e6)):06}"
+  )
+
+  FLAGS.sequence_length_buckets = 3
+  try:
+    model = graph_lstm.GraphLstm(
+      logger,
+      graph_db,
+      ir_db=ir_db,
+      batch_size=4,
+      padded_sequence_length=100,
+      run_id=run_id,
+    )
+  finally:
+    FLAGS.sequence_length_buckets = 0
+  model.Initialize()
+
+  assert model.sequence_input_length is None
+  assert model.bucket_lengths == lstm_base.GetBucketLengths(
+    model.padded_sequence_length, 3
+  )
+
+  graphs = list(graph_database_reader.BufferedGraphReader(graph_db))
+  grouped_graphs = list(model.GroupGraphsByLength(graphs))
+  # Grouping reorders graphs, but does not drop any.
+  assert sorted(graph.id for graph in grouped_graphs) == sorted(
+    graph.id for graph in graphs
+  )
+
+  grouped_graphs = iter(grouped_graphs)
+  while True:
+    batch = model.MakeBatch(epoch.Type.TEST, grouped_graphs)
+    if not batch.graph_count:
+      break
+    padded_length = batch.data.encoded_sequences.shape[1]
+    assert padded_length in model.bucket_lengths
+    batch_graph_ids = set(batch.graph_ids)
+    batch_graphs = [graph for graph in graphs if graph.id in batch_graph_ids]
+    longest = max(model.encoder.GetEncodedLengths(batch_graphs))
+    # The batch is padded to the shortest bucket which fits, or truncated to
+    # the longest bucket.
+    assert padded_length == model.GetPaddedSequenceLength([longest])
+
+
 def test_classifier_call(
   epoch_type: epoch.Type,
   logger: logging.Logger,
@@ -206,5 +307,51 @@ def test_classifier_call(
     assert not results.has_loss
 
 
+def test_BatchProducer_encoded_sequence_store(
+  logger: logging.Logger,
+  graph_db: graph_tuple_database.Database,
+  ir_db: ir_database.Database,
+  tmp_path: pathlib.Path,
+):
+  """Test constructing batches on worker processes, and that the sequences
+  encoded by the workers are written to the store when they exit."""
+  run_id = run_id_lib.RunId.GenerateUnique(
+    f"mock{random.randint(0, int(1e6)):06}"
+  )
+
+  FLAGS.encoded_sequence_store = str(tmp_path / "store")
+  try:
+    model = graph_lstm.GraphLstm(
+      logger,
+      graph_db,
+      ir_db=ir_db,
+      batch_size=8,
+      padded_sequence_length=100,
+      run_id=run_id,
+    )
+  finally:
+    FLAGS.encoded_sequence_store = None
+  model.Initialize()
+
+  graphs = list(graph_database_reader.BufferedGraphReader(graph_db, limit=32))
+  with batch_producer.BatchProducer(
+    model, worker_count=2, chunk_size=8, shm_dir=str(tmp_path)
+  ) as producer:
+    batch_list = list(producer(epoch.Type.TEST, graphs))
+
+  # Only the workers have encoded sequences, and wrote them when they exited.
+  assert list((tmp_path / "store").glob("*/segment_*"))
+
+  # Batches match those constructed on this process.
+  expected_batch_list = list(model.BatchIterator(epoch.Type.TEST, iter(graphs)))
+  assert [batch.graph_ids for batch in batch_list] == [
+    batch.graph_ids for batch in expected_batch_list
+  ]
+  for batch, expected_batch in zip(batch_list, expected_batch_list):
+    assert np.array_equal(
+      batch.data.encoded_sequences, expected_batch.data.encoded_sequences
+    )
+
+
 if __name__ == "__main__":
   test.Main()
@@ -1,5 +1,7 @@
 """This module defines the abstract base class for LSTM models."""
+import bisect
 import io
+import itertools
 import pathlib
 import tempfile
 from typing import Any
@@ -7,6 +9,7 @@ from typing import Iterable
 from typing import List
 from typing import Optional
 
+import numpy as np
 import tensorflow as tf
 
 from deeplearning.ml4pl.graphs.labelled import graph_database_reader
@@ -36,6 +39,37 @@ app.DEFINE_integer(
   64,
   "The number of padded sequences to concatenate into a batch.",
 )
+app.DEFINE_integer(
+  "sequence_length_buckets",
+  0,
+  "If > 0, group graphs into batches of similar encoded length, and pad each "
+  "batch only to the shortest of this many bucket lengths that fits its "
+  "longest sequence. The bucket lengths are the padded sequence length, "
+  "halved repeatedly. If 0, every batch is padded to the padded sequence "
+  "length.",
+)
+app.DEFINE_integer(
+  "sequence_length_bucket_window",
+  16,
+  "Tuning parameter. When --sequence_length_buckets is set, graphs are read "
+  "in windows of this many batches before being grouped into buckets. Larger "
+  "windows produce fuller buckets, but graphs are reordered over a larger "
+  "range.",
+)
+
+
+def GetBucketLengths(max_length: int, bucket_count: int) -> List[int]:
+  """Return the lengths to pad bucketed batches to.
+
+  Args:
+    max_length: The length of the longest bucket.
+    bucket_count: The maximum number of buckets.
+
+  Returns:
+    A sorted list of up to bucket_count lengths, where each length is half of
+    the next, and the last is max_length.
+  """
+  return sorted({max(max_length >> i, 1) for i in range(bucket_count)})
 
 
 class LstmBase(classifier_base.ClassifierBase):
@@ -52,7 +86,6 @@ class LstmBase(classifier_base.ClassifierBase):
     super(LstmBase, self).__init__(*args, **kwargs)
 
     self.batch_size = batch_size or FLAGS.batch_size
-<<<<<<< HEAD
 
     # Determine the size of padded sequences. Use the requested
     # padded_sequence_length, or the maximum encoded length if it is shorter.
@@ -66,15 +99,12 @@ class LstmBase(classifier_base.ClassifierBase):
     # length.
     self.padded_sequence_length = min(
       self.padded_sequence_length, self.encoder.max_encoded_length
-=======
-    self.encoder = graph2seq_encoder or self.GetEncoder()
+    )
 
-    # Determine the size of padded sequences. Use the requested
-    # padded_sequence_length, or the maximum encoded length if it is shorter.
-    self.padded_sequence_length = min(
-      padded_sequence_length or FLAGS.padded_sequence_length,
-      self.encoder.max_encoded_length,
->>>>>>> 33703e4de... Split the LSTM into multiple modules.
+    # If set, batches are grouped by encoded length and padded to the
+    # shortest of these lengths which fits, rather than padded_sequence_length.
+    self.bucket_lengths = GetBucketLengths(
+      self.padded_sequence_length, FLAGS.sequence_length_buckets
     )
 
     # Reset any previous Tensorflow session. This is required when running
@@ -140,6 +170,30 @@ class LstmBase(classifier_base.ClassifierBase):
     )
     return buf.getvalue()
 
+  @property
+  def sequence_input_length(self) -> Optional[int]:
+    """Get the length of the model's sequence inputs.
+
+    If batches are bucketed by length, the same model is used for every bucket
+    length, so the length is None.
+    """
+    return None if self.bucket_lengths else self.padded_sequence_length
+
+  def GetPaddedSequenceLength(self, lengths: Iterable[int]) -> int:
+    """Return the length to pad a batch of encoded sequences to.
+
+    Args:
+      lengths: The lengths of the encoded sequences in the batch.
+
+    Returns:
+      The shortest bucket length which fits the longest sequence, or
+      padded_sequence_length if batches are not bucketed.
+    """
+    if not self.bucket_lengths:
+      return self.padded_sequence_length
+    i = bisect.bisect_left(self.bucket_lengths, max(lengths, default=0))
+    return self.bucket_lengths[min(i, len(self.bucket_lengths) - 1)]
+
   @property
   def padded_vocabulary_size(self) -> int:
     return self.encoder.vocabulary_size + 1
@@ -163,6 +217,67 @@ class LstmBase(classifier_base.ClassifierBase):
       graphs.append(graph)
     return graphs
 
+  def BatchIterator(
+    self,
+    epoch_type: epoch.Type,
+    graphs: Iterable[graph_tuple_database.GraphTuple],
+    ctx: progress.ProgressContext = progress.NullContext,
+  ) -> Iterable[batches.Data]:
+    """Generate model batches from a iterator of graphs.
+
+    If batches are bucketed by length, the graphs are reordered so that each
+    batch contains graphs of similar encoded lengths.
+    """
+    if self.bucket_lengths:
+      graphs = self.GroupGraphsByLength(graphs, ctx=ctx)
+    return super(LstmBase, self).BatchIterator(epoch_type, graphs, ctx=ctx)
+
+  def GroupGraphsByLength(
+    self,
+    graphs: Iterable[graph_tuple_database.GraphTuple],
+    ctx: progress.ProgressContext = progress.NullContext,
+  ) -> Iterable[graph_tuple_database.GraphTuple]:
+    """Reorder graphs into runs of batch_size graphs of similar lengths.
+
+    Graphs are assigned to the bucket of the shortest bucket length which fits
+    their encoded sequence. Whenever a bucket fills, its batch_size graphs are
+    produced. Once the input graphs are exhausted, the remaining graphs are
+    produced in order of increasing bucket length.
+
+    Args:
+      graphs: The graphs to reorder.
+      ctx: A logging context.
+
+    Returns:
+      An iterator over the reordered graphs.
+    """
+    buckets: List[List[graph_tuple_database.GraphTuple]] = [
+      [] for _ in self.bucket_lengths
+    ]
+    window_size = self.batch_size * FLAGS.sequence_length_bucket_window
+
+    graphs = iter(graphs)
+    while True:
+      window = list(itertools.islice(graphs, window_size))
+      if not window:
+        break
+
+      # Look up the lengths of the window of graphs at once.
+      lengths = self.encoder.GetEncodedLengths(window, ctx=ctx)
+      bucket_indices = np.minimum(
+        np.searchsorted(self.bucket_lengths, lengths),
+        len(self.bucket_lengths) - 1,
+      )
+      for graph, bucket_index in zip(window, bucket_indices):
+        bucket = buckets[bucket_index]
+        bucket.append(graph)
+        if len(bucket) == self.batch_size:
+          yield from bucket
+          bucket.clear()
+
+    for bucket in buckets:
+      yield from bucket
+
   def GetModelData(self) -> Any:
     """Get the model state."""
     # According to https://keras.io/getting-started/faq/, it is not recommended
@@ -202,7 +317,6 @@ class LstmBase(classifier_base.ClassifierBase):
   ) -> batches.Results:
     """Run a batch of data through the model.
 
-<<<<<<< HEAD
     Args:
       epoch_type: The type of the current epoch.
       batch: A batch of graphs and model data. This requires that batch data has
@@ -211,10 +325,6 @@ class LstmBase(classifier_base.ClassifierBase):
         method that recieves as input the data generated by model and returns
         a flattened array of the same shape as `targets`.
       ctx: A logging context.
-=======
-    This requires that batch data has 'x' and 'y' properties that return a list
-    of feature arrays and target arrays, respectively.
->>>>>>> 33703e4de... Split the LSTM into multiple modules.
     """
     # We can only get the loss on training.
     loss = None
@@ -223,7 +333,6 @@ class LstmBase(classifier_base.ClassifierBase):
       tf.compat.v1.keras.backend.set_session(self.session)
 
       if epoch_type == epoch.Type.TRAIN:
-<<<<<<< HEAD
         loss, *_ = self.model.train_on_batch(batch.data.x, batch.data.y)
 
       predictions = self.model.predict_on_batch(batch.data.x)
@@ -233,25 +342,3 @@ class LstmBase(classifier_base.ClassifierBase):
       predictions=batch.data.GetPredictions(predictions, ctx=ctx),
       loss=loss,
     )
-=======
-        loss = self.model.train_on_batch(batch.data.x, batch.data.y)
-        loss = self.ReshapeLoss(loss)
-
-      predictions = self.model.predict_on_batch(batch.data.x)
-
-    # TODO: Reshape the node-level predictions using node_indices so that
-    # we match the shape of the actual graphs, not just the nodes that
-    # we make predictions for.
-
-    return batches.Results.Create(
-      targets=self.ReshapeTargets(batch.data.y[0]),
-      predictions=self.ReshapeTargets(predictions),
-      loss=loss,
-    )
-
-  def ReshapeLoss(self, loss):
-    return loss[0]
-
-  def ReshapeTargets(self, targets):
-    return targets
->>>>>>> 33703e4de... Split the LSTM into multiple modules.
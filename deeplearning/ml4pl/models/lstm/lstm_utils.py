@@ -9,6 +9,7 @@ import keras
 
 sys.stderr = stderr
 
+import numpy as np
 import tensorflow as tf
 
 from labm8.py import app
@@ -107,3 +108,56 @@ def SliceToSizeLayer(
   return tf.compat.v1.keras.layers.Lambda(SliceToSize)(
     [segmented_input, selector_vector]
   )
+
+
+def PositionsInGroups(lengths: np.array) -> np.array:
+  """Return the position of each element within consecutive groups.
+
+  For example, groups of lengths [2, 3, 1] produce positions:
+  [0, 1, 0, 1, 2, 0].
+
+  Args:
+    lengths: The length of each group.
+
+  Returns:
+    An array of shape (sum(lengths)), dtype np.int64.
+  """
+  lengths = np.asarray(lengths, dtype=np.int64)
+  starts = np.cumsum(lengths) - lengths
+  return np.arange(lengths.sum(), dtype=np.int64) - np.repeat(starts, lengths)
+
+
+def PadSequences(
+  values: np.array, lengths: np.array, maxlen: int, value
+) -> np.array:
+  """Pad and truncate a batch of concatenated sequences to the same length.
+
+  This is equivalent to calling tf.keras.preprocessing.sequence.pad_sequences()
+  with padding="pre" and truncating="post" on the list of sequences, but
+  operates on a single buffer of concatenated sequences, so the cost does not
+  grow with the number of sequences.
+
+  Args:
+    values: The concatenated sequences, of shape (sum(lengths), ...).
+    lengths: The length of each sequence.
+    maxlen: The length to pad and truncate sequences to.
+    value: The padding value, which is broadcast to the shape of an element.
+
+  Returns:
+    An array of shape (len(lengths), maxlen, ...), with the dtype of values.
+  """
+  lengths = np.asarray(lengths, dtype=np.int64)
+  padded = np.empty(
+    (len(lengths), maxlen) + values.shape[1:], dtype=values.dtype
+  )
+  padded[:] = value
+
+  # Scatter the first maxlen elements of each sequence into its row, after the
+  # padding.
+  rows = np.repeat(np.arange(len(lengths)), lengths)
+  positions = PositionsInGroups(lengths)
+  keep = positions < maxlen
+  rows, positions = rows[keep], positions[keep]
+  padding = maxlen - np.minimum(lengths, maxlen)
+  padded[rows, padding[rows] + positions] = values[keep]
+  return padded
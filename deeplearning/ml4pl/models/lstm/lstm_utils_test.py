@@ -0,0 +1,53 @@
+"""Unit tests for //deeplearning/ml4pl/models/lstm:lstm_utils."""
+import numpy as np
+import tensorflow as tf
+
+from deeplearning.ml4pl.models.lstm import lstm_utils
+from labm8.py import test
+
+FLAGS = test.FLAGS
+
+
+def test_PositionsInGroups():
+  """Test the positions of elements in groups."""
+  assert lstm_utils.PositionsInGroups([2, 3, 1]).tolist() == [0, 1, 0, 1, 2, 0]
+  assert lstm_utils.PositionsInGroups([0, 2, 0]).tolist() == [0, 1]
+  assert lstm_utils.PositionsInGroups([]).tolist() == []
+
+
+@test.Parametrize("maxlen", (0, 1, 3, 10))
+def test_PadSequences_equivalent_to_keras(maxlen: int):
+  """Test that padding is the same as keras' pad_sequences()."""
+  sequences = [
+    np.random.randint(0, 10, size=length, dtype=np.int32)
+    for length in (5, 0, 3, 1, 12)
+  ]
+  lengths = [len(s) for s in sequences]
+  padded = lstm_utils.PadSequences(
+    np.concatenate(sequences), lengths, maxlen, -1
+  )
+  expected = tf.keras.preprocessing.sequence.pad_sequences(
+    sequences,
+    maxlen=maxlen,
+    dtype="int32",
+    padding="pre",
+    truncating="post",
+    value=-1,
+  )
+  assert padded.dtype == np.int32
+  assert padded.tolist() == expected.tolist()
+
+
+def test_PadSequences_vector_elements():
+  """Test padding sequences of vectors."""
+  values = np.arange(10, dtype=np.int32).reshape(5, 2)
+  padded = lstm_utils.PadSequences(values, [1, 4], 3, np.array([-1, -2]))
+  assert padded.shape == (2, 3, 2)
+  assert padded.tolist() == [
+    [[-1, -2], [-1, -2], [0, 1]],
+    [[2, 3], [4, 5], [6, 7]],
+  ]
+
+
+if __name__ == "__main__":
+  test.Main()
@@ -3,27 +3,16 @@ from typing import Iterable
 from typing import List
 from typing import NamedTuple
 from typing import Optional
-<<<<<<< HEAD
 
-=======
->>>>>>> 33703e4de... Split the LSTM into multiple modules.
 import numpy as np
 import tensorflow as tf
 
 from deeplearning.ml4pl.graphs.labelled import graph_tuple_database
-<<<<<<< HEAD
 from deeplearning.ml4pl.graphs.unlabelled import unlabelled_graph_database
 from deeplearning.ml4pl.models import batch as batches
 from deeplearning.ml4pl.models import epoch
 from deeplearning.ml4pl.models.lstm import lstm_base
 from deeplearning.ml4pl.models.lstm import lstm_utils as utils
-=======
-from deeplearning.ml4pl.models import batch as batches
-from deeplearning.ml4pl.models import epoch
-from deeplearning.ml4pl.graphs.unlabelled import unlabelled_graph_database
-from deeplearning.ml4pl.models.lstm import lstm_utils as utils
-from deeplearning.ml4pl.models.lstm import lstm_base
->>>>>>> 33703e4de... Split the LSTM into multiple modules.
 from deeplearning.ml4pl.seq import graph2seq
 from labm8.py import app
 from labm8.py import progress
@@ -32,17 +21,10 @@ from labm8.py import progress
 FLAGS = app.FLAGS
 
 app.DEFINE_integer(
-<<<<<<< HEAD
   "padded_node_sequence_length",
   5000,
   "For node-level models, the padded/truncated length of encoded node "
   "sequences.",
-=======
-    "padded_nodes_sequence_length",
-    5000,
-    "For node-level models, the padded/truncated length of encoded node "
-    "sequences.",
->>>>>>> 33703e4de... Split the LSTM into multiple modules.
 )
 
 
@@ -53,7 +35,6 @@ class NodeLstmBatch(NamedTuple):
   encoded_sequences: np.array
   # Shape (batch_size, padded_sequence_length, 1), dtype np.int32
   segment_ids: np.array
-<<<<<<< HEAD
   # Shape (batch_size, padded_node_sequence_length, 2), dtype np.int32
   selector_vectors: np.array
   # Shape (batch_size, padded_node_sequence_length, node_y_dimensionality),
@@ -113,73 +94,32 @@ class NodeLstmBatch(NamedTuple):
     )
     return predictions
 
-=======
-  # Shape (batch_size, padded_nodes_sequence_length, 2), dtype np.int32
-  selector_vectors: np.array
-  # Shape (batch_size, padded_nodes_sequence_length, node_y_dimensionality),
-  # dtype np.float32
-  node_y: np.array
-
-  # A list of indices into the graph nodes for the nodes that are encoded.
-  # Shape (batch_size, ?),
-  node_indices: List[np.array]
-
-  @property
-  def x(self):
-    return [self.encoded_sequences, self.segment_ids, self.selector_vectors]
-
-  @property
-  def y(self):
-    return [self.node_y]
-
->>>>>>> 33703e4de... Split the LSTM into multiple modules.
 
 class NodeLstm(lstm_base.LstmBase):
   """An LSTM model for node-level classification."""
 
   def __init__(
-<<<<<<< HEAD
     self,
     *args,
     padded_node_sequence_length: Optional[int] = None,
     proto_db: Optional[unlabelled_graph_database.Database] = None,
     **kwargs,
-=======
-      self,
-      *args,
-      padded_nodes_sequence_length: Optional[int] = None,
-      proto_db: Optional[unlabelled_graph_database.Database] = None,
-      **kwargs,
->>>>>>> 33703e4de... Split the LSTM into multiple modules.
   ):
     if not proto_db and not FLAGS.proto_db:
       raise app.UsageError("--proto_db is required for node level models")
     self._proto_db = proto_db or FLAGS.proto_db()
 
     # Determine the maximum node sequence length.
-<<<<<<< HEAD
     self._padded_node_sequence_length = padded_node_sequence_length
 
     super(NodeLstm, self).__init__(*args, **kwargs)
 
-=======
-    self._padded_nodes_sequence_length = padded_nodes_sequence_length
-
-    super(NodeLstm, self).__init__(*args, **kwargs)
-
-
->>>>>>> 33703e4de... Split the LSTM into multiple modules.
   @property
   def padded_node_sequence_length(self) -> int:
     """Get the length of padded node sequences."""
     return min(
-<<<<<<< HEAD
       self.padded_sequence_length,
       self._padded_node_sequence_length or FLAGS.padded_node_sequence_length,
-=======
-        self.padded_sequence_length,
-        self._padded_nodes_sequence_length or FLAGS.padded_nodes_sequence_length,
->>>>>>> 33703e4de... Split the LSTM into multiple modules.
     )
 
   @property
@@ -191,13 +131,12 @@ class NodeLstm(lstm_base.LstmBase):
   def CreateKerasModel(self) -> tf.compat.v1.keras.Model:
     """Construct the tensorflow computation graph."""
     sequence_input = tf.compat.v1.keras.layers.Input(
-<<<<<<< HEAD
-      batch_shape=(self.batch_size, self.padded_sequence_length,),
+      batch_shape=(self.batch_size, self.sequence_input_length,),
       dtype="int32",
       name="sequence_in",
     )
     segment_ids = tf.compat.v1.keras.layers.Input(
-      batch_shape=(self.batch_size, self.padded_sequence_length,),
+      batch_shape=(self.batch_size, self.sequence_input_length,),
       dtype="int32",
       name="segment_ids",
     )
@@ -205,28 +144,12 @@ class NodeLstm(lstm_base.LstmBase):
       batch_shape=(self.batch_size, None, 2),
       dtype="float32",
       name="selector_vector",
-=======
-        batch_shape=(self.batch_size, self.padded_sequence_length,),
-        dtype="int32",
-        name="sequence_in",
-    )
-    segment_ids = tf.compat.v1.keras.layers.Input(
-        batch_shape=(self.batch_size, self.padded_sequence_length,),
-        dtype="int32",
-        name="segment_ids",
-    )
-    selector_vector = tf.compat.v1.keras.layers.Input(
-        batch_shape=(self.batch_size, None, 2),
-        dtype="float32",
-        name="selector_vector",
->>>>>>> 33703e4de... Split the LSTM into multiple modules.
     )
 
     # Embed the sequence inputs and sum the embeddings by nodes.
     embedded_inputs = tf.compat.v1.keras.layers.Embedding(
-<<<<<<< HEAD
       input_dim=self.padded_vocabulary_size,
-      input_length=self.padded_sequence_length,
+      input_length=self.sequence_input_length,
       output_dim=FLAGS.lang_model_hidden_size,
       name="embedding",
     )(sequence_input)
@@ -247,35 +170,10 @@ class NodeLstm(lstm_base.LstmBase):
     )
     lang_model_input = tf.compat.v1.keras.layers.Concatenate(
       axis=2, name="segmented_inputs_and_selector_vectors"
-=======
-        input_dim=self.padded_vocabulary_size,
-        input_length=self.padded_sequence_length,
-        output_dim=FLAGS.lang_model_hidden_size,
-        name="embedding",
-    )(sequence_input)
-
-    segmented_input = utils.SegmentSumLayer(
-        encoded_sequences=embedded_inputs,
-        segment_ids=segment_ids,
-        batch_size=self.batch_size,
-        max_sequence_length=self.padded_sequence_length,
-        max_output_sequence_length=self.graph_db.node_count_max,
-    )
-    # Because padded values in segment_ids have value, the segment sum emits a
-    # tensor of shape [B, padded_nodes_sequence_length + 1, 64] IFF something
-    # was padded and [B, padded_nodes_sequence_length, 64] otherwise. We want
-    # to discard the + 1 guy because that is just summed padded tokens anyway.
-    segmented_input = utils.SliceToSizeLayer(
-        segmented_input=segmented_input, selector_vector=selector_vector
-    )
-    lang_model_input = tf.compat.v1.keras.layers.Concatenate(
-        axis=2, name="segmented_inputs_and_selector_vectors"
->>>>>>> 33703e4de... Split the LSTM into multiple modules.
     )([segmented_input, selector_vector],)
 
     # Make the language model.
     lang_model = utils.LstmLayer(
-<<<<<<< HEAD
       FLAGS.lang_model_hidden_size, return_sequences=True, name="lstm_1"
     )(lang_model_input)
     lang_model = utils.LstmLayer(
@@ -299,31 +197,6 @@ class NodeLstm(lstm_base.LstmBase):
       metrics=["accuracy"],
       loss=["categorical_crossentropy"],
       loss_weights=[1.0],
-=======
-        FLAGS.lang_model_hidden_size, return_sequences=True, name="lstm_1"
-    )(lang_model_input)
-    lang_model = utils.LstmLayer(
-        FLAGS.lang_model_hidden_size,
-        return_sequences=True,
-        return_state=False,
-        name="lstm_2",
-    )(lang_model)
-
-    node_out = tf.compat.v1.keras.layers.Dense(
-        self.graph_db.node_y_dimensionality,
-        activation="sigmoid",
-        name="node_out",
-    )(lang_model)
-
-    model = tf.compat.v1.keras.Model(
-        inputs=[sequence_input, segment_ids, selector_vector], outputs=[node_out],
-    )
-    model.compile(
-        optimizer="adam",
-        metrics=["accuracy"],
-        loss=["categorical_crossentropy"],
-        loss_weights=[1.0],
->>>>>>> 33703e4de... Split the LSTM into multiple modules.
     )
 
     return model
@@ -331,7 +204,6 @@ class NodeLstm(lstm_base.LstmBase):
   def GetEncoder(self) -> graph2seq.EncoderBase:
     """Construct the graph encoder."""
     if not (
-<<<<<<< HEAD
       self.graph_db.node_y_dimensionality
       and self.graph_db.node_x_dimensionality == 2
       and self.graph_db.graph_y_dimensionality == 0
@@ -340,10 +212,7 @@ class NodeLstm(lstm_base.LstmBase):
         f"Unsupported graph dimensionalities: {self.graph_db}"
       )
     return graph2seq.StatementEncoder(
-      graph_db=self.graph_db,
-      proto_db=self._proto_db,
-      max_encoded_length=self.padded_sequence_length,
-      max_nodes=self.padded_node_sequence_length,
+      graph_db=self.graph_db, proto_db=self._proto_db
     )
 
   def MakeBatch(
@@ -351,22 +220,6 @@ class NodeLstm(lstm_base.LstmBase):
     epoch_type: epoch.Type,
     graphs: Iterable[graph_tuple_database.GraphTuple],
     ctx: progress.ProgressContext = progress.NullContext,
-=======
-        self.graph_db.node_y_dimensionality
-        and self.graph_db.node_x_dimensionality == 2
-        and self.graph_db.graph_y_dimensionality == 0
-    ):
-      raise app.UsageError(f"Unsupported graph dimensionalities: {self.graph_db}")
-    return graph2seq.StatementEncoder(
-        graph_db=self.graph_db, proto_db=self._proto_db
-    )
-
-  def MakeBatch(
-      self,
-      epoch_type: epoch.Type,
-      graphs: Iterable[graph_tuple_database.GraphTuple],
-      ctx: progress.ProgressContext = progress.NullContext,
->>>>>>> 33703e4de... Split the LSTM into multiple modules.
   ) -> batches.Data:
     """Create a mini-batch of LSTM data."""
     del epoch_type  # Unused.
@@ -376,26 +229,9 @@ class NodeLstm(lstm_base.LstmBase):
     # In the future we could work around this by padding an incomplete
     # batch with arrays of zeros.
     if not graphs or len(graphs) != self.batch_size:
-<<<<<<< HEAD
-      return batches.EndOfBatches()
-=======
       return batches.Data(graph_ids=[], data=None)
->>>>>>> 33703e4de... Split the LSTM into multiple modules.
 
     # Encode the graphs in the batch.
-
-    # A list of arrays of shape (node_count, 1)
-    encoded_sequences: List[np.array] = []
-    # A list of arrays of shape (node_count, 1)
-    segment_ids: List[np.array] = []
-    # A list of arrays of shape (node_mask_count, 2)
-    selector_vectors: List[np.array] = []
-    # A list of arrays of shape (node_mask_count, node_y_dimensionality)
-    node_y: List[np.array] = []
-<<<<<<< HEAD
-    all_node_indices: List[np.array] = []
-    targets: List[np.array] = []
-
     try:
       encoded_graphs = self.encoder.Encode(graphs, ctx=ctx)
     except ValueError as e:
@@ -408,172 +244,115 @@ class NodeLstm(lstm_base.LstmBase):
       # data.
       return batches.Data(graph_ids=[], data=None)
 
-    node_offset = 0
-    # Convert ProgramGraphSeq protos to arrays of numeric values.
-    for graph, seq in zip(graphs, encoded_graphs):
-=======
-    node_indices: List[np.array] = []
-
-    # Convert ProgramGraphSeq protos to arrays of numeric values.
-    for graph, seq in zip(graphs, self.encoder.Encode(graphs, ctx=ctx)):
->>>>>>> 33703e4de... Split the LSTM into multiple modules.
-      # Skip empty graphs.
-      if not seq.encoded:
-        continue
-
-      encoded_sequences.append(np.array(seq.encoded, dtype=np.int32))
-
-      # Construct a list of segment IDs using the encoded node lengths,
-      # e.g. for encoded node lengths [2, 3, 1], produce segment IDs:
-      # [0, 0, 1, 1, 1, 2].
-<<<<<<< HEAD
-      out_of_range_segment = self.padded_node_sequence_length - 1
-      segment_ids.append(
-        np.concatenate(
-          [
-            np.ones(encoded_node_length, dtype=np.int32)
-            * min(segment_id, out_of_range_segment)
-            for segment_id, encoded_node_length in enumerate(
-              seq.encoded_node_length
-            )
-          ]
-        )
-=======
-      out_of_range_segment = self.padded_nodes_sequence_length - 1
-      segment_ids.append(
-          np.concatenate(
-              [
-                np.ones(encoded_node_length, dtype=np.int32)
-                * min(segment_id, out_of_range_segment)
-                for segment_id, encoded_node_length in enumerate(
-                  seq.encoded_node_length
-              )
-              ]
-          )
->>>>>>> 33703e4de... Split the LSTM into multiple modules.
-      )
-
-      # Get the list of graph node indices that produced the serialized encoded
-      # graph representation. We use this to construct predictions for the
-      # "full" graph through padding.
-<<<<<<< HEAD
-      node_indices = np.array(seq.node, dtype=np.int32)
-
-      # Offset the node index list and concatenate.
-      all_node_indices.append(node_indices + node_offset)
-
-      # Sanity check that the node indices are in-range for this graph.
-      assert len(graph.tuple.node_x) >= max(node_indices)
-
-      # Use only the 'binary selector' feature and convert to an array of
-      # 1 hot binary vectors.
-      node_selectors = graph.tuple.node_x[:, 1][node_indices]
-=======
-      seq_node_indices = np.array(seq.node, dtype=np.int32)
-      node_indices.append(seq_node_indices)
-
-      # Sanity check that the node indices are in-range for this graph.
-      assert len(graph.tuple.node_x) >= max(seq_node_indices)
-
-      # Use only the 'binary selector' feature and convert to an array of
-      # 1 hot binary vectors.
-      node_selectors = graph.tuple.node_x[:, 1][seq_node_indices]
->>>>>>> 33703e4de... Split the LSTM into multiple modules.
-      node_selector_vectors = np.zeros((node_selectors.size, 2), dtype=np.int32)
-      node_selector_vectors[np.arange(node_selectors.size), node_selectors] = 1
-      selector_vectors.append(node_selector_vectors)
-
-      # Select the node targets for only the active nodes.
-<<<<<<< HEAD
-      node_y.append(graph.tuple.node_y[node_indices])
-      targets.append(graph.tuple.node_y)
-
-      # Increment out node offset for concatenating the list of node indices.
-      node_offset += graph.node_count
+    # Skip empty graphs.
+    graph_tuples = [
+      graph.tuple
+      for graph, seq in zip(graphs, encoded_graphs)
+      if len(seq.encoded)
+    ]
+    encoded_graphs = [seq for seq in encoded_graphs if len(seq.encoded)]
+
+    # Convert the encoded graphs to arrays of numeric values for the entire
+    # batch at once. Each per-graph array is concatenated into a single array,
+    # and the length of each graph's array is recorded.
+    encoded = np.concatenate([seq.encoded for seq in encoded_graphs]).astype(
+      np.int32
+    )
+    encoded_lengths = [len(seq.encoded) for seq in encoded_graphs]
+    encoded_node_lengths = np.concatenate(
+      [seq.encoded_node_length for seq in encoded_graphs]
+    )
+    encoded_node_counts = [
+      len(seq.encoded_node_length) for seq in encoded_graphs
+    ]
+    segment_lengths = [
+      int(np.sum(seq.encoded_node_length)) for seq in encoded_graphs
+    ]
+
+    # Construct a list of segment IDs using the encoded node lengths,
+    # e.g. for encoded node lengths [2, 3, 1], produce segment IDs:
+    # [0, 0, 1, 1, 1, 2].
+    out_of_range_segment = self.padded_node_sequence_length - 1
+    segment_ids = np.repeat(
+      np.minimum(
+        utils.PositionsInGroups(encoded_node_counts), out_of_range_segment
+      ),
+      encoded_node_lengths,
+    ).astype(np.int32)
+
+    # Get the list of graph node indices that produced the serialized encoded
+    # graph representation. We use this to construct predictions for the
+    # "full" graph through padding.
+    node_indices = np.concatenate(
+      [seq.node for seq in encoded_graphs]
+    ).astype(np.int32)
+    node_index_lengths = [len(seq.node) for seq in encoded_graphs]
+    node_counts = np.array([len(t.node_x) for t in graph_tuples])
+
+    # Sanity check that the node indices are in-range for their graphs.
+    assert np.all(node_indices <= np.repeat(node_counts, node_index_lengths))
+
+    # Offset the node indices of each graph to index into the concatenated
+    # nodes of the batch.
+    node_offsets = np.cumsum(node_counts) - node_counts
+    batch_node_indices = node_indices + np.repeat(
+      node_offsets, node_index_lengths
+    ).astype(np.int32)
+
+    # Use only the 'binary selector' feature and convert to an array of
+    # 1 hot binary vectors. The selectors and node targets for the active
+    # nodes of every graph are gathered with a single index.
+    node_selectors = np.concatenate([t.node_x[:, 1] for t in graph_tuples])
+    selector_vectors = np.eye(2, dtype=np.int32)[
+      node_selectors[batch_node_indices]
+    ]
+    all_node_y = np.vstack([t.node_y for t in graph_tuples])
+    node_y = all_node_y[batch_node_indices].astype(np.int32)
 
     # Pad and truncate encoded sequences.
-    encoded_sequences = tf.keras.preprocessing.sequence.pad_sequences(
-      encoded_sequences,
-      maxlen=self.padded_sequence_length,
-      dtype="int32",
-      padding="pre",
-      truncating="post",
+    padded_sequence_length = self.GetPaddedSequenceLength(encoded_lengths)
+    encoded_sequences = utils.PadSequences(
+      encoded,
+      encoded_lengths,
+      maxlen=padded_sequence_length,
       value=self.padding_element,
-=======
-      node_y.append(graph.tuple.node_y[seq_node_indices])
-
-    # Pad and truncate encoded sequences.
-    encoded_sequences = tf.keras.preprocessing.sequence.pad_sequences(
-        encoded_sequences,
-        maxlen=self.padded_sequence_length,
-        dtype="int32",
-        padding="pre",
-        truncating="post",
-        value=self.padding_element,
->>>>>>> 33703e4de... Split the LSTM into multiple modules.
     )
 
     # Determine an out-of-range segment ID to pad the segment IDs to.
     segment_id_padding_element = (
-<<<<<<< HEAD
-      max(max(s) if s.size else 0 for s in segment_ids) + 1
-    )
+      int(segment_ids.max()) if segment_ids.size else 0
+    ) + 1
 
-    segment_ids = tf.keras.preprocessing.sequence.pad_sequences(
+    segment_ids = utils.PadSequences(
       segment_ids,
-      maxlen=self.padded_sequence_length,
-      dtype="int32",
-      padding="pre",
-      truncating="post",
+      segment_lengths,
+      maxlen=padded_sequence_length,
       value=segment_id_padding_element,
     )
 
     padded_node_sequence_length = min(
-      self.padded_node_sequence_length, max(len(s) for s in selector_vectors)
-=======
-        max(max(s) if s.size else 0 for s in segment_ids) + 1
-    )
-
-    segment_ids = tf.keras.preprocessing.sequence.pad_sequences(
-        segment_ids,
-        maxlen=self.padded_sequence_length,
-        dtype="int32",
-        padding="pre",
-        truncating="post",
-        value=segment_id_padding_element,
-    )
-
-    padded_nodes_sequence_length = min(
-        self.padded_nodes_sequence_length, max(len(s) for s in selector_vectors)
->>>>>>> 33703e4de... Split the LSTM into multiple modules.
+      self.padded_node_sequence_length, max(node_index_lengths)
     )
 
     # Pad the selector vectors to the same shape as the segment IDs.)
-    selector_vectors = tf.keras.preprocessing.sequence.pad_sequences(
-<<<<<<< HEAD
+    selector_vectors = utils.PadSequences(
       selector_vectors,
+      node_index_lengths,
       maxlen=padded_node_sequence_length,
-      dtype="int32",
-      padding="pre",
-      truncating="post",
       value=np.array((0, 0), dtype=np.int32),
     )
 
-    node_y = tf.keras.preprocessing.sequence.pad_sequences(
+    node_y = utils.PadSequences(
       node_y,
+      node_index_lengths,
       maxlen=padded_node_sequence_length,
-      dtype="int32",
-      padding="pre",
-      truncating="post",
-      value=np.zeros(self.graph_db.node_y_dimensionality, dtype=np.int64),
+      value=np.zeros(self.graph_db.node_y_dimensionality, dtype=np.int32),
     )
 
-    all_node_indices = tf.keras.preprocessing.sequence.pad_sequences(
-      all_node_indices,
+    batch_node_indices = utils.PadSequences(
+      batch_node_indices,
+      node_index_lengths,
       maxlen=padded_node_sequence_length,
-      dtype="int32",
-      padding="pre",
-      truncating="post",
       value=-1,
     )
 
@@ -584,40 +363,7 @@ class NodeLstm(lstm_base.LstmBase):
         segment_ids=segment_ids,
         selector_vectors=selector_vectors,
         node_y=node_y,
-        node_indices=np.concatenate(all_node_indices),
-        targets=np.vstack(targets),
+        node_indices=np.concatenate(batch_node_indices),
+        targets=all_node_y,
       ),
     )
-=======
-        selector_vectors,
-        maxlen=padded_nodes_sequence_length,
-        dtype="int32",
-        padding="pre",
-        truncating="post",
-        value=np.array((0, 0), dtype=np.int32),
-    )
-
-    node_y = tf.keras.preprocessing.sequence.pad_sequences(
-        node_y,
-        maxlen=padded_nodes_sequence_length,
-        dtype="int32",
-        padding="pre",
-        truncating="post",
-        value=np.zeros(self.graph_db.node_y_dimensionality, dtype=np.int64),
-    )
-
-    return batches.Data(
-        graph_ids=[graph.id for graph in graphs],
-        data=NodeLstmBatch(
-            encoded_sequences=encoded_sequences,
-            segment_ids=segment_ids,
-            selector_vectors=selector_vectors,
-            node_y=node_y,
-            node_indices=node_indices,
-        ),
-    )
-
-  def ReshapeTargets(self, targets):
-    # Stack the manually-batched targets list.
-    return np.vstack(targets)
->>>>>>> 33703e4de... Split the LSTM into multiple modules.
@@ -2,8 +2,11 @@
 import random
 from typing import List
 
+import numpy as np
+
 from datasets.opencl.device_mapping import opencl_device_mapping_dataset
 from deeplearning.ml4pl import run_id as run_id_lib
+from deeplearning.ml4pl.graphs.labelled import graph_database_reader
 from deeplearning.ml4pl.graphs.labelled import graph_tuple_database
 from deeplearning.ml4pl.graphs.labelled.devmap import make_devmap_dataset
 from deeplearning.ml4pl.graphs.unlabelled import unlabelled_graph_database
@@ -141,6 +144,81 @@ def test_load_restore_model_from_checkpoint_smoke_test(
   model.RestoreFrom(checkpoint_ref)
 
 
+def test_MakeBatch(
+  logger: logging.Logger,
+  graph_db: graph_tuple_database.Database,
+  proto_db: unlabelled_graph_database.Database,
+  node_y_dimensionality: int,
+):
+  """Test the shapes of a node classifier batch."""
+  run_id = run_id_lib.RunId.GenerateUnique(
+    f"mock{random.randint(0, int(1e6)):06}"
+  )
+
+  model = node_lstm.NodeLstm(
+    logger,
+    graph_db,
+    proto_db=proto_db,
+    batch_size=8,
+    padded_sequence_length=100,
+    padded_node_sequence_length=50,
+    run_id=run_id,
+  )
+  model.Initialize()
+
+  graphs = list(graph_database_reader.BufferedGraphReader(graph_db, limit=8))
+  batch = model.MakeBatch(epoch.Type.TEST, iter(graphs))
+  assert batch.graph_ids == [graph.id for graph in graphs]
+
+  sequence_length = model.padded_sequence_length
+  node_count = batch.data.selector_vectors.shape[1]
+  assert 0 < node_count <= model.padded_node_sequence_length
+  assert batch.data.encoded_sequences.shape == (8, sequence_length)
+  assert batch.data.segment_ids.shape == (8, sequence_length)
+  assert batch.data.selector_vectors.shape == (8, node_count, 2)
+  assert batch.data.node_y.shape == (8, node_count, node_y_dimensionality)
+  assert batch.data.node_indices.shape == (8 * node_count,)
+  assert batch.data.targets.shape == (
+    sum(graph.node_count for graph in graphs),
+    node_y_dimensionality,
+  )
+  # Every node index is either padding or in range of the batch nodes.
+  assert batch.data.node_indices.min() >= -1
+  assert batch.data.node_indices.max() < batch.data.targets.shape[0]
+
+  # The outputs for the padded nodes are scattered back to the targets.
+  predictions = batch.data.GetPredictions(
+    batch.data.node_y.astype(np.float32)
+  )
+  assert predictions.shape == batch.data.targets.shape
+
+
+def test_MakeBatch_end_of_batches(
+  logger: logging.Logger,
+  graph_db: graph_tuple_database.Database,
+  proto_db: unlabelled_graph_database.Database,
+):
+  """Test that an incomplete batch of graphs produces an empty batch."""
+  run_id = run_id_lib.RunId.GenerateUnique(
+    f"mock{random.randint(0, int(1e6)):06}"
+  )
+
+  model = node_lstm.NodeLstm(
+    logger,
+    graph_db,
+    proto_db=proto_db,
+    batch_size=8,
+    padded_sequence_length=100,
+    padded_node_sequence_length=50,
+    run_id=run_id,
+  )
+  model.Initialize()
+
+  graphs = graph_database_reader.BufferedGraphReader(graph_db, limit=3)
+  batch = model.MakeBatch(epoch.Type.TEST, iter(graphs))
+  assert not batch.graph_count
+
+
 def test_classifier_call(
   epoch_type: epoch.Type,
   logger: logging.Logger,
@@ -158,7 +236,7 @@ def test_classifier_call(
     proto_db=proto_db,
     batch_size=8,
     padded_sequence_length=100,
-    padded_nodes_sequence_length=50,
+    padded_node_sequence_length=50,
     run_id=run_id,
   )
   model.Initialize()
@@ -6,6 +6,7 @@ of a machine learning model.
 import copy
 import sys
 import warnings
+from typing import Any
 from typing import Dict
 from typing import List
 from typing import Optional
@@ -17,6 +18,7 @@ import pyfiglet
 from sklearn.exceptions import UndefinedMetricWarning
 
 from deeplearning.ml4pl.graphs.labelled import graph_tuple_database
+from deeplearning.ml4pl.models import async_evaluator
 from deeplearning.ml4pl.models import batch as batchs
 from deeplearning.ml4pl.models import batch_iterator as batch_iterator_lib
 from deeplearning.ml4pl.models import checkpoints
@@ -87,6 +89,20 @@ app.DEFINE_integer(
   "Tuning parameter. The maximum number of batches to generate before "
   "waiting for the model to complete. Must be >= 1.",
 )
+app.DEFINE_boolean(
+  "async_eval",
+  False,
+  "If set, validation and test epochs are run on a separate process using a "
+  "snapshot of the model, so that the next training epoch can start without "
+  "waiting for them. The model must be usable after a fork.",
+)
+app.DEFINE_integer(
+  "async_eval_max_pending",
+  2,
+  "The maximum number of model snapshots awaiting validation when "
+  "--async_eval is set. Training waits for the oldest snapshot to be "
+  "validated when this is exceeded.",
+)
 app.DEFINE_boolean(
   "k_fold",
   False,
@@ -186,6 +202,9 @@ class Train(progress.Progress):
     self.graph_db = graph_db
     self.logger = logger
     self.splits = splits
+    # Model snapshots which are awaiting validation when --async_eval is set,
+    # as a mapping from epoch number to <model_data, test_requested> tuples.
+    self.snapshots: Dict[int, Tuple[Any, bool]] = {}
     super(Train, self).__init__(
       str(self.model.run_id),
       i=self.model.epoch_num,
@@ -246,12 +265,115 @@ class Train(progress.Progress):
 
     save_on = FLAGS.save_on()
 
-    for self.ctx.i in range(self.ctx.i, self.ctx.n):
-      self.RunOneEpoch(test_on, save_on)
+    if FLAGS.async_eval:
+      with async_evaluator.AsyncEvaluator(self.model, self.splits) as evaluator:
+        for self.ctx.i in range(self.ctx.i, self.ctx.n):
+          self.RunOneEpochAsync(evaluator, test_on, save_on)
+        # Wait for the evaluations of the final epochs.
+        while evaluator.pending_count:
+          self.OnEvaluationResult(evaluator, evaluator.Get(), test_on, save_on)
+    else:
+      for self.ctx.i in range(self.ctx.i, self.ctx.n):
+        self.RunOneEpoch(test_on, save_on)
 
     # Record the final epoch.
     self.ctx.i += 1
 
+  def RunOneEpochAsync(
+    self, evaluator: async_evaluator.AsyncEvaluator, test_on: str, save_on
+  ) -> None:
+    """Run a training epoch, and request the evaluation of the trained model.
+
+    The results of evaluations are handled by OnEvaluationResult() as they
+    become available.
+    """
+    self.RunEpoch(epoch.Type.TRAIN, self.MakeBatchIterator(epoch.Type.TRAIN))
+
+    # Handle the evaluations which completed while training.
+    while evaluator.Poll():
+      self.OnEvaluationResult(evaluator, evaluator.Get(), test_on, save_on)
+
+    # Bound the number of snapshots that are held in memory.
+    while len(self.snapshots) >= FLAGS.async_eval_max_pending:
+      self.OnEvaluationResult(evaluator, evaluator.Get(), test_on, save_on)
+
+    # The model data may reference the live model state, so take a copy.
+    model_data = copy.deepcopy(self.model.GetModelData())
+    epoch_types = [epoch.Type.VAL]
+    if test_on == "every" or (
+      test_on == "improvement_and_last"
+      and self.model.epoch_num == self.ctx.n
+    ):
+      epoch_types.append(epoch.Type.TEST)
+    self.snapshots[self.model.epoch_num] = (
+      model_data,
+      epoch.Type.TEST in epoch_types,
+    )
+    evaluator.Evaluate(self.model.epoch_num, epoch_types, model_data)
+
+  def OnEvaluationResult(
+    self,
+    evaluator: async_evaluator.AsyncEvaluator,
+    result: async_evaluator.EvaluationResult,
+    test_on: str,
+    save_on,
+  ) -> None:
+    """Record the result of an evaluation of a model snapshot.
+
+    This updates the best results of the model, and if the result is a
+    validation epoch, runs the test epoch and saves a checkpoint of the
+    snapshot, as determined by the schedules. Checkpoints are saved only once
+    their snapshot has been validated, so that they include its results.
+    """
+    if result.error:
+      raise RunError(
+        f"{result.epoch_type.name.capitalize()} epoch of snapshot "
+        f"{result.epoch_num} failed: {result.error}"
+      )
+
+    best_results = self.model.best_results[result.epoch_type]
+    self.logger.ctx.print(
+      f"{shell.ShellEscapeCodes.BLUE}{self.model.run_id}"
+      f"{shell.ShellEscapeCodes.END} "
+      f"{result.epoch_type.name.lower():>5} "
+      f"[{result.epoch_num:3d} / {self.ctx.n:3d}] "
+      f"{result.results.ToFormattedString(best_results.results)}"
+    )
+    improved = result.results > best_results.results
+    if improved:
+      self.logger.ctx.Log(
+        2,
+        "%s results improved from %s",
+        result.epoch_type.name.capitalize(),
+        best_results,
+      )
+      self.model.best_results[result.epoch_type] = epoch.BestResults(
+        epoch_num=result.epoch_num, results=result.results
+      )
+
+    if result.epoch_type != epoch.Type.VAL:
+      return
+
+    model_data, test_requested = self.snapshots.pop(result.epoch_num)
+    if (
+      improved
+      and not test_requested
+      and test_on in {"improvement", "improvement_and_last"}
+    ):
+      evaluator.Evaluate(result.epoch_num, [epoch.Type.TEST], model_data)
+
+    if save_on == schedules.SaveOn.EVERY_EPOCH or (
+      improved and save_on == schedules.SaveOn.VAL_IMPROVED
+    ):
+      self.logger.Save(
+        checkpoints.Checkpoint(
+          run_id=self.model.run_id,
+          epoch_num=result.epoch_num,
+          best_results=self.model.best_results,
+          model_data=model_data,
+        )
+      )
+
   def RunEpoch(
     self, epoch_type: epoch.Type, batch_iterator: batchs.BatchIterator,
   ) -> Tuple[epoch.Results, int]:
@@ -12,6 +12,7 @@ from deeplearning.ml4pl.models import classifier_base
 from deeplearning.ml4pl.models import epoch
 from deeplearning.ml4pl.models import log_database
 from deeplearning.ml4pl.models import run
+from deeplearning.ml4pl.models import schedules
 from deeplearning.ml4pl.testing import random_graph_tuple_database_generator
 from deeplearning.ml4pl.testing import testing_databases
 from labm8.py import progress
@@ -205,5 +206,91 @@ def test_Run_with_mock_module(
   assert log_db.run_count == graph_db.split_count if k_fold else 1
 
 
+@test.Parametrize(
+  "test_on", ("every", "improvement", "improvement_and_last", "none")
+)
+@test.Parametrize(
+  "save_on", list(schedules.SaveOn), namer=lambda x: x.name.lower()
+)
+def test_Run_with_async_eval(
+  disposable_log_db: log_database.Database,
+  graph_db: graph_tuple_database.Database,
+  test_on: str,
+  save_on: schedules.SaveOn,
+):
+  """Test the run.Run() method with evaluation on a separate process."""
+  log_db = disposable_log_db
+
+  FLAGS.graph_db = flags_parsers.DatabaseFlag(
+    graph_tuple_database.Database, graph_db.url, must_exist=True
+  )
+  FLAGS.log_db = flags_parsers.DatabaseFlag(
+    log_database.Database, log_db.url, must_exist=True
+  )
+  FLAGS.epoch_count = 3
+  FLAGS.k_fold = False
+  FLAGS.run_with_memory_profiler = False
+  previous_test_on, previous_save_on = FLAGS.test_on, FLAGS.save_on
+  FLAGS.test_on = test_on
+  FLAGS.save_on = flags_parsers.EnumFlag(schedules.SaveOn, save_on)
+  FLAGS.async_eval = True
+  try:
+    run.Run(MockModel)
+  finally:
+    FLAGS.async_eval = False
+    FLAGS.test_on = previous_test_on
+    FLAGS.save_on = previous_save_on
+
+  with log_db.Session() as session:
+    run_id = session.query(log_database.RunId.run_id).one().run_id
+    epochs = {
+      epoch_type: {
+        row.epoch_num
+        for row in session.query(log_database.Batch.epoch_num).filter(
+          log_database.Batch.epoch_type_num == epoch_type.value
+        )
+      }
+      for epoch_type in (epoch.Type.VAL, epoch.Type.TEST)
+    }
+    checkpoint_epochs = {
+      row.epoch_num
+      for row in session.query(log_database.Checkpoint.epoch_num)
+    }
+
+  # Every epoch is validated by the evaluator process.
+  assert epochs[epoch.Type.VAL] == {1, 2, 3}
+
+  # Determine the epochs which improved on the best validation accuracy.
+  improved_epochs = set()
+  best_accuracy = 0
+  for epoch_num in sorted(epochs[epoch.Type.VAL]):
+    accuracy = log_db.GetEpochResults(
+      run_id, epoch_num, epoch.Type.VAL
+    ).accuracy
+    if accuracy > best_accuracy:
+      improved_epochs.add(epoch_num)
+      best_accuracy = accuracy
+
+  best_results = log_db.GetBestResults(run_id)
+  assert best_results[epoch.Type.VAL].epoch_num == max(improved_epochs)
+
+  # Test epochs are run on the snapshots that were requested.
+  if test_on == "every":
+    assert epochs[epoch.Type.TEST] == {1, 2, 3}
+  elif test_on == "improvement":
+    assert epochs[epoch.Type.TEST] == improved_epochs
+  elif test_on == "improvement_and_last":
+    assert epochs[epoch.Type.TEST] == improved_epochs | {3}
+  else:
+    assert not epochs[epoch.Type.TEST]
+
+  # Checkpoints are saved for validated snapshots.
+  if save_on == schedules.SaveOn.EVERY_EPOCH:
+    assert checkpoint_epochs == epochs[epoch.Type.VAL]
+  elif save_on == schedules.SaveOn.VAL_IMPROVED:
+    assert checkpoint_epochs == improved_epochs
+  else:
+    assert not checkpoint_epochs
+
 if __name__ == "__main__":
   test.Main()
@@ -0,0 +1,301 @@
+"""A persistent, memory-mapped store of encoded sequences.
+
+Encoding a corpus of intermediate representations requires lexing every IR
+through an encoder worker process, which is repeated by every process that
+constructs an encoder. An EncodedSequenceStore persists the encoded sequences
+to disk so that they are computed once and then shared by every process which
+uses the same encoder and vocabulary.
+
+A store is keyed by encoder type and vocabulary hash, and holds one or more
+named columns of variable-length int32 arrays for each IR ID. For example, a
+graph2seq.StatementEncoder store has "encoded", "encoded_node_length", and
+"node" columns.
+
+Sequences are appended in immutable segments, where each segment is a
+directory of .npy files:
+
+    <root>/<encoder_type>_<vocabulary_hash>/segment_<name>/
+        ir_ids.npy             int64, shape (n)
+        <column>.npy           int32, shape (sum of column lengths)
+        <column>_offsets.npy   int64, shape (n + 1)
+
+The values of column c for the i-th IR of a segment are the slice
+[c_offsets[i], c_offsets[i + 1]) of c. Segments are memory mapped read-only,
+so reading a sequence does not copy it, and concurrent processes share the
+pages of the mapped files.
+"""
+import atexit
+import json
+import os
+import pathlib
+import tempfile
+import time
+import weakref
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+
+from labm8.py import app
+from labm8.py import crypto
+
+FLAGS = app.FLAGS
+
+app.DEFINE_string(
+  "encoded_sequence_store",
+  None,
+  "If set, encoded sequences are persisted to this directory and shared by "
+  "every encoder which uses the same vocabulary. Else, encoded sequences are "
+  "cached only in memory.",
+)
+app.DEFINE_integer(
+  "encoded_sequence_store_segment_mb",
+  64,
+  "Tuning parameter. The size of newly encoded sequences to accumulate "
+  "before writing them to a segment of --encoded_sequence_store, in "
+  "megabytes.",
+)
+
+
+# Directory modification times may have a coarse resolution, so a store
+# directory which was modified less than this many nanoseconds before the last
+# refresh may have been modified again without its mtime changing.
+_MTIME_RESOLUTION_NS = int(1e9)
+
+# Every store in this process. Stores are weakly referenced, so that they can
+# be freed. The pending sequences of a freed store are discarded.
+_stores: "weakref.WeakSet[EncodedSequenceStore]" = weakref.WeakSet()
+
+
+def FlushAll() -> None:
+  """Write the pending sequences of every store in this process."""
+  for store in list(_stores):
+    store.Flush()
+
+
+# Write any pending sequences when the process exits.
+atexit.register(FlushAll)
+
+
+def HashVocabulary(vocabulary: Dict[str, int]) -> str:
+  """Return a checksum of a vocabulary, for use as a store key."""
+  return crypto.sha1_str(json.dumps(vocabulary, sort_keys=True))
+
+
+class _Segment(object):
+  """A read-only, memory-mapped segment."""
+
+  def __init__(self, path: pathlib.Path, columns: List[str]):
+    self.ir_ids = np.load(path / "ir_ids.npy", mmap_mode="r")
+    self.columns = [
+      (
+        _LoadArray(path / f"{column}.npy"),
+        np.load(path / f"{column}_offsets.npy", mmap_mode="r"),
+      )
+      for column in columns
+    ]
+
+  def Get(self, i: int) -> Tuple[np.array, ...]:
+    """Return the column values of the i-th IR in the segment."""
+    return tuple(
+      values[offsets[i] : offsets[i + 1]] for values, offsets in self.columns
+    )
+
+  def Length(self, i: int, column: int) -> int:
+    """Return the length of a column value of the i-th IR in the segment."""
+    offsets = self.columns[column][1]
+    return int(offsets[i + 1] - offsets[i])
+
+
+def _LoadArray(path: pathlib.Path) -> np.array:
+  """Memory map an array. Empty arrays cannot be mapped, so are loaded."""
+  try:
+    return np.load(path, mmap_mode="r")
+  except ValueError:
+    return np.load(path)
+
+
+class EncodedSequenceStore(object):
+  """A persistent store of encoded sequences, keyed by IR ID."""
+
+  def __init__(
+    self,
+    path: pathlib.Path,
+    columns: List[str],
+    segment_size: int = 64 << 20,
+  ):
+    """Constructor.
+
+    Args:
+      path: The directory of the store. Every store at this path must be
+        constructed with the same columns.
+      columns: The names of the columns of each stored sequence.
+      segment_size: The number of bytes of new sequences to accumulate before
+        writing a segment.
+    """
+    self.path = pathlib.Path(path)
+    self.path.mkdir(parents=True, exist_ok=True)
+    self.columns = columns
+    self.segment_size = segment_size
+
+    # A map from IR ID to a <segment, index> pair.
+    self._index: Dict[int, Tuple[_Segment, int]] = {}
+    self._segment_names = set()
+    # Sequences which have been added but not yet written to a segment.
+    self._pending: Dict[int, Tuple[np.array, ...]] = {}
+    self._pending_size = 0
+    # The modification time of the store directory and the wall clock time
+    # at the last refresh, in nanoseconds.
+    self._refresh_mtime = 0
+    self._refresh_time = 0
+
+    self.Refresh()
+    _stores.add(self)
+
+  @classmethod
+  def FromFlags(
+    cls, encoder_type: str, vocabulary_hash: str, columns: List[str]
+  ) -> Optional["EncodedSequenceStore"]:
+    """Construct a store from flags, or None if --encoded_sequence_store is
+    unset.
+
+    Args:
+      encoder_type: The name of the encoder.
+      vocabulary_hash: The checksum of the vocabulary used by the encoder, as
+        returned by HashVocabulary().
+      columns: The names of the columns of each stored sequence.
+    """
+    if not FLAGS.encoded_sequence_store:
+      return None
+    return cls(
+      pathlib.Path(FLAGS.encoded_sequence_store)
+      / f"{encoder_type}_{vocabulary_hash[:16]}",
+      columns,
+      segment_size=FLAGS.encoded_sequence_store_segment_mb * 1024 * 1024,
+    )
+
+  def Refresh(self) -> None:
+    """Load any segments which have been written since the last refresh."""
+    # Read the mtime before listing the directory, so that segments written
+    # during the listing are loaded by the next refresh.
+    self._refresh_mtime = os.stat(self.path).st_mtime_ns
+    self._refresh_time = time.time_ns()
+    for path in sorted(self.path.glob("segment_*")):
+      if path.name in self._segment_names:
+        continue
+      segment = _Segment(path, self.columns)
+      for i, ir_id in enumerate(segment.ir_ids.tolist()):
+        self._index.setdefault(ir_id, (segment, i))
+      self._segment_names.add(path.name)
+
+  def _RefreshOnMiss(self) -> None:
+    """Refresh the store if another process may have written a segment since
+    the last refresh.
+
+    Segments are renamed into the store directory, which updates its mtime, so
+    a directory whose mtime is unchanged since the last refresh is not listed
+    again.
+    """
+    mtime = os.stat(self.path).st_mtime_ns
+    if (
+      mtime != self._refresh_mtime
+      or self._refresh_time - mtime < _MTIME_RESOLUTION_NS
+    ):
+      self.Refresh()
+
+  def Get(self, ir_ids: Iterable[int]) -> Dict[int, Tuple[np.array, ...]]:
+    """Look up the stored sequences of IR IDs.
+
+    Args:
+      ir_ids: The IR IDs to look up.
+
+    Returns:
+      A map from IR ID to a tuple of column values, for every IR ID which is
+      in the store. Values read from segments are read-only.
+    """
+    ir_ids = set(ir_ids)
+    if not all(i in self._index or i in self._pending for i in ir_ids):
+      # Another process may have written the missing sequences.
+      self._RefreshOnMiss()
+
+    found = {}
+    for ir_id in ir_ids:
+      if ir_id in self._pending:
+        found[ir_id] = self._pending[ir_id]
+      elif ir_id in self._index:
+        segment, i = self._index[ir_id]
+        found[ir_id] = segment.Get(i)
+    return found
+
+  def GetLengths(self, ir_ids: Iterable[int], column: str) -> Dict[int, int]:
+    """Look up the lengths of a column of stored sequences.
+
+    This reads only the offsets of the column, not the sequences.
+
+    Args:
+      ir_ids: The IR IDs to look up.
+      column: The name of the column.
+
+    Returns:
+      A map from IR ID to column length, for every IR ID which is in the store.
+    """
+    ir_ids = set(ir_ids)
+    if not all(i in self._index or i in self._pending for i in ir_ids):
+      self._RefreshOnMiss()
+
+    i = self.columns.index(column)
+    lengths = {}
+    for ir_id in ir_ids:
+      if ir_id in self._pending:
+        lengths[ir_id] = len(self._pending[ir_id][i])
+      elif ir_id in self._index:
+        segment, j = self._index[ir_id]
+        lengths[ir_id] = segment.Length(j, i)
+    return lengths
+
+  def Put(
+    self, ir_ids: List[int], values: List[Tuple[np.array, ...]]
+  ) -> None:
+    """Add sequences to the store.
+
+    Args:
+      ir_ids: The IR IDs of the sequences.
+      values: A tuple of column values for each IR ID.
+    """
+    for ir_id, value in zip(ir_ids, values):
+      if ir_id in self._index or ir_id in self._pending:
+        continue
+      value = tuple(np.asarray(column, dtype=np.int32) for column in value)
+      self._pending[ir_id] = value
+      self._pending_size += sum(column.nbytes for column in value)
+    if self._pending_size >= self.segment_size:
+      self.Flush()
+
+  def Flush(self) -> None:
+    """Write pending sequences to a new segment."""
+    if not self._pending:
+      return
+
+    ir_ids = sorted(self._pending)
+    arrays = {"ir_ids": np.array(ir_ids, dtype=np.int64)}
+    for i, column in enumerate(self.columns):
+      values = [self._pending[ir_id][i] for ir_id in ir_ids]
+      offsets = np.zeros(len(values) + 1, dtype=np.int64)
+      np.cumsum([len(value) for value in values], out=offsets[1:])
+      arrays[column] = np.concatenate(values).astype(np.int32)
+      arrays[f"{column}_offsets"] = offsets
+
+    # Write the segment to a temporary directory and rename it, so that
+    # readers never see a partially written segment.
+    tmp_path = pathlib.Path(tempfile.mkdtemp(prefix=".tmp_", dir=self.path))
+    for name, array in arrays.items():
+      np.save(tmp_path / f"{name}.npy", array)
+    path = self.path / f"segment_{tmp_path.name[len('.tmp_'):]}"
+    os.rename(tmp_path, path)
+
+    self._pending = {}
+    self._pending_size = 0
+    self.Refresh()
@@ -0,0 +1,157 @@
+"""Unit tests for //deeplearning/ml4pl/seq:encoded_sequence_store."""
+import gc
+import os
+import pathlib
+import time
+import weakref
+
+import numpy as np
+
+from deeplearning.ml4pl.seq import encoded_sequence_store
+from labm8.py import test
+
+FLAGS = test.FLAGS
+
+# The columns of a store, as used by graph2seq.StatementEncoder.
+COLUMNS = ["encoded", "encoded_node_length", "node"]
+
+
+def MakeValue(ir_id: int):
+  """Generate a tuple of column values which is unique to an IR ID."""
+  return (
+    np.arange(ir_id, dtype=np.int32),
+    np.array([ir_id], dtype=np.int32),
+    np.arange(ir_id % 3, dtype=np.int32),
+  )
+
+
+def AssertValueEqual(actual, ir_id: int):
+  """Check the column values for an IR ID."""
+  expected = MakeValue(ir_id)
+  assert len(actual) == len(expected)
+  for a, b in zip(actual, expected):
+    assert a.dtype == np.int32
+    assert a.tolist() == b.tolist()
+
+
+def test_EncodedSequenceStore_pending_sequences(tmp_path: pathlib.Path):
+  """Test that sequences are readable before they are written."""
+  store = encoded_sequence_store.EncodedSequenceStore(tmp_path, COLUMNS)
+  store.Put([1, 2], [MakeValue(1), MakeValue(2)])
+  assert not list(tmp_path.glob("segment_*"))
+
+  found = store.Get([1, 2, 3])
+  assert set(found) == {1, 2}
+  AssertValueEqual(found[1], 1)
+  AssertValueEqual(found[2], 2)
+
+
+def test_EncodedSequenceStore_persisted(tmp_path: pathlib.Path):
+  """Test that sequences are shared between stores."""
+  writer = encoded_sequence_store.EncodedSequenceStore(tmp_path, COLUMNS)
+  reader = encoded_sequence_store.EncodedSequenceStore(tmp_path, COLUMNS)
+  assert not reader.Get([0, 5, 10])
+
+  writer.Put([0, 5, 10], [MakeValue(i) for i in (0, 5, 10)])
+  writer.Flush()
+
+  # The reader loads the new segment on the next miss.
+  found = reader.Get([0, 5, 10])
+  assert set(found) == {0, 5, 10}
+  for ir_id, value in found.items():
+    AssertValueEqual(value, ir_id)
+  assert isinstance(found[10][0].base, np.memmap)
+
+  # A new store loads the existing segments.
+  found = encoded_sequence_store.EncodedSequenceStore(tmp_path, COLUMNS).Get(
+    [5]
+  )
+  AssertValueEqual(found[5], 5)
+
+
+def test_EncodedSequenceStore_segment_size(tmp_path: pathlib.Path):
+  """Test that a segment is written once enough sequences are pending."""
+  store = encoded_sequence_store.EncodedSequenceStore(
+    tmp_path, COLUMNS, segment_size=100
+  )
+  store.Put(list(range(10)), [MakeValue(i) for i in range(10)])
+  store.Put(list(range(10, 20)), [MakeValue(i) for i in range(10, 20)])
+  assert len(list(tmp_path.glob("segment_*"))) == 2
+
+  found = store.Get(range(20))
+  for ir_id in range(20):
+    AssertValueEqual(found[ir_id], ir_id)
+
+
+def test_EncodedSequenceStore_GetLengths(tmp_path: pathlib.Path):
+  """Test looking up the lengths of stored sequences."""
+  store = encoded_sequence_store.EncodedSequenceStore(tmp_path, COLUMNS)
+  store.Put([4, 7], [MakeValue(4), MakeValue(7)])
+  store.Flush()
+  store.Put([5], [MakeValue(5)])
+
+  assert store.GetLengths([4, 5, 7, 8], "encoded") == {4: 4, 5: 5, 7: 7}
+  assert store.GetLengths([4, 5, 7], "node") == {4: 1, 5: 2, 7: 1}
+
+
+def test_EncodedSequenceStore_refresh_on_miss(tmp_path: pathlib.Path):
+  """Test that a miss lists the store directory only if it has changed."""
+  # Backdate the store directory, so that its mtime is reliable.
+  past = time.time_ns() - int(10e9)
+  os.utime(tmp_path, ns=(past, past))
+  reader = encoded_sequence_store.EncodedSequenceStore(tmp_path, COLUMNS)
+
+  refresh_count = 0
+  refresh = reader.Refresh
+
+  def CountingRefresh():
+    nonlocal refresh_count
+    refresh_count += 1
+    refresh()
+
+  reader.Refresh = CountingRefresh
+  assert not reader.Get([1])
+  assert not reader.GetLengths([1], "encoded")
+  assert refresh_count == 0
+
+  writer = encoded_sequence_store.EncodedSequenceStore(tmp_path, COLUMNS)
+  writer.Put([1], [MakeValue(1)])
+  writer.Flush()
+
+  AssertValueEqual(reader.Get([1])[1], 1)
+  assert refresh_count == 1
+
+
+def test_FlushAll(tmp_path: pathlib.Path):
+  """Test that pending sequences of every store are written."""
+  a = encoded_sequence_store.EncodedSequenceStore(tmp_path / "a", COLUMNS)
+  b = encoded_sequence_store.EncodedSequenceStore(tmp_path / "b", COLUMNS)
+  a.Put([1], [MakeValue(1)])
+  b.Put([2], [MakeValue(2)])
+
+  encoded_sequence_store.FlushAll()
+
+  assert len(list((tmp_path / "a").glob("segment_*"))) == 1
+  assert len(list((tmp_path / "b").glob("segment_*"))) == 1
+
+
+def test_EncodedSequenceStore_can_be_freed(tmp_path: pathlib.Path):
+  """Test that a store is not kept alive by the module."""
+  store = encoded_sequence_store.EncodedSequenceStore(tmp_path, COLUMNS)
+  ref = weakref.ref(store)
+  del store
+  gc.collect()
+  assert ref() is None
+
+
+def test_HashVocabulary():
+  """Test that vocabulary hashes do not depend on insertion order."""
+  a = encoded_sequence_store.HashVocabulary({"a": 0, "b": 1})
+  b = encoded_sequence_store.HashVocabulary({"b": 1, "a": 0})
+  c = encoded_sequence_store.HashVocabulary({"a": 1, "b": 0})
+  assert a == b
+  assert a != c
+
+
+if __name__ == "__main__":
+  test.Main()
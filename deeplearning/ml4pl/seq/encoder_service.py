@@ -0,0 +1,270 @@
+"""A service of long-lived encoder worker processes.
+
+The native string and graph encoders are C++ binaries which process an encoder
+job proto in place. Running a new worker process for every job requires the
+process to be started, and the full vocabulary to be serialized and sent with
+the job. For small jobs, this costs more than the encoding itself.
+
+An EncoderService instead keeps a pool of long-lived worker processes, each
+started with a --stream argument. A worker in stream mode reads a sequence of
+jobs from stdin, and writes each processed job to stdout. Every job on the
+pipe is prefixed by its length in bytes, encoded as a little-endian uint64.
+The vocabulary is sent only with the first job of each worker, after which the
+worker reuses its encoder and the encoder's cache of encoded strings.
+
+Jobs are written to a worker as soon as they are submitted, without waiting
+for the results of the previous jobs, so that multiple jobs may be in flight
+on each worker.
+"""
+import collections
+import os
+import struct
+import subprocess
+import threading
+from concurrent import futures
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from labm8.py import app
+from labm8.py import pbutil
+
+FLAGS = app.FLAGS
+
+app.DEFINE_integer(
+  "encoder_workers",
+  0,
+  "The number of persistent encoder worker processes to use for lexing and "
+  "graph encoding. If zero, a new worker process is started for every encoder "
+  "job.",
+)
+
+# The length prefix of a job on a worker pipe.
+_LENGTH_PREFIX = struct.Struct("<Q")
+
+
+class _Worker(object):
+  """A worker process in stream mode."""
+
+  def __init__(self, cmd: List[str]):
+    self.cmd = cmd
+    self.process = subprocess.Popen(
+      cmd + ["--stream"], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+    )
+    self.vocabulary_sent = False
+    # The error which terminated the worker, if any.
+    self.error: Optional[Exception] = None
+
+    # The futures of the jobs which have been written to the worker but not yet
+    # read, in the order that they were written. The worker processes jobs in
+    # order, so the next result belongs to the first pending future.
+    self.pending = collections.deque()
+    self.lock = threading.Lock()
+
+    self.reader = threading.Thread(target=self._ReadResults, daemon=True)
+    self.reader.start()
+
+  def Submit(
+    self, job: pbutil.ProtocolBuffer, vocabulary: Dict[str, int]
+  ) -> futures.Future:
+    """Write a job to the worker and return a future of the processed job."""
+    future = futures.Future()
+    with self.lock:
+      if self.error:
+        raise self.error
+
+      # Only the first job sent to a worker needs the vocabulary.
+      if not self.vocabulary_sent:
+        job.vocabulary.update(vocabulary)
+      serialized = job.SerializeToString()
+      job.ClearField("vocabulary")
+
+      self.pending.append((future, job))
+      try:
+        self.process.stdin.write(
+          _LENGTH_PREFIX.pack(len(serialized)) + serialized
+        )
+        self.process.stdin.flush()
+      except BrokenPipeError:
+        # The reader thread fails the pending futures once the worker exits.
+        pass
+      self.vocabulary_sent = True
+    return future
+
+  def Close(self) -> None:
+    """Close the input of the worker and wait for it to terminate."""
+    try:
+      self.process.stdin.close()
+    except BrokenPipeError:
+      pass
+    self.process.wait()
+    self.reader.join()
+
+  def Kill(self) -> None:
+    """Terminate the worker, failing any pending jobs."""
+    self.process.kill()
+    self.process.wait()
+    self.reader.join()
+
+  def _ReadResults(self) -> None:
+    """Read processed jobs from the worker until it terminates."""
+    stdout = self.process.stdout
+    while True:
+      header = stdout.read(_LENGTH_PREFIX.size)
+      if len(header) < _LENGTH_PREFIX.size:
+        break
+      (length,) = _LENGTH_PREFIX.unpack(header)
+      serialized = stdout.read(length)
+      if len(serialized) < length:
+        break
+
+      with self.lock:
+        future, job = self.pending.popleft()
+      try:
+        job.ParseFromString(serialized)
+        future.set_result(job)
+      except Exception as e:
+        future.set_exception(e)
+
+    # The worker has closed its output, so fail any jobs that it did not
+    # process.
+    returncode = self.process.wait()
+    with self.lock:
+      if returncode == -9:
+        self.error = OSError(f"Encoder worker killed: {' '.join(self.cmd)}")
+      else:
+        self.error = subprocess.CalledProcessError(returncode, self.cmd)
+      while self.pending:
+        future, _ = self.pending.popleft()
+        future.set_exception(self.error)
+
+
+class EncoderService(object):
+  """A pool of persistent encoder worker processes.
+
+  Worker processes are started on first use. Processes which are forked from
+  the process which owns the workers do not share them, and start their own
+  workers on first use.
+  """
+
+  def __init__(
+    self,
+    cmd: List[str],
+    vocabulary: Dict[str, int],
+    worker_count: int,
+    timeout_seconds: int = 60,
+  ):
+    """Constructor.
+
+    Args:
+      cmd: The command of the encoder worker binary.
+      vocabulary: The vocabulary to send to the workers.
+      worker_count: The number of worker processes.
+      timeout_seconds: The maximum number of seconds to wait for the results
+        of a call to Map().
+    """
+    self.cmd = cmd
+    self.vocabulary = vocabulary
+    self.worker_count = worker_count
+    self.timeout_seconds = timeout_seconds
+
+    self._workers: List[_Worker] = []
+    # The ID of the process which started the workers.
+    self._pid = None
+    self._lock = threading.Lock()
+
+  @classmethod
+  def FromFlags(
+    cls, cmd: List[str], vocabulary: Dict[str, int]
+  ) -> Optional["EncoderService"]:
+    """Construct a service from flags, or None if --encoder_workers is 0."""
+    if not FLAGS.encoder_workers:
+      return None
+    return cls(cmd, vocabulary, FLAGS.encoder_workers)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    del exc_type
+    del exc_val
+    del exc_tb
+    self.Close()
+
+  def Submit(self, job: pbutil.ProtocolBuffer) -> futures.Future:
+    """Submit a job to the worker with the fewest pending jobs.
+
+    Args:
+      job: An encoder job, without a vocabulary. The job is processed in place.
+
+    Returns:
+      A future of the processed job.
+    """
+    with self._lock:
+      self._StartWorkers()
+      worker = min(self._workers, key=lambda w: len(w.pending))
+      return worker.Submit(job, self.vocabulary)
+
+  def Map(
+    self, jobs: List[pbutil.ProtocolBuffer]
+  ) -> List[pbutil.ProtocolBuffer]:
+    """Process a list of jobs in parallel and return them in order.
+
+    Args:
+      jobs: A list of encoder jobs, without vocabularies. The jobs are
+        processed in place.
+
+    Returns:
+      The processed jobs.
+
+    Raises:
+      ProtoWorkerTimeoutError: If the jobs are not processed within
+        timeout_seconds. The workers are restarted on the next call.
+      CalledProcessError: If a worker terminates with an error.
+    """
+    pending = [self.Submit(job) for job in jobs]
+    _, not_done = futures.wait(pending, timeout=self.timeout_seconds)
+    if not_done:
+      with self._lock:
+        for worker in self._workers:
+          worker.Kill()
+        self._workers = []
+      raise pbutil.ProtoWorkerTimeoutError(
+        cmd=self.cmd, timeout_seconds=self.timeout_seconds, returncode=-9
+      )
+    return [future.result() for future in pending]
+
+  def Close(self) -> None:
+    """Terminate the worker processes."""
+    with self._lock:
+      if self._pid == os.getpid():
+        for worker in self._workers:
+          worker.Close()
+      self._workers = []
+
+  def _StartWorkers(self) -> None:
+    """Start worker processes to replace any that are missing or failed."""
+    if self._pid != os.getpid():
+      # The workers were started by a parent process. Their pipes are shared
+      # with the parent, so they cannot be used by this process.
+      self._workers = []
+      self._pid = os.getpid()
+    self._workers = [worker for worker in self._workers if not worker.error]
+    self._workers += [
+      _Worker(self.cmd) for _ in range(self.worker_count - len(self._workers))
+    ]
+
+
+def Chunk(items: List, chunk_count: int) -> List[List]:
+  """Split a list into at most chunk_count contiguous, similarly sized chunks.
+
+  Args:
+    items: The list to split.
+    chunk_count: The maximum number of chunks.
+
+  Returns:
+    A list of non-empty chunks, which concatenate to the input list.
+  """
+  chunk_count = max(min(chunk_count, len(items)), 1)
+  chunk_size = max((len(items) + chunk_count - 1) // chunk_count, 1)
+  return [items[i : i + chunk_size] for i in range(0, len(items), chunk_size)]
@@ -0,0 +1,69 @@
+"""Unit tests for //deeplearning/ml4pl/seq:encoder_service."""
+from deeplearning.ml4pl.seq import encoder_service
+from deeplearning.ml4pl.seq import ir2seq_pb2
+from labm8.py import bazelutil
+from labm8.py import test
+
+FLAGS = test.FLAGS
+
+STRING_ENCODER_WORKER = bazelutil.DataPath(
+  "phd/deeplearning/ml4pl/seq/string_encoder_worker"
+)
+
+VOCABULARY = {"a": 0, "bc": 1}
+
+
+@test.Fixture(scope="function", params=(1, 3))
+def service(request) -> encoder_service.EncoderService:
+  """A test fixture which yields a service with 1 and 3 workers."""
+  with encoder_service.EncoderService(
+    [str(STRING_ENCODER_WORKER)], VOCABULARY, worker_count=request.param
+  ) as service:
+    yield service
+
+
+def EncodedStrings(jobs):
+  """Return the encoded strings of a list of processed jobs."""
+  return [list(seq.encoded) for job in jobs for seq in job.seq]
+
+
+def test_EncoderService_Map(service: encoder_service.EncoderService):
+  """Test that jobs are encoded in order."""
+  jobs = service.Map(
+    [
+      ir2seq_pb2.StringEncoderJob(string=["abc", "a"]),
+      ir2seq_pb2.StringEncoderJob(string=[]),
+      ir2seq_pb2.StringEncoderJob(string=["bca"]),
+    ]
+  )
+  assert EncodedStrings(jobs) == [[0, 1], [0], [1, 0]]
+  # The vocabulary is not returned with the jobs.
+  assert not any(job.vocabulary for job in jobs)
+
+  # The workers reuse the vocabulary of the first job.
+  jobs = service.Map([ir2seq_pb2.StringEncoderJob(string=["x", "bc"])] * 4)
+  assert EncodedStrings(jobs) == [[2], [1]] * 4
+
+
+def test_EncoderService_restarts_failed_workers(
+  service: encoder_service.EncoderService,
+):
+  """Test that a worker which terminates is replaced."""
+  service.Map([ir2seq_pb2.StringEncoderJob(string=["a"])])
+  for worker in service._workers:
+    worker.Kill()
+
+  jobs = service.Map([ir2seq_pb2.StringEncoderJob(string=["bca"])])
+  assert EncodedStrings(jobs) == [[1, 0]]
+
+
+def test_Chunk():
+  """Test splitting a list into chunks."""
+  assert encoder_service.Chunk([], 2) == []
+  assert encoder_service.Chunk([1, 2, 3], 2) == [[1, 2], [3]]
+  assert encoder_service.Chunk([1, 2, 3], 5) == [[1], [2], [3]]
+  assert encoder_service.Chunk([1, 2, 3], 0) == [[1, 2, 3]]
+
+
+if __name__ == "__main__":
+  test.Main()
@@ -1,9 +1,13 @@
 """Module for conversion from unlabelled graphs to encoded sequences."""
 import json
+from typing import Any
+from typing import Callable
 from typing import Dict
+from typing import Iterable
 from typing import List
+from typing import NamedTuple
 from typing import Optional
-from typing import Set
+from typing import Tuple
 from typing import Union
 
 import lru
@@ -13,6 +17,8 @@ import sqlalchemy as sql
 from deeplearning.ml4pl.graphs import programl_pb2
 from deeplearning.ml4pl.graphs.labelled import graph_tuple_database
 from deeplearning.ml4pl.graphs.unlabelled import unlabelled_graph_database
+from deeplearning.ml4pl.seq import encoded_sequence_store
+from deeplearning.ml4pl.seq import encoder_service
 from deeplearning.ml4pl.seq import graph2seq_pb2
 from deeplearning.ml4pl.seq import ir2seq
 from labm8.py import app
@@ -38,6 +44,21 @@ GRAPH_ENCODER_WORKER = bazelutil.DataPath(
 LLVM_VOCAB = bazelutil.DataPath("phd/deeplearning/ml4pl/seq/llvm_vocab.json")
 
 
+class EncodedGraphSeq(NamedTuple):
+  """A graph encoded by a StatementEncoder.
+
+  This has the same fields as a graph2seq_pb2.ProgramGraphSeq message, stored
+  as arrays.
+  """
+
+  # The concatenated sequences of encoded node representations.
+  encoded: np.array
+  # The length of the encoded sequence of each node.
+  encoded_node_length: np.array
+  # The nodes of the graph which produced the encoded sequences.
+  node: np.array
+
+
 class EncoderBase(object):
   """Base class for performing graph-to-encoded sequence translation."""
 
@@ -52,15 +73,103 @@ class EncoderBase(object):
     # cost of encoding.
     cache_size = cache_size or FLAGS.graph2seq_cache_entries
     self.ir_id_to_encoded: Dict[int, np.array] = lru.LRU(cache_size)
+    # An optional persistent store of encoded sequences, shared between
+    # processes. Subclasses which support it set this during construction.
+    self.store: Optional[encoded_sequence_store.EncodedSequenceStore] = None
 
   def Encode(
     self,
     graphs: List[graph_tuple_database.GraphTuple],
     ctx: progress.ProgressContext = progress.NullContext,
-  ) -> List[Union[np.array, graph2seq_pb2.ProgramGraphSeq]]:
+  ) -> List[Union[np.array, EncodedGraphSeq]]:
     """Translate a list of graph IDs to encoded sequences."""
     raise NotImplementedError("abstract class")
 
+  def ToStoreColumns(self, encoded: Any) -> Tuple[np.array, ...]:
+    """Convert an encoded sequence to a tuple of store column values."""
+    raise NotImplementedError("abstract class")
+
+  def FromStoreColumns(self, columns: Tuple[np.array, ...]) -> Any:
+    """Convert a tuple of store column values to an encoded sequence."""
+    raise NotImplementedError("abstract class")
+
+  def CacheEncodedSequences(
+    self,
+    ir_ids: Iterable[int],
+    encode: Callable[[List[int]], List[Any]],
+  ) -> None:
+    """Ensure that the encoded sequences of IR IDs are cached.
+
+    IR IDs which are not in the in-memory cache are read from the persistent
+    store, if there is one. Any remaining IR IDs are encoded, and added to
+    both.
+
+    Args:
+      ir_ids: The IR IDs to cache the encoded sequences of.
+      encode: A callback which encodes a sorted list of IR IDs.
+    """
+    unknown_ir_ids = {
+      ir_id for ir_id in ir_ids if ir_id not in self.ir_id_to_encoded
+    }
+
+    if unknown_ir_ids and self.store:
+      for ir_id, columns in self.store.Get(unknown_ir_ids).items():
+        self.ir_id_to_encoded[ir_id] = self.FromStoreColumns(columns)
+        unknown_ir_ids.remove(ir_id)
+
+    if unknown_ir_ids:
+      # Encode the unknown IRs.
+      sorted_ir_ids_to_encode = sorted(unknown_ir_ids)
+      sorted_encoded = encode(sorted_ir_ids_to_encode)
+
+      # Cache the encoded unknown IRs.
+      for ir_id, encoded in zip(sorted_ir_ids_to_encode, sorted_encoded):
+        self.ir_id_to_encoded[ir_id] = encoded
+      if self.store:
+        self.store.Put(
+          sorted_ir_ids_to_encode,
+          [self.ToStoreColumns(encoded) for encoded in sorted_encoded],
+        )
+
+  def GetEncodedLengths(
+    self,
+    graphs: List[graph_tuple_database.GraphTuple],
+    ctx: progress.ProgressContext = progress.NullContext,
+  ) -> np.array:
+    """Return the lengths of the encoded sequences of graphs.
+
+    Lengths are looked up in the in-memory cache, and then in the offsets of
+    the persistent store, which does not require reading the sequences. Only
+    graphs which are in neither are encoded.
+
+    Args:
+      graphs: A list of graphs.
+      ctx: A logging context.
+
+    Returns:
+      An array of shape (len(graphs)), dtype np.int64.
+    """
+    lengths: Dict[int, int] = {}
+    for graph in graphs:
+      if graph.ir_id in self.ir_id_to_encoded:
+        encoded = self.ToStoreColumns(self.ir_id_to_encoded[graph.ir_id])[0]
+        lengths[graph.ir_id] = len(encoded)
+
+    missing = [graph for graph in graphs if graph.ir_id not in lengths]
+    if missing and self.store:
+      lengths.update(
+        self.store.GetLengths(
+          (graph.ir_id for graph in missing), self.store.columns[0]
+        )
+      )
+      missing = [graph for graph in missing if graph.ir_id not in lengths]
+
+    if missing:
+      for graph, encoded in zip(missing, self.Encode(missing, ctx=ctx)):
+        lengths[graph.ir_id] = len(self.ToStoreColumns(encoded)[0])
+
+    return np.array([lengths[graph.ir_id] for graph in graphs], dtype=np.int64)
+
   @property
   def max_encoded_length(self) -> int:
     """Return an upper bound on the length of the encoded sequences."""
@@ -88,6 +197,13 @@ class GraphEncoder(EncoderBase):
     super(GraphEncoder, self).__init__(graph_db, cache_size)
     self.ir2seq_encoder = ir2seq_encoder
 
+    # Encoders which have no vocabulary hash are not persisted.
+    vocabulary_hash = ir2seq_encoder.vocabulary_hash
+    if vocabulary_hash:
+      self.store = encoded_sequence_store.EncodedSequenceStore.FromFlags(
+        type(ir2seq_encoder).__name__, vocabulary_hash, columns=["encoded"],
+      )
+
   @property
   def max_encoded_length(self) -> int:
     """Return an upper bound on the length of the encoded sequences."""
@@ -116,26 +232,19 @@ class GraphEncoder(EncoderBase):
     Returns:
       A list of encoded sequences.
     """
-    unknown_ir_ids = set(
-      graph.ir_id
-      for graph in graphs
-      if graph.ir_id not in self.ir_id_to_encoded
+    self.CacheEncodedSequences(
+      (graph.ir_id for graph in graphs),
+      lambda ir_ids: self.ir2seq_encoder.Encode(ir_ids, ctx=ctx),
     )
+    return [self.ir_id_to_encoded[graph.ir_id] for graph in graphs]
 
-    if unknown_ir_ids:
-      # Encode the unknown IRs.
-      sorted_ir_ids_to_encode = sorted(unknown_ir_ids)
-      sorted_encoded_sequences = self.ir2seq_encoder.Encode(
-        sorted_ir_ids_to_encode, ctx=ctx
-      )
-
-      # Cache the encoded unknown IRs.
-      for ir_id, encoded_sequence in zip(
-        sorted_ir_ids_to_encode, sorted_encoded_sequences
-      ):
-        self.ir_id_to_encoded[ir_id] = encoded_sequence
+  def ToStoreColumns(self, encoded: np.array) -> Tuple[np.array, ...]:
+    """Convert an encoded sequence to a tuple of store column values."""
+    return (encoded,)
 
-    return [self.ir_id_to_encoded[graph.ir_id] for graph in graphs]
+  def FromStoreColumns(self, columns: Tuple[np.array, ...]) -> np.array:
+    """Convert a tuple of store column values to an encoded sequence."""
+    return columns[0]
 
 
 class StatementEncoder(EncoderBase):
@@ -160,11 +269,21 @@ class StatementEncoder(EncoderBase):
     self.vocabulary = data_to_load["vocab"]
     self._max_encoded_length = data_to_load["max_encoded_length"]
 
+    self.store = encoded_sequence_store.EncodedSequenceStore.FromFlags(
+      type(self).__name__,
+      encoded_sequence_store.HashVocabulary(self.vocabulary),
+      columns=list(EncodedGraphSeq._fields),
+    )
+    # If set, graphs are encoded by persistent worker processes.
+    self.encoder_service = encoder_service.EncoderService.FromFlags(
+      [str(GRAPH_ENCODER_WORKER)], self.vocabulary
+    )
+
   def Encode(
     self,
     graphs: List[graph_tuple_database.GraphTuple],
     ctx: progress.ProgressContext = progress.NullContext,
-  ) -> List[graph2seq_pb2.ProgramGraphSeq]:
+  ) -> List[EncodedGraphSeq]:
     """Serialize a graph into an encoded sequence.
 
     This method is used to provide a serialized sequence of encoded tokens
@@ -211,21 +330,13 @@ class StatementEncoder(EncoderBase):
       ctx: A logging context.
 
     Returns:
-      A list of EncodedSubsequence tuples, where each tuple maps a graph to
+      A list of EncodedGraphSeq tuples, where each tuple maps a graph to
       encoded sequences, subsequence groupings, and node_mask arrays which list
       the nodes which are selected from each graph.
     """
-    # Look for any graphs that are unknown.
-    graph_ids_to_encode: Set[int] = {
-      graph.ir_id
-      for graph in graphs
-      if graph.ir_id not in self.ir_id_to_encoded
-    }
 
-    if graph_ids_to_encode:
-      sorted_graph_ids_to_encode = sorted(graph_ids_to_encode)
-
-      # Fetch the protos for the graphs that we need to encode.
+    def EncodeIrIds(sorted_ir_ids: List[int]) -> List[EncodedGraphSeq]:
+      """Fetch and encode the protos of graphs."""
       with self.proto_db.Session() as session:
         sorted_protos_to_encode = [
           row.proto
@@ -234,27 +345,37 @@ class StatementEncoder(EncoderBase):
             sql.orm.joinedload(unlabelled_graph_database.ProgramGraph.data)
           )
           .filter(
-            unlabelled_graph_database.ProgramGraph.ir_id.in_(
-              graph_ids_to_encode
-            )
+            unlabelled_graph_database.ProgramGraph.ir_id.in_(sorted_ir_ids)
           )
           .order_by(unlabelled_graph_database.ProgramGraph.ir_id)
         ]
-        if len(sorted_protos_to_encode) != len(sorted_graph_ids_to_encode):
+        if len(sorted_protos_to_encode) != len(sorted_ir_ids):
           raise OSError(
-            f"Requested {len(sorted_graph_ids_to_encode)} protos "
+            f"Requested {len(sorted_ir_ids)} protos "
             "from database but received "
             f"{len(sorted_protos_to_encode)}"
           )
 
-      # Encode the unknown graphs.
-      sorted_encoded = self.EncodeGraphs(sorted_protos_to_encode, ctx=ctx)
-      # Encode and cache the unknown graphs.
-      for ir_id, encoded in zip(sorted_graph_ids_to_encode, sorted_encoded):
-        self.ir_id_to_encoded[ir_id] = encoded
+      return [
+        EncodedGraphSeq(
+          encoded=np.array(seq.encoded, dtype=np.int32),
+          encoded_node_length=np.array(seq.encoded_node_length, dtype=np.int32),
+          node=np.array(seq.node, dtype=np.int32),
+        )
+        for seq in self.EncodeGraphs(sorted_protos_to_encode, ctx=ctx)
+      ]
 
+    self.CacheEncodedSequences((graph.ir_id for graph in graphs), EncodeIrIds)
     return [self.ir_id_to_encoded[graph.ir_id] for graph in graphs]
 
+  def ToStoreColumns(self, encoded: EncodedGraphSeq) -> Tuple[np.array, ...]:
+    """Convert an encoded sequence to a tuple of store column values."""
+    return tuple(encoded)
+
+  def FromStoreColumns(self, columns: Tuple[np.array, ...]) -> EncodedGraphSeq:
+    """Convert a tuple of store column values to an encoded sequence."""
+    return EncodedGraphSeq(*columns)
+
   @property
   def max_encoded_length(self) -> int:
     """Return an upper bound on the length of the encoded sequences."""
@@ -285,13 +406,27 @@ class StatementEncoder(EncoderBase):
         f"({humanize.DecimalPrefix(token_count / t, ' tokens/sec')})"
       ),
     ):
-      message = graph2seq_pb2.GraphEncoderJob(
-        vocabulary=self.vocabulary, graph=graphs,
-      )
-      pbutil.RunProcessMessageInPlace(
-        [str(GRAPH_ENCODER_WORKER)], message, timeout_seconds=60
-      )
-      encoded_graphs = [encoded for encoded in message.seq]
+      if self.encoder_service:
+        # Split the graphs between the workers of the encoder service.
+        messages = self.encoder_service.Map(
+          [
+            graph2seq_pb2.GraphEncoderJob(graph=chunk)
+            for chunk in encoder_service.Chunk(
+              graphs, self.encoder_service.worker_count
+            )
+          ]
+        )
+      else:
+        message = graph2seq_pb2.GraphEncoderJob(
+          vocabulary=self.vocabulary, graph=graphs,
+        )
+        pbutil.RunProcessMessageInPlace(
+          [str(GRAPH_ENCODER_WORKER)], message, timeout_seconds=60
+        )
+        messages = [message]
+      encoded_graphs = [
+        encoded for message in messages for encoded in message.seq
+      ]
       token_count = sum(len(encoded.encoded) for encoded in encoded_graphs)
       if len(encoded_graphs) != len(graphs):
         raise ValueError(
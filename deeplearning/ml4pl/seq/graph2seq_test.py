@@ -215,6 +215,16 @@ def test_fuzz_GraphEncoder(
   assert len(encoded) == len(graphs)
 
 
+def test_GraphEncoder_GetEncodedLengths(
+  graph_encoder: graph2seq.GraphEncoder,
+  populated_graph_db: graph_tuple_database.Database,
+):
+  """Test that encoded lengths match the lengths of encoded sequences."""
+  graphs = SelectRandomGraphs(populated_graph_db)
+  lengths = graph_encoder.GetEncodedLengths(graphs)
+  assert lengths.tolist() == [len(e) for e in graph_encoder.Encode(graphs)]
+
+
 @decorators.loop_for(seconds=2, min_iteration_count=10)
 def test_fuzz_StatementEncoder(
   statement_encoder: graph2seq.StatementEncoder,
@@ -1,3 +1,5 @@
+#include <memory>
+
 #include "deeplearning/ml4pl/seq/cached_string_encoder.h"
 #include "deeplearning/ml4pl/seq/graph2seq.pb.h"
 #include "deeplearning/ml4pl/seq/graph_encoder.h"
@@ -7,21 +9,29 @@
 namespace ml4pl {
 
 // Process a graph encoder job inplace.
+//
+// The graph encoder is constructed from the vocabulary of a job. When
+// processing a stream of jobs, a job which does not set a vocabulary reuses the
+// encoder of the previous job, along with its cache of encoded strings.
 void ProgressGraphEncoderJobInplace(GraphEncoderJob* job) {
-  // Create the vocabulary.
-  absl::flat_hash_map<string, int> vocabulary;
-  for (auto it = job->vocabulary().begin(); it != job->vocabulary().end();
-       ++it) {
-    vocabulary.insert({it->first, it->second});
+  static std::unique_ptr<GraphEncoder> encoder;
+
+  if (!encoder || job->vocabulary_size()) {
+    // Create the vocabulary.
+    absl::flat_hash_map<string, int> vocabulary;
+    for (auto it = job->vocabulary().begin(); it != job->vocabulary().end();
+         ++it) {
+      vocabulary.insert({it->first, it->second});
+    }
+
+    // Create the string and graph encoders.
+    CachedStringEncoder string_encoder(vocabulary);
+    encoder.reset(new GraphEncoder(string_encoder));
   }
 
-  // Create the string and graph encoders.
-  CachedStringEncoder string_encoder(vocabulary);
-  GraphEncoder encoder(string_encoder);
-
   // Encode each of the graphs and record the results.
   for (const auto& graph : job->graph()) {
-    *job->add_seq() = encoder.Encode(graph);
+    *job->add_seq() = encoder->Encode(graph);
   }
 
   // Unset the input fields to minimize the size of the proto that must be
@@ -32,5 +42,5 @@ void ProgressGraphEncoderJobInplace(GraphEncoderJob* job) {
 
 }  // namespace ml4pl
 
-PBUTIL_INPLACE_PROCESS_MAIN(ml4pl::ProgressGraphEncoderJobInplace,
-                            ml4pl::GraphEncoderJob);
+PBUTIL_INPLACE_PROCESS_STREAM_MAIN(ml4pl::ProgressGraphEncoderJobInplace,
+                                   ml4pl::GraphEncoderJob);
@@ -1,6 +1,11 @@
 """Module to convert intermediate representations into vocabulary sequences."""
+import itertools
 import json
+import multiprocessing
+import multiprocessing.pool
+from typing import Dict
 from typing import List
+from typing import Optional
 from typing import Tuple
 
 import numpy as np
@@ -9,7 +14,9 @@ import sqlalchemy as sql
 from datasets.opencl.device_mapping import opencl_device_mapping_dataset
 from deeplearning.ml4pl.graphs.labelled.devmap import make_devmap_dataset
 from deeplearning.ml4pl.ir import ir_database
+from deeplearning.ml4pl.seq import encoded_sequence_store
 from deeplearning.ml4pl.seq import lexers
+from deeplearning.ml4pl.seq import statement_cache
 from deeplearning.ncc import vocabulary as inst2vec_vocab
 from deeplearning.ncc.inst2vec import api as inst2vec
 from labm8.py import app
@@ -20,6 +27,14 @@ from labm8.py import progress
 
 FLAGS = app.FLAGS
 
+app.DEFINE_integer(
+  "inst2vec_encoder_processes",
+  1,
+  "The number of worker processes that each inst2vec encoder encodes "
+  "sequences with. If 0, one process per CPU is used. If 1, sequences are "
+  "encoded in the calling process.",
+)
+
 # The vocabulary to use for LLVM encoders. Use
 # //deeplearning/ml4pl/seq:derive_vocab to generate a vocabulary.
 LLVM_VOCAB = bazelutil.DataPath("phd/deeplearning/ml4pl/seq/llvm_vocab.json")
@@ -57,6 +72,13 @@ class EncoderBase(object):
     """Return an upper bound on the length of the encoded sequences."""
     raise NotImplementedError("abstract class")
 
+  @property
+  def vocabulary_hash(self) -> Optional[str]:
+    """Return a checksum of the vocabulary, or None if the encoded sequences
+    should not be persisted.
+    """
+    return None
+
 
 class LlvmEncoder(EncoderBase):
   """An encoder for LLVM intermediate representations."""
@@ -132,6 +154,11 @@ class LlvmEncoder(EncoderBase):
     """Return an upper bound on the length of the encoded sequences."""
     return self._max_encoded_length
 
+  @property
+  def vocabulary_hash(self) -> Optional[str]:
+    """Return a checksum of the vocabulary."""
+    return encoded_sequence_store.HashVocabulary(self.lexer.vocab)
+
 
 class OpenClEncoder(EncoderBase):
   """An OpenCL source-level encoder.
@@ -247,9 +274,20 @@ class Inst2VecEncoder(EncoderBase):
       ).scalar()
       self._max_encoded_length = max_line_count
 
+    # A memo table of raw statement encodings, shared by every IR.
+    self.statement_cache = statement_cache.StatementCache.FromFlags(
+      type(self).__name__, self.vocabulary_hash
+    )
+    # The pool of worker processes, created on first use.
+    self._pool: Optional[multiprocessing.pool.Pool] = None
+
   def __del__(self):
     # Tidy up the unpacked vocabulary zipfile.
     self.vocab.__exit__()
+    # The pool is not set if the constructor raised before creating it.
+    pool = getattr(self, "_pool", None)
+    if pool:
+      pool.terminate()
 
   def Encode(
     self, ids: List[int], ctx: progress.ProgressContext = progress.NullContext,
@@ -291,7 +329,7 @@ class Inst2VecEncoder(EncoderBase):
         ),
       ):
         sorted_unique_encodeds: List[np.array] = self.EncodeStrings(
-          sorted_unique_ir
+          sorted_unique_ir, ctx=ctx
         )
         token_count = sum(len(encoded) for encoded in sorted_unique_encodeds)
 
@@ -307,11 +345,71 @@ class Inst2VecEncoder(EncoderBase):
     strings: List[str],
     ctx: progress.ProgressContext = progress.NullContext,
   ) -> List[np.array]:
+    """Encode a list of IR strings.
+
+    The IRs are split into statements, and the statements which are not in
+    the statement cache are encoded. Both stages are sharded across the
+    worker processes.
+
+    The statement cache is keyed on the raw statement alone. This is correct
+    only because inst2vec.EncodeLlvmBytecode() does not inline struct types,
+    so the encoding of a statement does not depend on the struct definitions
+    of its IR. If struct inlining is added, the key must include the struct
+    context.
+
+    Args:
+      strings: The IRs to encode.
+
+    Returns:
+      A list of encoded sequences.
+    """
+    statements: List[List[str]] = self._Map(
+      inst2vec.LlvmBytecodeStatements, strings, chunksize=4
+    )
+
+    unique_statements = set(itertools.chain.from_iterable(statements))
+    encoded: Dict[str, Optional[int]] = self.statement_cache.Get(
+      unique_statements
+    )
+    misses = [
+      statement for statement in unique_statements if statement not in encoded
+    ]
+    ctx.Log(
+      4,
+      "Encoding %s of %s unique statements",
+      humanize.Commas(len(misses)),
+      humanize.Commas(len(unique_statements)),
+    )
+    if misses:
+      encoded_misses = self._Map(_EncodeStatement, misses, chunksize=256)
+      self.statement_cache.Put(misses, encoded_misses)
+      encoded.update(zip(misses, encoded_misses))
+
     return [
-      np.array(inst2vec.EncodeLlvmBytecode(string, self.vocab), dtype=np.int32)
-      for string in strings
+      np.array(
+        [encoded[s] for s in ir_statements if encoded[s] is not None],
+        dtype=np.int32,
+      )
+      for ir_statements in statements
     ]
 
+  def _Map(self, fn, values: List, chunksize: int) -> List:
+    """Map a function over values using the pool of worker processes."""
+    processes = (
+      FLAGS.inst2vec_encoder_processes or multiprocessing.cpu_count()
+    )
+    if processes == 1 or len(values) <= 1:
+      _InitEncodeStatementWorker(self.vocab.dictionary)
+      return [fn(value) for value in values]
+
+    if not self._pool:
+      self._pool = multiprocessing.Pool(
+        processes,
+        initializer=_InitEncodeStatementWorker,
+        initargs=(self.vocab.dictionary,),
+      )
+    return self._pool.map(fn, values, chunksize=chunksize)
+
   @property
   def vocabulary_size(self) -> int:
     """Get the size of the vocabulary."""
@@ -321,3 +419,23 @@ class Inst2VecEncoder(EncoderBase):
   def max_encoded_length(self) -> int:
     """Return an upper bound on the length of the encoded sequences."""
     return self._max_encoded_length
+
+  @property
+  def vocabulary_hash(self) -> Optional[str]:
+    """Return a checksum of the vocabulary."""
+    return encoded_sequence_store.HashVocabulary(self.vocab.dictionary)
+
+
+# The vocabulary dictionary of an inst2vec worker process.
+_WORKER_DICTIONARY: Optional[Dict[str, int]] = None
+
+
+def _InitEncodeStatementWorker(dictionary: Dict[str, int]) -> None:
+  """Set the vocabulary dictionary used by _EncodeStatement()."""
+  global _WORKER_DICTIONARY
+  _WORKER_DICTIONARY = dictionary
+
+
+def _EncodeStatement(statement: str) -> Optional[int]:
+  """Encode a raw statement using the worker's vocabulary dictionary."""
+  return inst2vec.EncodeStatement(statement, _WORKER_DICTIONARY)
@@ -10,6 +10,7 @@ from deeplearning.ml4pl.graphs.labelled.devmap import make_devmap_dataset
 from deeplearning.ml4pl.ir import ir_database
 from deeplearning.ml4pl.seq import ir2seq
 from deeplearning.ml4pl.testing import testing_databases
+from deeplearning.ncc.inst2vec import api as inst2vec
 from labm8.py import decorators
 from labm8.py import test
 
@@ -93,5 +94,49 @@ def test_fuzz_Encode(encoder: ir2seq.EncoderBase):
     assert not np.where(encoded > encoder.vocabulary_size + 1)[0].size
 
 
+# Two IRs which contain the same raw statements, but different definitions of
+# the struct type that the statements use.
+STRUCT_IR_TEMPLATE = """\
+%struct.foo = type {{ {fields} }}
+
+define i32 @A(%struct.foo* %0) {{
+  %2 = getelementptr inbounds %struct.foo, %struct.foo* %0, i32 0, i32 1
+  %3 = load i32, i32* %2, align 4
+  ret i32 %3
+}}
+"""
+STRUCT_IRS = [
+  STRUCT_IR_TEMPLATE.format(fields="i32, i32"),
+  STRUCT_IR_TEMPLATE.format(fields="float, i32"),
+]
+
+
+def test_Inst2VecEncoder_EncodeStrings_struct_context(
+  populated_ir_db: ir_database.Database,
+):
+  """Test that memoized statements are encoded as by EncodeLlvmBytecode().
+
+  The statement cache is keyed on the raw statement alone, which assumes that
+  the encoding of a statement does not depend on the struct definitions of
+  its IR. This fails if EncodeLlvmBytecode() starts inlining struct types.
+  """
+  inst2vec_encoder_processes = FLAGS.inst2vec_encoder_processes
+  FLAGS.inst2vec_encoder_processes = 1
+  try:
+    encoder = ir2seq.Inst2VecEncoder(populated_ir_db)
+    # Encode the IRs one at a time, so that the second IR's statements are
+    # read from the statement cache populated by the first.
+    encodeds = [encoder.EncodeStrings([ir])[0] for ir in STRUCT_IRS]
+  finally:
+    FLAGS.inst2vec_encoder_processes = inst2vec_encoder_processes
+
+  # The IRs share raw statements, so the second IR is encoded using entries
+  # which were memoized for the first.
+  a, b = [inst2vec.LlvmBytecodeStatements(ir) for ir in STRUCT_IRS]
+  assert set(a) & set(b)
+  for ir, encoded in zip(STRUCT_IRS, encodeds):
+    assert encoded.tolist() == inst2vec.EncodeLlvmBytecode(ir, encoder.vocab)
+
+
 if __name__ == "__main__":
   test.Main()
@@ -7,6 +7,7 @@ from typing import Optional
 
 import numpy as np
 
+from deeplearning.ml4pl.seq import encoder_service
 from deeplearning.ml4pl.seq import ir2seq_pb2
 from labm8.py import app
 from labm8.py import bazelutil
@@ -263,6 +264,10 @@ class Lexer(object):
     self.max_chunk_size = max_chunk_size or (
       FLAGS.lexer_chunk_size_mb * 1024 * 1024
     )
+    # If set, strings are lexed by persistent worker processes.
+    self.encoder_service = encoder_service.EncoderService.FromFlags(
+      [str(STRING_ENCODER_WORKER)], self.vocab
+    )
 
   @property
   def vocabulary_size(self) -> int:
@@ -307,17 +312,30 @@ class Lexer(object):
         f"({humanize.DecimalPrefix(token_count / t, ' tokens/sec')})"
       ),
     ):
-      message = ir2seq_pb2.StringEncoderJob(
-        string=texts, vocabulary=self.vocab,
-      )
-      pbutil.RunProcessMessageInPlace(
-        [str(STRING_ENCODER_WORKER)], message, timeout_seconds=60
-      )
+      if self.encoder_service:
+        # Split the strings between the workers of the encoder service.
+        messages = self.encoder_service.Map(
+          [
+            ir2seq_pb2.StringEncoderJob(string=chunk)
+            for chunk in encoder_service.Chunk(
+              texts, self.encoder_service.worker_count
+            )
+          ]
+        )
+      else:
+        message = ir2seq_pb2.StringEncoderJob(
+          string=texts, vocabulary=self.vocab,
+        )
+        pbutil.RunProcessMessageInPlace(
+          [str(STRING_ENCODER_WORKER)], message, timeout_seconds=60
+        )
+        messages = [message]
+      seqs = [seq for message in messages for seq in message.seq]
 
       # Used in profiling callback.
-      token_count = sum([len(seq.encoded) for seq in message.seq])
+      token_count = sum([len(seq.encoded) for seq in seqs])
 
-    encoded = [np.array(j.encoded, dtype=np.int32) for j in message.seq]
+    encoded = [np.array(j.encoded, dtype=np.int32) for j in seqs]
     if len(encoded) != len(texts):
       raise OSError(
         f"Lexer returned {len(texts)} sequences for {len(encoded)} inputs"
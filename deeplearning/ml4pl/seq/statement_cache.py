@@ -0,0 +1,140 @@
+"""A bounded, persistent memo table of encoded statements.
+
+Statement-level encoders such as inst2vec map each statement of an IR to a
+single vocabulary index, independently of the other statements of the IR.
+Most statements recur many times across a corpus, so a StatementCache
+memoizes the encoding of each raw statement, bounded to the most recently
+used entries.
+
+The memo table can be persisted to a file which is keyed by encoder type and
+vocabulary hash, so that the statements encoded by one run are reused by the
+next:
+
+    <root>/<encoder_type>_<vocabulary_hash>_statements.pickle
+
+where <root> is --encoded_sequence_store. The file is rewritten in full when
+the cache is flushed, so concurrent processes which share a file do not
+corrupt it, but the file holds only the entries of the last process to flush.
+"""
+import atexit
+import os
+import pathlib
+import pickle
+import tempfile
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+
+import lru
+
+from deeplearning.ml4pl.seq import encoded_sequence_store  # Defines flags.
+from labm8.py import app
+
+FLAGS = app.FLAGS
+
+app.DEFINE_integer(
+  "statement_cache_entries",
+  1000000,
+  "The number of statement -> encoded index entries to cache.",
+)
+
+
+class StatementCache(object):
+  """A bounded memo table from raw statement to encoded index."""
+
+  def __init__(
+    self, path: Optional[pathlib.Path] = None, max_entries: int = 1000000,
+  ):
+    """Constructor.
+
+    Args:
+      path: The file to persist the memo table to. If the file exists, the
+        cache is initialized with its entries. If not provided, the cache is
+        not persisted.
+      max_entries: The maximum number of entries to cache. Once full, the
+        least recently used entries are evicted.
+    """
+    self.path = pathlib.Path(path) if path else None
+    self._cache = lru.LRU(max_entries)
+    # Whether the cache has entries which have not been written to path.
+    self._dirty = False
+
+    if self.path and self.path.is_file():
+      with open(self.path, "rb") as f:
+        # Entries are stored from least to most recently used.
+        for statement, encoded in pickle.load(f):
+          self._cache[statement] = encoded
+
+    if self.path:
+      # Write any new entries when the process exits.
+      atexit.register(self.Flush)
+
+  @classmethod
+  def FromFlags(
+    cls, encoder_type: str, vocabulary_hash: str
+  ) -> "StatementCache":
+    """Construct a cache from flags, which is persisted if
+    --encoded_sequence_store is set.
+
+    Args:
+      encoder_type: The name of the encoder.
+      vocabulary_hash: The checksum of the vocabulary used by the encoder, as
+        returned by encoded_sequence_store.HashVocabulary().
+    """
+    path = None
+    if FLAGS.encoded_sequence_store:
+      path = (
+        pathlib.Path(FLAGS.encoded_sequence_store)
+        / f"{encoder_type}_{vocabulary_hash[:16]}_statements.pickle"
+      )
+    return cls(path, max_entries=FLAGS.statement_cache_entries)
+
+  def __len__(self) -> int:
+    return len(self._cache)
+
+  def Get(self, statements: Iterable[str]) -> Dict[str, Optional[int]]:
+    """Look up the encodings of statements.
+
+    Args:
+      statements: The raw statements to look up.
+
+    Returns:
+      A map from statement to encoded index, for every statement which is in
+      the cache. A statement which is not encoded has a value of None.
+    """
+    found = {}
+    for statement in statements:
+      if statement in self._cache:
+        found[statement] = self._cache[statement]
+    return found
+
+  def Put(self, statements: List[str], encoded: List[Optional[int]]) -> None:
+    """Add the encodings of statements to the cache.
+
+    Args:
+      statements: The raw statements.
+      encoded: The encoded index of each statement, or None for statements
+        which are not encoded.
+    """
+    for statement, value in zip(statements, encoded):
+      self._cache[statement] = value
+    self._dirty = True
+
+  def Flush(self) -> None:
+    """Write the cache to its file, if it has changed since the last flush."""
+    if not self.path or not self._dirty:
+      return
+
+    # LRU.items() is ordered from most to least recently used.
+    entries = list(reversed(self._cache.items()))
+
+    # Write to a temporary file and rename it, so that readers never see a
+    # partially written file.
+    self.path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", dir=self.path.parent)
+    with os.fdopen(fd, "wb") as f:
+      pickle.dump(entries, f)
+    os.rename(tmp_path, self.path)
+
+    self._dirty = False
@@ -0,0 +1,67 @@
+"""Unit tests for //deeplearning/ml4pl/seq:statement_cache."""
+import pathlib
+
+from deeplearning.ml4pl.seq import statement_cache
+from labm8.py import test
+
+FLAGS = test.FLAGS
+
+
+def test_StatementCache_Get():
+  """Test that only cached statements are returned."""
+  cache = statement_cache.StatementCache()
+  cache.Put(["ret void", "entry:"], [5, None])
+
+  assert cache.Get(["ret void", "entry:", "unreachable"]) == {
+    "ret void": 5,
+    "entry:": None,
+  }
+
+
+def test_StatementCache_max_entries():
+  """Test that the least recently used statements are evicted."""
+  cache = statement_cache.StatementCache(max_entries=2)
+  cache.Put(["a", "b"], [0, 1])
+  # Use "a", so that "b" is the least recently used.
+  assert cache.Get(["a"]) == {"a": 0}
+  cache.Put(["c"], [2])
+
+  assert len(cache) == 2
+  assert cache.Get(["a", "b", "c"]) == {"a": 0, "c": 2}
+
+
+def test_StatementCache_persisted(tmp_path: pathlib.Path):
+  """Test that statements are reused by a new cache."""
+  path = tmp_path / "statements.pickle"
+  writer = statement_cache.StatementCache(path, max_entries=2)
+  writer.Put(["a", "b", "c"], [0, None, 2])
+  writer.Flush()
+
+  # The most recently used entries are loaded.
+  reader = statement_cache.StatementCache(path, max_entries=2)
+  assert reader.Get(["a", "b", "c"]) == {"b": None, "c": 2}
+
+  # A smaller cache keeps only the most recently used entry.
+  reader = statement_cache.StatementCache(path, max_entries=1)
+  assert reader.Get(["a", "b", "c"]) == {"c": 2}
+
+
+def test_StatementCache_FromFlags(tmp_path: pathlib.Path):
+  """Test that caches are keyed by encoder type and vocabulary hash."""
+  encoded_sequence_store = FLAGS.encoded_sequence_store
+  FLAGS.encoded_sequence_store = str(tmp_path)
+  try:
+    cache = statement_cache.StatementCache.FromFlags("Foo", "0123456789abcdefg")
+    assert cache.path == tmp_path / "Foo_0123456789abcdef_statements.pickle"
+    cache.Put(["a"], [0])
+    cache.Flush()
+    assert cache.path.is_file()
+
+    other = statement_cache.StatementCache.FromFlags("Foo", "fedcba9876543210")
+    assert not other.Get(["a"])
+  finally:
+    FLAGS.encoded_sequence_store = encoded_sequence_store
+
+
+if __name__ == "__main__":
+  test.Main()
@@ -1,3 +1,5 @@
+#include <memory>
+
 #include "deeplearning/ml4pl/seq/cached_string_encoder.h"
 #include "deeplearning/ml4pl/seq/ir2seq.pb.h"
 
@@ -5,22 +7,30 @@
 
 namespace ml4pl {
 
-// Process a graph encoder job inplace.
+// Process a string encoder job inplace.
+//
+// The string encoder is constructed from the vocabulary of a job. When
+// processing a stream of jobs, a job which does not set a vocabulary reuses the
+// encoder of the previous job, along with its cache of encoded strings.
 void ProgressStringEncoderJobInplace(StringEncoderJob* job) {
-  // Create the vocabulary.
-  absl::flat_hash_map<string, int> vocabulary;
-  for (auto it = job->vocabulary().begin(); it != job->vocabulary().end();
-       ++it) {
-    vocabulary.insert({it->first, it->second});
-  }
+  static std::unique_ptr<CachedStringEncoder> encoder;
+
+  if (!encoder || job->vocabulary_size()) {
+    // Create the vocabulary.
+    absl::flat_hash_map<string, int> vocabulary;
+    for (auto it = job->vocabulary().begin(); it != job->vocabulary().end();
+         ++it) {
+      vocabulary.insert({it->first, it->second});
+    }
 
-  // Create the string encoder.
-  CachedStringEncoder encoder(vocabulary);
+    // Create the string encoder.
+    encoder.reset(new CachedStringEncoder(vocabulary));
+  }
 
   // Encode each of the string and record the results.
   for (const auto& string : job->string()) {
     EncodedString* message = job->add_seq();
-    std::vector<int> encoded = encoder.EncodeAndCache(string);
+    std::vector<int> encoded = encoder->EncodeAndCache(string);
     message->mutable_encoded()->Reserve(encoded.size());
     for (int i = 0; i < encoded.size(); ++i) {
       message->mutable_encoded()->Add(encoded[i]);
@@ -35,5 +45,5 @@ void ProgressStringEncoderJobInplace(StringEncoderJob* job) {
 
 }  // namespace ml4pl
 
-PBUTIL_INPLACE_PROCESS_MAIN(ml4pl::ProgressStringEncoderJobInplace,
-                            ml4pl::StringEncoderJob);
+PBUTIL_INPLACE_PROCESS_STREAM_MAIN(ml4pl::ProgressStringEncoderJobInplace,
+                                   ml4pl::StringEncoderJob);
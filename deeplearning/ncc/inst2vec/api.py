@@ -10,6 +10,7 @@ import numpy as np
 from deeplearning.ncc import rgx_utils as rgx
 from deeplearning.ncc import vocabulary
 from deeplearning.ncc.inst2vec import inst2vec_preprocess as preprocess
+from deeplearning.ncc.inst2vec import statement_normalizer
 from labm8.py import app
 from labm8.py import bazelutil
 
@@ -22,6 +23,9 @@ INST2VEC_DICITONARY_PATH = bazelutil.DataPath(
   "phd/deeplearning/ncc/published_results/dic_pickle"
 )
 
+# Normalized label declarations, which are not encoded.
+_LABEL_RE = re.compile(r"((?:<label>:)?(<LABEL>):|:; <label>:<LABEL>)")
+
 
 def PreprocessLlvmBytecode(bytecode: str) -> str:
   """Pre-process an LLVM bytecode for encoding."""
@@ -43,28 +47,47 @@ def EncodeLlvmBytecode(
   bytecode: str, vocab: vocabulary.VocabularyZipFile
 ) -> typing.List[int]:
   """Encode an LLVM bytecode to an array of vocabulary indices."""
-  bytecode_lines = bytecode.split("\n")
-  preprocessed_lines, functions_declared_in_files = preprocess.preprocess(
-    [bytecode_lines]
-  )
-  preprocessed_lines = preprocessed_lines[0]
-
   # TODO(cec): inline_struct_types_txt
 
-  # Abstract identifiers from statements.
-  preprocessed_lines = [
-    preprocess.PreprocessStatement(statement)
-    for statement in preprocessed_lines
-  ]
+  # Preprocess and abstract identifiers from statements.
+  preprocessed_lines = statement_normalizer.PreprocessBytecode(bytecode)
 
   # Translate from statement to encoded token.
   return [
     vocab.dictionary.get(statement, vocab.dictionary[rgx.unknown_token])
     for statement in preprocessed_lines
-    if not re.match(r"((?:<label>:)?(<LABEL>):|:; <label>:<LABEL>)", statement)
+    if not _LABEL_RE.match(statement)
   ]
 
 
+def LlvmBytecodeStatements(bytecode: str) -> typing.List[str]:
+  """Split an LLVM bytecode into the raw statements which are encoded.
+
+  Each statement can be encoded independently using EncodeStatement().
+  """
+  preprocessed, _ = preprocess.preprocess([bytecode.split("\n")])
+  return preprocessed[0]
+
+
+def EncodeStatement(
+  statement: str, dictionary: typing.Dict[str, int]
+) -> typing.Optional[int]:
+  """Encode a raw statement to a vocabulary index.
+
+  Args:
+    statement: A statement, as returned by LlvmBytecodeStatements().
+    dictionary: The vocabulary dictionary.
+
+  Returns:
+    The vocabulary index of the statement, or None if the statement is a label
+    declaration, which is not encoded.
+  """
+  statement = statement_normalizer.NormalizeStatement(statement)
+  if _LABEL_RE.match(statement):
+    return None
+  return dictionary.get(statement, dictionary[rgx.unknown_token])
+
+
 def EmbedEncoded(encoded: typing.List[int], embedding_matrix) -> np.ndarray:
   """Embed an array of vocabulary indices."""
   raise NotImplementedError
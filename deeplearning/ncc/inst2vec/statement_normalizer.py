@@ -0,0 +1,304 @@
+"""A single-pass normalizer for inst2vec statements.
+
+inst2vec abstracts the identifiers and immediate values of an LLVM IR
+statement into tokens, e.g.
+
+    %5 = fadd double %4, 1.000000e+00
+
+becomes
+
+    <%ID> = fadd double <%ID>, <FLOAT>
+
+inst2vec_preprocess.PreprocessStatement() and
+vocabulary.PreprocessLlvmBytecode() do this with a chain of regular expression
+substitutions per statement, where each substitution is applied to the output
+of the previous one. This module produces the same statements by scanning each
+statement once with a single compiled pattern. Since each substitution of the
+chain only changes the text that later substitutions see in a few ways, the
+order of the chain is encoded in the scanner:
+
+  * Identifiers are matched first. A number or label can never start inside
+    an identifier, since the identifier would consume it.
+  * Integers are only matched if no float or label would be matched at the
+    same position.
+  * The "align" and "[" lookbehinds of integers are evaluated on the text
+    since the previous token, which is the same text that the chain sees.
+
+Statements which contain string constants or are extractelement or
+insertelement instructions, which are a small fraction of statements, have one
+more substitution applied to the output of the scanner.
+"""
+import multiprocessing
+import re
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+
+from deeplearning.ncc import rgx_utils as rgx
+from deeplearning.ncc.inst2vec import inst2vec_preprocess
+
+
+# The characters of a global identifier, after the "@".
+_GLOBAL_ID_CHAR = r'["\w\d\.\-\_\$\\]'
+
+# A label name, e.g. "for.body:". This is rgx.local_id_no_perc followed by a
+# colon, except that an "@" which starts a global identifier is not part of a
+# label, since global identifiers are substituted before labels.
+_LABEL_NAME = r'(?:["\d\w\.\-\_\:]|@(?!' + _GLOBAL_ID_CHAR + r"))+:"
+
+# The number of a label declaration, e.g. ":12" in "; <label>:12:".
+_LABEL_NUMBER = r":\d+"
+
+_FLOAT = rgx.immediate_value_float_hexa + "|" + rgx.immediate_value_float_sci
+
+
+def _CompileScanner(
+  label: Optional[str],
+  label_first_chars: str,
+  ints: bool,
+  space_before_float: bool,
+):
+  """Compile the pattern of a statement scanner.
+
+  Args:
+    label: The pattern of labels to match, if any.
+    label_first_chars: The characters that a label can start with, as the
+      contents of a character class.
+    ints: Whether to match integers.
+    space_before_float: Whether floats must be preceded by a space.
+
+  Returns:
+    A compiled pattern with one named group per token type.
+  """
+  # Numbers which start after a space must not start a label.
+  not_label = f"(?!{label})" if label else ""
+
+  alternatives = [
+    f"(?P<local>{rgx.local_id})",
+    f"(?P<global>{rgx.global_id})",
+  ]
+  if label:
+    alternatives.append(f"(?P<label>{label})")
+  if space_before_float:
+    alternatives.append(f"(?P<float> {not_label}(?:{_FLOAT}))")
+  else:
+    alternatives.append(f"(?P<float>{_FLOAT})")
+  if ints:
+    alternatives.append(
+      f"(?P<int> {not_label}(?!{_FLOAT}){rgx.immediate_value_int})"
+    )
+  # Most characters cannot start a token, so check the character before trying
+  # each of the alternatives.
+  first_chars = r"%@ \d\-" + label_first_chars
+  return re.compile(f"(?=[{first_chars}])(?:{'|'.join(alternatives)})")
+
+
+# The statement modes, which determine the tokens to match. Labels are only
+# substituted in label declarations, and integers are not substituted in
+# aggregate and vector element instructions.
+_INSTRUCTION = 0
+_ELEMENT_INSTRUCTION = 1
+_LABEL_NUMBER_DECLARATION = 2
+_LABEL_NAME_DECLARATION = 3
+
+
+def _Tokens(mode: int, space_before_float: bool) -> Dict[str, str]:
+  """Return the substitutions of each token type of a scanner."""
+  tokens = {
+    "local": "<%ID>",
+    "global": "<@ID>",
+    "float": " <FLOAT>" if space_before_float else "<FLOAT>",
+    "int": " <INT>",
+  }
+  if mode == _LABEL_NUMBER_DECLARATION:
+    tokens.update(local="<LABEL>", label=":<LABEL>")
+  elif mode == _LABEL_NAME_DECLARATION:
+    tokens.update(local="<LABEL>", label="<LABEL>:")
+  return tokens
+
+
+# A map from <mode, space_before_float> to a <scanner, tokens> pair.
+_SCANNERS = {
+  (mode, space_before_float): (
+    _CompileScanner(label, label_first_chars, ints, space_before_float),
+    _Tokens(mode, space_before_float),
+  )
+  for mode, label, label_first_chars, ints in (
+    (_INSTRUCTION, None, "", True),
+    (_ELEMENT_INSTRUCTION, None, "", False),
+    (_LABEL_NUMBER_DECLARATION, _LABEL_NUMBER, ":", True),
+    (_LABEL_NAME_DECLARATION, _LABEL_NAME, r'"\w\.\-\:@', True),
+  )
+  for space_before_float in (False, True)
+}
+
+_LABEL_NUMBER_DECLARATION_RE = re.compile(r"; <label>:\d+")
+_LABEL_NAME_DECLARATION_RE = re.compile(_LABEL_NAME)
+_ELEMENT_INSTRUCTION_RE = re.compile(
+  rgx.local_id + r" = (?:extract|insert)(?:element|value)"
+)
+_STRING_RE = re.compile(rgx.immediate_value_string)
+_INDEX_TYPE_RE = re.compile(r"i\d+ ")
+_STRUCT_NAME_RE = re.compile("(" + rgx.struct_name + ")")
+
+
+def NormalizeStatement(stmt: str, space_before_float: bool = False) -> str:
+  """Abstract the identifiers and immediate values of a statement.
+
+  Args:
+    stmt: A statement, as produced by inst2vec_preprocess.preprocess().
+    space_before_float: If true, only floats which are preceded by a space are
+      substituted, as done by vocabulary.PreprocessLlvmBytecode(). Else, all
+      floats are substituted, as done by
+      inst2vec_preprocess.PreprocessStatement().
+
+  Returns:
+    The normalized statement.
+  """
+  if _LABEL_NUMBER_DECLARATION_RE.match(stmt):
+    mode = _LABEL_NUMBER_DECLARATION
+  elif _LABEL_NAME_DECLARATION_RE.match(stmt):
+    mode = _LABEL_NAME_DECLARATION
+  else:
+    mode = _INSTRUCTION
+
+  # Drop the text between a label and its predecessors. Tokens never contain
+  # spaces, so this can be done before scanning.
+  if "; preds = " in stmt:
+    s = stmt.split("  ")
+    if s[-1][0] == " ":
+      stmt = s[0] + s[-1]
+    else:
+      stmt = s[0] + " " + s[-1]
+
+  if mode == _INSTRUCTION and _ELEMENT_INSTRUCTION_RE.match(stmt):
+    mode = _ELEMENT_INSTRUCTION
+
+  scanner, tokens = _SCANNERS[(mode, space_before_float)]
+  out = []
+  end = 0
+  for match in scanner.finditer(stmt):
+    start = match.start()
+    token = match.lastgroup
+    if token == "int":
+      # An integer must not follow "align" or "[".
+      text_before = stmt[end:start]
+      if text_before.endswith("align") or text_before.endswith("["):
+        continue
+    out.append(stmt[end:start])
+    out.append(tokens[token])
+    end = match.end()
+  out.append(stmt[end:])
+  stmt = "".join(out)
+
+  if 'c"' in stmt:
+    stmt = _STRING_RE.sub(" <STRING>", stmt)
+  if stmt.startswith(("<%ID> = extractelement", "<%ID> = insertelement")):
+    stmt = _INDEX_TYPE_RE.sub("<TYP> ", stmt)
+
+  return stmt
+
+
+def InlineStructTypes(
+  lines: List[str], struct_dict: Dict[str, str]
+) -> List[str]:
+  """Replace the names of structures with their literal structure types.
+
+  Most statements do not use named structures, so a single search for any of
+  the names in the dictionary is used to skip them.
+
+  Args:
+    lines: The statements to inline structures in.
+    struct_dict: A map from structure name to literal structure type, as
+      returned by vocabulary.GetStructDict().
+
+  Returns:
+    The statements with structure types inlined.
+  """
+  if not struct_dict:
+    return lines
+
+  names = re.compile(
+    "(?:"
+    + "|".join(re.escape(name) for name in struct_dict)
+    + ")"
+    + rgx.struct_lookahead
+  )
+  inlined = []
+  for line in lines:
+    if names.search(line):
+      for possible_struct in _STRUCT_NAME_RE.findall(line):
+        if possible_struct in struct_dict and not re.match(
+          possible_struct + r"\d* = ", line
+        ):
+          line = re.sub(
+            re.escape(possible_struct) + rgx.struct_lookahead,
+            struct_dict[possible_struct],
+            line,
+          )
+    inlined.append(line)
+  return inlined
+
+
+def NormalizeBytecodeLines(
+  lines: List[str], struct_dict: Dict[str, str]
+) -> List[str]:
+  """Inline structures and normalize the statements of a bytecode.
+
+  This is equivalent to vocabulary.PreprocessLlvmBytecode().
+
+  Args:
+    lines: The statements of a bytecode, as produced by
+      inst2vec_preprocess.preprocess().
+    struct_dict: A map from structure name to literal structure type.
+
+  Returns:
+    The normalized statements.
+  """
+  # Remove the structure definitions. "." does not match a newline.
+  lines = [line for line in lines if " = type " not in line.split("\n", 1)[0]]
+  return [
+    NormalizeStatement(line, space_before_float=True)
+    for line in InlineStructTypes(lines, struct_dict)
+  ]
+
+
+def PreprocessBytecode(bytecode: str) -> List[str]:
+  """Preprocess a bytecode and normalize its statements.
+
+  This produces the statements which are looked up in the vocabulary by
+  api.EncodeLlvmBytecode().
+
+  Args:
+    bytecode: An LLVM bytecode.
+
+  Returns:
+    A list of normalized statements.
+  """
+  preprocessed, _ = inst2vec_preprocess.preprocess([bytecode.split("\n")])
+  return [NormalizeStatement(stmt) for stmt in preprocessed[0]]
+
+
+def PreprocessBytecodes(
+  bytecodes: Iterable[str],
+  pool: Optional[multiprocessing.Pool] = None,
+  chunksize: int = 8,
+) -> Iterator[List[str]]:
+  """Preprocess and normalize a batch of bytecodes in parallel.
+
+  Args:
+    bytecodes: The bytecodes to preprocess.
+    pool: The pool of worker processes to use. If not provided, a pool is
+      created for the duration of the batch.
+    chunksize: The number of bytecodes to send to a worker at a time.
+
+  Returns:
+    An iterator of normalized statements, in the same order as the bytecodes.
+  """
+  if pool:
+    yield from pool.imap(PreprocessBytecode, bytecodes, chunksize=chunksize)
+  else:
+    with multiprocessing.Pool() as pool:
+      yield from pool.imap(PreprocessBytecode, bytecodes, chunksize=chunksize)
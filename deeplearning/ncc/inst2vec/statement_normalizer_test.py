@@ -0,0 +1,119 @@
+"""Unit tests for //deeplearning/ncc/inst2vec:statement_normalizer.
+
+The normalizer is tested differentially against the regular expression
+implementations that it replaces, using a corpus of real bytecodes.
+"""
+import multiprocessing
+import pathlib
+from typing import List
+
+from deeplearning.ncc import vocabulary
+from deeplearning.ncc.inst2vec import inst2vec_preprocess
+from deeplearning.ncc.inst2vec import statement_normalizer
+from labm8.py import bazelutil
+from labm8.py import test
+
+FLAGS = test.FLAGS
+
+BYTECODE_REGRESSION_TESTS = bazelutil.DataPath(
+  "phd/deeplearning/ml4pl/testing/data/bytecode_regression_tests"
+)
+
+BYTECODE_PATHS = sorted(BYTECODE_REGRESSION_TESTS.glob("*.ll"))
+
+# Statements which exercise the interactions between substitutions.
+STATEMENTS = [
+  "%5 = fadd double %4, 1.000000e+00",
+  "%3 = fmul float %2, 0x3FB99999A0000000",
+  "store double -0x7FF0000000000000, double* %x, align 8",
+  "%7 = getelementptr inbounds [10 x i32], [10 x i32]* %6, i64 0, i64 %5",
+  "%2 = alloca [4 x i8], align 16",
+  "%9 = extractelement <4 x i32> %8, i32 2",
+  "%10 = insertelement <2 x double> undef, double 1.5, i64 1",
+  "%11 = extractvalue { i32, i1 } %10, 0",
+  "%agg = insertvalue { i32, float } undef, i32 7, 0",
+  "; <label>:12:                                      ; preds = %5, %3",
+  "; <label>:7:                                      ; preds = %7, %3",
+  "for.body:                                         ; preds = %for.cond",
+  "entry:",
+  "13:                                               ; preds = %4",
+  "@.str = private unnamed_addr constant [4 x i8] c\"%d\\0A\\00\", align 1",
+  '@.str.1 = private constant [8 x i8] c"100% 5 \\00", align 1',
+  "%call = call i32 (i8*, ...) @printf(i8* getelementptr inbounds "
+  "([4 x i8], [4 x i8]* @.str, i32 0, i32 0), i32 %1)",
+  "switch i32 %0, label %7 [\n i32 1, label %3\n i32 -2, label %5]",
+  "%add = add nsw i32 %x.align 4, -12",
+  "%struct.foo = type { i32, %struct.bar* }",
+  "br i1 %cmp, label %if.then, label %if.else",
+]
+
+
+def ReadStatements(path: pathlib.Path) -> List[str]:
+  """Read the statements of a bytecode, as produced by preprocess()."""
+  preprocessed, _ = inst2vec_preprocess.preprocess(
+    [path.read_text().split("\n")]
+  )
+  return preprocessed[0]
+
+
+@test.Parametrize("stmt", STATEMENTS)
+def test_NormalizeStatement_equivalent_to_PreprocessStatement(stmt: str):
+  """Test that statements are normalized as by PreprocessStatement()."""
+  assert statement_normalizer.NormalizeStatement(
+    stmt
+  ) == inst2vec_preprocess.PreprocessStatement(stmt)
+
+
+@test.Parametrize("stmt", STATEMENTS)
+def test_NormalizeStatement_space_before_float_equivalent_to_vocabulary(
+  stmt: str,
+):
+  """Test that statements are normalized as by PreprocessLlvmBytecode()."""
+  assert statement_normalizer.NormalizeBytecodeLines(
+    [stmt], {}
+  ) == vocabulary.PreprocessLlvmBytecode([stmt], {})
+
+
+@test.Parametrize("path", BYTECODE_PATHS, namer=lambda path: path.stem)
+def test_NormalizeStatement_bytecode_regression_tests(path: pathlib.Path):
+  """Test that the statements of real bytecodes are normalized identically."""
+  for stmt in ReadStatements(path):
+    assert statement_normalizer.NormalizeStatement(
+      stmt
+    ) == inst2vec_preprocess.PreprocessStatement(stmt), stmt
+
+
+@test.Parametrize("path", BYTECODE_PATHS, namer=lambda path: path.stem)
+def test_NormalizeBytecodeLines_bytecode_regression_tests(path: pathlib.Path):
+  """Test that structures of real bytecodes are inlined identically."""
+  try:
+    struct_dict = vocabulary.GetStructDict(path.read_text().split("\n"))
+  except AssertionError:
+    # Some bytecodes have structure types which cannot be inlined.
+    struct_dict = {}
+  statements = ReadStatements(path)
+
+  assert statement_normalizer.NormalizeBytecodeLines(
+    statements, struct_dict
+  ) == vocabulary.PreprocessLlvmBytecode(statements, struct_dict)
+
+
+def test_PreprocessBytecodes():
+  """Test that a batch of bytecodes is preprocessed in order."""
+  bytecodes = [path.read_text() for path in BYTECODE_PATHS]
+  with multiprocessing.Pool(2) as pool:
+    preprocessed = list(
+      statement_normalizer.PreprocessBytecodes(bytecodes, pool=pool)
+    )
+
+  assert preprocessed == [
+    [
+      inst2vec_preprocess.PreprocessStatement(stmt)
+      for stmt in ReadStatements(path)
+    ]
+    for path in BYTECODE_PATHS
+  ]
+
+
+if __name__ == "__main__":
+  test.Main()
@@ -10,6 +10,7 @@ import zipfile
 from deeplearning.ncc import inst2vec_pb2
 from deeplearning.ncc import rgx_utils
 from deeplearning.ncc.inst2vec import inst2vec_preprocess as i2v_prep
+from deeplearning.ncc.inst2vec import statement_normalizer
 from labm8.py import app
 from labm8.py import bazelutil
 from labm8.py import decorators
@@ -134,7 +135,7 @@ class VocabularyZipFile(object):
     # TODO(cec): Merge i2v_prep.preprocess() and PreprocessLlvmBytecode().
     preprocessed_data, _ = i2v_prep.preprocess([llvm_bytecode_lines])
     llvm_bytecode_lines = preprocessed_data[0]
-    llvm_bytecode_lines = PreprocessLlvmBytecode(
+    llvm_bytecode_lines = statement_normalizer.NormalizeBytecodeLines(
       llvm_bytecode_lines, struct_dict
     )
     _MaybeSetBytecodeAfterPreprocessing(llvm_bytecode_lines)
@@ -187,6 +188,9 @@ def PreprocessLlvmBytecode(
 ):
   """Simplify lines of code by stripping them from their identifiers,
   unnamed values, etc. so that LLVM IR statements can be abstracted from them.
+
+  This is the reference implementation of
+  statement_normalizer.NormalizeBytecodeLines(), which is faster.
   """
   # Remove all "... = type {..." statements since we don't need them anymore
   lines = [stmt for stmt in lines if not re.match(".* = type ", stmt)]
@@ -3,8 +3,10 @@
 
 #include "labm8/cpp/logging.h"
 
+#include <cstdint>
 #include <functional>
 #include <iostream>
+#include <string>
 
 namespace pbutil {
 
@@ -50,6 +52,61 @@ void ProcessMessage(
   CHECK(output_message.SerializeToOstream(ostream));
 }
 
+namespace internal {
+
+// Read a little-endian uint64 length prefix. Returns false at end of stream.
+inline bool ReadLengthPrefix(std::istream *istream, uint64_t *length) {
+  unsigned char bytes[8];
+  if (!istream->read(reinterpret_cast<char *>(bytes), sizeof(bytes))) {
+    CHECK(istream->gcount() == 0) << "Truncated message length";
+    return false;
+  }
+  *length = 0;
+  for (int i = 7; i >= 0; --i) {
+    *length = (*length << 8) | bytes[i];
+  }
+  return true;
+}
+
+// Write a little-endian uint64 length prefix.
+inline void WriteLengthPrefix(std::ostream *ostream, uint64_t length) {
+  unsigned char bytes[8];
+  for (int i = 0; i < 8; ++i) {
+    bytes[i] = static_cast<unsigned char>(length >> (8 * i));
+  }
+  ostream->write(reinterpret_cast<char *>(bytes), sizeof(bytes));
+}
+
+}  // namespace internal
+
+// Run a process_function callback on a stream of proto messages, mutating
+// each in place. Each message is read from istream and written to ostream
+// prefixed by its length in bytes, encoded as a little-endian uint64. The
+// output of each message is flushed before the next message is read, and the
+// stream terminates when istream is closed.
+template <typename Message>
+void ProcessMessageStreamInPlace(
+    std::function<void(Message *)> process_function,
+    std::istream *istream = &std::cin, std::ostream *ostream = &std::cout) {
+  std::string buffer;
+  uint64_t length;
+  while (internal::ReadLengthPrefix(istream, &length)) {
+    buffer.resize(length);
+    CHECK(istream->read(&buffer[0], length)) << "Truncated message";
+
+    Message message;
+    CHECK(message.ParseFromString(buffer));
+
+    // Do the work.
+    process_function(&message);
+
+    CHECK(message.SerializeToString(&buffer));
+    internal::WriteLengthPrefix(ostream, buffer.size());
+    ostream->write(buffer.data(), buffer.size());
+    ostream->flush();
+  }
+}
+
 }  // namespace pbutil
 
 // A convenience macro to run an in-place process_function as the main()
@@ -69,3 +126,18 @@ void ProcessMessage(
         process_function);                                           \
     return 0;                                                        \
   }
+
+// A convenience macro to run an in-place process_function as the main()
+// function of a program. If the program is invoked with a --stream argument,
+// it processes a stream of length-prefixed messages until stdin is closed.
+// Else, it processes a single message.
+#define PBUTIL_INPLACE_PROCESS_STREAM_MAIN(process_function, message_type) \
+  int main(int argc, char **argv) {                                        \
+    if (argc > 1 && std::string(argv[1]) == "--stream") {                  \
+      std::ios_base::sync_with_stdio(false);                               \
+      pbutil::ProcessMessageStreamInPlace<message_type>(process_function); \
+    } else {                                                               \
+      pbutil::ProcessMessageInPlace<message_type>(process_function);       \
+    }                                                                      \
+    return 0;                                                              \
+  }
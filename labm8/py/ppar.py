@@ -20,11 +20,14 @@ import multiprocessing.pool
 import queue
 import subprocess
 import threading
+import time
 import typing
 
 from labm8.py import app
 from labm8.py import bazelutil
+from labm8.py import humanize
 from labm8.py import pbutil
+from labm8.py import progress
 from labm8.py import sqlutil
 
 FLAGS = app.FLAGS
@@ -285,6 +288,9 @@ def MapDatabaseRowBatchProcessor(
   rows_per_work_unit: int = 5,
   start_at: int = 0,
   pool: typing.Optional[multiprocessing.Pool] = None,
+  key_column=None,
+  max_batches_in_flight: int = 2,
+  ctx: progress.ProgressContext = progress.NullContext,
 ) -> None:
   """Execute a database row-processesing function in parallel.
 
@@ -297,17 +303,37 @@ def MapDatabaseRowBatchProcessor(
       work_unit_result_callback(work_unit(generate_work_unit_args)))
     end_of_batch_callback()
 
+  The stages are pipelined. A reader thread reads batches of rows from the
+  query and submits their work units to the pool, keeping up to
+  max_batches_in_flight batches ahead of the results, while the calling thread
+  passes the results of each batch to the callbacks. The batch callbacks are
+  called in batch order, and the results of a batch are passed to
+  work_unit_result_callback in the order that they complete.
+
+  generate_work_unit_args is called from the reader thread, concurrently with
+  the other callbacks, so it must be thread-safe. start_of_batch_callback,
+  work_unit_result_callback, and end_of_batch_callback are called from the
+  calling thread.
+
   Args:
     work_unit: A function which takes an input a list of the values returned
       by generate_work_unit_args callback, and produces a list of zero or more
       instances of output_table_class.
-    query: The query which produces inputs to the work units.
+    query: The query which produces inputs to the work units. The query is run
+      on the reader thread using its own session, so the rows should not be
+      lazily loaded or modified.
     generate_work_unit_args: A callback which transforms a single result of the
-      query into an input to a work unit.
+      query into an input to a work unit. This is called from the reader
+      thread.
     batch_size:
     rows_per_work_unit:
     start_at:
     pool:
+    key_column: If set, page through the query results on this unique,
+      indexed column. See sqlutil.KeysetBatchedQuery().
+    max_batches_in_flight: The maximum number of batches to read and submit to
+      the pool ahead of the batch whose results are being processed.
+    ctx: A progress context to log the throughput of the stages to.
 
   Returns:
     Foo.
@@ -315,24 +341,93 @@ def MapDatabaseRowBatchProcessor(
 
   pool = pool or multiprocessing.Pool()
 
-  i = start_at
-  row_batches = sqlutil.OffsetLimitBatchedQuery(query, batch_size=batch_size)
-
-  for batch in row_batches:
-    rows_batch = batch.rows
-    start_of_batch_callback(i)
-
-    work_unit_args = [
-      generate_work_unit_args(rows_batch[i : i + rows_per_work_unit])
-      for i in range(0, len(rows_batch), rows_per_work_unit)
-    ]
-
-    for result in pool.starmap(work_unit, work_unit_args):
-      work_unit_result_callback(result)
+  # The queue of batches which have been submitted to the pool, as
+  # <row_count, results> tuples, followed by an end-of-batches marker.
+  in_flight = queue.Queue(maxsize=max(max_batches_in_flight, 1))
+  stop = threading.Event()
+  read_stats = {"rows": 0, "seconds": 0.0}
+
+  def ReadBatches():
+    """Read batches of rows and submit their work units to the pool."""
+    # The reader uses its own session, since a session must not be shared
+    # between threads.
+    session = sqlutil.Session(bind=query.session.get_bind())
+    row_batches = sqlutil.OffsetLimitBatchedQuery(
+      query.with_session(session), batch_size=batch_size, key_column=key_column
+    )
+    try:
+      while not stop.is_set():
+        start_time = time.time()
+        batch = next(row_batches, None)
+        if batch is None:
+          break
+        rows_batch = batch.rows
+        work_unit_args = [
+          (
+            work_unit,
+            generate_work_unit_args(rows_batch[i : i + rows_per_work_unit]),
+          )
+          for i in range(0, len(rows_batch), rows_per_work_unit)
+        ]
+        read_stats["rows"] += len(rows_batch)
+        read_stats["seconds"] += time.time() - start_time
+        results = pool.imap_unordered(_StarCallWorkUnit, work_unit_args)
+        in_flight.put(
+          ThreadedIterator._ValueOrError(value=(len(rows_batch), results))
+        )
+    except Exception as e:
+      in_flight.put(ThreadedIterator._ValueOrError(error=e))
+    finally:
+      row_batches.close()
+      session.close()
+    in_flight.put(ThreadedIterator._EndOfIterator())
 
-    i += len(rows_batch)
+  reader = threading.Thread(target=ReadBatches, daemon=True)
+  reader.start()
 
-    end_of_batch_callback(i)
+  start_time = time.time()
+  i = start_at
+  try:
+    while True:
+      item = in_flight.get()
+      if isinstance(item, ThreadedIterator._EndOfIterator):
+        break
+      row_count, results = item.GetOrRaise()
+
+      start_of_batch_callback(i)
+      for result in results:
+        work_unit_result_callback(result)
+      i += row_count
+      end_of_batch_callback(i)
+
+      elapsed = time.time() - start_time
+      ctx.Log(
+        2,
+        "Processed %s rows (%s rows/sec). Reader: %s rows/sec, %d of %d "
+        "batches in flight",
+        humanize.Commas(i - start_at),
+        humanize.Commas(int((i - start_at) / max(elapsed, 1e-6))),
+        humanize.Commas(
+          int(read_stats["rows"] / max(read_stats["seconds"], 1e-6))
+        ),
+        in_flight.qsize(),
+        max_batches_in_flight,
+      )
+  finally:
+    # Unblock the reader if we are stopping early due to an error.
+    stop.set()
+    while reader.is_alive():
+      try:
+        in_flight.get(timeout=0.1)
+      except queue.Empty:
+        pass
+    reader.join()
+
+
+def _StarCallWorkUnit(work_unit_and_args):
+  """Call a work unit with a tuple of arguments, as in Pool.starmap()."""
+  work_unit, args = work_unit_and_args
+  return work_unit(*args)
 
 
 class _ForcedNonDaemonProcess(multiprocessing.Process):
@@ -0,0 +1,158 @@
+"""Unit tests for //labm8/py:ppar."""
+import multiprocessing.pool
+import pathlib
+import threading
+import time
+from typing import List
+
+import sqlalchemy as sql
+
+from labm8.py import ppar
+from labm8.py import sqlutil
+from labm8.py import test
+
+FLAGS = test.FLAGS
+
+Base = sqlutil.Base()
+
+
+class Row(Base):
+  """A table for testing."""
+
+  __tablename__ = "rows"
+
+  id: int = sql.Column(sql.Integer, primary_key=True)
+
+
+@test.Fixture(scope="function")
+def db(tmp_path: pathlib.Path) -> sqlutil.Database:
+  """A test fixture which yields a database of 25 rows."""
+  db = sqlutil.Database(f"sqlite:///{tmp_path}/db", Base)
+  with db.Session(commit=True) as session:
+    session.add_all([Row(id=i) for i in range(1, 26)])
+  yield db
+
+
+@test.Fixture(scope="function")
+def pool() -> multiprocessing.pool.ThreadPool:
+  """A test fixture which yields a thread pool."""
+  pool = multiprocessing.pool.ThreadPool(4)
+  yield pool
+  pool.close()
+  pool.join()
+
+
+def GetIds(ids: List[int]) -> List[int]:
+  """A work unit which returns its inputs."""
+  return ids
+
+
+@test.Parametrize("key_column", (None, Row.id))
+def test_MapDatabaseRowBatchProcessor_batch_order(
+  db: sqlutil.Database, pool: multiprocessing.pool.ThreadPool, key_column
+):
+  """Test that callbacks are called in batch order on the calling thread."""
+  calling_thread = threading.get_ident()
+  reader_threads = set()
+  callback_threads = set()
+  events = []
+
+  def GenerateWorkUnitArgs(rows):
+    reader_threads.add(threading.get_ident())
+    return ([row.id for row in rows],)
+
+  def Callback(event):
+    def _Callback(value):
+      callback_threads.add(threading.get_ident())
+      events.append((event, value))
+
+    return _Callback
+
+  with db.Session() as session:
+    ppar.MapDatabaseRowBatchProcessor(
+      GetIds,
+      session.query(Row).order_by(Row.id),
+      generate_work_unit_args=GenerateWorkUnitArgs,
+      work_unit_result_callback=Callback("result"),
+      start_of_batch_callback=Callback("start"),
+      end_of_batch_callback=Callback("end"),
+      batch_size=10,
+      rows_per_work_unit=3,
+      start_at=100,
+      pool=pool,
+      key_column=key_column,
+    )
+
+  assert callback_threads == {calling_thread}
+  assert calling_thread not in reader_threads
+
+  # Split the events into batches, each of which starts with a start event and
+  # ends with an end event.
+  batches = []
+  for event, value in events:
+    if event == "start":
+      batches.append((value, [], None))
+    elif event == "result":
+      batches[-1][1].extend(value)
+    else:
+      batches[-1] = (batches[-1][0], batches[-1][1], value)
+
+  assert [(start, end) for start, _, end in batches] == [
+    (100, 110),
+    (110, 120),
+    (120, 125),
+  ]
+  assert sorted(batches[0][1]) == list(range(1, 11))
+  assert sorted(batches[1][1]) == list(range(11, 21))
+  assert sorted(batches[2][1]) == list(range(21, 26))
+
+
+@test.Parametrize("max_batches_in_flight", (1, 2))
+def test_MapDatabaseRowBatchProcessor_max_batches_in_flight(
+  db: sqlutil.Database,
+  pool: multiprocessing.pool.ThreadPool,
+  max_batches_in_flight: int,
+):
+  """Test that the reader does not read too far ahead of the results."""
+  lock = threading.Lock()
+  batches_read = [0]
+  batches_ahead = []
+
+  def GenerateWorkUnitArgs(rows):
+    with lock:
+      batches_read[0] += 1
+    return ([row.id for row in rows],)
+
+  def StartOfBatchCallback(i: int):
+    batch_num = i // 5 + 1
+    with lock:
+      batches_ahead.append(batches_read[0] - batch_num)
+
+  def EndOfBatchCallback(i: int):
+    # Process the results slowly so that the reader has time to fill the queue.
+    time.sleep(0.05)
+
+  with db.Session() as session:
+    ppar.MapDatabaseRowBatchProcessor(
+      GetIds,
+      session.query(Row),
+      generate_work_unit_args=GenerateWorkUnitArgs,
+      start_of_batch_callback=StartOfBatchCallback,
+      end_of_batch_callback=EndOfBatchCallback,
+      batch_size=5,
+      rows_per_work_unit=5,
+      pool=pool,
+      key_column=Row.id,
+      max_batches_in_flight=max_batches_in_flight,
+    )
+
+  assert batches_read[0] == 5
+  assert len(batches_ahead) == 5
+  # At most max_batches_in_flight batches are queued, plus one batch which the
+  # reader is blocked on adding to the queue.
+  assert max(batches_ahead) <= max_batches_in_flight + 1
+  assert max(batches_ahead) > 0
+
+
+if __name__ == "__main__":
+  test.Main()
@@ -13,6 +13,7 @@
 # limitations under the License.
 """Utility code for working with sqlalchemy."""
 import contextlib
+import itertools
 import os
 import pathlib
 import queue
@@ -21,7 +22,10 @@ import sys
 import threading
 import time
 import typing
+from concurrent import futures
+from typing import Any
 from typing import Callable
+from typing import Dict
 from typing import List
 from typing import Optional
 
@@ -708,6 +712,8 @@ def OffsetLimitBatchedQuery(
   batch_size: int = 1000,
   start_at: int = 0,
   compute_max_rows: bool = False,
+  key_column=None,
+  prefetch: bool = False,
 ) -> typing.Iterator[OffsetLimitQueryResultsBatch]:
   """Split and return the rows resulting from a query in to batches.
 
@@ -717,18 +723,37 @@ def OffsetLimitBatchedQuery(
 
   This function is useful for returning row sets from enormous tables, where
   loading the full query results in to memory would take prohibitive time or
-  resources.
+  resources. However, the database must scan and discard `i` rows to return
+  each batch, so reading a full table is quadratic in the number of rows. If
+  the query has a unique, indexed column, pass it as `key_column` to page on
+  that column using KeysetBatchedQuery() instead.
 
   Args:
     query: The query to run.
     batch_size: The number of rows to return per batch.
     start_at: The initial offset into the table.
     compute_max_rows: If true
+    key_column: If set, use KeysetBatchedQuery() to page on this column.
+    prefetch: If set, read the next batch on a background thread. Only
+      supported when key_column is set.
 
   Returns:
     A generator of OffsetLimitQueryResultsBatch tuples, where each tuple
     contains between 1 <= x <= `batch_size` rows.
   """
+  if key_column is not None:
+    yield from KeysetBatchedQuery(
+      query,
+      key_column,
+      batch_size=batch_size,
+      start_at=start_at,
+      compute_max_rows=compute_max_rows,
+      prefetch=prefetch,
+    )
+    return
+  if prefetch:
+    raise TypeError("OffsetLimitBatchedQuery() prefetch requires key_column")
+
   max_rows = None
   if compute_max_rows:
     max_rows = query.count()
@@ -751,6 +776,99 @@ def OffsetLimitBatchedQuery(
       break
 
 
+def KeysetBatchedQuery(
+  query: Query,
+  key_column,
+  batch_size: int = 1000,
+  start_at: int = 0,
+  compute_max_rows: bool = False,
+  prefetch: bool = False,
+) -> typing.Iterator[OffsetLimitQueryResultsBatch]:
+  """Split and return the rows resulting from a query in to batches, using
+  keyset pagination.
+
+  This iteratively runs the query
+  `SELECT * FROM * WHERE key > k ORDER BY key LIMIT batch_size;`, where `k` is
+  the key of the last row of the previous batch. Unlike an OFFSET query, each
+  batch is read by seeking the index on the key column, so the cost of reading
+  a batch does not grow with the number of rows already read. Iteration
+  terminates when the query returns no rows.
+
+  The key column must be unique and indexed, such as an integer primary key,
+  and its value must be accessible as an attribute of every row. This is the
+  case for queries of mapped objects, and for queries of columns which include
+  the key column. Any ordering of the query is replaced by the key column.
+
+  Args:
+    query: The query to run.
+    key_column: The column to page on, e.g. `MyTable.id`.
+    batch_size: The number of rows to return per batch.
+    start_at: The number of rows to skip. This uses an OFFSET for the first
+      batch only.
+    compute_max_rows: If true, compute the total number of rows.
+    prefetch: If true, read the next batch on a background thread while the
+      current batch is being processed. The background thread uses its own
+      session, so rows should not be lazily loaded or modified.
+
+  Returns:
+    A generator of OffsetLimitQueryResultsBatch tuples, where each tuple
+    contains between 1 <= x <= `batch_size` rows.
+  """
+  max_rows = None
+  if compute_max_rows:
+    max_rows = query.count()
+
+  key_name = key_column.key
+
+  prefetch_session = None
+  executor = None
+  if prefetch:
+    prefetch_session = Session(bind=query.session.get_bind())
+    query = query.with_session(prefetch_session)
+    executor = futures.ThreadPoolExecutor(max_workers=1)
+  query = query.order_by(None).order_by(key_column)
+
+  def ReadBatch(last_key) -> typing.List[typing.Any]:
+    """Read the batch of rows after the given key."""
+    if last_key is None:
+      return query.offset(start_at).limit(batch_size).all()
+    return query.filter(key_column > last_key).limit(batch_size).all()
+
+  try:
+    if executor:
+      next_batch = executor.submit(ReadBatch, None)
+    else:
+      next_batch = ReadBatch(None)
+
+    batch_num = 0
+    i = start_at
+    while True:
+      batch = next_batch.result() if executor else next_batch
+      if not batch:
+        break
+      # Start reading the next batch before returning this one.
+      last_key = getattr(batch[-1], key_name)
+      if executor:
+        next_batch = executor.submit(ReadBatch, last_key)
+
+      batch_num += 1
+      yield OffsetLimitQueryResultsBatch(
+        batch_num=batch_num,
+        offset=i,
+        limit=i + batch_size,
+        max_rows=max_rows,
+        rows=batch,
+      )
+      i += len(batch)
+
+      if not executor:
+        next_batch = ReadBatch(last_key)
+  finally:
+    if executor:
+      executor.shutdown(wait=True)
+      prefetch_session.close()
+
+
 class ColumnTypes(object):
   """Abstract class containing methods for generating column types."""
 
@@ -884,6 +1002,111 @@ def ResilientAddManyAndCommit(db: Database, mapped: typing.Iterable[Base]):
   return failures
 
 
+def RowFromMapped(mapped: Base) -> Dict[str, Any]:
+  """Return the column values of a mapped object as a row dictionary.
+
+  Use this to convert mapped objects for BufferedDatabaseWriter.AddRows().
+  Relationships are not included. Columns which are unset and have a default
+  value or are primary keys are omitted, so that their values are generated on
+  insert.
+
+  Args:
+    mapped: A mapped object.
+
+  Returns:
+    A map from column key to value.
+  """
+  row = {}
+  for attr in sql.inspect(type(mapped)).column_attrs:
+    column = attr.columns[0]
+    value = getattr(mapped, attr.key)
+    if value is None and (
+      column.primary_key
+      or column.default is not None
+      or column.server_default is not None
+    ):
+      continue
+    row[column.key] = value
+  return row
+
+
+def InsertMany(
+  connection: sql.engine.Connection,
+  table: sql.Table,
+  rows: List[Dict[str, Any]],
+) -> None:
+  """Insert rows using the fastest multi-row insert for the dialect.
+
+  For MySQL, the rows are passed to executemany(), which the MySQL drivers
+  rewrite into multi-row INSERT statements. For SQLite, executemany() reuses a
+  single prepared statement. For PostgreSQL, a single multi-row INSERT ...
+  VALUES statement is executed.
+
+  Args:
+    connection: The connection to execute the insert on.
+    table: The table to insert into.
+    rows: A list of rows, where every row has the same keys.
+  """
+  if connection.dialect.name == "postgresql":
+    connection.execute(table.insert().values(rows))
+  else:
+    connection.execute(table.insert(), rows)
+
+
+def ResilientInsertManyAndCommit(
+  db: Database, table: sql.Table, rows: List[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+  """Attempt to insert and commit rows and return those that fail.
+
+  This is the Core equivalent of ResilientAddManyAndCommit(). The rows are
+  inserted in a single transaction. In case of error, this method will recurse
+  up to O(log(n)) times, inserting as many of the rows as possible.
+
+  Args:
+    db: The database to insert the rows into.
+    table: The table to insert into.
+    rows: A list of rows, where every row has the same keys.
+
+  Returns:
+    Any rows which could not be committed, if any. Relative order of rows is
+    preserved.
+  """
+  failures = []
+
+  if not rows:
+    return failures
+
+  try:
+    with db.engine.begin() as connection:
+      InsertMany(connection, table, rows)
+  except sql.exc.SQLAlchemyError as e:
+    logging.Log(
+      logging.GetCallingModuleName(),
+      1,
+      "Caught error while inserting %d rows into %s: %s",
+      len(rows),
+      table.name,
+      e,
+    )
+
+    if len(rows) == 1:
+      return rows
+    else:
+      mid = int(len(rows) / 2)
+      failures += ResilientInsertManyAndCommit(db, table, rows[:mid])
+      failures += ResilientInsertManyAndCommit(db, table, rows[mid:])
+
+  return failures
+
+
+def _EstimateRowSize(row: Dict[str, Any]) -> int:
+  """Estimate the size of a row from the lengths of its values, in bytes."""
+  return sum(
+    len(value) if isinstance(value, (bytes, str)) else 8
+    for value in row.values()
+  )
+
+
 def QueryToString(query) -> str:
   """Compile the query to inline literals in place of '?' placeholders.
 
@@ -914,6 +1137,12 @@ class BufferedDatabaseWriter(threading.Thread):
       for chunk in chunks_to_process:
         objs = ProcessChunk(chunk)
         writer.AddMany(objs)
+
+  Mapped objects are committed through the ORM unit of work. For tables which
+  are written in bulk and do not need the ORM, such as rows which do not depend
+  on the generated primary keys of other rows, use AddRows() instead. Rows are
+  inserted using multi-row INSERT statements in chunks of insert_chunk_size,
+  and only the chunks which fail to insert are retried row by row.
   """
 
   def __init__(
@@ -924,6 +1153,7 @@ class BufferedDatabaseWriter(threading.Thread):
     max_seconds_since_flush: Optional[float] = None,
     log_level: int = 2,
     ctx: progress.ProgressContext = progress.NullContext,
+    insert_chunk_size: int = 1000,
   ):
     """Constructor.
 
@@ -939,6 +1169,8 @@ class BufferedDatabaseWriter(threading.Thread):
         flushes.
       ctx: progress.ProgressContext = progress.NullContext,
       log_level: The logging level for logging output.
+      insert_chunk_size: The maximum number of rows added by AddRows() to
+        insert in a single statement.
     """
     super(BufferedDatabaseWriter, self).__init__()
     self.db = db
@@ -948,12 +1180,15 @@ class BufferedDatabaseWriter(threading.Thread):
     self.max_seconds_since_flush = max_seconds_since_flush
     self.max_buffer_size = max_buffer_size
     self.max_buffer_length = max_buffer_length
+    self.insert_chunk_size = insert_chunk_size
 
     # Counters.
     self.flush_count = 0
     self.error_count = 0
 
     self._buffer = []
+    # The number of mapped objects, rows, and lambda ops in the buffer.
+    self._buffer_length = 0
     self.buffer_size = 0
     self._last_flush = time.time()
 
@@ -999,6 +1234,34 @@ class BufferedDatabaseWriter(threading.Thread):
     for mapped, size in zip(mappeds, sizes):
       self._queue.put((mapped, size))
 
+  def AddRows(
+    self,
+    table,
+    rows: typing.Iterable[typing.Union[Dict[str, Any], typing.Tuple]],
+    sizes: Optional[List[int]] = None,
+  ) -> None:
+    """Add rows to insert into a table, bypassing the ORM.
+
+    Args:
+      table: The table to insert into, as a mapped class or a Table.
+      rows: The rows to insert. A row is either a dictionary of column keys to
+        values, or a tuple of values for every column of the table, in order.
+        Use RowFromMapped() to convert a mapped object to a row.
+      sizes: A list of row sizes to use to calculate the buffer size. If not
+        provided, the size of a row is estimated from the lengths of its string
+        and bytes values.
+    """
+    table = getattr(table, "__table__", table)
+    column_keys = [column.key for column in table.columns]
+    rows = [
+      row if isinstance(row, dict) else dict(zip(column_keys, row))
+      for row in rows
+    ]
+    if not rows:
+      return
+    sizes = sizes or [_EstimateRowSize(row) for row in rows]
+    self._queue.put((BufferedDatabaseWriter.Rows(table, rows), sum(sizes)))
+
   def AddLambdaOp(self, callback: Callable[[Database.SessionType], None]):
     self._queue.put(BufferedDatabaseWriter.LambdaOp(callback))
 
@@ -1028,7 +1291,7 @@ class BufferedDatabaseWriter(threading.Thread):
   @property
   def buffer_length(self) -> int:
     """Get the current length of the buffer, in range [0, max_buffer_length]."""
-    return len(self._buffer)
+    return self._buffer_length
 
   @property
   def seconds_since_last_flush(self) -> float:
@@ -1056,6 +1319,13 @@ class BufferedDatabaseWriter(threading.Thread):
     def __call__(self, session: Database.SessionType):
       self.callback(session)
 
+  class Rows(object):
+    """Rows to insert into a table."""
+
+    def __init__(self, table: sql.Table, rows: List[Dict[str, Any]]):
+      self.table = table
+      self.rows = rows
+
   def run(self):
     """The thread loop."""
     while True:
@@ -1077,11 +1347,16 @@ class BufferedDatabaseWriter(threading.Thread):
       elif isinstance(item, BufferedDatabaseWriter.LambdaOp):
         # Handle delete op.
         self._buffer.append(item)
+        self._buffer_length += 1
         self._MaybeFlush()
       else:
-        # Add the object to the buffer.
+        # Add the object or rows to the buffer.
         mapped, size = item
         self._buffer.append(mapped)
+        if isinstance(mapped, BufferedDatabaseWriter.Rows):
+          self._buffer_length += len(mapped.rows)
+        else:
+          self._buffer_length += 1
         self.buffer_size += size
         self._MaybeFlush()
 
@@ -1116,6 +1391,25 @@ class BufferedDatabaseWriter(threading.Thread):
       self.ctx.Error("Logger failed to commit %d objects", len(failures))
     self.error_count += len(failures)
 
+  def _InsertRows(self, table: sql.Table, rows: List[Dict[str, Any]]) -> None:
+    """Insert and commit a list of rows in chunks."""
+    failure_count = 0
+    # A multi-row insert requires that every row has the same keys, so split
+    # the rows into runs of rows with the same keys.
+    for _, group in itertools.groupby(rows, key=lambda row: tuple(row)):
+      group = list(group)
+      for i in range(0, len(group), self.insert_chunk_size):
+        failure_count += len(
+          ResilientInsertManyAndCommit(
+            self.db, table, group[i : i + self.insert_chunk_size]
+          )
+        )
+    if failure_count:
+      self.ctx.Error(
+        "Logger failed to insert %d rows into %s", failure_count, table.name
+      )
+    self.error_count += failure_count
+
   def _Flush(self):
     """Flush the buffer."""
     if not self._buffer:
@@ -1126,20 +1420,37 @@ class BufferedDatabaseWriter(threading.Thread):
       f"Committed {self.buffer_length} rows "
       f"({humanize.BinaryPrefix(self.buffer_size, 'B')}) to {self.db.url}",
     ), self.db.Session() as session:
-      # Iterate through the buffer and handle any lambda ops.
-      start_i, end_i = 0, 0
-      for end_i, item in enumerate(self._buffer):
+      # Iterate through the buffer in order, accumulating consecutive mapped
+      # objects, and consecutive rows for the same table.
+      mapped = []
+      rows_table, rows = None, []
+      for item in self._buffer:
+        if isinstance(item, BufferedDatabaseWriter.Rows):
+          self._AddMapped(mapped)
+          mapped = []
+          if item.table is not rows_table:
+            self._InsertRows(rows_table, rows)
+            rows_table, rows = item.table, []
+          rows += item.rows
+          continue
+
+        self._InsertRows(rows_table, rows)
+        rows_table, rows = None, []
         if isinstance(item, BufferedDatabaseWriter.LambdaOp):
           # If we have a lambda op, we flush the contents of the current buffer,
           # then execute the op and continue.
-          self._AddMapped(self._buffer[start_i:end_i])
-          self._buffer[end_i](session)
+          self._AddMapped(mapped)
+          mapped = []
+          item(session)
           session.commit()
-          start_i = end_i + 1
-      # Add any remaining mapped objects from the buffer.
-      self._AddMapped(self._buffer[start_i:])
+        else:
+          mapped.append(item)
+      # Add any remaining mapped objects or rows from the buffer.
+      self._AddMapped(mapped)
+      self._InsertRows(rows_table, rows)
 
       self._buffer = []
+      self._buffer_length = 0
       self._last_flush = time.time()
       self.buffer_size = 0
       self.flush_count += 1
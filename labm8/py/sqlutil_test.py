@@ -0,0 +1,271 @@
+"""Unit tests for //labm8/py:sqlutil."""
+import pathlib
+
+import sqlalchemy as sql
+
+from labm8.py import sqlutil
+from labm8.py import test
+
+FLAGS = test.FLAGS
+
+Base = sqlutil.Base()
+
+
+class Row(Base):
+  """A table for testing."""
+
+  __tablename__ = "rows"
+
+  id: int = sql.Column(sql.Integer, primary_key=True)
+  name: str = sql.Column(sql.String(64), nullable=False, unique=True)
+  value: int = sql.Column(sql.Integer, default=7)
+  data: bytes = sql.Column(sql.LargeBinary, nullable=True)
+
+
+@test.Fixture(scope="function")
+def db(tmp_path: pathlib.Path) -> sqlutil.Database:
+  """A test fixture which yields an empty database."""
+  yield sqlutil.Database(f"sqlite:///{tmp_path}/db", Base)
+
+
+def GetNames(db: sqlutil.Database):
+  """Return the names of the rows in the database, in order of insertion."""
+  with db.Session() as session:
+    return [row.name for row in session.query(Row.name).order_by(Row.id)]
+
+
+def test_RowFromMapped_omits_generated_columns():
+  """Test that unset primary keys and columns with defaults are omitted."""
+  assert sqlutil.RowFromMapped(Row(name="a")) == {"name": "a", "data": None}
+
+
+def test_RowFromMapped_includes_set_columns():
+  """Test that set primary keys and columns with defaults are included."""
+  assert sqlutil.RowFromMapped(Row(id=3, name="a", value=5, data=b"x")) == {
+    "id": 3,
+    "name": "a",
+    "value": 5,
+    "data": b"x",
+  }
+
+
+def test_InsertMany(db: sqlutil.Database):
+  """Test inserting rows in a single statement."""
+  with db.engine.begin() as connection:
+    sqlutil.InsertMany(
+      connection, Row.__table__, [{"name": "a"}, {"name": "b"}],
+    )
+  assert GetNames(db) == ["a", "b"]
+
+
+def test_ResilientInsertManyAndCommit_returns_failures(db: sqlutil.Database):
+  """Test that only the rows which fail to insert are returned."""
+  rows = [{"name": str(i)} for i in range(10)]
+  rows[6] = {"name": "3"}
+
+  failures = sqlutil.ResilientInsertManyAndCommit(db, Row.__table__, rows)
+
+  assert failures == [{"name": "3"}]
+  assert GetNames(db) == ["0", "1", "2", "3", "4", "5", "7", "8", "9"]
+
+
+def test_BufferedDatabaseWriter_AddRows_round_trip(db: sqlutil.Database):
+  """Test that rows added as dictionaries and tuples are inserted."""
+  with sqlutil.BufferedDatabaseWriter(db) as writer:
+    writer.AddRows(Row, [sqlutil.RowFromMapped(Row(name="a", data=b"123"))])
+    writer.AddRows(Row.__table__, [(10, "b", 5, None)])
+
+  with db.Session() as session:
+    a = session.query(Row).filter(Row.name == "a").one()
+    b = session.query(Row).filter(Row.name == "b").one()
+  assert a.id
+  assert a.value == 7
+  assert a.data == b"123"
+  assert b.id == 10
+  assert b.value == 5
+  assert b.data is None
+  assert writer.error_count == 0
+
+
+def test_BufferedDatabaseWriter_AddRows_flushes_by_estimated_size(
+  db: sqlutil.Database,
+):
+  """Test that the buffer is flushed once the estimated row sizes are full."""
+  with sqlutil.BufferedDatabaseWriter(db, max_buffer_size=1000) as writer:
+    for i in range(4):
+      # The estimated size of each row is 504 bytes, so every second row
+      # fills the buffer.
+      writer.AddRows(Row, [{"name": f"{i:04d}", "data": b"x" * 500}])
+
+  assert writer.flush_count == 2
+  assert GetNames(db) == ["0000", "0001", "0002", "0003"]
+
+
+def test_BufferedDatabaseWriter_AddRows_resilient_to_bad_row(
+  db: sqlutil.Database,
+):
+  """Test that one bad row does not prevent the other rows being inserted."""
+  rows = [{"name": f"{i:02d}"} for i in range(25)]
+  # A duplicate of a unique column fails to insert.
+  rows[13] = {"name": "02"}
+
+  with sqlutil.BufferedDatabaseWriter(db, insert_chunk_size=10) as writer:
+    writer.AddRows(Row, rows)
+
+  assert writer.error_count == 1
+  assert GetNames(db) == [f"{i:02d}" for i in range(25) if i != 13]
+
+
+def test_BufferedDatabaseWriter_AddRows_and_AddMany(db: sqlutil.Database):
+  """Test that rows and mapped objects are written in the order added."""
+  with sqlutil.BufferedDatabaseWriter(db) as writer:
+    writer.AddRows(Row, [{"name": "a"}])
+    writer.AddMany([Row(name="b"), Row(name="c")])
+    writer.AddRows(Row, [{"name": "d"}])
+
+  assert GetNames(db) == ["a", "b", "c", "d"]
+
+
+def AddRows(db: sqlutil.Database, row_count: int) -> None:
+  """Add rows with names "000", "001", etc. to the database."""
+  with db.Session(commit=True) as session:
+    session.add_all([Row(name=f"{i:03d}") for i in range(row_count)])
+
+
+def test_KeysetBatchedQuery_empty_table(db: sqlutil.Database):
+  """Test that no batches are returned from an empty table."""
+  with db.Session() as session:
+    batches = list(
+      sqlutil.KeysetBatchedQuery(session.query(Row), Row.id, batch_size=10)
+    )
+
+  assert batches == []
+
+
+@test.Parametrize("row_count", (1, 9, 10, 11, 25))
+def test_KeysetBatchedQuery_rows_at_page_boundaries(
+  db: sqlutil.Database, row_count: int
+):
+  """Test that no rows are skipped or repeated between pages."""
+  AddRows(db, row_count)
+
+  with db.Session() as session:
+    batches = list(
+      sqlutil.KeysetBatchedQuery(session.query(Row), Row.id, batch_size=10)
+    )
+    names = [row.name for batch in batches for row in batch.rows]
+
+  assert names == [f"{i:03d}" for i in range(row_count)]
+  assert [b.batch_num for b in batches] == list(range(1, len(batches) + 1))
+  assert [b.offset for b in batches] == list(range(0, row_count, 10))
+  assert all(b.limit == b.offset + 10 for b in batches)
+  assert all(b.max_rows is None for b in batches)
+
+
+def test_KeysetBatchedQuery_ignores_query_order(db: sqlutil.Database):
+  """Test that pages are ordered by the key column."""
+  AddRows(db, 25)
+
+  with db.Session() as session:
+    query = session.query(Row).order_by(Row.id.desc())
+    names = [
+      row.name
+      for batch in sqlutil.KeysetBatchedQuery(query, Row.id, batch_size=10)
+      for row in batch.rows
+    ]
+
+  assert names == [f"{i:03d}" for i in range(25)]
+
+
+def test_KeysetBatchedQuery_start_at(db: sqlutil.Database):
+  """Test that start_at skips the first rows."""
+  AddRows(db, 25)
+
+  with db.Session() as session:
+    batches = list(
+      sqlutil.KeysetBatchedQuery(
+        session.query(Row),
+        Row.id,
+        batch_size=10,
+        start_at=5,
+        compute_max_rows=True,
+      )
+    )
+    names = [row.name for batch in batches for row in batch.rows]
+
+  assert names == [f"{i:03d}" for i in range(5, 25)]
+  assert [b.offset for b in batches] == [5, 15]
+  assert all(b.max_rows == 25 for b in batches)
+
+
+def test_KeysetBatchedQuery_start_at_end_of_table(db: sqlutil.Database):
+  """Test that no batches are returned when start_at skips every row."""
+  AddRows(db, 10)
+
+  with db.Session() as session:
+    batches = list(
+      sqlutil.KeysetBatchedQuery(
+        session.query(Row), Row.id, batch_size=10, start_at=10
+      )
+    )
+
+  assert batches == []
+
+
+@test.Parametrize("start_at", (0, 5))
+def test_KeysetBatchedQuery_prefetch_order(db: sqlutil.Database, start_at: int):
+  """Test that prefetching returns the same batches as reading in turn."""
+  AddRows(db, 25)
+
+  with db.Session() as session:
+    query = session.query(Row.id, Row.name)
+    expected = [
+      (batch.offset, [row.name for row in batch.rows])
+      for batch in sqlutil.KeysetBatchedQuery(
+        query, Row.id, batch_size=10, start_at=start_at
+      )
+    ]
+    prefetched = [
+      (batch.offset, [row.name for row in batch.rows])
+      for batch in sqlutil.KeysetBatchedQuery(
+        query, Row.id, batch_size=10, start_at=start_at, prefetch=True
+      )
+    ]
+
+  assert prefetched == expected
+  assert [name for _, names in prefetched for name in names] == [
+    f"{i:03d}" for i in range(start_at, 25)
+  ]
+
+
+def test_OffsetLimitBatchedQuery_key_column(db: sqlutil.Database):
+  """Test that offset-limit and keyset pagination return the same batches."""
+  AddRows(db, 25)
+
+  with db.Session() as session:
+    query = session.query(Row.id, Row.name).order_by(Row.id)
+    offset_limit = [
+      (batch.batch_num, batch.offset, batch.limit, batch.rows)
+      for batch in sqlutil.OffsetLimitBatchedQuery(query, batch_size=10)
+    ]
+    keyset = [
+      (batch.batch_num, batch.offset, batch.limit, batch.rows)
+      for batch in sqlutil.OffsetLimitBatchedQuery(
+        query, batch_size=10, key_column=Row.id
+      )
+    ]
+
+  assert keyset == offset_limit
+
+
+def test_OffsetLimitBatchedQuery_prefetch_without_key_column(
+  db: sqlutil.Database,
+):
+  """Test that prefetching requires a key column."""
+  with db.Session() as session:
+    with test.Raises(TypeError):
+      next(sqlutil.OffsetLimitBatchedQuery(session.query(Row), prefetch=True))
+
+
+if __name__ == "__main__":
+  test.Main()